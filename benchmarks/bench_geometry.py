@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the longitude and latitude grids, the satellite and solar
+angles, and the cast shadow masks.
+"""
+
+from __future__ import absolute_import
+
+import numpy
+from scipy import ndimage
+import h5py
+
+from wagl.constants import DatasetName, GroupName
+from wagl.longitude_latitude_arrays import create_lon_lat_grids
+from wagl.margins import pixel_buffer
+from wagl.satellite_solar_angles import calculate_angles
+from wagl.terrain_shadow_masks import calculate_cast_shadow
+from benchmarks.synthetic import SCENES, SCENE_NAMES, TIMEOUT, SEED
+from benchmarks.synthetic import memory_file, write_scene, open_acquisition
+from benchmarks.synthetic import satellite_solar_group
+
+# the buffer (metres) around the scene used by the cast shadow masks
+BUFFER_DISTANCE = 8000
+
+
+def synthetic_dsm(shape, low=0, high=1500, scale=128):
+    """
+    A smoothly varying elevation model (metres).
+    """
+    numpy.random.seed(SEED)
+    coarse = numpy.random.uniform(low, high, (shape[0] // scale + 2,
+                                              shape[1] // scale + 2))
+    dsm = ndimage.zoom(coarse, scale, order=3)[:shape[0], :shape[1]]
+    return dsm.astype('float32')
+
+
+class LonLatGrids(object):
+
+    """
+    Creates the longitude and latitude grids of a scene.
+    """
+
+    params = [SCENE_NAMES]
+    param_names = ['scene']
+    timeout = TIMEOUT
+
+    def setup_cache(self):
+        return {scene: write_scene('.', SCENES[scene])
+                for scene in SCENE_NAMES}
+
+    def setup(self, inputs, scene):
+        self.acquisition = open_acquisition(inputs[scene])
+
+    def _create(self):
+        with memory_file('lon-lat.h5') as out_fid:
+            create_lon_lat_grids(self.acquisition, out_fid)
+
+    def time_create_lon_lat_grids(self, inputs, scene):
+        self._create()
+
+    def peakmem_create_lon_lat_grids(self, inputs, scene):
+        self._create()
+
+
+class CalculateAngles(object):
+
+    """
+    Calculates the satellite and solar angle grids of a scene.
+    No TLE is available, so the nominal orbit of the acquisition
+    is used.
+    """
+
+    params = [SCENE_NAMES]
+    param_names = ['scene']
+    timeout = TIMEOUT
+
+    def setup_cache(self):
+        inputs = {}
+        for scene in SCENE_NAMES:
+            fname = write_scene('.', SCENES[scene])
+            h5_fname = 'lon-lat-{}.h5'.format(scene)
+            with h5py.File(h5_fname, 'w') as fid:
+                create_lon_lat_grids(open_acquisition(fname), fid)
+            inputs[scene] = (fname, h5_fname)
+
+        return inputs
+
+    def setup(self, inputs, scene):
+        fname, h5_fname = inputs[scene]
+        self.acquisition = open_acquisition(fname)
+        self.fid = h5py.File(h5_fname, 'r')
+
+    def teardown(self, inputs, scene):
+        self.fid.close()
+
+    def _calculate(self):
+        lon_lat_group = self.fid[GroupName.LON_LAT_GROUP.value]
+        with memory_file('satellite-solar.h5') as out_fid:
+            calculate_angles(self.acquisition, lon_lat_group, out_fid,
+                             tle_path='.')
+
+    def time_calculate_angles(self, inputs, scene):
+        self._calculate()
+
+    def peakmem_calculate_angles(self, inputs, scene):
+        self._calculate()
+
+
+class CastShadow(object):
+
+    """
+    Calculates the cast shadow mask of a scene, with the sun as the
+    source direction.
+    """
+
+    params = [SCENE_NAMES]
+    param_names = ['scene']
+    timeout = TIMEOUT
+
+    def setup_cache(self):
+        inputs = {}
+        for scene in SCENE_NAMES:
+            shape = SCENES[scene]
+            fname = write_scene('.', shape)
+            margins = pixel_buffer(open_acquisition(fname), BUFFER_DISTANCE)
+            dsm_shape = (shape[0] + margins.top + margins.bottom,
+                         shape[1] + margins.left + margins.right)
+
+            h5_fname = 'cast-shadow-inputs-{}.h5'.format(scene)
+            with h5py.File(h5_fname, 'w') as fid:
+                satellite_solar_group(fid, shape, (256, 256))
+                fid.create_dataset(DatasetName.DSM_SMOOTHED.value,
+                                   data=synthetic_dsm(dsm_shape))
+            inputs[scene] = (fname, h5_fname)
+
+        return inputs
+
+    def setup(self, inputs, scene):
+        fname, h5_fname = inputs[scene]
+        self.acquisition = open_acquisition(fname)
+        self.fid = h5py.File(h5_fname, 'r')
+
+    def teardown(self, inputs, scene):
+        self.fid.close()
+
+    def _calculate(self):
+        with memory_file('cast-shadow.h5') as out_fid:
+            calculate_cast_shadow(self.acquisition, self.fid, self.fid,
+                                  BUFFER_DISTANCE, out_fid)
+
+    def time_calculate_cast_shadow(self, inputs, scene):
+        self._calculate()
+
+    def peakmem_calculate_cast_shadow(self, inputs, scene):
+        self._calculate()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the conversion of `pandas.DataFrame`'s to and from HDF5
+`TABLE`'s.
+"""
+
+from __future__ import absolute_import
+
+import numpy
+import pandas
+
+from wagl.hdf5 import write_dataframe, read_h5_table
+from benchmarks.synthetic import TIMEOUT, SEED, memory_file
+
+
+def synthetic_table(nrows, columns='numeric'):
+    """
+    A table structured like the MODTRAN flux tables; indexed by the
+    wavelength and atmospheric level, with 3 columns of flux data.
+    Mixed tables include a column of strings, like the band names
+    of the coefficient tables.
+    """
+    levels = 36
+    wavelengths = numpy.arange(nrows) // levels
+    index = pandas.MultiIndex.from_arrays([2600 - wavelengths,
+                                           numpy.arange(nrows) % levels],
+                                          names=['wavelength', 'level'])
+
+    numpy.random.seed(SEED)
+    data = {'upward_diffuse': numpy.random.random(nrows),
+            'downward_diffuse': numpy.random.random(nrows),
+            'direct_solar': numpy.random.random(nrows)}
+    if columns == 'mixed':
+        data['band_name'] = numpy.random.choice(['BAND-1', 'BAND-2',
+                                                 'BAND-3', 'BAND-10'], nrows)
+
+    return pandas.DataFrame(data, index=index)
+
+
+class Tables(object):
+
+    """
+    Writes and reads tables of various lengths.
+    """
+
+    params = [[1000, 100000, 1000000], ['numeric', 'mixed']]
+    param_names = ['nrows', 'columns']
+    timeout = TIMEOUT
+
+    def setup(self, nrows, columns):
+        self.df = synthetic_table(nrows, columns)
+        self.fid = memory_file('tables.h5')
+        write_dataframe(self.df, 'TABLE', self.fid)
+
+    def teardown(self, nrows, columns):
+        self.fid.close()
+
+    def time_write_dataframe(self, nrows, columns):
+        with memory_file('write.h5') as fid:
+            write_dataframe(self.df, 'TABLE', fid)
+
+    def time_read_h5_table(self, nrows, columns):
+        read_h5_table(self.fid, 'TABLE')
+
+    def peakmem_write_dataframe(self, nrows, columns):
+        with memory_file('write.h5') as fid:
+            write_dataframe(self.df, 'TABLE', fid)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the interpolation of the atmospheric coefficients.
+"""
+
+from __future__ import absolute_import
+
+import numpy
+
+from wagl.interpolation import sheared_bilinear_interpolate
+from benchmarks.synthetic import SCENES, SCENE_NAMES, TIMEOUT, SEED
+
+
+class ShearedBilinearInterpolate(object):
+
+    """
+    Interpolates a grid of coefficients (as evaluated at the
+    MODTRAN points) across a scene.
+    """
+
+    params = [SCENE_NAMES, [9, 25]]
+    param_names = ['scene', 'npoints']
+    timeout = TIMEOUT
+
+    def setup(self, scene, npoints):
+        rows, cols = SCENES[scene]
+        size = int(numpy.sqrt(npoints))
+
+        # the boxline shears to the right by 5% of the scene width
+        shear = cols // 20
+        self.row_start = numpy.linspace(0, shear, rows).astype('int64')
+        self.row_end = self.row_start + cols - shear - 1
+        self.row_centre = (self.row_start + self.row_end) // 2
+
+        # the (row, column) of each point, located on the boxlines
+        locations = []
+        for row in numpy.linspace(0, rows - 1, size).astype('int64'):
+            for col in numpy.linspace(self.row_start[row], self.row_end[row],
+                                      size).astype('int64'):
+                locations.append((row, col))
+        self.locations = numpy.array(locations)
+
+        numpy.random.seed(SEED)
+        self.samples = numpy.random.uniform(0.1, 1.0, npoints)
+        self.shape = (rows, cols)
+
+    def _interpolate(self, both_sides):
+        rows, cols = self.shape
+        return sheared_bilinear_interpolate(cols, rows, self.locations,
+                                            self.samples, self.row_start,
+                                            self.row_end, self.row_centre,
+                                            both_sides=both_sides)
+
+    def time_sheared_bilinear_interpolate(self, scene, npoints):
+        self._interpolate(False)
+
+    def time_sheared_bilinear_interpolate_both_sides(self, scene, npoints):
+        self._interpolate(True)
+
+    def peakmem_sheared_bilinear_interpolate(self, scene, npoints):
+        self._interpolate(False)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the reading of the MODTRAN flux output, and the
+accumulation of the solar radiation.
+"""
+
+from __future__ import absolute_import
+from os.path import join as pjoin, dirname
+
+import numpy
+
+from wagl.modtran import read_modtran_flux, read_spectral_response
+from wagl.modtran import calculate_solar_radiation
+from benchmarks.synthetic import TIMEOUT, SEED
+
+SPECTRAL_RESPONSE_DIR = pjoin(dirname(dirname(__file__)), 'wagl',
+                              'spectral_response')
+
+
+def write_flux(fname, levels=36):
+    """
+    Write a random flux file, structured as per the MODTRAN `*_b.flx`
+    binary output; a header record followed by a record of the
+    upward diffuse, downward diffuse and direct solar flux at each
+    atmospheric level, for each wavelength from 2600nm to 350nm.
+    """
+    hdr_dtype = numpy.dtype([('record_length', 'int32'),
+                             ('spectral_unit', 'S1'),
+                             ('relabs', 'S1'),
+                             ('linefeed', 'S1'),
+                             ('mlflx', 'int32'),
+                             ('iv1', 'float32'),
+                             ('band_width', 'float32'),
+                             ('fwhm', 'float32'),
+                             ('ifwhm', 'float32')])
+    record_dtype = numpy.dtype([('head', 'int32'),
+                                ('wavelength', 'float64'),
+                                ('flux_data', 'float64', (levels, 3)),
+                                ('tail', 'int32')])
+
+    hdr = numpy.zeros(1, dtype=hdr_dtype)
+    hdr['mlflx'] = levels - 1
+    altitude = numpy.linspace(0, 100, levels).astype('float32')
+
+    wavelengths = numpy.arange(2600, 349, -1)
+    records = numpy.zeros(wavelengths.shape[0], dtype=record_dtype)
+    records['head'] = records['tail'] = record_dtype.itemsize - 8
+    records['wavelength'] = wavelengths
+    numpy.random.seed(SEED)
+    records['flux_data'] = numpy.random.random(records['flux_data'].shape)
+
+    with open(fname, 'wb') as src:
+        hdr.tofile(src)
+        altitude.tofile(src)
+        numpy.zeros(1, dtype='int32').tofile(src)
+        records.tofile(src)
+
+
+class ModtranFlux(object):
+
+    """
+    Reads a MODTRAN flux file, and accumulates the solar radiation
+    for each band of a sensor's spectral response.
+    """
+
+    params = [['landsat8_vsir.flt', 'sentinel2a_all.flt'], [False, True]]
+    param_names = ['spectral_response', 'transmittance']
+    timeout = TIMEOUT
+
+    def setup_cache(self):
+        fname = 'synthetic_b.flx'
+        write_flux(fname)
+        return fname
+
+    def setup(self, fname, spectral_response, transmittance):
+        self.flux_data, self.altitudes = read_modtran_flux(fname)
+        self.response = read_spectral_response(pjoin(SPECTRAL_RESPONSE_DIR,
+                                                     spectral_response))
+
+    def time_read_modtran_flux(self, fname, spectral_response,
+                               transmittance):
+        read_modtran_flux(fname)
+
+    def time_calculate_solar_radiation(self, fname, spectral_response,
+                                       transmittance):
+        calculate_solar_radiation(self.flux_data, self.response,
+                                  self.altitudes.shape[0], transmittance)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the pixel quality stages; saturation, contiguity, ACCA,
+the cloud shadow masks and the projection of the cloud shadows,
+Fmask's cloud shadow matching, the percentiles of their scene
+statistics, and the morphology of the masks.
+"""
+
+from __future__ import absolute_import
+
+import numpy
+from scipy import ndimage
+
+from wagl.acca_cloud_masking import calc_acca_cloud_mask
+from wagl.cloud_shadow_masking import cloud_shadow, project_shadows
+from wagl.constants import PQAConstants
+from wagl.contiguity_masking import calc_contiguity_mask
+from wagl.fmask_cloud_masking import fcssm
+from wagl.morphology import square_dilation, square_erosion
+from wagl.morphology import majority_filter
+from wagl.quantiles import percentiles
+from wagl.saturation_masking import saturation_mask
+from wagl.unittesting_tools import create_test_image
+from benchmarks.synthetic import SCENES, SCENE_NAMES, TIMEOUT
+from benchmarks.synthetic import write_scene, open_acquisition, cloud_mask
+from benchmarks.synthetic import reflectance_bands, brightness_temperature
+
+# the spectral bands of the contiguity mask
+NBANDS = 7
+
+
+class SaturationMask(object):
+
+    """
+    Masks the saturated pixels of a band.
+    """
+
+    params = [SCENE_NAMES, [True, False]]
+    param_names = ['scene', 'use_numexpr']
+    timeout = TIMEOUT
+
+    def setup(self, scene, use_numexpr):
+        self.band = create_test_image(SCENES[scene])[0]
+
+    def time_saturation_mask(self, scene, use_numexpr):
+        saturation_mask(self.band, use_numexpr=use_numexpr)
+
+
+class ContiguityMask(object):
+
+    """
+    Masks the pixels that aren't contiguous across all bands.
+    """
+
+    params = [SCENE_NAMES]
+    param_names = ['scene']
+    timeout = TIMEOUT
+
+    def setup_cache(self):
+        return {scene: [write_scene('.', SCENES[scene], str(band_id))
+                        for band_id in range(1, NBANDS + 1)]
+                for scene in SCENE_NAMES}
+
+    def setup(self, inputs, scene):
+        self.acquisitions = [open_acquisition(fname, 'BAND {}'.format(i),
+                                              str(i))
+                             for i, fname in enumerate(inputs[scene], 1)]
+
+    def time_calc_contiguity_mask(self, inputs, scene):
+        calc_contiguity_mask(self.acquisitions, 'LANDSAT_8')
+
+    def peakmem_calc_contiguity_mask(self, inputs, scene):
+        calc_contiguity_mask(self.acquisitions, 'LANDSAT_8')
+
+
+class CloudMasks(object):
+
+    """
+    The ACCA cloud mask, and the cloud shadow mask derived from it.
+    """
+
+    params = [SCENE_NAMES]
+    param_names = ['scene']
+    timeout = TIMEOUT
+
+    def setup(self, scene):
+        shape = SCENES[scene]
+        self.bands = reflectance_bands(shape)
+        self.kelvin = brightness_temperature(shape)
+        self.contiguity = numpy.ones(shape, dtype='bool')
+        self.cloud = ~cloud_mask(shape)
+        self.geobox = create_test_image(shape)[1]
+        self.pq_const = PQAConstants('ETM+')
+
+    def _acca(self):
+        calc_acca_cloud_mask(*self.bands, kelvin_array=self.kelvin,
+                             pq_const=self.pq_const,
+                             contiguity_mask=self.contiguity)
+
+    def _cloud_shadow(self):
+        # the cloud mask is modified in place
+        cloud_shadow(*self.bands, kelvin_array=self.kelvin,
+                     cloud_mask=self.cloud.copy(), geo_box=self.geobox,
+                     sun_az_deg=45.0, sun_elev_deg=50.0,
+                     pq_const=self.pq_const, contiguity_mask=self.contiguity,
+                     growregion=True)
+
+    def time_calc_acca_cloud_mask(self, scene):
+        self._acca()
+
+    def peakmem_calc_acca_cloud_mask(self, scene):
+        self._acca()
+
+    def time_cloud_shadow(self, scene):
+        self._cloud_shadow()
+
+    def peakmem_cloud_shadow(self, scene):
+        self._cloud_shadow()
+
+
+class ShadowProjection(object):
+
+    """
+    The projection of a heavily clouded scene to the locations of its
+    shadows, for each of the environmental lapse rates.
+    """
+
+    params = [SCENE_NAMES]
+    param_names = ['scene']
+    timeout = TIMEOUT
+
+    def setup(self, scene):
+        shape = SCENES[scene]
+        self.cloud = cloud_mask(shape, fraction=0.8)
+        self.kelvin = brightness_temperature(shape)
+        self.geo_transform = create_test_image(shape)[1].transform.to_gdal()
+        pq_const = PQAConstants('ETM+')
+        self.lapse_rates = numpy.array([pq_const.cshadow_lapse_wet,
+                                        pq_const.cshadow_lapse_standard,
+                                        pq_const.cshadow_lapse_dry],
+                                       dtype='float32')
+
+    def _project(self):
+        project_shadows(self.cloud, self.kelvin, numpy.float32(300.0),
+                        self.lapse_rates, self.geo_transform,
+                        numpy.radians(50.0), numpy.radians(135.0))
+
+    def time_project_shadows(self, scene):
+        self._project()
+
+    def peakmem_project_shadows(self, scene):
+        self._project()
+
+
+class FmaskCloudShadow(object):
+
+    """
+    Matches the Fmask cloud objects to their shadows.
+    """
+
+    params = [SCENE_NAMES]
+    param_names = ['scene']
+    timeout = TIMEOUT
+
+    def setup(self, scene):
+        shape = SCENES[scene]
+        cloud = cloud_mask(shape, fraction=0.2)
+        self.shape = shape
+        self.temp = ((brightness_temperature(shape) - 273.15) *
+                     100).astype('int16')
+        self.water = numpy.zeros(shape, dtype='bool')
+        self.snow = numpy.zeros(shape, dtype='bool')
+        self.cloud = cloud.astype('uint8')
+
+        # potential shadows are found alongside the clouds
+        self.shadow = numpy.roll(cloud, (40, 40), (0, 1)).astype('uint8')
+
+    def time_fcssm(self, scene):
+        fcssm(40.0, 45.0, 90.0, self.temp, 1700, 3100, self.water,
+              self.snow, self.cloud.copy(), self.shadow.copy(), self.shape,
+              (30, 30), 55, 3, 3, 3)
+
+
+class Percentiles(object):
+
+    """
+    The percentiles of the cloud temperatures, as evaluated for the
+    ACCA and Fmask statistics.
+    """
+
+    params = [SCENE_NAMES, ['histogram', 'numpy']]
+    param_names = ['scene', 'method']
+    timeout = TIMEOUT
+
+    def setup(self, scene, method):
+        shape = SCENES[scene]
+        self.sample = brightness_temperature(shape)[cloud_mask(shape)]
+        self.func = percentiles if method == 'histogram' else numpy.percentile
+
+    def time_percentiles(self, scene, method):
+        self.func(self.sample, [97.5, 83.5, 98.75])
+
+
+class Morphology(object):
+
+    """
+    The 7x7 dilation and erosion, and the 3x3 majority filter, of the
+    cloud mask, as applied by the contiguity, ACCA and Fmask masks.
+    """
+
+    params = [SCENE_NAMES, ['wagl', 'scipy']]
+    param_names = ['scene', 'method']
+    timeout = TIMEOUT
+
+    def setup(self, scene, method):
+        self.mask = cloud_mask(SCENES[scene])
+        self.structure = numpy.ones((7, 7), dtype='bool')
+        self.weights = numpy.ones((3, 3), dtype='uint8')
+
+    def time_dilation(self, scene, method):
+        if method == 'wagl':
+            square_dilation(self.mask, 7)
+        else:
+            ndimage.binary_dilation(self.mask, self.structure)
+
+    def time_erosion(self, scene, method):
+        if method == 'wagl':
+            square_erosion(self.mask, 7)
+        else:
+            ndimage.binary_erosion(self.mask, self.structure)
+
+    def time_majority_filter(self, scene, method):
+        if method == 'wagl':
+            majority_filter(self.mask, iterations=2)
+        else:
+            mask = self.mask
+            for _ in range(2):
+                mask = ndimage.convolve(mask.astype('uint8'),
+                                        self.weights) > 4
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the surface reflectance calculation.
+"""
+
+from __future__ import absolute_import
+
+import h5py
+
+from wagl.reflectance import calculate_reflectance
+from benchmarks.synthetic import SCENES, SCENE_NAMES, TIMEOUT
+from benchmarks.synthetic import memory_file, write_scene, open_acquisition
+from benchmarks.synthetic import reflectance_inputs
+
+
+class CalculateReflectance(object):
+
+    """
+    Calculates the lambertian, NBAR and NBART reflectance of a band.
+    The inputs are written once, to files on disk, as they would be
+    during the workflow.
+    """
+
+    params = [SCENE_NAMES]
+    param_names = ['scene']
+    timeout = TIMEOUT
+
+    def setup_cache(self):
+        inputs = {}
+        for scene in SCENE_NAMES:
+            fname = write_scene('.', SCENES[scene])
+            h5_fname = 'reflectance-inputs-{}.h5'.format(scene)
+            with h5py.File(h5_fname, 'w') as fid:
+                reflectance_inputs(fid, open_acquisition(fname))
+            inputs[scene] = (fname, h5_fname)
+
+        return inputs
+
+    def setup(self, inputs, scene):
+        fname, h5_fname = inputs[scene]
+        self.acquisition = open_acquisition(fname)
+        self.fid = h5py.File(h5_fname, 'r')
+
+    def teardown(self, inputs, scene):
+        self.fid.close()
+
+    def _calculate(self):
+        grp = self.fid
+        with memory_file('reflectance.h5') as out_fid:
+            calculate_reflectance(self.acquisition, grp, grp, grp, grp, grp,
+                                  grp, grp, grp, 0.52, out_fid)
+
+    def time_calculate_reflectance(self, inputs, scene):
+        self._calculate()
+
+    def peakmem_calculate_reflectance(self, inputs, scene):
+        self._calculate()
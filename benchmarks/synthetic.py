@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+"""
+Synthetic scenes for the benchmarks
+-----------------------------------
+
+Generates inputs of the size of real Landsat and Sentinel-2 scenes,
+so that the hot paths can be timed without any reference data.
+The imagery is random (see `wagl.unittesting_tools.create_test_image`),
+which is fine for measuring throughput, but the results are
+meaningless.
+
+The scene sizes that are benchmarked can be restricted via the
+`WAGL_BENCHMARK_SCENES` environment variable, eg:
+
+    $ WAGL_BENCHMARK_SCENES=small asv run --quick
+"""
+
+from __future__ import absolute_import
+import datetime
+import os
+from os.path import join as pjoin
+import tempfile
+
+import numpy
+from scipy import ndimage
+import h5py
+import rasterio
+
+from wagl.acquisition.landsat import Landsat8Acquisition
+from wagl.constants import DatasetName, BandType, BrdfParameters
+from wagl.constants import AtmosphericCoefficients as AC
+from wagl.unittesting_tools import create_test_image, random_pixel_locations
+
+# (rows, columns) of each scene class
+SCENES = {'small': (1024, 1024),
+          'landsat': (7841, 7691),
+          'sentinel2': (10980, 10980)}
+
+SCENE_NAMES = [s for s in os.environ.get('WAGL_BENCHMARK_SCENES',
+                                         'small,landsat,sentinel2').split(',')
+               if s in SCENES]
+
+# the largest scenes exceed asv's default timeout of 60 seconds
+TIMEOUT = 1200
+
+# a fixed seed, so each commit is benchmarked against the same data
+SEED = 12345
+
+ACQUISITION_DATETIME = datetime.datetime(2017, 1, 4, 23, 54)
+
+
+def memory_file(name):
+    """
+    An in-memory HDF5 file.
+    """
+    return h5py.File(name, 'w', driver='core', backing_store=False)
+
+
+def random_image(shape, low, high, dtype='float32'):
+    """
+    A random image of uniformly distributed values in [low, high).
+    """
+    numpy.random.seed(SEED)
+    return numpy.random.uniform(low, high, shape).astype(dtype)
+
+
+def write_scene(outdir, shape, band_id='1', nulls=1000):
+    """
+    Write a random Landsat 8 like GeoTIFF.
+
+    :param outdir:
+        The directory to write the GeoTIFF into.
+
+    :param shape:
+        The (rows, columns) of the scene.
+
+    :param band_id:
+        The band id, used to name the file.
+
+    :param nulls:
+        The number of randomly located pixels set to no data.
+
+    :return:
+        The file pathname of the GeoTIFF.
+    """
+    numpy.random.seed(SEED)
+    img, geobox = create_test_image(shape, dtype='uint16')
+    img[random_pixel_locations(shape, nulls)] = 0
+
+    fname = pjoin(outdir, 'synthetic-{}x{}-{}.tif'.format(shape[0], shape[1],
+                                                          band_id))
+    kwargs = {'driver': 'GTiff',
+              'width': shape[1],
+              'height': shape[0],
+              'count': 1,
+              'dtype': img.dtype.name,
+              'crs': geobox.crs.ExportToWkt(),
+              'transform': geobox.transform,
+              'nodata': 0}
+    with rasterio.open(fname, 'w', **kwargs) as ds:
+        ds.write(img, 1)
+
+    return fname
+
+
+def open_acquisition(fname, band_name='BAND 1', band_id='1'):
+    """
+    Return an acquisition object that reads from a GeoTIFF written by
+    `write_scene`.
+
+    :return:
+        An instance of a `Landsat8Acquisition`.
+    """
+    metadata = {'band_type': BandType.REFLECTIVE.name,
+                'min_radiance': -64.0,
+                'max_radiance': 780.0,
+                'min_quantize': 1,
+                'max_quantize': 65535,
+                'reflectance_adjustment': 1.0}
+
+    return Landsat8Acquisition(fname, fname, ACQUISITION_DATETIME,
+                               band_name=band_name, band_id=band_id,
+                               metadata=metadata)
+
+
+def cloud_mask(shape, fraction=0.3, scale=64):
+    """
+    A mask of contiguous cloud like objects, given by thresholding
+    a smoothly varying random field.
+
+    :param fraction:
+        The fraction of the pixels flagged as cloud.
+
+    :param scale:
+        The approximate size in pixels of the objects.
+    """
+    numpy.random.seed(SEED)
+    coarse = numpy.random.random((shape[0] // scale + 2,
+                                  shape[1] // scale + 2))
+    field = ndimage.zoom(coarse, scale, order=1)[:shape[0], :shape[1]]
+    return field > numpy.percentile(field, 100 * (1 - fraction))
+
+
+def reflectance_bands(shape):
+    """
+    The blue, green, red, nir, swir1 and swir2 bands as reflectance
+    scaled from 0 to 10,000, with brighter values over the cloud
+    mask given by `cloud_mask`.
+
+    :return:
+        A `list` of 6 `NumPy` arrays.
+    """
+    cloud = cloud_mask(shape)
+    bands = []
+    for low, high in [(300, 1200), (400, 1400), (300, 1600),
+                      (1500, 4000), (1200, 3500), (600, 2500)]:
+        band = random_image(shape, low, high, 'int16')
+        band[cloud] += 4000
+        bands.append(band)
+
+    return bands
+
+
+def brightness_temperature(shape):
+    """
+    A brightness temperature image in degrees Kelvin, that is colder
+    over the cloud mask given by `cloud_mask`.
+    """
+    kelvin = random_image(shape, 290, 305)
+    kelvin[cloud_mask(shape)] -= 40
+    return kelvin
+
+
+def create_images(group, specs, shape, chunks):
+    """
+    Create random image datasets.
+
+    :param group:
+        The `h5py.Group` to create the datasets in.
+
+    :param specs:
+        A `dict` mapping each dataset pathname to a tuple of the
+        (low, high) bounds of its values.
+    """
+    for pathname, (low, high) in specs.items():
+        group.create_dataset(pathname, data=random_image(shape, low, high),
+                             chunks=chunks)
+
+
+def satellite_solar_group(group, shape, chunks):
+    """
+    Populate a group with the satellite and solar angle datasets.
+    """
+    specs = {DatasetName.SOLAR_ZENITH.value: (20, 60),
+             DatasetName.SOLAR_AZIMUTH.value: (30, 60),
+             DatasetName.SATELLITE_VIEW.value: (0, 8),
+             DatasetName.SATELLITE_AZIMUTH.value: (100, 110),
+             DatasetName.RELATIVE_AZIMUTH.value: (-90, 90)}
+    create_images(group, specs, shape, chunks)
+    return group
+
+
+def lon_lat_group(group, shape, chunks):
+    """
+    Populate a group with the longitude and latitude datasets.
+    """
+    specs = {DatasetName.LON.value: (149, 152),
+             DatasetName.LAT.value: (-36, -34)}
+    create_images(group, specs, shape, chunks)
+    return group
+
+
+def reflectance_inputs(group, acquisition):
+    """
+    Populate a group with every input of
+    `wagl.reflectance.calculate_reflectance`, for the given
+    acquisition.
+    """
+    shape = (acquisition.lines, acquisition.samples)
+    chunks = acquisition.chunks
+    bn = acquisition.band_name
+
+    satellite_solar_group(group, shape, chunks)
+
+    fmt = DatasetName.INTERPOLATION_FMT.value
+    specs = {fmt.format(coefficient=c.value, band_name=bn): (0.1, 1.0)
+             for c in [AC.FV, AC.FS, AC.B, AC.S, AC.A, AC.DIR, AC.DIF, AC.TS]}
+    specs.update({DatasetName.SLOPE.value: (0, 30),
+                  DatasetName.ASPECT.value: (0, 360),
+                  DatasetName.RELATIVE_SLOPE.value: (-180, 180),
+                  DatasetName.INCIDENT.value: (0, 90),
+                  DatasetName.EXITING.value: (0, 90)})
+    create_images(group, specs, shape, chunks)
+
+    numpy.random.seed(SEED)
+    shadow = numpy.ones(shape, dtype='bool')
+    shadow[random_pixel_locations(shape, shape[0] * shape[1] // 20)] = False
+    group.create_dataset(DatasetName.COMBINED_SHADOW.value, data=shadow,
+                         chunks=chunks)
+
+    fmt = DatasetName.BRDF_FMT.value
+    for param, value in zip(BrdfParameters, [0.05, 0.02, 0.01]):
+        group.create_dataset(fmt.format(band_name=bn, parameter=param.value),
+                             data=value)
+
+    return group
+
+
+def temporary_directory():
+    """
+    A temporary directory for the synthetic files of a benchmark.
+    """
+    return tempfile.TemporaryDirectory(prefix='wagl-benchmark-')
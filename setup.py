@@ -65,7 +65,7 @@ setup(
     author='The wagl authors',
     author_email='earth.observation@ga.gov.au',
     maintainer='wagl developers',
-    packages=setuptools.find_packages(exclude=("tests", )),
+    packages=setuptools.find_packages(exclude=("tests", "benchmarks")),
     scripts=['utils/test_satellite_solar_angles',
              'utils/test_dsm',
              'utils/test_exiting_angles',
@@ -77,7 +77,9 @@ setup(
              'utils/wagl_convert',
              'utils/wagl_ls',
              'utils/wagl_residuals',
-             'utils/wagl_pbs'],
+             'utils/wagl_compression_benchmark',
+             'utils/wagl_pbs',
+             'utils/wagl_queue_worker'],
     setup_requires=['pytest-runner'],
     tests_require=tests_require,
     install_requires=install_requires,
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""
+Tests the tile streamed ACCA cloud mask.
+"""
+
+from __future__ import absolute_import
+import unittest
+
+import numpy
+import numpy.testing as npt
+
+from wagl import acca_cloud_masking as acca
+from wagl.constants import PQAConstants
+
+SHAPE = (211, 157)
+
+
+def scene(seed):
+    """
+    Random bands, bright and cold over a block of cloud, with a
+    strip of non-contiguous pixels.
+    """
+    numpy.random.seed(seed)
+    bands = [numpy.random.randint(200, 3000, SHAPE).astype('int16')
+             for _ in range(6)]
+    kelvin = numpy.random.uniform(285, 305, SHAPE).astype('float32')
+
+    cloud = numpy.zeros(SHAPE, dtype='bool')
+    cloud[40:150, 30:120] = True
+    cloud &= numpy.random.random(SHAPE) < 0.9
+    for band, offset in zip(bands, [4000, 4000, 4000, 3000, 2500, 2000]):
+        band[cloud] += offset
+    kelvin[cloud] -= numpy.random.uniform(20, 60, cloud.sum())
+
+    contiguity = numpy.ones(SHAPE, dtype='bool')
+    contiguity[:, :5] = False
+
+    return bands, kelvin, contiguity
+
+
+class AccaCloudMaskTest(unittest.TestCase):
+
+    """
+    Test the ACCA cloud mask is independent of the tiling.
+    """
+
+    def run_acca(self, seed, tile_lines, pq_const=None):
+        """The cloud mask and aux data of a scene."""
+        bands, kelvin, contiguity = scene(seed)
+        original = kelvin.copy()
+        aux_data = {'scene': seed}
+        mask = acca.calc_acca_cloud_mask(*bands, kelvin_array=kelvin,
+                                         pq_const=pq_const or
+                                         PQAConstants('ETM+'),
+                                         contiguity_mask=contiguity,
+                                         aux_data=aux_data,
+                                         tile_lines=tile_lines)
+
+        # the temperature is unmodified
+        npt.assert_array_equal(kelvin, original)
+        aux_data.pop('acca_process_time_secs')
+
+        return mask, aux_data
+
+    def assert_tiling_independent(self, seed, pq_const=None):
+        """The masks and aux data of each tiling are the same."""
+        mask, aux_data = self.run_acca(seed, None, pq_const)
+        for tile_lines in [1, 10, 64]:
+            tiled_mask, tiled_aux_data = self.run_acca(seed, tile_lines,
+                                                       pq_const)
+            npt.assert_array_equal(tiled_mask, mask)
+            self.assertEqual(set(tiled_aux_data), set(aux_data))
+            for key, value in aux_data.items():
+                if isinstance(value, str):
+                    self.assertEqual(tiled_aux_data[key], value)
+                else:
+                    npt.assert_allclose(tiled_aux_data[key], value,
+                                        rtol=1e-6)
+
+        return mask, aux_data
+
+    def test_second_pass(self):
+        """
+        Test the second pass statistics over tiles.
+        """
+        mask, aux_data = self.assert_tiling_independent(1)
+        self.assertEqual(aux_data['acca_pass_2'], 'engaged')
+        self.assertFalse(mask[60:130, 50:100].any())
+        self.assertTrue(mask[:, :5].all())
+
+    def test_cold_cloud(self):
+        """
+        Test the cold cloud of a desert scene.
+        """
+        pq_const = PQAConstants('ETM+')
+        pq_const.acca_desert_index = 10.0
+        _, aux_data = self.assert_tiling_independent(2, pq_const)
+        self.assertNotIn('acca_pass_2', aux_data)
+
+    def test_rejected(self):
+        """
+        Test a scene whose cloud is rejected.
+        """
+        pq_const = PQAConstants('ETM+')
+        pq_const.acca_thresh_f1 = 10.0
+        mask, aux_data = self.assert_tiling_independent(3, pq_const)
+        self.assertEqual(aux_data['acca_identified_pixels'], 'all rejected')
+        self.assertTrue(mask.all())
+
+    def test_tallies(self):
+        """
+        Test the tallies, and the statistics of the cloud temperatures,
+        of the tiles.
+        """
+        tallies = acca.FirstPassTallies()
+        thermal = numpy.arange(12, dtype='float32').reshape(3, 4)
+        cold = (thermal % 3) == 0
+        warm = (thermal % 3) == 1
+        for idx in [slice(0, 1), slice(1, 3)]:
+            tallies.add(thermal[idx], cold[idx], warm[idx], cold[idx],
+                        cold[idx], warm[idx])
+
+        self.assertEqual(tallies.pixels, 12)
+        self.assertEqual(tallies.snow, 4)
+        self.assertEqual(tallies.f6_survivors, 4)
+        self.assertEqual(tallies.count(cold=False), 4)
+        self.assertEqual(tallies.count(), 8)
+        self.assertEqual(tallies.mean(), thermal[cold | warm].mean())
+        self.assertEqual(tallies.mean(warm=False), thermal[cold].mean())
+
+        # the percentiles, from a second pass over the tiles
+        for cold_, warm_ in [(True, True), (True, False), (False, True)]:
+            selected = (cold & cold_) | (warm & warm_)
+            tiles = [thermal[idx][selected[idx]] for idx in
+                     [slice(1, 3), slice(0, 1)]]
+            result = tallies.quantiles(cold_, warm_).percentiles(
+                [17.5, 83.5], tiles)
+            npt.assert_array_equal(result, numpy.percentile(
+                thermal[selected], [17.5, 83.5]))
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    return unittest.defaultTestLoader.loadTestsFromTestCase(AccaCloudMaskTest)
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
@@ -1,11 +1,14 @@
 from __future__ import absolute_import
 import unittest
 import datetime
+import numpy
 import rasterio
 from osgeo import osr
+from scipy import interpolate
 from wagl.acquisition import acquisitions
 from wagl.acquisition.sentinel import (
-    Sentinel2Acquisition, Sentinel2aAcquisition, Sentinel2bAcquisition
+    Sentinel2Acquisition, Sentinel2aAcquisition, Sentinel2bAcquisition,
+    SolarZenithModel
 )
 from wagl.constants import BandType
 from wagl.temperature import temperature_at_sensor
@@ -115,3 +118,67 @@ class Sentinel2BScene1AcquisitionTest(unittest.TestCase):
                          'sentinel2b_all.flt')
     def test_read(self):
         self.assertEqual(self.acq.data()[100, 100], 1029)
+
+
+def full_solar_zenith(grid, lines, samples):
+    """
+    The solar zenith evaluated across the full dimensions, as
+    previously computed by the acquisition.
+    """
+    solar_zenith = grid.copy()
+    numpy.absolute(solar_zenith, out=solar_zenith)
+    numpy.clip(solar_zenith, 0, 70.0, out=solar_zenith)
+
+    dims = solar_zenith.shape
+    y = numpy.arange(lines) / (lines - 1) * dims[0]
+    x = numpy.arange(samples) / (samples - 1) * dims[1]
+    func = interpolate.RectBivariateSpline(
+        numpy.arange(dims[1], dtype=numpy.float32),
+        numpy.arange(dims[0], dtype=numpy.float32), solar_zenith)
+
+    solar_zenith = numpy.float32(func(y, x))
+    return numpy.radians(solar_zenith, out=solar_zenith)
+
+
+class SolarZenithModelTest(unittest.TestCase):
+    def setUp(self):
+        y, x = numpy.mgrid[0:23, 0:23]
+        self.grid = (40 + 0.3 * y - 0.1 * x + 0.01 * x * y).astype('float32')
+
+    def test_windows(self):
+        """Windows are identical to the full dimensions."""
+        lines, samples = 300, 300
+        expected = full_solar_zenith(self.grid, lines, samples)
+        model = SolarZenithModel(self.grid, lines, samples)
+
+        numpy.testing.assert_array_equal(model(), expected)
+        for window in [((0, 64), (0, 300)), ((64, 128), (100, 200)),
+                       ((250, 300), (290, 300))]:
+            idx = tuple(slice(*w) for w in window)
+            numpy.testing.assert_array_equal(model(window), expected[idx])
+
+    def test_cache(self):
+        """Repeated windows are cached, within the memory limit."""
+        model = SolarZenithModel(self.grid, 100, 100, cache_bytes=60000)
+        first = model(((0, 100), (0, 100)))
+        self.assertIs(model(((0, 100), (0, 100))), first)
+        self.assertFalse(first.flags.writeable)
+
+        model(((0, 50), (0, 100)))
+        model(((50, 100), (0, 100)))
+        self.assertIsNot(model(((0, 100), (0, 100))), first)
+        self.assertLessEqual(model._cached_bytes, model.cache_bytes)
+
+
+class Sentinel2SolarZenithTest(unittest.TestCase):
+    def test_shared_model(self):
+        """Acquisitions of a resolution group share the model."""
+        container = acquisitions(S2A_SCENE1)
+        acqs = container.get_acquisitions(group='RES-GROUP-0')
+        radiance = [acq.radiance_data() for acq in acqs]
+        self.assertIs(acqs[0]._solar_zenith, acqs[1]._solar_zenith)
+
+        window = ((10, 60), (20, 109))
+        idx = tuple(slice(*w) for w in window)
+        numpy.testing.assert_array_equal(acqs[0].radiance_data(window),
+                                         radiance[0][idx])
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+Tests the aerosol point selection and spatial indexing.
+"""
+
+from __future__ import absolute_import
+import unittest
+
+import numpy
+import h5py
+import pandas
+from shapely.geometry import Point, Polygon
+
+from wagl.ancillary import grid_cells, points_in_polygon, read_aerosol_table
+from wagl.hdf5 import write_dataframe, write_h5_table
+from wagl.scripts.aot_converter import spatial_index
+
+
+class TestAerosolSelection(unittest.TestCase):
+
+    """
+    Test the vectorised aerosol point selection against shapely.
+    """
+
+    def setUp(self):
+        numpy.random.seed(0)
+        self.lon = numpy.random.uniform(110, 155, 5000)
+        self.lat = numpy.random.uniform(-45, -10, 5000)
+        self.aerosol = numpy.random.uniform(0, 1, 5000)
+
+        # a rotated scene footprint with a hole
+        exterior = [(130.1, -25.3), (132.4, -25.9), (131.7, -28.2),
+                    (129.5, -27.6)]
+        interior = [(130.8, -26.4), (131.2, -26.5), (131.0, -26.9)]
+        self.polygon = Polygon(exterior, [interior])
+
+    def test_points_in_polygon(self):
+        """Test the selection matches shapely's within:"""
+        expected = numpy.array([Point(x, y).within(self.polygon) for x, y
+                                in zip(self.lon, self.lat)])
+        result = points_in_polygon(self.lon, self.lat, self.polygon)
+        self.assertTrue(expected.any())
+        self.assertTrue((result == expected).all())
+
+    def test_spatial_index(self):
+        """Test reading via the spatial index selects the same rows:"""
+        df = pandas.DataFrame({'lon': self.lon, 'lat': self.lat,
+                               'aerosol': self.aerosol})
+        sorted_df, index = spatial_index(df, 0.5)
+
+        cells = grid_cells(sorted_df['lon'].values, sorted_df['lat'].values,
+                           0.5)
+        self.assertTrue((numpy.diff(cells) >= 0).all())
+        self.assertEqual(index['stop'][-1], df.shape[0])
+
+        with h5py.File('aerosol.h5', 'w', driver='core',
+                       backing_store=False) as fid:
+            write_h5_table(index, 'pix/SPATIAL-INDEX/test', fid)
+            attrs = {'spatial_index': 'pix/SPATIAL-INDEX/test',
+                     'spatial_index_cell_size': 0.5}
+            write_dataframe(sorted_df, 'pix/test', fid, attrs=attrs)
+            write_dataframe(df, 'pix/unindexed', fid)
+
+            bounds = self.polygon.bounds
+            indexed = read_aerosol_table(fid, 'pix/test', bounds)
+            unindexed = read_aerosol_table(fid, 'pix/unindexed', bounds)
+
+        self.assertEqual(indexed.shape[0], unindexed.shape[0])
+        self.assertAlmostEqual(indexed['aerosol'].sum(),
+                               unindexed['aerosol'].sum())
+
+
+if __name__ == '__main__':
+    unittest.main()
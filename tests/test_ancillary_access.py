@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""
+Tests the pooled ancillary raster access.
+"""
+
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import rasterio
+from affine import Affine
+
+from wagl.ancillary_access import AncillaryPool, get_pool, reset_pool
+from wagl.data import get_pixel
+
+
+def write_raster(fname, data):
+    """Write a lon/lat raster with a 1 degree pixel size."""
+    kwargs = {'driver': 'GTiff',
+              'width': data.shape[2],
+              'height': data.shape[1],
+              'count': data.shape[0],
+              'dtype': data.dtype.name,
+              'crs': 'EPSG:4326',
+              'transform': Affine(1.0, 0.0, 100.0, 0.0, -1.0, -10.0)}
+    with rasterio.open(fname, 'w', **kwargs) as ds:
+        ds.write(data)
+
+
+class TestAncillaryPool(unittest.TestCase):
+
+    """Unit tests for the AncillaryPool."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.data = numpy.random.randint(0, 1000, (5, 20, 30))
+        self.data = self.data.astype('int16')
+        self.fnames = []
+        for i in range(3):
+            fname = os.path.join(self.temp_dir, 'anc{}.tif'.format(i))
+            write_raster(fname, self.data + i)
+            self.fnames.append(fname)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_pixel(self):
+        """Test the pixel values match wagl.data.get_pixel:"""
+        lonlats = [(100.5, -10.5), (112.3, -21.7), (129.9, -29.9)]
+        with AncillaryPool() as pool:
+            for fname in self.fnames:
+                for lonlat in lonlats:
+                    for band in [1, 3, [2, 4, 5]]:
+                        # twice; once read, once memoised
+                        for _ in range(2):
+                            result = pool.get_pixel(fname, lonlat, band)
+                            expected = get_pixel(fname, lonlat, band)
+                            self.assertTrue((result == expected).all())
+
+    def test_out_of_bounds(self):
+        """Test a location outside the raster raises an IndexError:"""
+        with AncillaryPool() as pool:
+            self.assertRaises(IndexError, pool.get_pixel, self.fnames[0],
+                              (50.0, 50.0))
+
+    def test_lru_bound(self):
+        """Test the number of opened rasters is bounded:"""
+        with AncillaryPool(max_open=2) as pool:
+            for fname in self.fnames:
+                pool.get_pixel(fname, (101.5, -11.5))
+            self.assertEqual(len(pool._datasets), 2)
+            self.assertNotIn(self.fnames[0], pool._datasets)
+
+            # an evicted raster is still served from the memo
+            self.assertEqual(pool.get_pixel(self.fnames[0], (101.5, -11.5)),
+                             self.data[0, 1, 1])
+            self.assertNotIn(self.fnames[0], pool._datasets)
+
+    def test_memo_bound(self):
+        """Test the number of memoised pixels is bounded:"""
+        with AncillaryPool(max_pixels=4) as pool:
+            for x in range(10):
+                pool.get_pixel(self.fnames[0], (100.5 + x, -10.5))
+            self.assertEqual(len(pool._pixels), 4)
+
+    def test_count(self):
+        """Test the band count:"""
+        with AncillaryPool() as pool:
+            self.assertEqual(pool.count(self.fnames[0]), 5)
+
+    def test_metadata(self):
+        """Test the file metadata is memoised:"""
+        with AncillaryPool() as pool:
+            md = pool.metadata(self.fnames[0])
+            md['owner_id'] = 'modified'
+            self.assertNotEqual(pool.metadata(self.fnames[0])['owner_id'],
+                                'modified')
+
+    def test_updated(self):
+        """Test a file updated in place is reopened:"""
+        fname = self.fnames[0]
+        lonlat = (100.5, -10.5)
+        with AncillaryPool() as pool:
+            self.assertEqual(pool.count(fname), 5)
+            self.assertEqual(pool.get_pixel(fname, lonlat, 5),
+                             self.data[4, 0, 0])
+            md = pool.metadata(fname)
+
+            # a file that has been appended to
+            data = numpy.concatenate([self.data, self.data + 1])
+            write_raster(fname, data)
+            stat = os.stat(fname)
+            os.utime(fname, ns=(stat.st_atime_ns,
+                                stat.st_mtime_ns + 10**9))
+
+            self.assertEqual(pool.count(fname), 10)
+            self.assertEqual(pool.get_pixel(fname, lonlat, 10),
+                             data[9, 0, 0])
+            self.assertNotEqual(pool.metadata(fname), md)
+
+            # the previous version was discarded
+            self.assertEqual(len(pool._datasets), 1)
+            self.assertEqual(len(pool._pixels), 1)
+            self.assertEqual(len(pool._metadata), 1)
+
+    def test_shared_pool(self):
+        """Test the process wide pool is shared and resettable:"""
+        pool = get_pool()
+        self.assertIs(pool, get_pool())
+        reset_pool()
+        self.assertIsNot(pool, get_pool())
+        reset_pool()
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    return unittest.defaultTestLoader.loadTestsFromTestCase(TestAncillaryPool)
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""
+Tests the multi-scene batch driver.
+"""
+
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from wagl.batch import MemoryBudget, run_batch
+
+
+class FakeAcquisition(object):
+
+    def __init__(self, lines, samples):
+        self.lines = lines
+        self.samples = samples
+
+
+class FakeContainer(object):
+
+    supported_groups = ['RES-GROUP-0', 'RES-GROUP-1']
+
+    def get_acquisitions(self, granule=None, group=None):
+        if group == 'RES-GROUP-0':
+            return [FakeAcquisition(100, 100)]
+        return [FakeAcquisition(50, 50)]
+
+
+class TestMemoryBudget(unittest.TestCase):
+
+    """Unit tests for the MemoryBudget."""
+
+    def test_blocks(self):
+        """Test an acquire blocks until there is room:"""
+        budget = MemoryBudget(100)
+        budget.acquire(60)
+        admitted = threading.Event()
+
+        def acquire():
+            budget.acquire(60)
+            admitted.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(admitted.wait(0.1))
+        budget.release(60)
+        self.assertTrue(admitted.wait(5))
+        thread.join()
+        self.assertEqual(budget.in_use, 60)
+
+    def test_oversized(self):
+        """Test an oversized request is admitted when idle:"""
+        budget = MemoryBudget(100)
+        budget.acquire(1000)
+        self.assertEqual(budget.in_use, 1000)
+
+    def test_unlimited(self):
+        """Test an unlimited budget never blocks:"""
+        budget = MemoryBudget()
+        for _ in range(10):
+            budget.acquire(2**40)
+        self.assertEqual(budget.in_use, 10 * 2**40)
+
+
+class TestRunBatch(unittest.TestCase):
+
+    """Unit tests for run_batch."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.scenes = [('level1-{}'.format(i), None,
+                        os.path.join(self.temp_dir, '{}.wagl.h5'.format(i)))
+                       for i in range(6)]
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def fake_card4l(self, level1, granule, out_fname=None, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05)
+        with self.lock:
+            self.in_flight -= 1
+
+        if level1 == 'level1-3':
+            raise ValueError('failed scene')
+
+        with open(out_fname, 'w') as src:
+            src.write(level1)
+
+    def run_batch(self, **kwargs):
+        with mock.patch('wagl.batch.acquisitions',
+                        return_value=FakeContainer()), \
+                mock.patch('wagl.batch.card4l', side_effect=self.fake_card4l):
+            return run_batch(self.scenes, {}, **kwargs)
+
+    def test_results(self):
+        """Test the completed and failed scenes are reported:"""
+        results = self.run_batch(workers=3)
+        for level1, _, out_fname in self.scenes:
+            if level1 == 'level1-3':
+                self.assertIsInstance(results[out_fname], ValueError)
+                self.assertFalse(os.path.exists(out_fname))
+            else:
+                self.assertIsNone(results[out_fname])
+                with open(out_fname) as src:
+                    self.assertEqual(src.read(), level1)
+
+        # no temporary files are left behind
+        self.assertEqual(len(os.listdir(self.temp_dir)), 5)
+
+    def test_memory_budget(self):
+        """Test the memory budget bounds the scenes in flight:"""
+        # each scene is estimated at (100*100 + 50*50) * 64 bytes
+        footprint = (100 * 100 + 50 * 50) * 64
+        self.run_batch(workers=4, memory_budget=2 * footprint)
+        self.assertEqual(self.max_in_flight, 2)
+
+    def test_workers(self):
+        """Test the worker limit bounds the scenes in flight:"""
+        self.run_batch(workers=1)
+        self.assertEqual(self.max_in_flight, 1)
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestMemoryBudget)
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(
+        TestRunBatch))
+
+    return suite
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+Tests the projection of the cloud pixels to the locations of their
+shadows.
+"""
+
+from __future__ import absolute_import
+import math
+import unittest
+
+import numpy
+import numpy.testing as npt
+
+from wagl.cloud_shadow_masking import project_shadows
+
+SHAPE = (157, 131)
+
+LAPSE_RATES = numpy.array([6.4, 7.0, 7.5, 8.0, 9.0, 9.8], dtype='float32')
+
+PROJECTED = (500000.0, 30.0, 0.0, 6000000.0, 0.0, -30.0)
+
+GEOGRAPHIC = (148.0, 0.00025, 0.0, -35.0, 0.0, -0.00025)
+
+SEMI_MAJOR = 6378137.0
+
+
+def scene(seed):
+    """
+    A random cloud mask, with the cloud colder than the surface.
+    """
+    numpy.random.seed(seed)
+    cloud = numpy.random.random(SHAPE) < 0.3
+    kelvin = numpy.random.uniform(285, 305, SHAPE).astype('float32')
+    kelvin[cloud] -= numpy.random.uniform(5, 40, cloud.sum())
+    return cloud, kelvin
+
+
+class ProjectShadowsTest(unittest.TestCase):
+
+    """
+    Test the shadow projection of every lapse rate.
+    """
+
+    def project(self, geo_transform, semi_major=None, **kwargs):
+        """The shadow masks of a random scene."""
+        cloud, kelvin = scene(1)
+        return project_shadows(cloud, kelvin, numpy.float32(300.0),
+                               kwargs.pop('lapse_rates', LAPSE_RATES),
+                               geo_transform, math.radians(50.0),
+                               math.radians(110.0), semi_major=semi_major,
+                               **kwargs)
+
+    def assert_lapse_rates(self, geo_transform, semi_major=None):
+        """
+        The shadows of the lapse rates together are the union of the
+        shadows of each lapse rate, and independent of the chunks.
+        """
+        shadow, last = self.project(geo_transform, semi_major)
+        self.assertTrue(shadow.any())
+
+        union = numpy.zeros(SHAPE, dtype='bool')
+        for lapse_rate in LAPSE_RATES:
+            single, single_last = self.project(geo_transform, semi_major,
+                                               lapse_rates=[lapse_rate])
+            npt.assert_array_equal(single, single_last)
+            union |= single
+        npt.assert_array_equal(shadow, union)
+        npt.assert_array_equal(last, single)
+
+        for chunk in [1, 500, SHAPE[0] * SHAPE[1]]:
+            chunked = self.project(geo_transform, semi_major, chunk=chunk)
+            npt.assert_array_equal(chunked[0], shadow)
+            npt.assert_array_equal(chunked[1], last)
+
+    def test_projected(self):
+        """
+        Test the shadows of a projected co-ordinate system.
+        """
+        self.assert_lapse_rates(PROJECTED)
+
+    def test_geographic(self):
+        """
+        Test the shadows of a geographic co-ordinate system.
+        """
+        self.assert_lapse_rates(GEOGRAPHIC, SEMI_MAJOR)
+
+    def test_single_pixel(self):
+        """
+        Test the shadow of a single cloud pixel; a cloud 300m high,
+        with the sun at 45 degrees elevation, casts its shadow 10
+        pixels away.
+        """
+        cloud = numpy.zeros(SHAPE, dtype='bool')
+        cloud[50, 20] = True
+        kelvin = numpy.full(SHAPE, 297.0, dtype='float32')
+        shadow, last = project_shadows(cloud, kelvin, numpy.float32(300.0),
+                                       [10.0], PROJECTED, math.radians(45.0),
+                                       0.0)
+
+        expected = numpy.zeros(SHAPE, dtype='bool')
+        expected[50, 30] = True
+        npt.assert_array_equal(shadow, expected)
+        npt.assert_array_equal(last, expected)
+
+    def test_outside(self):
+        """
+        Test the shadows projected beyond the image are discarded.
+        """
+        cloud = numpy.zeros(SHAPE, dtype='bool')
+        cloud[50, -5] = True
+        kelvin = numpy.full(SHAPE, 297.0, dtype='float32')
+        shadow, last = project_shadows(cloud, kelvin, numpy.float32(300.0),
+                                       [10.0], PROJECTED, math.radians(45.0),
+                                       0.0)
+        self.assertFalse(shadow.any())
+        self.assertFalse(last.any())
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    return unittest.defaultTestLoader.loadTestsFromTestCase(ProjectShadowsTest)
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+Tests the compression benchmarks, and the per dataset class
+compression settings.
+"""
+
+from __future__ import absolute_import
+import unittest
+
+import numpy
+import pandas
+
+from wagl.hdf5 import H5CompressionFilter, DatasetClass
+from wagl.hdf5 import dataset_class_config
+from wagl.hdf5.compression import BloscShuffle
+from wagl.hdf5.compression_benchmark import synthetic_samples, run_benchmarks
+from wagl.hdf5.compression_benchmark import candidate_configs, recommend
+
+
+class TestDatasetClassConfig(unittest.TestCase):
+
+    """Unit tests for dataset_class_config."""
+
+    def test_passthrough(self):
+        """Test filter_opts without dataset classes are unchanged:"""
+        opts = {'aggression': 6}
+        result = dataset_class_config(H5CompressionFilter.GZIP, opts,
+                                      DatasetClass.MASK)
+        self.assertEqual(result, (H5CompressionFilter.GZIP, opts))
+
+    def test_classes(self):
+        """Test the settings of a class replace the defaults:"""
+        opts = {'shuffle': False,
+                'dataset_classes': {'mask': {'compression': 'GZIP',
+                                             'aggression': 6},
+                                    'table': {'compression': 'BLOSC_LZ4',
+                                              'shuffle_id': 'BITSHUFFLE'}}}
+        compression, mask_opts = dataset_class_config(
+            H5CompressionFilter.LZF, opts, DatasetClass.MASK)
+        self.assertEqual(compression, H5CompressionFilter.GZIP)
+        self.assertEqual(mask_opts, {'aggression': 6})
+
+        compression, table_opts = dataset_class_config(
+            H5CompressionFilter.LZF, opts, DatasetClass.TABLE)
+        self.assertEqual(compression, H5CompressionFilter.BLOSC_LZ4)
+        self.assertEqual(table_opts['shuffle_id'], BloscShuffle.BITSHUFFLE)
+
+        compression, angle_opts = dataset_class_config(
+            H5CompressionFilter.LZF, opts, DatasetClass.ANGLES)
+        self.assertEqual(compression, H5CompressionFilter.LZF)
+        self.assertEqual(angle_opts, {'shuffle': False})
+
+    def test_config(self):
+        """Test the dataset classes are ignored by a filter's config:"""
+        opts = {'shuffle': False,
+                'dataset_classes': {'mask': {'compression': 'GZIP'}}}
+        config = H5CompressionFilter.LZF.config(**opts)
+        self.assertEqual(config, H5CompressionFilter.LZF.config(shuffle=False))
+        self.assertIn('dataset_classes', opts)
+
+
+class TestCompressionBenchmark(unittest.TestCase):
+
+    """Unit tests for the compression benchmarks."""
+
+    def test_run_benchmarks(self):
+        """Test every sample is benchmarked for each configuration:"""
+        samples = synthetic_samples((64, 80))
+        configs = candidate_configs([H5CompressionFilter.LZF,
+                                     H5CompressionFilter.GZIP])
+        results = run_benchmarks(samples, configs, [(32, 32), (128, 128)],
+                                 repeats=1)
+
+        # 3 images * 2 chunk shapes + 1 table, for 4 configurations
+        self.assertEqual(len(results), 4 * 7)
+        self.assertEqual(set(results['dataset_class']),
+                         set(c.value for c in DatasetClass))
+        self.assertTrue((results['ratio'] > 0).all())
+        self.assertIn((64, 80), list(results['chunks']))
+
+    def test_recommend(self):
+        """Test the best ratio is selected within the throughput limits:"""
+        records = [('mask', 'GZIP', {'shuffle': True}, 500, 500, 20.0),
+                   ('mask', 'LZF', {'shuffle': True}, 900, 900, 5.0),
+                   ('mask', 'MAFISC', {}, 10, 50, 40.0),
+                   ('angles', 'GZIP', {'shuffle': True}, 50, 150, 8.0),
+                   ('angles', 'LZF', {'shuffle': False}, 80, 300, 1.1)]
+        columns = ['dataset_class', 'compression', 'filter_opts',
+                   'write_mbs', 'read_mbs', 'ratio']
+        results = pandas.DataFrame(records, columns=columns)
+
+        classes = recommend(results, 100, 200)['dataset_classes']
+        self.assertEqual(classes['mask'],
+                         {'compression': 'GZIP', 'shuffle': True})
+
+        # nothing sustains the limits; the fastest writes are selected
+        self.assertEqual(classes['angles'],
+                         {'compression': 'LZF', 'shuffle': False})
+
+        # the recommendation resolves to a valid configuration
+        compression, opts = dataset_class_config(
+            H5CompressionFilter.LZF, {'dataset_classes': classes},
+            DatasetClass.MASK)
+        kwargs = compression.config(**opts).dataset_compression_kwargs()
+        self.assertEqual(kwargs['compression'], 'gzip')
+
+    def test_synthetic_samples(self):
+        """Test the synthetic samples match the dataset classes:"""
+        samples = synthetic_samples((64, 80))
+        self.assertEqual(samples[DatasetClass.REFLECTANCE].dtype,
+                         numpy.int16)
+        self.assertEqual(samples[DatasetClass.ANGLES].dtype, numpy.float32)
+        self.assertEqual(samples[DatasetClass.MASK].dtype, numpy.bool_)
+        self.assertIsNotNone(samples[DatasetClass.TABLE].dtype.names)
+        self.assertTrue((samples[DatasetClass.REFLECTANCE] == -999).any())
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    test_classes = [TestDatasetClassConfig,
+                    TestCompressionBenchmark]
+
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(
+            test_class))
+
+    return suite
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+"""
+Tests the consolidation of several HDF5 files into one, via batched
+external links, virtual datasets, and the repacking of the result.
+"""
+
+from os.path import join as pjoin
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import numpy.testing as npt
+import h5py
+
+from wagl.hdf5 import create_external_links, create_virtual_datasets
+from wagl.hdf5 import link_datasets, repack
+from wagl.hdf5 import H5CompressionFilter
+
+
+def write_source(fname, seed):
+    """
+    A file of an image, a table and a scalar within an attributed
+    group.
+    """
+    numpy.random.seed(seed)
+    table = numpy.zeros(5, dtype=[('a', 'float64'), ('b', 'int32')])
+    table['a'] = numpy.random.random(5)
+    with h5py.File(fname, 'w') as fid:
+        group = fid.create_group('results')
+        group.attrs['lonlat'] = (148.5, -35.25)
+        group.attrs['description'] = 'results {}'.format(seed)
+        dset = group.create_dataset('image',
+                                    data=numpy.random.random((40, 30)),
+                                    compression='gzip', chunks=(10, 10))
+        dset.attrs['CLASS'] = 'IMAGE'
+        group.create_dataset('table', data=table)
+        group.create_dataset('scalar', data=seed)
+
+
+class ConsolidateTest(unittest.TestCase):
+
+    """
+    Test the consolidation of several HDF5 files.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fnames = [pjoin(self.tmpdir, 'source-{}.h5'.format(i))
+                       for i in range(3)]
+        for i, fname in enumerate(self.fnames):
+            write_source(fname, i)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assert_attributes(self, obj, source):
+        """The attributes of an object are those of its source."""
+        self.assertEqual(set(obj.attrs), set(source.attrs))
+        for key in source.attrs:
+            npt.assert_array_equal(obj.attrs[key], source.attrs[key])
+            self.assertEqual(obj.attrs.get_id(key).dtype,
+                             source.attrs.get_id(key).dtype)
+
+    def assert_consolidated(self, fname, virtual=None):
+        """
+        The contents of the consolidated file are those of the
+        sources.
+        """
+        with h5py.File(fname, 'r') as fid:
+            for i, source_fname in enumerate(self.fnames):
+                with h5py.File(source_fname, 'r') as src:
+                    source = src['results']
+                    group = fid['source-{}'.format(i)]
+                    self.assert_attributes(group, source)
+                    for key in source:
+                        npt.assert_array_equal(group[key][()],
+                                               source[key][()])
+                        self.assert_attributes(group[key], source[key])
+                    if virtual is not None:
+                        self.assertEqual(group['image'].is_virtual, virtual)
+
+    def links(self):
+        """A link for each source."""
+        return [(fname, 'results', 'source-{}'.format(i))
+                for i, fname in enumerate(self.fnames)]
+
+    def test_external_links(self):
+        """
+        Test the batched external links.
+        """
+        out_fname = pjoin(self.tmpdir, 'links.h5')
+        create_external_links(self.links(), out_fname)
+        with h5py.File(out_fname, 'r') as fid:
+            link = fid.get('source-1', getlink=True)
+            self.assertIsInstance(link, h5py.ExternalLink)
+            self.assertEqual(link.filename, self.fnames[1])
+
+        out_fname = pjoin(self.tmpdir, 'links-datasets.h5')
+        link_datasets([(fname, 'results/image', 'a/b/image-{}'.format(i))
+                       for i, fname in enumerate(self.fnames)], out_fname)
+        with h5py.File(out_fname, 'r') as fid, \
+                h5py.File(self.fnames[2], 'r') as src:
+            npt.assert_array_equal(fid['a/b/image-2'], src['results/image'])
+
+    def test_virtual(self):
+        """
+        Test the groups, datasets and attributes of the virtual
+        datasets.
+        """
+        out_fname = pjoin(self.tmpdir, 'virtual.h5')
+        create_virtual_datasets(self.links(), out_fname)
+        self.assert_consolidated(out_fname, virtual=True)
+
+        # metadata is available without the sources
+        with h5py.File(out_fname, 'r') as fid:
+            dset = fid['source-0/image']
+            self.assertEqual(dset.shape, (40, 30))
+            self.assertEqual(dset.attrs['CLASS'], 'IMAGE')
+            self.assertEqual(len(fid['source-0/table'].dtype), 2)
+
+    def test_nested(self):
+        """
+        Test a consolidation of consolidated files resolves to the
+        original sources.
+        """
+        virtual_fname = pjoin(self.tmpdir, 'virtual.h5')
+        links_fname = pjoin(self.tmpdir, 'links.h5')
+        create_virtual_datasets(self.links()[:2], virtual_fname)
+        create_external_links(self.links()[2:], links_fname)
+
+        out_fname = pjoin(self.tmpdir, 'nested.h5')
+        link_datasets([(virtual_fname, '/', '/'), (links_fname, '/', '/')],
+                      out_fname, virtual=True)
+        self.assert_consolidated(out_fname, virtual=True)
+
+        with h5py.File(out_fname, 'r') as fid:
+            for i, fname in enumerate(self.fnames):
+                sources = fid['source-{}/image'.format(i)].virtual_sources()
+                self.assertEqual([s.file_name for s in sources], [fname])
+
+    def test_repack(self):
+        """
+        Test the repacked file is self contained.
+        """
+        virtual_fname = pjoin(self.tmpdir, 'virtual.h5')
+        links_fname = pjoin(self.tmpdir, 'links.h5')
+        create_virtual_datasets(self.links()[:2], virtual_fname)
+        create_external_links(self.links(), links_fname)
+        with h5py.File(virtual_fname, 'a') as fid:
+            fid.attrs['level1_uri'] = 'some/level1'
+            fid['source-2'] = h5py.ExternalLink(links_fname, 'source-2')
+
+        out_fname = pjoin(self.tmpdir, 'repacked.h5')
+        repack(virtual_fname, out_fname)
+        for fname in self.fnames:
+            shutil.move(fname, fname + '.moved')
+
+        # the data is readable without the sources; a virtual dataset
+        # would instead be filled with zeros
+        with h5py.File(out_fname, 'r') as fid:
+            self.assertEqual(fid.attrs['level1_uri'], 'some/level1')
+            self.assertIsInstance(fid.get('source-2', getlink=True),
+                                  h5py.HardLink)
+            images = [fid['source-{}/image'.format(i)][()]
+                      for i in range(len(self.fnames))]
+
+        for fname, image in zip(self.fnames, images):
+            shutil.move(fname + '.moved', fname)
+            with h5py.File(fname, 'r') as src:
+                npt.assert_array_equal(image, src['results/image'])
+        self.assert_consolidated(out_fname, virtual=False)
+
+    def test_repack_compression(self):
+        """
+        Test the data of the virtual datasets is written with the
+        given compression.
+        """
+        virtual_fname = pjoin(self.tmpdir, 'virtual.h5')
+        create_virtual_datasets(self.links(), virtual_fname)
+
+        out_fname = pjoin(self.tmpdir, 'repacked.h5')
+        repack(virtual_fname, out_fname, H5CompressionFilter.GZIP,
+               {'compression_opts': 6})
+        with h5py.File(out_fname, 'r') as fid:
+            dset = fid['source-0/image']
+            self.assertEqual(dset.compression, 'gzip')
+            self.assertEqual(dset.compression_opts, 6)
+        self.assert_consolidated(out_fname, virtual=False)
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    return unittest.defaultTestLoader.loadTestsFromTestCase(ConsolidateTest)
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
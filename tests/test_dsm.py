@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""
+Tests the blocked smoothing of the DSM.
+"""
+
+from __future__ import absolute_import
+from os.path import join as pjoin
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy
+import rasterio
+
+from wagl.constants import DatasetName, GroupName
+from wagl.dsm import filter_dsm, _halo_window, get_dsm, dsm_offset
+from wagl.geobox import GriddedGeoBox
+from wagl.margins import pixel_buffer
+from wagl.tiling import plan_tiles
+
+CRS = 'EPSG:32755'
+ORIGIN = (500000.0, 6000000.0)
+PIXELSIZE = 25.0
+
+
+class Acquisition(object):
+
+    """
+    The parts of an acquisition used to subset the DSM.
+    """
+
+    def __init__(self, shape, chunks):
+        self.lines, self.samples = shape
+        self.chunks = chunks
+        self.resolution = (PIXELSIZE, PIXELSIZE)
+
+    def gridded_geo_box(self):
+        return GriddedGeoBox((self.lines, self.samples), ORIGIN,
+                             self.resolution, CRS)
+
+    def tiles(self):
+        return plan_tiles((self.lines, self.samples),
+                          chunks=self.chunks).tiles()
+
+
+def ramp(x, y):
+    """A plane of map co-ordinates, retained by the smoothing."""
+    return (x - ORIGIN[0]) / PIXELSIZE + 1000 * (ORIGIN[1] - y) / PIXELSIZE
+
+
+class TestBlockedFilter(unittest.TestCase):
+
+    """
+    Test that smoothing the DSM in halo padded blocks is identical
+    to smoothing the full array.
+    """
+
+    def do_test(self, chunks):
+        """Smooth in blocks and compare to the full array."""
+        data = numpy.random.rand(300, 217).astype('float32')
+        expected = filter_dsm(data)
+
+        result = numpy.zeros_like(data)
+        tiles = plan_tiles(data.shape, chunks=chunks, bytes_per_pixel=1,
+                           memory_budget=5000).tiles()
+        for block in tiles:
+            padded, idx = _halo_window(block, data.shape)
+            subset = data[slice(*padded[0]), slice(*padded[1])]
+            out_idx = (slice(*block[0]), slice(*block[1]))
+            result[out_idx] = filter_dsm(subset)[idx]
+
+        self.assertTrue(numpy.array_equal(result, expected))
+
+    def test_row_chunks(self):
+        """Test single row chunks:"""
+        self.do_test((1, 217))
+
+    def test_tiled_chunks(self):
+        """Test square chunks:"""
+        self.do_test((32, 32))
+
+
+class TestChunkAlignment(unittest.TestCase):
+
+    """
+    Test the chunks of the DSM subset coincide with the tiles of the
+    acquisition, as read by the slope and aspect.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dsm_fname = pjoin(self.tmpdir, 'dsm.tif')
+
+        # a national DSM well beyond the buffered acquisition
+        shape = (400, 400)
+        origin = (ORIGIN[0] - 100 * PIXELSIZE, ORIGIN[1] + 100 * PIXELSIZE)
+        box = GriddedGeoBox(shape, origin, (PIXELSIZE, PIXELSIZE), CRS)
+        x, y = numpy.meshgrid(numpy.arange(shape[1]) + 0.5,
+                              numpy.arange(shape[0]) + 0.5)
+        data = ramp(*(box.transform * (x, y))).astype('float32')
+
+        kwargs = {'driver': 'GTiff', 'width': shape[1], 'height': shape[0],
+                  'count': 1, 'dtype': 'float32', 'crs': CRS,
+                  'transform': box.transform}
+        with rasterio.open(self.dsm_fname, 'w', **kwargs) as dst:
+            dst.write(data, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_aligned(self):
+        """Test each tile maps onto whole chunks of the DSM:"""
+        for chunks in [(32, 32), (16, 48), (1, 150)]:
+            acquisition = Acquisition((100, 150), chunks)
+
+            # margins of 13 pixels
+            buffer_distance = 13 * PIXELSIZE
+            margins = pixel_buffer(acquisition, buffer_distance)
+            fid = h5py.File('dsm-{}-{}.h5'.format(*chunks), 'w',
+                            driver='core', backing_store=False)
+            get_dsm(acquisition, self.dsm_fname, buffer_distance, fid)
+            group = fid[GroupName.ELEVATION_GROUP.value]
+            dset = group[DatasetName.DSM_SMOOTHED.value]
+            self.assertEqual(dset.chunks, chunks)
+
+            row_offset, col_offset = dsm_offset(group, margins)
+            self.assertEqual(row_offset % chunks[0], 0)
+            self.assertEqual(col_offset % chunks[1], 0)
+            self.assertLess(row_offset - margins.top, chunks[0])
+            self.assertLess(col_offset - margins.left, chunks[1])
+            self.assertEqual(dset.shape,
+                             (row_offset + 100 + margins.bottom,
+                              col_offset + 150 + margins.right))
+
+            for (ys, ye), (xs, xe) in acquisition.tiles():
+                # the chunks of the DSM read for the tile (sans halo)
+                rows = range((ys + row_offset) // chunks[0],
+                             (ye + row_offset - 1) // chunks[0] + 1)
+                cols = range((xs + col_offset) // chunks[1],
+                             (xe + col_offset - 1) // chunks[1] + 1)
+                self.assertEqual(len(rows), -(-(ye - ys) // chunks[0]))
+                self.assertEqual(len(cols), -(-(xe - xs) // chunks[1]))
+                self.assertEqual(rows[0] * chunks[0], ys + row_offset)
+                self.assertEqual(cols[0] * chunks[1], xs + col_offset)
+
+            # the acquisition's first pixel (away from the edges of the
+            # subset) is at the offset
+            x, y = acquisition.gridded_geo_box().transform * (0.5, 0.5)
+            self.assertAlmostEqual(dset[row_offset, col_offset], ramp(x, y),
+                                   delta=0.5)
+            fid.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
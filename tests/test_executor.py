@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+"""
+Tests the in-process stage executor.
+"""
+
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import h5py
+import numpy
+
+from wagl.executor import StageGraph, StageGraphError, merge_group
+
+
+def memory_file(name):
+    """An in-memory HDF5 file."""
+    return h5py.File(name, 'w', driver='core', backing_store=False)
+
+
+def write(name, value, delay=0.0):
+    """A stage writing a dataset derived from its dependency."""
+    def stage(out_group, graph=None, dependency=None):
+        time.sleep(delay)
+        data = numpy.full((10, 10), value, dtype='int32')
+        if dependency is not None:
+            data += graph.out_group[dependency][:]
+        out_group.create_dataset(name, data=data)
+        out_group.attrs[name] = value
+        return value
+    return stage
+
+
+def build(fid, delay=0.0):
+    """
+    A diamond shaped graph:
+        a -> (b, c) -> d
+    """
+    graph = StageGraph(fid)
+    graph.add('a', write('a', 1, delay), destination='grp')
+    graph.add('b', lambda g: write('b', 2, delay)(g, graph, 'grp/a'), ['a'],
+              'grp/sub')
+    graph.add('c', lambda g: write('c', 3, delay)(g, graph, 'grp/a'), ['a'],
+              'grp/sub')
+    graph.add('d', lambda g: write('d', 4, delay)(g, graph, 'grp/sub/b'),
+              ['b', 'c'])
+    return graph
+
+
+class TestStageGraph(unittest.TestCase):
+
+    """Unit tests for the StageGraph."""
+
+    def test_serial_concurrent(self):
+        """Test the concurrent output matches the serial output:"""
+        with memory_file('serial.h5') as fid1, \
+                memory_file('concurrent.h5') as fid2:
+            results1 = build(fid1).run(1)
+            results2 = build(fid2, 0.05).run(4)
+            self.assertEqual(results1, results2)
+            self.assertEqual(results1, {'a': 1, 'b': 2, 'c': 3, 'd': 4})
+
+            for dname in ['grp/a', 'grp/sub/b', 'grp/sub/c', 'd']:
+                self.assertTrue((fid1[dname][:] == fid2[dname][:]).all())
+
+            self.assertEqual(fid2['d'][0, 0], 4 + 2 + 1)
+            self.assertEqual(dict(fid1['grp/sub'].attrs),
+                             dict(fid2['grp/sub'].attrs))
+
+    def test_concurrency(self):
+        """Test independent stages run concurrently:"""
+        lock = threading.Lock()
+        state = {'running': 0, 'max': 0}
+
+        def stage(out_group):
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(0.1)
+            with lock:
+                state['running'] -= 1
+
+        with memory_file('concurrency.h5') as fid:
+            graph = StageGraph(fid)
+            for i in range(4):
+                graph.add(str(i), stage)
+            graph.run(4)
+
+        self.assertGreater(state['max'], 1)
+
+    def test_order(self):
+        """Test dependencies complete before their dependents start:"""
+        order = []
+
+        def stage(name):
+            def func(out_group):
+                order.append(name)
+            return func
+
+        with memory_file('order.h5') as fid:
+            graph = StageGraph(fid)
+            graph.add('c', stage('c'), ['b'])
+            graph.add('a', stage('a'))
+            graph.add('b', stage('b'), ['a'])
+            graph.add('d', stage('d'))
+            graph.run(3)
+            self.assertLess(order.index('a'), order.index('b'))
+            self.assertLess(order.index('b'), order.index('c'))
+
+            # serial execution runs the earliest added stage that is ready
+            del order[:]
+            graph.results.clear()
+            graph.run(1)
+            self.assertEqual(order, ['a', 'b', 'c', 'd'])
+
+    def test_cycle(self):
+        """Test a cyclic graph is rejected:"""
+        with memory_file('cycle.h5') as fid:
+            graph = StageGraph(fid)
+            graph.add('a', lambda g: None, ['b'])
+            graph.add('b', lambda g: None, ['a'])
+            self.assertRaises(StageGraphError, graph.run)
+
+    def test_undefined(self):
+        """Test an undefined dependency is rejected:"""
+        with memory_file('undefined.h5') as fid:
+            graph = StageGraph(fid)
+            graph.add('a', lambda g: None, ['b'])
+            self.assertRaises(StageGraphError, graph.run)
+            self.assertRaises(StageGraphError, graph.add, 'a', None)
+
+    def test_failure(self):
+        """Test a failed stage raises and its dependents don't run:"""
+        def fail(out_group):
+            raise ValueError('failed stage')
+
+        ran = []
+        with memory_file('failure.h5') as fid:
+            graph = StageGraph(fid)
+            graph.add('a', fail)
+            graph.add('b', lambda g: ran.append('b'), ['a'])
+            self.assertRaises(ValueError, graph.run, 2)
+            self.assertEqual(ran, [])
+
+    def test_scratch(self):
+        """Test the scratch files are on disk, and removed once merged:"""
+        scratch_dir = tempfile.mkdtemp()
+        fnames = []
+
+        def stage(out_group):
+            fnames.append(out_group.file.filename)
+            self.assertTrue(os.path.exists(out_group.file.filename))
+            out_group.create_dataset('data', data=numpy.arange(10))
+
+        def fail(out_group):
+            fnames.append(out_group.file.filename)
+            raise ValueError('failed stage')
+
+        try:
+            with memory_file('scratch.h5') as fid:
+                graph = StageGraph(fid, scratch_dir=scratch_dir)
+                graph.add('a', stage, destination='a')
+                graph.add('b', stage, destination='b')
+                graph.run(2)
+                self.assertTrue((fid['a/data'][:] == numpy.arange(10)).all())
+
+                graph = StageGraph(fid, scratch_dir=scratch_dir)
+                graph.add('c', fail)
+                self.assertRaises(ValueError, graph.run, 2)
+
+            self.assertEqual(len(fnames), 3)
+            for fname in fnames:
+                self.assertTrue(fname.startswith(scratch_dir))
+            self.assertEqual(os.listdir(scratch_dir), [])
+        finally:
+            shutil.rmtree(scratch_dir)
+
+
+class TestMergeGroup(unittest.TestCase):
+
+    """Unit tests for merge_group."""
+
+    def test_merge(self):
+        """Test datasets, groups and attributes are merged:"""
+        with memory_file('source.h5') as src, memory_file('dest.h5') as dst:
+            src.create_dataset('grp/a', data=numpy.arange(10),
+                               chunks=(5,), compression='gzip')
+            src['grp'].attrs['name'] = 'source'
+            src['grp'].attrs.create('values', data=['x', 'yz'],
+                                    dtype=h5py.special_dtype(vlen=str))
+            dst.create_dataset('grp/b', data=numpy.arange(5))
+
+            merge_group(src, dst)
+            self.assertTrue((dst['grp/a'][:] == numpy.arange(10)).all())
+            self.assertTrue((dst['grp/b'][:] == numpy.arange(5)).all())
+            self.assertEqual(dst['grp/a'].compression, 'gzip')
+            self.assertEqual(dst['grp/a'].chunks, (5,))
+            self.assertEqual(dst['grp'].attrs['name'], 'source')
+            self.assertEqual(list(dst['grp'].attrs['values']), ['x', 'yz'])
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestStageGraph)
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(
+        TestMergeGroup))
+
+    return suite
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
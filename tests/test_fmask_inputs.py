@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+"""
+Tests the Fmask inputs read via the acquisitions, and the tiled
+evaluation of the Fmask cloud tests.
+"""
+
+from __future__ import absolute_import
+import math
+from os.path import join as pjoin, basename
+import re
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import numpy.testing as npt
+import rasterio
+from rasterio.transform import from_origin
+
+from wagl.acquisition import acquisitions
+from wagl import fmask_cloud_masking as fmask
+from wagl.mtl import load_mtl
+
+from .data import DATA_DIR
+
+MTL = pjoin(DATA_DIR, 'LANDSAT8', 'LC80990842016277LGN00_MTL.txt')
+
+SHAPE = (300, 200)
+
+
+def write_scene(outdir, thermal_res=60):
+    """
+    Write random DN's for each band of the MTL, with the thermal
+    bands at a resolution of `thermal_res` (by default, half the
+    resolution of the reflective bands). The dimensions of the copied
+    MTL are those of the reflective bands, as read by `lndhdrread`.
+    """
+    numpy.random.seed(1)
+    product = load_mtl(MTL)['PRODUCT_METADATA']
+    dns = {}
+    for key, fname in product.items():
+        if not key.startswith('file_name_band'):
+            continue
+
+        band_id = key.replace('file_name_band_', '')
+        if band_id == '8':
+            shape, res = (SHAPE[0] * 2, SHAPE[1] * 2), 15
+        elif band_id in ('10', '11'):
+            factor = thermal_res // 30
+            shape = (SHAPE[0] // factor, SHAPE[1] // factor)
+            res = thermal_res
+        else:
+            shape, res = SHAPE, 30
+
+        dn = numpy.random.randint(5000, 30000, shape).astype('uint16')
+        dn[:10, :10] = 0
+        dns[band_id] = dn
+
+        kwargs = {'driver': 'GTiff', 'width': shape[1], 'height': shape[0],
+                  'count': 1, 'dtype': 'uint16', 'crs': 'EPSG:32753',
+                  'transform': from_origin(500000, 6000000, res, res),
+                  'nodata': 0}
+        with rasterio.open(pjoin(outdir, fname), 'w', **kwargs) as ds:
+            ds.write(dn, 1)
+
+    with open(MTL) as src:
+        mtl = src.read()
+    for prefix in ['REFLECTIVE', 'THERMAL']:
+        mtl = re.sub(r'({}_LINES = )\d+'.format(prefix),
+                     r'\g<1>{}'.format(SHAPE[0]), mtl)
+        mtl = re.sub(r'({}_SAMPLES = )\d+'.format(prefix),
+                     r'\g<1>{}'.format(SHAPE[1]), mtl)
+    with open(pjoin(outdir, basename(MTL)), 'w') as out:
+        out.write(mtl)
+
+    return dns
+
+
+class FmaskInputsTest(unittest.TestCase):
+
+    """
+    Test the Fmask inputs of a synthetic Landsat 8 scene.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.dns = write_scene(cls.tmpdir)
+        container = acquisitions(pjoin(cls.tmpdir, basename(MTL)))
+        cls.acqs = [acq for group in container.groups for acq in
+                    container.get_acquisitions(group,
+                                               only_supported_bands=False)]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def test_toarbt(self):
+        """
+        Test the int16 TOA reflectance and the resampled brightness
+        temperature.
+        """
+        result = fmask.acquisitions_toarbt(self.acqs, tile_lines=64)
+        temp, images = result[0], result[1]
+        self.assertEqual(images.dtype, numpy.int16)
+        self.assertEqual(images.shape, (7,) + SHAPE)
+        self.assertEqual(result[2], SHAPE)
+
+        # the nulls of the reflective and (coarser) thermal bands
+        nulls = numpy.zeros(SHAPE, dtype='bool')
+        nulls[:20, :20] = True
+        npt.assert_array_equal(temp == -9999, nulls)
+        npt.assert_array_equal(images == -9999, numpy.tile(nulls, (7, 1, 1)))
+
+        # the cirrus band, which isn't a supported band
+        cirrus = [acq for acq in self.acqs if acq.band_id == '9'][0]
+        zen = result[4]
+        gain = ((cirrus.max_reflectance - cirrus.min_reflectance) /
+                (cirrus.max_quantize - cirrus.min_quantize))
+        expected = (gain * (self.dns['9'] - cirrus.min_quantize) +
+                    cirrus.min_reflectance) * 10000 / math.cos(
+                        math.radians(zen))
+        self.assertLessEqual(abs(images[-1] - expected)[~nulls].max(), 0.51)
+
+        # nearest neighbour resampling of the thermal band
+        thermal = [acq for acq in self.acqs if acq.band_id == '10'][0]
+        dn = self.dns['10'].repeat(2, axis=0).repeat(2, axis=1)
+        radiance = thermal.gain * dn + thermal.bias
+        k1, k2 = fmask.THERMAL_CONSTANTS[8]
+        expected = 100 * (k2 / numpy.log(k1 / radiance + 1) - 273.15)
+        npt.assert_allclose(temp[~nulls], expected[~nulls], atol=0.01)
+
+    def test_tiled_plcloud(self):
+        """
+        Test the cloud tests are independent of the tiling.
+        """
+        results = []
+        for lines in [SHAPE[0], 32]:
+            results.append(fmask.plcloud(None, num_Lst=8,
+                                         acquisitions=self.acqs,
+                                         tile_lines=lines))
+
+        for whole, tiled in zip(*results):
+            npt.assert_array_equal(whole, tiled)
+
+
+class NdToaRbtRegressionTest(unittest.TestCase):
+
+    """
+    Compare the Fmask inputs and outputs of the acquisitions against
+    those of `nd2toarbt`, for a synthetic Landsat 8 scene whose thermal
+    bands are delivered at the resolution of the reflective bands.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        write_scene(cls.tmpdir, thermal_res=30)
+        cls.mtl = pjoin(cls.tmpdir, basename(MTL))
+        container = acquisitions(cls.mtl)
+        cls.acqs = [acq for group in container.groups for acq in
+                    container.get_acquisitions(group,
+                                               only_supported_bands=False)]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def test_toarbt(self):
+        """
+        Test the int16 reflectance is the float32 reflectance of
+        `nd2toarbt` rounded to the nearest integer, and the brightness
+        temperature agrees to within float32 precision.
+        """
+        result = fmask.acquisitions_toarbt(self.acqs)
+        expected = fmask.nd2toarbt(self.mtl)
+
+        self.assertEqual(result[1].shape, expected[1].shape)
+        self.assertLessEqual(abs(result[1] - expected[1]).max(), 0.501)
+        npt.assert_allclose(result[0], expected[0], atol=0.01)
+        npt.assert_array_equal(result[0] == -9999, expected[0] == -9999)
+        for i in range(7, 10):
+            npt.assert_array_equal(result[i], expected[i])
+
+    def test_plcloud(self):
+        """
+        Test the cloud, snow and water masks of the rounded reflectance
+        differ from those of `nd2toarbt` only at the few pixels whose
+        reflectance lies within 0.5 of a threshold, eg `data6 > 300`.
+        """
+        result = fmask.plcloud(None, num_Lst=8, acquisitions=self.acqs)
+        expected = fmask.plcloud(self.mtl, num_Lst=8)
+
+        # zen, azi
+        npt.assert_array_equal(result[:2], expected[:2])
+
+        # the clear pixel percentage, and the clear land temperatures
+        self.assertAlmostEqual(result[2], expected[2], delta=0.01)
+        npt.assert_allclose(result[3], expected[3], atol=0.01)
+        npt.assert_allclose(result[4:6], expected[4:6], atol=10)
+
+        # water, snow, cloud and shadow masks
+        for mask, other in zip(result[6:10], expected[6:10]):
+            self.assertLessEqual((mask != other).mean(), 0.001)
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    suite = unittest.TestSuite()
+    for case in [FmaskInputsTest, NdToaRbtRegressionTest]:
+        suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(case))
+    return suite
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
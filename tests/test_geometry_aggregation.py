@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+"""
+Tests the derivation of coarser resolution geometry.
+"""
+
+from __future__ import absolute_import
+import unittest
+
+import h5py
+import numpy
+
+from wagl.geobox import GriddedGeoBox
+from wagl.geometry_aggregation import Aggregation, GeometryAlignmentError
+from wagl.geometry_aggregation import aggregate_blocks, aggregation_window
+from wagl.geometry_aggregation import aggregate_dataset, derive_group
+from wagl.geometry_aggregation import aggregation_error_bound
+from wagl.geometry_aggregation import derivation_error
+
+CRS = 'EPSG:32755'
+ORIGIN = (500000.0, 6000000.0)
+
+
+def memory_file(name):
+    """An in-memory HDF5 file."""
+    return h5py.File(name, 'w', driver='core', backing_store=False)
+
+
+def geobox(pixelsize, shape, origin=ORIGIN):
+    """A GriddedGeoBox with square pixels."""
+    return GriddedGeoBox(shape, origin, (pixelsize, pixelsize), CRS)
+
+
+def evaluate(func, box):
+    """Evaluate a function of map (x, y) at each pixel centre."""
+    rows, cols = box.shape
+    x, y = numpy.meshgrid(numpy.arange(cols) + 0.5, numpy.arange(rows) + 0.5)
+    return func(*(box.transform * (x, y)))
+
+
+def write_image(group, dname, data, box, no_data=None):
+    """Write an IMAGE dataset."""
+    dset = group.create_dataset(dname, data=data, chunks=True)
+    dset.attrs['CLASS'] = 'IMAGE'
+    dset.attrs['geotransform'] = box.transform.to_gdal()
+    dset.attrs['crs_wkt'] = box.crs.ExportToWkt()
+    if no_data is not None:
+        dset.attrs['no_data_value'] = no_data
+    return dset
+
+
+def smooth(x, y):
+    """A smooth, non-linear, field of map co-ordinates."""
+    return (numpy.sin((x - ORIGIN[0]) / 300.0) +
+            numpy.cos((y - ORIGIN[1]) / 500.0)) * 10
+
+
+class TestAggregationWindow(unittest.TestCase):
+
+    """Unit tests for aggregation_window."""
+
+    def test_aligned(self):
+        """Test the window and factor of aligned grids:"""
+        window, factor = aggregation_window(geobox(10, (60, 60)),
+                                            geobox(60, (10, 10)))
+        self.assertEqual(window, ((0, 60), (0, 60)))
+        self.assertEqual(factor, (6, 6))
+
+    def test_offset(self):
+        """Test an offset coarse grid, such as a buffered extent:"""
+        fine = geobox(10, (100, 100), (ORIGIN[0] - 200, ORIGIN[1] + 200))
+        window, factor = aggregation_window(fine, geobox(20, (30, 30)))
+        self.assertEqual(window, ((20, 80), (20, 80)))
+        self.assertEqual(factor, (2, 2))
+
+    def test_misaligned(self):
+        """Test grids that can't be aggregated are rejected:"""
+        fine = geobox(10, (60, 60))
+        for coarse in [geobox(15, (40, 40)),
+                       geobox(20, (30, 30), (ORIGIN[0] + 5, ORIGIN[1])),
+                       geobox(20, (31, 30)),
+                       geobox(20, (30, 30), (ORIGIN[0] - 20, ORIGIN[1])),
+                       geobox(5, (120, 120))]:
+            self.assertRaises(GeometryAlignmentError, aggregation_window,
+                              fine, coarse)
+
+
+class TestAggregateBlocks(unittest.TestCase):
+
+    """Unit tests for aggregate_blocks."""
+
+    def test_centre_odd(self):
+        """Test the centre of an odd factor is a decimation:"""
+        data = numpy.random.random((9, 12))
+        result, _ = aggregate_blocks(data, (3, 3), Aggregation.CENTRE)
+        self.assertTrue((result == data[1::3, 1::3]).all())
+
+    def test_centre_even(self):
+        """Test the centre of an even factor on a linear field:"""
+        y, x = numpy.mgrid[0:12, 0:12]
+        data = 2.0 * x + 3.0 * y
+        result, deviation = aggregate_blocks(data, (4, 4),
+                                             Aggregation.CENTRE)
+        y, x = numpy.mgrid[0:3, 0:3] * 4 + 1.5
+        self.assertTrue(numpy.allclose(result, 2.0 * x + 3.0 * y))
+        self.assertTrue(numpy.allclose(deviation, 1.5 * 2 + 1.5 * 3))
+
+    def test_mean(self):
+        """Test the mean of each block:"""
+        data = numpy.random.random((6, 6))
+        result, _ = aggregate_blocks(data, (2, 3), Aggregation.MEAN)
+        expected = data.reshape(3, 2, 2, 3).mean(axis=(1, 3))
+        self.assertTrue(numpy.allclose(result, expected))
+
+    def test_no_data(self):
+        """Test no data pixels are excluded:"""
+        data = numpy.array([[1.0, -999, -999, -999],
+                            [3.0, -999, -999, -999]])
+        result, deviation = aggregate_blocks(data, (2, 2), Aggregation.MEAN,
+                                             -999)
+        self.assertEqual(list(result[0]), [2.0, -999])
+        self.assertEqual(deviation[0, 0], 1.0)
+        self.assertTrue(numpy.isnan(deviation[0, 1]))
+
+    def test_circular(self):
+        """Test angles are averaged across the wrap:"""
+        data = numpy.array([[359.0, 1.0, 179.0, -179.0],
+                            [359.0, 1.0, 179.0, -179.0]])
+        result, deviation = aggregate_blocks(data, (2, 2),
+                                             Aggregation.CIRCULAR_MEAN)
+        self.assertTrue(numpy.allclose(result, [[0.0, 180.0]]) or
+                        numpy.allclose(result, [[0.0, -180.0]]))
+        self.assertTrue(numpy.allclose(deviation, 1.0))
+
+        # the [0, 360) convention is retained
+        data = numpy.array([[350.0, 340.0]])
+        result, _ = aggregate_blocks(data, (1, 2), Aggregation.CIRCULAR_MEAN)
+        self.assertTrue(numpy.allclose(result, 345.0))
+
+    def test_error_bound(self):
+        """Test the error bound is exact for a quadratic field:"""
+        y, x = numpy.mgrid[0:12, 0:12].astype('float64')
+        data = y ** 2 + 0.5 * x ** 2
+        for factor, method in [((3, 3), Aggregation.MEAN),
+                               ((4, 4), Aggregation.CENTRE),
+                               ((3, 3), Aggregation.CENTRE)]:
+            result, _ = aggregate_blocks(data, factor, method)
+            rows, cols = result.shape
+            centre_y = numpy.arange(rows)[:, numpy.newaxis] * factor[0]
+            centre_x = numpy.arange(cols)[numpy.newaxis, :] * factor[1]
+            centre_y = centre_y + (factor[0] - 1) / 2.0
+            centre_x = centre_x + (factor[1] - 1) / 2.0
+            independent = centre_y ** 2 + 0.5 * centre_x ** 2
+
+            bound = aggregation_error_bound(data, factor, method)
+            self.assertTrue(numpy.allclose(numpy.abs(result - independent),
+                                           bound))
+
+        # angles are differenced across the wrap
+        data = numpy.array([[350.0, 355.0, 0.0, 5.0, 10.0, 15.0]])
+        bound = aggregation_error_bound(data, (1, 3), Aggregation.CIRCULAR_MEAN)
+        self.assertTrue(numpy.allclose(bound, 0.0))
+
+    def test_majority(self):
+        """Test masks take the majority, with ties being False:"""
+        data = numpy.array([[True, True, False, False, True, True],
+                            [True, False, False, False, False, False]])
+        result, deviation = aggregate_blocks(data, (2, 2),
+                                             Aggregation.MAJORITY)
+        self.assertEqual(result.dtype, numpy.bool_)
+        self.assertEqual(list(result[0]), [True, False, False])
+        self.assertEqual(list(deviation[0]), [1.0, 0.0, 1.0])
+
+
+class TestAggregateDataset(unittest.TestCase):
+
+    """Unit tests for deriving datasets."""
+
+    def test_deviation(self):
+        """Test the deviations, and the independent computation error:"""
+        fine = geobox(10, (60, 60))
+        with memory_file('deviation.h5') as fid:
+            dset = write_image(fid, 'fine/FIELD', evaluate(smooth, fine),
+                               fine)
+
+            for pixelsize in [20, 30, 60]:
+                coarse = geobox(pixelsize, (600 // pixelsize,) * 2)
+                out_group = fid.create_group('{}m'.format(pixelsize))
+                for method in [Aggregation.CENTRE, Aggregation.MEAN]:
+                    dname = method.value
+                    deviations = aggregate_dataset(dset, coarse, out_group,
+                                                   dname, method)
+                    derived = out_group[dname]
+                    independent = evaluate(smooth, coarse)
+                    error = derivation_error(derived, independent)
+
+                    attrs = derived.attrs
+                    # a smooth field varies less across a block than within
+                    self.assertLessEqual(error['max'],
+                                         attrs['aggregation_max_deviation'])
+
+                    # the (second order) bound against the independent
+                    # computation
+                    bound = attrs['aggregation_error_bound']
+                    self.assertEqual(bound,
+                                     deviations['aggregation_error_bound'])
+                    self.assertLessEqual(error['max'], 1.01 * bound + 1e-9)
+                    self.assertLessEqual(bound, 2 * error['max'] + 1e-9)
+                    self.assertEqual(attrs['aggregation_max_deviation'],
+                                     deviations['aggregation_max_deviation'])
+                    self.assertEqual(attrs['derivation_method'], dname)
+                    self.assertEqual(list(attrs['aggregation_factor']),
+                                     [pixelsize // 10] * 2)
+                    self.assertEqual(attrs['derived_from'], '/fine/FIELD')
+                    self.assertTrue(GriddedGeoBox.from_h5_dataset(
+                        derived).equals(coarse))
+
+    def test_derive_group(self):
+        """Test a group is only written when every dataset aligns:"""
+        fine = geobox(10, (60, 60))
+        shifted = geobox(10, (60, 60), (ORIGIN[0] + 5, ORIGIN[1]))
+        with memory_file('derive-group.h5') as fid:
+            grp = fid.create_group('fine/ANGLES')
+            write_image(grp, 'A', numpy.zeros((60, 60)), fine)
+            write_image(grp, 'B', numpy.zeros((60, 60)), shifted)
+            out_group = fid.create_group('coarse')
+
+            self.assertRaises(GeometryAlignmentError, derive_group, grp,
+                              geobox(20, (30, 30)), out_group)
+            self.assertNotIn('ANGLES', out_group)
+
+            errors = derive_group(grp, geobox(20, (30, 30)), out_group, ['A'])
+            self.assertEqual(list(errors), ['A'])
+            self.assertEqual(out_group['ANGLES/A'].shape, (30, 30))
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    test_classes = [TestAggregationWindow,
+                    TestAggregateBlocks,
+                    TestAggregateDataset]
+
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(
+            test_class))
+
+    return suite
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
@@ -11,6 +11,7 @@ import h5py
 import pandas
 from wagl import hdf5
 from wagl.hdf5 import H5CompressionFilter
+from wagl.hdf5.chunk_writer import ChunkWriter, filter_pipeline
 
 
 class HDF5Test(unittest.TestCase):
@@ -372,5 +373,90 @@ class HDF5Test(unittest.TestCase):
             self.assertTrue(df.equals(hdf5.read_h5_table(fid, 'dataframe')))
 
 
+class ChunkWriterTest(unittest.TestCase):
+
+    """
+    Test the parallel chunk writes of wagl.hdf5.chunk_writer.
+    """
+
+    memory_kwargs = {'driver': 'core', 'backing_store': False}
+    data = numpy.random.randint(0, 1000, (100, 90)).astype('float32')
+
+    def create(self, fid, name, **kwargs):
+        return fid.create_dataset(name, shape=self.data.shape,
+                                  dtype=self.data.dtype, chunks=(32, 32),
+                                  fillvalue=-999, **kwargs)
+
+    def test_roundtrip(self):
+        """
+        Test tiled writes, including partial edge chunks, round trip.
+        """
+        fname = 'test_chunk_writer_roundtrip.h5'
+        with h5py.File(fname, 'w', **self.memory_kwargs) as fid:
+            dset = self.create(fid, 'data', compression='gzip', shuffle=True)
+            with ChunkWriter(workers=4, max_pending=3) as writer:
+                for ystart in range(0, 100, 32):
+                    idx = (slice(ystart, ystart + 32), slice(None))
+                    writer.write(dset, idx, self.data[idx])
+
+            self.assertTrue((dset[:] == self.data).all())
+
+    def test_byte_compatible(self):
+        """
+        Test the encoded chunks are identical to those of HDF5.
+        """
+        fname = 'test_chunk_writer_bytes.h5'
+        with h5py.File(fname, 'w', **self.memory_kwargs) as fid:
+            for shuffle in [False, True]:
+                kwargs = {'compression': 'gzip', 'compression_opts': 4,
+                          'shuffle': shuffle}
+                standard = self.create(fid, 'standard-{}'.format(shuffle),
+                                       **kwargs)
+                standard[:] = self.data
+                dset = self.create(fid, 'parallel-{}'.format(shuffle),
+                                   **kwargs)
+                with ChunkWriter(workers=2) as writer:
+                    writer.write(dset, (slice(None), slice(None)), self.data)
+
+                for offset in [(0, 0), (32, 64), (96, 64)]:
+                    self.assertEqual(standard.id.read_direct_chunk(offset),
+                                     dset.id.read_direct_chunk(offset))
+
+    def test_fallback(self):
+        """
+        Test unaligned writes, and unsupported datasets, are written
+        through h5py.
+        """
+        fname = 'test_chunk_writer_fallback.h5'
+        with h5py.File(fname, 'w', **self.memory_kwargs) as fid:
+            dset = self.create(fid, 'data', compression='gzip')
+            contiguous = fid.create_dataset('contiguous', data=self.data)
+            self.assertIsNone(filter_pipeline(contiguous))
+
+            with ChunkWriter(workers=2) as writer:
+                writer.write(dset, (slice(0, 64), slice(None)),
+                             self.data[0:64])
+                writer.write(dset, (slice(64, 70), slice(None)),
+                             self.data[64:70])
+                writer.write(dset, (slice(70, 100), slice(None)),
+                             self.data[70:100])
+                writer.write(contiguous, (slice(0, 10), slice(None)), 0)
+
+            self.assertTrue((dset[:] == self.data).all())
+            self.assertTrue((contiguous[0:10] == 0).all())
+
+    def test_serial(self):
+        """
+        Test a single worker writes through h5py.
+        """
+        fname = 'test_chunk_writer_serial.h5'
+        with h5py.File(fname, 'w', **self.memory_kwargs) as fid:
+            dset = self.create(fid, 'data', compression='gzip')
+            with ChunkWriter(workers=1) as writer:
+                writer.write(dset, (slice(None), slice(None)), self.data)
+
+            self.assertTrue((dset[:] == self.data).all())
+
+
 if __name__ == '__main__':
     unittest.main()
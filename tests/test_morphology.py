@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+Tests the square dilation, erosion and majority filter against
+`scipy.ndimage`.
+"""
+
+from __future__ import absolute_import
+import unittest
+
+import numpy
+import numpy.testing as npt
+from scipy import ndimage
+
+from wagl.morphology import square_dilation, square_erosion, majority_filter
+
+# shapes whose samples are, and aren't, a multiple of a byte
+SHAPES = [(1, 1), (5, 3), (37, 53), (64, 64), (101, 250)]
+
+SIZES = [1, 3, 7, 9, 15, 17]
+
+
+def reference_majority(mask, iterations=1, size=3):
+    """
+    The majority filter via `ndimage.convolve`, as previously given
+    by `acca_cloud_masking.majority_filter` for integer masks.
+    """
+    weights = numpy.ones((size, size), dtype='uint8')
+    for _ in range(iterations):
+        mask = ndimage.convolve(mask.astype('uint8'), weights)
+        mask = mask > size * size // 2
+    return mask
+
+
+class TestMorphology(unittest.TestCase):
+
+    """Unit tests for the morphology of the PQ masks."""
+
+    def setUp(self):
+        numpy.random.seed(1)
+
+    def masks(self):
+        """Sparse and dense random masks of each shape."""
+        for shape in SHAPES:
+            for fraction in [0.02, 0.5, 0.97]:
+                yield numpy.random.random(shape) < fraction
+
+    def test_dilation(self):
+        """Test the square dilation against binary_dilation:"""
+        for mask in self.masks():
+            for size in SIZES:
+                structure = numpy.ones((size, size), dtype='bool')
+                expected = ndimage.binary_dilation(mask, structure)
+                npt.assert_array_equal(square_dilation(mask, size), expected)
+
+    def test_erosion(self):
+        """Test the square erosion against binary_erosion:"""
+        for mask in self.masks():
+            for size in SIZES:
+                structure = numpy.ones((size, size), dtype='bool')
+                expected = ndimage.binary_erosion(mask, structure)
+                npt.assert_array_equal(square_erosion(mask, size), expected)
+
+    def test_majority(self):
+        """Test the majority filter against ndimage.convolve:"""
+        for mask in self.masks():
+            for iterations in [1, 2]:
+                for size in [3, 5]:
+                    expected = reference_majority(mask, iterations, size)
+                    result = majority_filter(mask, iterations, size)
+                    npt.assert_array_equal(result, expected)
+
+    def test_tiled(self):
+        """Test the tiled evaluation matches the whole array:"""
+        mask = numpy.random.random((203, 75)) < 0.3
+        for tile_lines in [1, 4, 50]:
+            npt.assert_array_equal(square_dilation(mask, 7, tile_lines),
+                                   square_dilation(mask, 7))
+            npt.assert_array_equal(square_erosion(mask, 7, tile_lines),
+                                   square_erosion(mask, 7))
+            npt.assert_array_equal(majority_filter(mask, 2,
+                                                   tile_lines=tile_lines),
+                                   majority_filter(mask, 2))
+
+    def test_integer_mask(self):
+        """Test non-zero values of an integer mask are True:"""
+        mask = numpy.random.randint(0, 3, (40, 30)).astype('int8')
+        structure = numpy.ones((3, 3), dtype='bool')
+        npt.assert_array_equal(square_dilation(mask, 3),
+                               ndimage.binary_dilation(mask, structure))
+        npt.assert_array_equal(majority_filter(mask, 2),
+                               reference_majority(mask != 0, 2))
+        self.assertRaises(ValueError, square_dilation, mask, 4)
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    return unittest.defaultTestLoader.loadTestsFromTestCase(TestMorphology)
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
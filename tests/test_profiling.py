@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+"""
+Tests the stage profiling.
+"""
+
+from __future__ import absolute_import
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+import h5py
+import numpy
+
+from wagl.executor import StageGraph
+from wagl.hdf5 import read_h5_table
+from wagl import profiling
+from wagl.profiling import Profiler, profile, profiled
+
+
+def memory_file(name):
+    """An in-memory HDF5 file."""
+    return h5py.File(name, 'w', driver='core', backing_store=False)
+
+
+def text(values):
+    """Decode fixed length strings read back as bytes."""
+    return [v.decode() if isinstance(v, bytes) else v for v in values]
+
+
+@profiled('decorated')
+def _decorated():
+    return sum(range(10000))
+
+
+class TestProfiler(unittest.TestCase):
+
+    """Unit tests for the Profiler."""
+
+    def test_nested(self):
+        """Test nested measurements are recorded against the profiler:"""
+        profiler = Profiler(level1='scene')
+        with profiler.profile('stage', granule='G1'):
+            with profile('subprocess'):
+                subprocess.check_call([sys.executable, '-c', 'pass'])
+            _decorated()
+
+        records = {r['name']: r for r in profiler.records}
+        self.assertEqual(set(records), {'stage', 'subprocess', 'decorated'})
+        self.assertEqual(records['subprocess']['parent'], 'stage')
+        self.assertEqual(records['decorated']['parent'], 'stage')
+        self.assertEqual(records['stage']['parent'], '')
+        self.assertEqual(records['stage']['granule'], 'G1')
+
+        for record in records.values():
+            self.assertEqual(record['level1'], 'scene')
+            self.assertEqual(record['status'], 'success')
+            self.assertGreaterEqual(record['wall_time'], 0)
+
+        stage, child = records['stage'], records['subprocess']
+        self.assertGreaterEqual(stage['wall_time'], child['wall_time'])
+        self.assertGreater(child['children_cpu_time'], 0)
+
+    def test_failure(self):
+        """Test a failed measurement is recorded:"""
+        profiler = Profiler()
+
+        def fail():
+            with profiler.profile('stage'):
+                raise ValueError('failed')
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(profiler.records[0]['status'], 'failure')
+
+        # outside of a profiler, measurements are only logged
+        with profile('orphan') as measurement:
+            pass
+        self.assertEqual(measurement.record['name'], 'orphan')
+        self.assertEqual(len(profiler.records), 1)
+
+    def test_rss(self):
+        """Test the peak RSS is sampled during the measurement:"""
+        profiler = Profiler()
+        nbytes = 200 * 2**20
+        with profiler.profile('allocate'):
+            data = numpy.ones(nbytes, dtype='uint8')
+            time.sleep(0.2)
+            del data
+
+        with profiler.profile('idle'):
+            time.sleep(0.2)
+
+        allocate, idle = profiler.records
+        if numpy.isnan(allocate['peak_rss']):
+            self.skipTest('/proc/self/statm is unavailable')
+
+        self.assertGreaterEqual(allocate['peak_rss_increase'], 0.9 * nbytes)
+        self.assertLess(idle['peak_rss_increase'], 0.5 * nbytes)
+
+        # whereas the high-water mark of the process retains the peak
+        self.assertGreaterEqual(idle['process_max_rss'], nbytes)
+
+    def test_cpu_time(self):
+        """Test the CPU time is measured with or without thread_time:"""
+        def spin(seconds):
+            end = time.perf_counter() + seconds
+            while time.perf_counter() < end:
+                pass
+
+        # time.thread_time is unavailable prior to Python 3.7
+        without = mock.Mock(spec=['time', 'perf_counter', 'process_time',
+                                  'sleep'], wraps=time)
+        for clock in [time, without]:
+            with mock.patch.object(profiling, 'time', clock):
+                profiler = Profiler()
+                with profiler.profile('busy'):
+                    spin(0.2)
+                with profiler.profile('idle'):
+                    worker = threading.Thread(target=spin, args=(0.2,))
+                    worker.start()
+                    worker.join()
+
+            busy, idle = profiler.records
+            self.assertGreater(busy['cpu_time'], 0.1)
+            if hasattr(clock, 'thread_time') or hasattr(profiling.resource,
+                                                        'RUSAGE_THREAD'):
+                self.assertLess(idle['cpu_time'], 0.1)
+
+    def test_stage_graph(self):
+        """Test each stage is measured, and the table written:"""
+        def write(name):
+            def stage(out_group):
+                out_group.create_dataset(name, data=numpy.random.random(
+                    (200, 200)))
+            return stage
+
+        for workers in [1, 2]:
+            profiler = Profiler(level1='scene')
+            with memory_file('profile-{}.h5'.format(workers)) as fid:
+                graph = StageGraph(fid, profiler)
+                graph.add('a', write('a'))
+                graph.add('b', write('b'), ['a'], 'GROUP')
+                graph.run(workers)
+                profiler.write(fid)
+
+                table = read_h5_table(fid, 'PROFILE')
+                self.assertEqual(sorted(text(table['name'])), ['a', 'b'])
+                self.assertEqual(set(text(table['level1'])), {'scene'})
+                self.assertTrue((table['hdf5_bytes'] > 0).all())
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    return unittest.defaultTestLoader.loadTestsFromTestCase(TestProfiler)
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
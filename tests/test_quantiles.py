@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""
+Tests the histogram and streamed quantiles against numpy.percentile.
+"""
+
+from __future__ import absolute_import
+import unittest
+
+import numpy
+import numpy.testing as npt
+
+from wagl import quantiles as quantiles_module
+from wagl.quantiles import HistogramQuantiles, StreamedQuantiles
+from wagl.quantiles import percentiles
+
+PERCENTILES = [0, 17.5, 50, 82.5, 83.5, 97.5, 98.75, 100]
+
+
+class TestHistogramQuantiles(unittest.TestCase):
+
+    """Unit tests for the HistogramQuantiles."""
+
+    def setUp(self):
+        numpy.random.seed(1)
+
+    def test_float(self):
+        """Test the refined percentiles of a float sample are exact:"""
+        data = numpy.random.normal(1500, 800, 200000).astype('float32')
+        result = percentiles(data, PERCENTILES)
+        npt.assert_allclose(result, numpy.percentile(data, PERCENTILES),
+                            rtol=1e-12)
+
+    def test_ties(self):
+        """Test a float sample of many repeated values:"""
+        data = numpy.random.randint(-3000, 3000, 100000).astype('float32')
+        result = percentiles(data, PERCENTILES, bins=1000)
+        npt.assert_allclose(result, numpy.percentile(data, PERCENTILES),
+                            rtol=1e-12)
+
+    def test_integer(self):
+        """Test the percentiles of an integer sample are exact:"""
+        data = numpy.random.randint(-200, 10000, 100000).astype('int16')
+        quantiles = HistogramQuantiles(data)
+        npt.assert_allclose(quantiles.percentiles(PERCENTILES),
+                            numpy.percentile(data, PERCENTILES), rtol=1e-12)
+        self.assertEqual(quantiles.resolution, 0)
+
+    def test_blocks(self):
+        """Test a sample binned over several blocks:"""
+        block_size = quantiles_module.BLOCK_SIZE
+        quantiles_module.BLOCK_SIZE = 999
+        try:
+            data = numpy.random.normal(0, 1, 50000).astype('float32')
+            idata = numpy.random.randint(0, 500, 50000)
+            npt.assert_allclose(percentiles(data, PERCENTILES),
+                                numpy.percentile(data, PERCENTILES),
+                                rtol=1e-12)
+            npt.assert_allclose(percentiles(idata, PERCENTILES),
+                                numpy.percentile(idata, PERCENTILES),
+                                rtol=1e-12)
+        finally:
+            quantiles_module.BLOCK_SIZE = block_size
+
+    def test_estimate(self):
+        """Test the unrefined percentiles are within a bin width:"""
+        data = numpy.random.gamma(2.0, 10.0, 100000)
+        quantiles = HistogramQuantiles(data, bins=512, refine=False)
+        self.assertAlmostEqual(quantiles.resolution,
+                               (data.max() - data.min()) / 512)
+        error = (quantiles.percentiles(PERCENTILES) -
+                 numpy.percentile(data, PERCENTILES))
+        self.assertTrue((numpy.abs(error) <= quantiles.resolution).all())
+
+    def test_small(self):
+        """Test the exact fallback, scalars and degenerate samples:"""
+        data = numpy.random.random(101)
+        for q in PERCENTILES:
+            self.assertEqual(percentiles(data, q), numpy.percentile(data, q))
+
+        self.assertEqual(percentiles(numpy.full(50000, 3.5), 97.5), 3.5)
+        self.assertEqual(percentiles(numpy.array([7]), 10), 7)
+        self.assertTrue(numpy.isnan(percentiles(numpy.array([]), 50)))
+        self.assertRaises(ValueError, percentiles, data, 101)
+
+
+class TestStreamedQuantiles(unittest.TestCase):
+
+    """Unit tests for the StreamedQuantiles."""
+
+    def setUp(self):
+        numpy.random.seed(1)
+
+    def streamed(self, blocks):
+        """The quantiles of the blocks of a sample."""
+        quantiles = StreamedQuantiles()
+        for block in blocks:
+            quantiles.add(block)
+        return quantiles
+
+    def test_exact(self):
+        """Test the percentiles of a float32 sample in blocks are exact:"""
+        data = numpy.random.normal(270, 15, 200001).astype('float32')
+        data[:6] = [-3.5, -0.0, 0.0, 1e-30, -1e30, 1e30]
+        blocks = numpy.array_split(data, 7)
+
+        # the second pass is in a different order to the first
+        result = self.streamed(blocks).percentiles(PERCENTILES,
+                                                   reversed(blocks))
+        npt.assert_allclose(result, numpy.percentile(data.astype('float64'),
+                                                     PERCENTILES),
+                            rtol=1e-12)
+
+    def test_ties(self):
+        """Test a sample of many repeated values:"""
+        data = numpy.random.randint(-3000, 3000, (300, 200)).astype('float32')
+        quantiles = self.streamed(data)
+        for q in PERCENTILES:
+            self.assertEqual(quantiles.percentiles(q, data),
+                             numpy.percentile(data, q))
+
+    def test_combine(self):
+        """Test the quantiles of the union of two samples:"""
+        first = numpy.random.gamma(2.0, 10.0, 5000).astype('float32')
+        second = numpy.random.gamma(5.0, 10.0, 7000).astype('float32')
+        quantiles = self.streamed([first]).combine(self.streamed([second]))
+        self.assertEqual(quantiles.size, 12000)
+
+        expected = numpy.percentile(numpy.concatenate([first, second]),
+                                    PERCENTILES)
+        npt.assert_allclose(quantiles.percentiles(PERCENTILES,
+                                                  [second, first]),
+                            expected, rtol=1e-6)
+
+    def test_degenerate(self):
+        """Test empty samples, and blocks differing from those added:"""
+        self.assertTrue(numpy.isnan(StreamedQuantiles().percentiles(50, [])))
+        self.assertEqual(StreamedQuantiles().percentiles([5, 6], []).shape,
+                         (2,))
+
+        blocks = [numpy.random.random(100), numpy.random.random(100)]
+        quantiles = self.streamed(blocks)
+        self.assertRaises(ValueError, quantiles.percentiles, 50, blocks[:1])
+        self.assertRaises(ValueError, quantiles.percentiles, 101, blocks)
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    suite = unittest.TestSuite()
+    for case in [TestHistogramQuantiles, TestStreamedQuantiles]:
+        suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(case))
+    return suite
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
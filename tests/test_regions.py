@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+"""
+Tests the selection of regions by label, and the contiguity and cloud
+shadow masks using it, against the reverse indices method previously
+used by those masks.
+"""
+
+from __future__ import absolute_import
+from os.path import join as pjoin
+import unittest
+
+import numpy
+from scipy import ndimage
+
+from wagl.cloud_shadow_masking import cloud_shadow
+from wagl.constants import PQAConstants
+from wagl.contiguity_masking import calc_contiguity_mask
+from wagl.geobox import GriddedGeoBox
+from wagl.regions import label_lookup, components_touching, grow_regions
+from wagl.tiling import plan_tiles
+
+from .data import DATA_DIR
+
+STRUCTURE = [[1, 1, 1], [1, 1, 1], [1, 1, 1]]
+
+SHAPE = (160, 200)
+
+# the cloud shadow masks of `shadow_scene`, as given by the cloud_shadow
+# of the baseline (reverse indices) implementation
+BASELINE_SHADOWS = pjoin(DATA_DIR, 'cloud_shadow_baseline.npz')
+
+
+def reverse_indices(array, maxval):
+    """
+    The `histogram` and reverse indices of an integer array, as
+    given by `idl_functions.histogram(array, minv=0, maxv=maxval,
+    reverse_indices='ri')`.
+    """
+    flat = array.ravel()
+    inrange = numpy.flatnonzero((flat >= 0) & (flat <= maxval))
+    values = flat[inrange]
+    order = numpy.argsort(values, kind='stable')
+
+    hist = numpy.bincount(values, minlength=maxval + 1)
+    offsets = numpy.zeros(maxval + 2, dtype='int64')
+    offsets[1:] = numpy.cumsum(hist)
+    ri = numpy.concatenate([offsets + maxval + 2, inrange[order]])
+
+    return hist, ri
+
+
+def reference_regions(mask, seeds, structure=STRUCTURE):
+    """
+    The regions of `mask` containing a seed pixel, as previously
+    selected by looping over the labels.
+    """
+    grown_regions = numpy.zeros(mask.shape, dtype='bool').ravel()
+
+    label_array, _ = ndimage.label(mask, structure=structure)
+    labels = label_array[seeds]
+    ulabels = numpy.unique(labels[labels > 0])
+
+    if ulabels.size > 0:
+        maxval = numpy.max(ulabels)
+        hist, ri = reverse_indices(label_array, maxval)
+
+        for i in numpy.arange(ulabels.shape[0]):
+            if hist[ulabels[i]] == 0:
+                continue
+            grown_regions[ri[ri[ulabels[i]]:ri[ulabels[i] + 1]]] = 1
+
+    return grown_regions.reshape(mask.shape)
+
+
+def random_mask(shape, fraction, seed):
+    """A random mask of many small components."""
+    numpy.random.seed(seed)
+    return numpy.random.random(shape) < fraction
+
+
+def baseline_contiguity(stack, platform_id):
+    """
+    The contiguity mask of a band stack, as previously calculated by
+    `calc_contiguity_mask`.
+    """
+    mask = stack.all(0)
+
+    if platform_id == 'LANDSAT_5':
+        struct = numpy.ones((7, 7), dtype='bool')
+        erode = ndimage.binary_erosion(mask, structure=struct)
+
+        dims = mask.shape
+        th_anom = numpy.zeros(dims, dtype='bool').flatten()
+
+        # `mask - erode`, whose boolean subtraction current numpy refuses
+        pix_3buff_mask = mask.astype('int8') - erode
+        pix_3buff_mask[pix_3buff_mask > 0] = 1
+        edge = pix_3buff_mask == 1
+
+        low_sat = stack[5] == 1
+        low_sat_buff = ndimage.binary_dilation(low_sat, structure=struct)
+
+        s = [[1, 1, 1], [1, 1, 1], [1, 1, 1]]
+        low_sat, _ = ndimage.label(low_sat_buff, structure=s)
+
+        labels = low_sat[edge]
+        ulabels = numpy.unique(labels[labels > 0])
+
+        mx = numpy.max(ulabels)
+        hist, ri = reverse_indices(low_sat, mx)
+
+        for i in numpy.arange(ulabels.shape[0]):
+            if hist[ulabels[i]] == 0:
+                continue
+            th_anom[ri[ri[ulabels[i]]:ri[ulabels[i] + 1]]] = True
+
+        th_anom = ~(th_anom.reshape(dims))
+        mask &= th_anom
+
+    return mask
+
+
+def contiguity_stack(seed, low_sat_fraction):
+    """
+    Random Landsat 5 bands with a ragged edge of null pixels, and
+    scattered low saturation thermal pixels.
+    """
+    numpy.random.seed(seed)
+    stack = numpy.random.randint(2, 255, (7,) + SHAPE).astype('uint8')
+    for band, offset in enumerate(numpy.random.randint(5, 20, 7)):
+        stack[band, :, :offset] = 0
+        stack[band, -offset:, :] = 0
+    stack[:, 60:64, 90:150] = 0
+
+    low_sat = numpy.random.random(SHAPE) < low_sat_fraction
+    stack[5][low_sat] = 1
+
+    return stack
+
+
+class Acquisition(object):
+
+    """
+    The parts of an acquisition read by the contiguity mask.
+    """
+
+    def __init__(self, data):
+        self.lines, self.samples = data.shape
+        self._data = data
+
+    def tiles(self):
+        return plan_tiles((self.lines, self.samples), chunks=(32, 64)).tiles()
+
+    def data(self, window=None, masked=False):
+        if window is None:
+            return self._data
+        (ys, ye), (xs, xe) = window
+        return self._data[ys:ye, xs:xe]
+
+    def data_and_box(self, window=None, masked=False):
+        return self.data(window, masked), None
+
+
+def shadow_scene(seed):
+    """
+    Smoothly varying land reflectances, under bright and cold discs of
+    cloud, each with a dark disc of shadow.
+    """
+    numpy.random.seed(seed)
+    land = ndimage.uniform_filter(numpy.random.random(SHAPE), 9)
+    bands = []
+    for low, high in [(300, 900), (400, 1100), (300, 1300), (1500, 3500),
+                      (1200, 3000), (600, 2000)]:
+        noise = 0.2 * numpy.random.random(SHAPE)
+        bands.append((low + (high - low) * (land + noise)).astype('float32'))
+
+    cloud = numpy.zeros(SHAPE, dtype='bool')
+    shadow = numpy.zeros(SHAPE, dtype='bool')
+    y, x = numpy.ogrid[:SHAPE[0], :SHAPE[1]]
+    for _ in range(6):
+        y0 = numpy.random.randint(10, SHAPE[0] - 30)
+        x0 = numpy.random.randint(10, SHAPE[1] - 30)
+        radius = numpy.random.randint(4, 10)
+        cloud |= (y - y0) ** 2 + (x - x0) ** 2 < radius ** 2
+        shadow |= (y - y0 - 12) ** 2 + (x - x0 - 12) ** 2 < radius ** 2
+    shadow &= ~cloud
+
+    for band in bands:
+        band[cloud] = 5000 + numpy.random.uniform(0, 500, cloud.sum())
+        band[shadow] *= 0.3
+
+    kelvin = numpy.random.uniform(290, 300, SHAPE).astype('float32')
+    kelvin[cloud] = numpy.random.uniform(270, 280, cloud.sum())
+
+    return bands, kelvin, ~cloud
+
+
+class TestRegions(unittest.TestCase):
+
+    """Unit tests for the region selection."""
+
+    def test_label_lookup(self):
+        """Test the background is never selected:"""
+        labels = numpy.array([[0, 1, 2], [3, 3, 0]])
+        lookup = label_lookup(labels, numpy.array([0, 3, 3]))
+        numpy.testing.assert_array_equal(lookup, [False, False, False, True])
+
+        lookup = label_lookup(labels, numpy.array([], dtype='int'), 5)
+        self.assertEqual(lookup.shape, (6,))
+        self.assertFalse(lookup.any())
+
+    def test_components_touching(self):
+        """Test only the components containing a seed are selected:"""
+        labels = numpy.array([[1, 1, 0, 2],
+                              [0, 0, 0, 2],
+                              [3, 0, 4, 4]])
+        seeds = numpy.zeros(labels.shape, dtype='bool')
+        seeds[0, 0] = seeds[2, 3] = seeds[1, 1] = True
+        expected = numpy.isin(labels, [1, 4])
+
+        numpy.testing.assert_array_equal(
+            components_touching(labels, seeds), expected)
+        numpy.testing.assert_array_equal(
+            components_touching(labels, numpy.where(seeds)), expected)
+
+    def test_cloud_shadow_equivalence(self):
+        """Test regions grown from shadow seeds match the previous masks:"""
+        for i, (fraction, seed_fraction) in enumerate([(0.4, 0.01),
+                                                       (0.55, 0.001),
+                                                       (0.3, 0.0)]):
+            mask = random_mask((300, 400), fraction, i)
+            seeds = random_mask((300, 400), seed_fraction, i + 100)
+
+            expected = reference_regions(mask, seeds)
+            result = grow_regions(mask, seeds, structure=STRUCTURE)
+            self.assertTrue(expected.any() or seed_fraction == 0)
+            numpy.testing.assert_array_equal(result, expected)
+
+    def test_contiguity_equivalence(self):
+        """Test the thermal edge anomalies match the previous masks:"""
+        struct = numpy.ones((7, 7), dtype='bool')
+        mask = numpy.zeros((200, 260), dtype='bool')
+        mask[20:180, 30:230] = True
+        erode = ndimage.binary_erosion(mask, structure=struct)
+        edge = mask & ~erode
+
+        low_sat = random_mask(mask.shape, 0.002, 7)
+        low_sat_buff = ndimage.binary_dilation(low_sat, structure=struct)
+
+        expected = mask & ~reference_regions(low_sat_buff, edge)
+        result = mask & ~grow_regions(low_sat_buff, edge, STRUCTURE)
+        self.assertFalse(expected.all())
+        numpy.testing.assert_array_equal(result, expected)
+
+
+class TestBaselineMasks(unittest.TestCase):
+
+    """
+    Test the contiguity and cloud shadow masks against those of the
+    reverse indices implementation.
+    """
+
+    def test_contiguity(self):
+        """Test the contiguity masks match the previous masks:"""
+        for seed in range(3):
+            stack = contiguity_stack(seed, 0.002)
+            acqs = [Acquisition(band) for band in stack]
+            for platform_id in ['LANDSAT_5', 'LANDSAT_7']:
+                expected = baseline_contiguity(stack, platform_id)
+                result = calc_contiguity_mask(acqs, platform_id)
+                numpy.testing.assert_array_equal(result, expected)
+
+            # thermal edge anomalies were found
+            self.assertFalse(numpy.array_equal(
+                baseline_contiguity(stack, 'LANDSAT_5'), expected))
+
+    def test_contiguity_edge(self):
+        """Test the edge buffer is the mask less its erosion:"""
+        stack = contiguity_stack(0, 0.0)
+        mask = stack.all(0)
+        erode = ndimage.binary_erosion(mask, structure=numpy.ones((7, 7)))
+        numpy.testing.assert_array_equal(mask.astype('int8') - erode,
+                                         mask & ~erode)
+
+        # only low saturation pixels on the edge are anomalies
+        stack[5][mask & ~erode] = 1
+        acqs = [Acquisition(band) for band in stack]
+        numpy.testing.assert_array_equal(
+            calc_contiguity_mask(acqs, 'LANDSAT_5'),
+            baseline_contiguity(stack, 'LANDSAT_5'))
+
+    def test_contiguity_no_anomalies(self):
+        """
+        Test a scene without low saturation pixels has no anomalies,
+        where previously it failed on the max of no labels:
+        """
+        stack = contiguity_stack(1, 0.0)
+        acqs = [Acquisition(band) for band in stack]
+        with self.assertRaises(ValueError):
+            baseline_contiguity(stack, 'LANDSAT_5')
+        numpy.testing.assert_array_equal(
+            calc_contiguity_mask(acqs, 'LANDSAT_5'), stack.all(0))
+
+    def test_cloud_shadow(self):
+        """Test the cloud shadow masks match the previous masks:"""
+        geo_box = GriddedGeoBox(SHAPE, origin=(500000.0, 6000000.0),
+                                pixelsize=(30.0, 30.0), crs='EPSG:32753')
+        with numpy.load(BASELINE_SHADOWS) as baseline:
+            for seed in range(5):
+                for growregion in [False, True]:
+                    bands, kelvin, cloud_mask = shadow_scene(seed)
+                    result = cloud_shadow(*bands, kelvin_array=kelvin,
+                                          cloud_mask=cloud_mask,
+                                          geo_box=geo_box, sun_az_deg=135.0,
+                                          sun_elev_deg=45.0,
+                                          pq_const=PQAConstants('TM'),
+                                          growregion=growregion)
+                    expected = baseline['{}-{}'.format(seed, growregion)]
+                    numpy.testing.assert_array_equal(result, expected)
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    suite = unittest.TestSuite()
+    for case in [TestRegions, TestBaselineMasks]:
+        suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(case))
+    return suite
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
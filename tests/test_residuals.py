@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""
+Tests the tiled residual analysis against the equivalent whole array
+computation.
+"""
+
+from __future__ import absolute_import
+from posixpath import join as ppjoin
+import unittest
+
+import h5py
+import numpy
+import numpy.testing as npt
+
+from wagl.scripts import wagl_residuals
+from wagl.scripts.wagl_residuals import distribution, image_residual
+
+CRS_WKT = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]'  # noqa
+
+
+def memory_file(name):
+    """An in-memory HDF5 file."""
+    return h5py.File(name, 'w', driver='core', backing_store=False)
+
+
+def float_histogram(data, omin, omax, nbins=256):
+    """The whole array histogram of a floating point array."""
+    data = data[~numpy.isnan(data)]
+    binsize = (omax - omin) / (nbins - 1)
+    edges = omin + numpy.arange(nbins + 1) * binsize
+    return numpy.histogram(data, edges)[0]
+
+
+class TestResiduals(unittest.TestCase):
+
+    """Unit tests for the tiled residuals."""
+
+    def setUp(self):
+        numpy.random.seed(2)
+        self.max_pixels = wagl_residuals.MAX_PIXELS
+
+        # several tiles, and a partial tile at the edges
+        wagl_residuals.MAX_PIXELS = 300
+
+    def tearDown(self):
+        wagl_residuals.MAX_PIXELS = self.max_pixels
+
+    def test_integer_distribution(self):
+        """Test the distribution of a chunked integer dataset:"""
+        data = numpy.random.randint(-50, 200, (61, 47)).astype('int16')
+        with memory_file('integer.h5') as fid:
+            dset = fid.create_dataset('data', data=data, chunks=(4, 10))
+            for absolute in [False, True]:
+                values = numpy.abs(data) if absolute else data
+                omin, omax = values.min(), values.max()
+                h = distribution(dset, omin, omax, absolute)
+                npt.assert_array_equal(h['histogram'],
+                                       numpy.bincount(values.ravel() - omin))
+                npt.assert_array_equal(h['loc'],
+                                       numpy.arange(omin, omax + 1))
+
+                # the same as a whole NumPy array
+                whole = distribution(data, omin, omax, absolute)
+                npt.assert_array_equal(h['histogram'], whole['histogram'])
+
+    def test_float_distribution(self):
+        """Test the distribution of a chunked float dataset with NaN's:"""
+        data = numpy.random.normal(0, 10, (61, 47)).astype('float32')
+        data[5:9, 3:30] = numpy.nan
+        omin, omax = numpy.nanmin(data), numpy.nanmax(data)
+        with memory_file('float.h5') as fid:
+            dset = fid.create_dataset('data', data=data, chunks=(8, 8))
+            h = distribution(dset, omin, omax)
+            npt.assert_array_equal(h['histogram'],
+                                   float_histogram(data, omin, omax))
+            self.assertEqual(h['histogram'].sum(),
+                             numpy.count_nonzero(~numpy.isnan(data)))
+
+            whole = distribution(data, omin, omax)
+            npt.assert_array_equal(h['histogram'], whole['histogram'])
+
+    def test_image_residual(self):
+        """Test the tiled residual outputs of an IMAGE dataset:"""
+        ref = numpy.random.normal(0, 10, (61, 47)).astype('float32')
+        test = ref.copy()
+        test[10:30, 5:20] += numpy.random.normal(0, 1, (20, 15))
+        test[40, 40] = numpy.nan
+        attrs = {'CLASS': 'IMAGE', 'crs_wkt': CRS_WKT,
+                 'geotransform': (148.0, 0.00025, 0, -35.0, 0, -0.00025)}
+
+        with memory_file('reference.h5') as ref_fid, \
+                memory_file('test.h5') as test_fid, \
+                memory_file('out.h5') as out_fid:
+            for fid, data in [(ref_fid, ref), (test_fid, test)]:
+                dset = fid.create_dataset('product/image', data=data,
+                                          chunks=(8, 8))
+                for key in attrs:
+                    dset.attrs[key] = attrs[key]
+
+            image_residual(ref_fid, test_fid, 'product/image', out_fid)
+
+            expected = ref - test
+            pathname = ppjoin('RESULTS', 'IMAGE', '{}', 'product', 'image')
+            residual = out_fid[pathname.format('RESIDUALS')]
+            npt.assert_array_equal(residual[:], expected)
+            self.assertEqual(residual.attrs['min_residual'],
+                             numpy.nanmin(expected))
+            self.assertEqual(residual.attrs['max_residual'],
+                             numpy.nanmax(expected))
+            self.assertAlmostEqual(residual.attrs['percent_difference'],
+                                   numpy.count_nonzero(expected) /
+                                   expected.size * 100)
+
+            omin, omax = numpy.nanmin(expected), numpy.nanmax(expected)
+            table = out_fid[pathname.format('FREQUENCY-DISTRIBUTIONS')][:]
+            npt.assert_array_equal(table['residuals_distribution'],
+                                   float_histogram(expected, omin, omax))
+
+            hist = float_histogram(numpy.abs(expected), 0,
+                                   numpy.nanmax(numpy.abs(expected)))
+            cdf = numpy.cumsum(hist / hist.sum())
+            dset = out_fid[pathname.format('CUMULATIVE-DISTRIBUTIONS')]
+            npt.assert_allclose(dset['cumulative_distribution'], cdf)
+            self.assertEqual(dset.attrs['90th_percentile'],
+                             dset['bin_locations'][numpy.searchsorted(cdf,
+                                                                      0.9)])
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    return unittest.defaultTestLoader.loadTestsFromTestCase(TestResiduals)
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""
+Tests the SAFE archive access.
+"""
+
+from __future__ import absolute_import
+from os.path import join as pjoin
+import tempfile
+import unittest
+import zipfile
+
+import numpy
+import rasterio
+from rasterio.transform import from_origin
+
+from wagl.acquisition.safe import open_archive, close_archives
+
+MTD_XML = b"""<?xml version="1.0"?>
+<Level-1C_Tile_ID><General_Info><SENSING_TIME>2017-12-07T00:22:52.127Z
+</SENSING_TIME></General_Info></Level-1C_Tile_ID>"""
+
+
+class SafeArchiveTest(unittest.TestCase):
+
+    """Unit tests for the SafeArchive."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.data = numpy.arange(64 * 80, dtype='uint16').reshape(64, 80)
+        tif = pjoin(cls.tmpdir.name, 'B02.tif')
+        kwargs = {'driver': 'GTiff', 'width': 80, 'height': 64, 'count': 1,
+                  'dtype': 'uint16', 'crs': 'EPSG:32755',
+                  'transform': from_origin(500000, 6000000, 10, 10)}
+        with rasterio.open(tif, 'w', **kwargs) as ds:
+            ds.write(cls.data, 1)
+
+        cls.pathname = pjoin(cls.tmpdir.name, 'S2A_MSIL1C_TEST.zip')
+        with zipfile.ZipFile(cls.pathname, 'w') as archive:
+            archive.writestr('TEST.SAFE/GRANULE/G1/MTD_TL.xml', MTD_XML,
+                             zipfile.ZIP_DEFLATED)
+            archive.write(tif, 'TEST.SAFE/GRANULE/G1/IMG_DATA/B02.tif',
+                          zipfile.ZIP_STORED)
+            archive.write(tif, 'TEST.SAFE/GRANULE/G1/IMG_DATA/B03.tif',
+                          zipfile.ZIP_DEFLATED)
+
+    @classmethod
+    def tearDownClass(cls):
+        close_archives()
+        cls.tmpdir.cleanup()
+
+    def test_cached(self):
+        """Test the archive and its parsed XML are reused:"""
+        archive = open_archive(self.pathname)
+        self.assertIs(open_archive(self.pathname), archive)
+
+        member = archive.find('MTD_TL.xml')[0]
+        root = archive.xml(member)
+        self.assertIs(archive.xml(member), root)
+        self.assertEqual(root.tag, 'Level-1C_Tile_ID')
+
+    def test_find(self):
+        """Test the member search:"""
+        archive = open_archive(self.pathname)
+        self.assertEqual(len(archive.find('IMG_DATA')), 2)
+        self.assertEqual(archive.find('IMG_DATA', 'B03'),
+                         ['TEST.SAFE/GRANULE/G1/IMG_DATA/B03.tif'])
+        self.assertEqual(archive.find('B04'), [])
+
+    def test_read_path(self):
+        """Test stored and compressed members are read correctly:"""
+        archive = open_archive(self.pathname)
+        stored = archive.read_path('/TEST.SAFE/GRANULE/G1/IMG_DATA/B02.tif')
+        deflated = archive.read_path('TEST.SAFE/GRANULE/G1/IMG_DATA/B03.tif')
+        self.assertTrue(stored.startswith('/vsisubfile/'))
+        self.assertTrue(deflated.startswith('zip://'))
+
+        window = ((10, 30), (5, 70))
+        for path in [stored, deflated]:
+            with rasterio.open(path) as ds:
+                numpy.testing.assert_array_equal(ds.read(1), self.data)
+                numpy.testing.assert_array_equal(
+                    ds.read(1, window=window), self.data[10:30, 5:70])
+
+    def test_read_path_unindexed(self):
+        """Test members missing from the index are read via the archive:"""
+        archive = open_archive(self.pathname)
+        path = archive.read_path('/TEST.SAFE/GRANULE/G1/IMG_DATA/')
+        self.assertEqual(path, 'zip://{}!/TEST.SAFE/GRANULE/G1/IMG_DATA/'
+                         .format(self.pathname))
+
+    def test_close(self):
+        """Test closed archives are re-opened:"""
+        archive = open_archive(self.pathname)
+        close_archives()
+        reopened = open_archive(self.pathname)
+        self.assertIsNot(reopened, archive)
+        self.assertEqual(len(reopened.namelist()), 3)
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    return unittest.defaultTestLoader.loadTestsFromTestCase(SafeArchiveTest)
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
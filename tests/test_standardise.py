@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""
+Tests the stage that averages the ancillary of a multi-granule level1.
+"""
+
+from __future__ import absolute_import
+from posixpath import join as ppjoin
+import threading
+import unittest
+from unittest import mock
+
+import h5py
+import numpy.testing as npt
+
+from wagl.ancillary import aggregate_ancillary
+from wagl.constants import DatasetName, GroupName
+from wagl.executor import StageGraph
+from wagl.standardise import _add_ancillary_barrier
+
+BARRIER = 'aggregate-ancillary'
+GRANULES = ['granule-1', 'granule-2']
+DATASETS = [DatasetName.OZONE, DatasetName.WATER_VAPOUR, DatasetName.AEROSOL,
+            DatasetName.ELEVATION]
+AVERAGED = ppjoin(GroupName.ANCILLARY_GROUP.value,
+                  GroupName.ANCILLARY_AVG_GROUP.value)
+
+
+def memory_file(name):
+    """An in-memory HDF5 file."""
+    return h5py.File(name, 'w', driver='core', backing_store=False)
+
+
+class AncillaryBarrierTest(unittest.TestCase):
+
+    """
+    Test the ancillary of every granule is averaged once, and shared
+    by the atmospherics of each granule.
+    """
+
+    def setUp(self):
+        self.calls = []
+        self.lock = threading.Lock()
+        self.averages = {}
+
+    def record(self, name):
+        """Record a call of a stage."""
+        with self.lock:
+            self.calls.append(name)
+
+    def ancillary(self, granule, index, fail=False):
+        """A stage writing the ancillary of a granule."""
+        def stage(out_group):
+            self.record(ppjoin(granule, 'ancillary'))
+            if fail:
+                raise RuntimeError('no ancillary')
+            group = out_group.create_group(GroupName.ANCILLARY_GROUP.value)
+            for i, dname in enumerate(DATASETS):
+                group.create_dataset(dname.value, data=float(index + i))
+        return stage
+
+    def tp5(self, graph, granule):
+        """A stage reading the averaged ancillary of a granule."""
+        def stage(out_group):
+            self.record(ppjoin(granule, 'tp5'))
+            group = graph.out_group[ppjoin(granule, AVERAGED)]
+            with self.lock:
+                self.averages[granule] = [group[d.value][()]
+                                          for d in DATASETS]
+        return stage
+
+    def build(self, fid, failing=None):
+        """Two granules, each of whose atmospherics wait on the barrier."""
+        graph = StageGraph(fid)
+        for i, granule in enumerate(GRANULES):
+            graph.add(ppjoin(granule, 'ancillary'),
+                      self.ancillary(granule, 2 * i, granule == failing),
+                      destination=granule)
+            graph.add(ppjoin(granule, 'tp5'), self.tp5(graph, granule),
+                      [ppjoin(granule, 'ancillary'), BARRIER], granule)
+
+        _add_ancillary_barrier(graph, 'level1', GRANULES, BARRIER)
+        return graph
+
+    def test_barrier(self):
+        """
+        Test the ancillary is collected once per granule, and the same
+        averages are seen by both granules.
+        """
+        for workers in [1, 2]:
+            self.setUp()
+            with memory_file('barrier-{}.h5'.format(workers)) as fid, \
+                    mock.patch('wagl.standardise.aggregate_ancillary',
+                               wraps=aggregate_ancillary) as aggregate:
+                self.build(fid).run(workers)
+                self.assertEqual(aggregate.call_count, 1)
+
+                for granule in GRANULES:
+                    self.assertEqual(self.calls.count(
+                        ppjoin(granule, 'ancillary')), 1)
+                    self.assertEqual(self.calls.count(
+                        ppjoin(granule, 'tp5')), 1)
+                    self.assertIn(AVERAGED, fid[granule])
+
+                # the averages of 0..3 and 2..5
+                npt.assert_array_equal(self.averages[GRANULES[0]],
+                                       [1.0, 2.0, 3.0, 4.0])
+                npt.assert_array_equal(self.averages[GRANULES[0]],
+                                       self.averages[GRANULES[1]])
+
+    def test_failure(self):
+        """
+        Test a failing granule raises, rather than leaving the other
+        granule waiting on the barrier.
+        """
+        for workers in [1, 2]:
+            self.setUp()
+            errors = []
+
+            def run():
+                with memory_file('failure-{}.h5'.format(workers)) as fid, \
+                        mock.patch('wagl.standardise.aggregate_ancillary',
+                                   wraps=aggregate_ancillary) as aggregate:
+                    try:
+                        self.build(fid, GRANULES[1]).run(workers)
+                    except RuntimeError as exc:
+                        errors.append(exc)
+                    errors.append(aggregate.call_count)
+
+            thread = threading.Thread(target=run)
+            thread.daemon = True
+            thread.start()
+            thread.join(30)
+
+            self.assertFalse(thread.is_alive())
+            self.assertIsInstance(errors[0], RuntimeError)
+            self.assertEqual(errors[1:], [0])
+            self.assertEqual(self.averages, {})
+            self.assertFalse(any(c.endswith('tp5') for c in self.calls))
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    return unittest.defaultTestLoader.loadTestsFromTestCase(
+        AncillaryBarrierTest)
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
@@ -5,12 +5,18 @@ Tests the tiling routines.
 """
 
 from __future__ import absolute_import
+import os
 import random
+import shutil
+import tempfile
 import unittest
 
+import gdal
 import numpy
 
-from wagl.tiling import generate_tiles
+from wagl.tiling import generate_tiles, plan_tiles, plan_strips
+from wagl.tiling import TiledOutput
+from wagl.data import write_img
 
 
 class TestGetTile3(unittest.TestCase):
@@ -118,6 +124,170 @@ class TestGetTile3(unittest.TestCase):
                           'Tile overlap detected at ' + repr(index))
 
 
+def chunk_aligned_tiles(shape, chunks, max_pixels):
+    """The tiles planned for existing chunks and a pixel budget."""
+    plan = plan_tiles(shape, chunks=chunks, bytes_per_pixel=1,
+                      memory_budget=max_pixels)
+    return plan.tiles()
+
+
+class TestChunkAlignedTiles(unittest.TestCase):
+
+    """Unit tests for the tiles planned for existing chunks."""
+
+    # (rows, columns), (row chunks, column chunks), max_pixels
+    test_input = [((300, 217), (32, 50), 5000),
+                  ((300, 217), (1, 217), 5000),
+                  ((300, 217), (300, 217), 10),
+                  ((7567, 8624), (256, 256), 2**22)]
+
+    def test_alignment(self):
+        """Test that tiles start on a chunk boundary:"""
+        for shape, chunks, max_pixels in self.test_input:
+            for tile in chunk_aligned_tiles(shape, chunks, max_pixels):
+                self.assertEqual(tile[0][0] % chunks[0], 0)
+                self.assertEqual(tile[1][0] % chunks[1], 0)
+
+    def test_coverage(self):
+        """Test that the tiles cover the array without overlap:"""
+        for shape, chunks, max_pixels in self.test_input:
+            count = numpy.zeros(shape, dtype='uint8')
+            for tile in chunk_aligned_tiles(shape, chunks, max_pixels):
+                count[tile[0][0]:tile[0][1], tile[1][0]:tile[1][1]] += 1
+            self.assertTrue((count == 1).all())
+
+
+class TestPlanTiles(unittest.TestCase):
+
+    """Unit tests for the plan_tiles function."""
+
+    # (rows, columns), source block shape, memory budget
+    test_input = [((7841, 7691), (1, 7691), 2**27),
+                  ((7841, 7691), (512, 512), 2**27),
+                  ((300, 217), (3, 217), 2**14),
+                  ((10980, 10980), (1024, 1024), 2**20),
+                  ((100, 90), None, 2**27)]
+
+    def test_alignment(self):
+        """Test tiles are aligned with both the chunks and blocks:"""
+        for shape, block_shape, budget in self.test_input:
+            plan = plan_tiles(shape, block_shape, memory_budget=budget)
+            for tile in plan.tiles():
+                for (start, end), chunk, size in zip(tile, plan.chunks,
+                                                     shape):
+                    self.assertEqual(start % chunk, 0)
+                    self.assertTrue(end % chunk == 0 or end == size)
+                if block_shape is not None:
+                    self.assertEqual(tile[0][0] % block_shape[0], 0)
+                    self.assertEqual(tile[1][0] % block_shape[1], 0)
+
+    def test_coverage(self):
+        """Test that the tiles cover the array without overlap:"""
+        for shape, block_shape, budget in self.test_input:
+            plan = plan_tiles(shape, block_shape, memory_budget=budget)
+            count = numpy.zeros(shape, dtype='uint8')
+            for tile in plan.tiles():
+                count[tile[0][0]:tile[0][1], tile[1][0]:tile[1][1]] += 1
+            self.assertTrue((count == 1).all())
+
+    def test_budget(self):
+        """Test tiles are sized from the memory budget:"""
+        plan = plan_tiles((7841, 7691), (1, 7691))
+        self.assertEqual(plan.chunks, (256, 256))
+        self.assertEqual(plan.tile_shape, (256, 7691))
+
+        plan = plan_tiles((7841, 7691), (1, 7691), bytes_per_pixel=4,
+                          memory_budget=2**25)
+        self.assertEqual(plan.tile_shape, (1024, 7691))
+
+        # a single aligned unit when the budget can't be met
+        plan = plan_tiles((7841, 7691), (1, 7691), memory_budget=1)
+        self.assertEqual(plan.tile_shape, (256, 7691))
+
+        # a single source block spanning the image exceeds the budget
+        plan = plan_tiles((7841, 7691), (7841, 7691), bytes_per_pixel=4,
+                          memory_budget=2**25)
+        self.assertEqual(plan.tile_shape, (1024, 7691))
+        for tile in plan.tiles():
+            self.assertTrue(all(type(i) is int for i in tile[0] + tile[1]))
+
+    def test_chunks(self):
+        """Test existing chunks are retained:"""
+        plan = plan_tiles((7841, 7691), chunks=(1, 7691))
+        self.assertEqual(plan.chunks, (1, 7691))
+        self.assertEqual(plan.tile_shape, (272, 7691))
+
+    def test_strips(self):
+        """Test strips of the memory budget, or of the given lines:"""
+        plan = plan_strips((7841, 7691))
+        self.assertEqual(plan.tile_shape, (272, 7691))
+
+        plan = plan_strips((7841, 7691), bytes_per_pixel=1,
+                           memory_budget=7691 * 3)
+        self.assertEqual(plan.tile_shape, (3, 7691))
+
+        for lines in [1, 100, 8000]:
+            plan = plan_strips((7841, 7691), lines)
+            tiles = list(plan.tiles())
+            self.assertEqual(plan.tile_shape, (min(lines, 7841), 7691))
+            self.assertEqual(tiles[-1][0][1], 7841)
+            self.assertTrue(all(tile[1] == (0, 7691) for tile in tiles))
+
+
+class TestTiledOutputOverviews(unittest.TestCase):
+
+    """Unit tests for the overviews populated by TiledOutput."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_cogtif(self):
+        """Test the layout of a COG streamed through TiledOutput:"""
+        data = numpy.random.randint(0, 256, (301, 257)).astype('uint8')
+        levels = [2, 4, 8]
+        fname = os.path.join(self.temp_dir, 'cogtif.tif')
+        write_img(data, fname, cogtif=True, levels=levels,
+                  options={'blockxsize': 64, 'blockysize': 64})
+
+        # the temporary file is removed
+        self.assertEqual(os.listdir(self.temp_dir), ['cogtif.tif'])
+
+        ds = gdal.Open(fname)
+        self.assertEqual(ds.GetMetadataItem('LAYOUT', 'IMAGE_STRUCTURE'),
+                         'COG')
+
+        band = ds.GetRasterBand(1)
+        self.assertTrue((band.ReadAsArray() == data).all())
+        self.assertEqual(band.GetBlockSize(), [64, 64])
+        self.assertEqual(band.GetOverviewCount(), len(levels))
+
+        # the data of the overviews precedes the full resolution data,
+        # smallest overview first
+        offsets = [int(band.GetOverview(i).GetMetadataItem(
+            'BLOCK_OFFSET_0_0', 'TIFF')) for i in range(len(levels))]
+        offsets.insert(0, int(band.GetMetadataItem('BLOCK_OFFSET_0_0',
+                                                   'TIFF')))
+        self.assertEqual(offsets, sorted(offsets, reverse=True))
+
+        for i, level in enumerate(levels):
+            overview = band.GetOverview(i)
+            self.assertEqual(overview.XSize, -(-data.shape[1] // level))
+            self.assertEqual(overview.YSize, -(-data.shape[0] // level))
+
+    def test_misaligned_tile(self):
+        """Test a tile not aligned with the overview levels:"""
+        fname = os.path.join(self.temp_dir, 'misaligned.tif')
+        outds = TiledOutput(fname, samples=100, lines=100, fmt='GTiff',
+                            levels=[2, 4])
+        tile = ((0, 10), (0, 100))
+        data = numpy.zeros((10, 100), dtype='uint8')
+        self.assertRaises(ValueError, outds.write_tile, data, tile)
+        outds.close()
+
+
 def generate_tile_tags(tiles_list):
     """Generate a random tag for each tile.
 
@@ -157,6 +327,12 @@ def the_suite():
     """Returns a test suite of all the tests in this module."""
 
     suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestGetTile3)
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(
+        TestChunkAlignedTiles))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(
+        TestPlanTiles))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(
+        TestTiledOutputOverviews))
 
     return suite
 
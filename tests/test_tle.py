@@ -1,10 +1,13 @@
 from __future__ import absolute_import
+import os
 from os.path import join as pjoin, abspath, dirname
+import shutil
+import tempfile
 import unittest
 import ephem
 
 from wagl.acquisition import acquisitions
-from wagl.tle import load_tle
+from wagl.tle import load_tle, _read_tle_text
 
 from .data import LS5_SCENE1, LS7_SCENE1, LS8_SCENE1, TLE_DIR
 
@@ -25,3 +28,29 @@ class TLELoadingTest(unittest.TestCase):
         acq = acquisitions(LS8_SCENE1).get_acquisitions(group='RES-GROUP-1')[0]
         data = load_tle(acq, TLE_DIR)
         self.assertIsInstance(data, ephem.EarthSatellite)
+
+
+class TLEReadingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_tle_text_refresh(self):
+        """
+        A missing TLE file isn't memoised, and a changed file is reread.
+        """
+        fname = pjoin(self.tmpdir, 'LS8_ARCHIVE.txt')
+        self.assertIsNone(_read_tle_text(fname))
+
+        with open(fname, 'w') as src:
+            src.write('first')
+        os.utime(fname, (1000, 1000))
+        self.assertEqual(_read_tle_text(fname), 'first')
+
+        with open(fname, 'w') as src:
+            src.write('second')
+        os.utime(fname, (2000, 2000))
+        self.assertEqual(_read_tle_text(fname), 'second')
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+"""
+Tests the shared work queue, with several worker processes standing
+in for the nodes.
+"""
+
+from __future__ import absolute_import
+from functools import partial
+import multiprocessing
+import os
+from os.path import join as pjoin
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from wagl.work_queue import WorkQueue, run_worker, DONE, FAILED, LEASED
+from wagl.work_queue import PENDING
+from wagl.scripts import wagl_queue_worker
+
+
+def process(outdir, fail_attempts, scene):
+    """
+    Record an attempt at a scene, failing the first `fail_attempts`
+    attempts of each scene.
+    """
+    time.sleep(random.uniform(0, 0.02))
+    attempts = len([f for f in os.listdir(outdir)
+                    if f.startswith(scene + '.')])
+    fname = pjoin(outdir, '{}.{}.{}'.format(scene, os.getpid(), attempts))
+    with open(fname, 'w'):
+        pass
+
+    if attempts < fail_attempts.get(scene, 0):
+        raise RuntimeError('attempt {} of {}'.format(attempts, scene))
+
+
+def worker(path, outdir, fail_attempts, lease, slots):
+    """A worker process, draining the queue."""
+    queue = WorkQueue(path, lease=lease)
+    run_worker(queue, partial(process, outdir, fail_attempts), slots=slots,
+               heartbeat=0.05, poll=0.05)
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    """
+    Test the claiming, retrying and lease expiry of the queue.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = pjoin(self.tmpdir, 'queue')
+        self.outdir = pjoin(self.tmpdir, 'out')
+        os.makedirs(self.outdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def attempts(self):
+        """The pids of the attempts at each scene."""
+        result = {}
+        for fname in os.listdir(self.outdir):
+            scene, pid, _ = fname.split('.')
+            result.setdefault(scene, []).append(pid)
+        return result
+
+    def run_workers(self, nworkers, fail_attempts=None, lease=60, slots=1):
+        """Drain the queue with several worker processes."""
+        args = (self.path, self.outdir, fail_attempts or {}, lease, slots)
+        workers = [multiprocessing.Process(target=worker, args=args)
+                   for _ in range(nworkers)]
+        for proc in workers:
+            proc.start()
+        for proc in workers:
+            proc.join(60)
+            self.assertEqual(proc.exitcode, 0)
+
+    def test_workers(self):
+        """
+        Test each scene is processed once, shared amongst the workers.
+        """
+        scenes = ['scene{:03d}'.format(i) for i in range(60)]
+        queue = WorkQueue(self.path)
+        self.assertEqual(queue.enqueue(scenes), 60)
+
+        self.run_workers(4, slots=2)
+
+        attempts = self.attempts()
+        self.assertEqual(sorted(attempts), scenes)
+        self.assertTrue(all(len(pids) == 1 for pids in attempts.values()))
+        self.assertGreater(len(set(p for v in attempts.values() for p in v)),
+                           1)
+        self.assertEqual(queue.counts(), {'pending': 0, 'leased': 0,
+                                          'done': 60, 'failed': 0})
+
+    def test_retry(self):
+        """
+        Test failed scenes are retried, up to the maximum attempts.
+        """
+        queue = WorkQueue(self.path, max_attempts=3)
+        queue.enqueue(['ok', 'flaky', 'broken'])
+
+        self.run_workers(3, {'flaky': 2, 'broken': 10})
+
+        attempts = self.attempts()
+        self.assertEqual({k: len(v) for k, v in attempts.items()},
+                         {'ok': 1, 'flaky': 3, 'broken': 3})
+        self.assertEqual(queue.items(DONE), ['00000000.json',
+                                             '00000001.json'])
+        self.assertEqual(queue.items(FAILED), ['00000002.json'])
+
+    def test_lease_expiry(self):
+        """
+        Test the scene of a dead worker is returned to the queue.
+        """
+        queue = WorkQueue(self.path, lease=0.5)
+        queue.enqueue(['orphan', 'other'])
+
+        # a worker that dies without completing its scene
+        lease = queue.claim('dead')
+        self.assertEqual(lease.scene, 'orphan')
+        self.assertEqual(queue.reap(), 0)
+
+        self.run_workers(2, lease=0.5)
+        self.assertEqual(sorted(self.attempts()), ['orphan', 'other'])
+        self.assertEqual(queue.counts()[DONE], 2)
+
+        # the dead worker's lease was lost
+        self.assertFalse(queue.renew(lease))
+        self.assertFalse(queue.complete(lease))
+
+    def test_lost_lease(self):
+        """
+        Test a lease reclaimed by another worker can't be released.
+        """
+        queue = WorkQueue(self.path, lease=0.0)
+        queue.enqueue(['scene'])
+        first = queue.claim('first')
+        time.sleep(0.05)
+        self.assertEqual(queue.reap(), 1)
+        second = queue.claim('second')
+        self.assertEqual(second.attempts, 2)
+
+        self.assertFalse(queue.fail(first, 'lost'))
+        self.assertTrue(queue.complete(second))
+        self.assertEqual(queue.items(PENDING), [])
+        self.assertEqual(queue.items(DONE), ['00000000.json'])
+
+    def test_dead_release(self):
+        """
+        Test an item left mid release by a dead worker is reaped.
+        """
+        queue = WorkQueue(self.path, lease=0.0)
+        queue.enqueue(['scene'])
+        lease = queue.claim('dead')
+
+        # the private name of the item during the release
+        leased = pjoin(self.path, LEASED, lease.name)
+        os.rename(leased, '{}.{}.release'.format(leased, 'abc'))
+        self.assertEqual(queue.items(LEASED), [])
+        self.assertFalse(queue.complete(lease))
+
+        time.sleep(0.05)
+        self.assertEqual(queue.reap(), 1)
+        second = queue.claim('second')
+        self.assertEqual(second.scene, 'scene')
+        self.assertTrue(queue.complete(second))
+        self.assertEqual(os.listdir(pjoin(self.path, LEASED)), [])
+
+    def test_command(self):
+        """
+        Test the queue worker runs its command for each scene.
+        """
+        out_fname = pjoin(self.outdir, 'scenes.txt')
+        command = '{} -c "import sys; open(sys.argv[2], \'a\').write(' \
+                  'open(sys.argv[1]).read())" {{scene_list}} {}'
+        command = command.format(sys.executable, out_fname)
+        queue = wagl_queue_worker.create_queue(self.path, ['a', 'b'],
+                                               command)
+        wagl_queue_worker.run(self.path)
+
+        with open(out_fname) as src:
+            self.assertEqual(sorted(src.read().split()), ['a', 'b'])
+        self.assertEqual(queue.counts()[DONE], 2)
+
+        # a failing command
+        path = pjoin(self.tmpdir, 'failing')
+        queue = wagl_queue_worker.create_queue(path, ['a'], 'exit 1',
+                                               max_attempts=2)
+        wagl_queue_worker.run(path)
+        self.assertEqual(queue.counts()[FAILED], 1)
+
+
+def the_suite():
+    """Returns a test suite of all the tests in this module."""
+    return unittest.defaultTestLoader.loadTestsFromTestCase(WorkQueueTest)
+
+
+def run_the_tests():
+    """Runs the tests defined in this module"""
+    unittest.TextTestRunner(verbosity=2).run(the_suite())
+
+
+if __name__ == '__main__':
+    run_the_tests()
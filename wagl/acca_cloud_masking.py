@@ -10,15 +10,21 @@ Sensing, Vol. 72, No. 10, October 2006, pp. 1179-1188.
 from __future__ import absolute_import, print_function
 import datetime
 import logging
-import gc
 
 import numexpr
 import numpy
 
-from scipy import ndimage
+from wagl import morphology
+from wagl.quantiles import StreamedQuantiles
+from wagl.tiling import plan_strips
 
 NAN = numpy.float32(numpy.NaN)
 
+# the classes of the first pass, combined as the bits of a uint8 code
+COLD_CLOUD = 1
+WARM_CLOUD = 2
+AMBIGUOUS = 4
+
 
 def water_test(reflectance_stack):
     """
@@ -171,24 +177,207 @@ def skewness(cloud_thermal_array, mean_temp, stdv_temp, count):
     return (sum_cubed_dv / cubed_stdv) / count
 
 
-def acca_2nd_pass(cloud_mask, ambiguous_array, thermal_array,
-                  mean_cloud_temp, pq_const, aux_data=None):
+class FirstPassTallies(object):
+
+    """
+    The class tallies, and the count, sum and histogram of the
+    temperatures of the cold and warm cloud pixels, accumulated over
+    the tiles of the first pass of the ACCA algorithm. No per pixel
+    values are retained.
     """
-    The second pass of the ACCA algorithm.
 
-    :param cloud_mask:
-        The current identifed cloud mask from the 1st pass.
+    def __init__(self):
+        self.pixels = 0
+        self.snow = 0
+        self.f6_survivors = 0
+        self.f7_survivors = 0
+        self._counts = [0, 0]
+        self._sums = [0.0, 0.0]
+        self._quantiles = [StreamedQuantiles(), StreamedQuantiles()]
+
+    def add(self, thermal_array, snow, f6_survivors, f7_survivors, cold_cloud,
+            warm_cloud):
+        """
+        Add the first pass results of a tile.
+        """
+        self.pixels += thermal_array.size
+        self.snow += int(snow.sum())
+        self.f6_survivors += int(f6_survivors.sum())
+        self.f7_survivors += int(f7_survivors.sum())
+
+        for i, cloud in enumerate([cold_cloud, warm_cloud]):
+            temperatures = thermal_array[cloud]
+            self._counts[i] += temperatures.size
+            self._sums[i] += temperatures.sum(dtype='float64')
+            self._quantiles[i].add(temperatures)
+
+    @staticmethod
+    def _classes(cold, warm):
+        """The indices of the cold and/or warm cloud tallies."""
+        return [i for i, selected in enumerate([cold, warm]) if selected]
+
+    def count(self, cold=True, warm=True):
+        """
+        The number of cold and/or warm cloud pixels.
+        """
+        return sum(self._counts[i] for i in self._classes(cold, warm))
+
+    def mean(self, cold=True, warm=True):
+        """
+        The mean temperature of the cold and/or warm cloud pixels.
+        """
+        total = sum(self._sums[i] for i in self._classes(cold, warm))
+        return numpy.float64(total) / self.count(cold, warm)
+
+    def quantiles(self, cold=True, warm=True):
+        """
+        The `StreamedQuantiles` of the temperatures of the cold and/or
+        warm cloud pixels.
+        """
+        quantiles = StreamedQuantiles()
+        for i in self._classes(cold, warm):
+            quantiles = quantiles.combine(self._quantiles[i])
+        return quantiles
+
+
+def acca_first_pass(reflectance_stack, thermal_array, pq_const, tallies):
+    """
+    Applies filters 1 to 8 of the first pass of the ACCA algorithm
+    to a tile.
 
-    :param ambiguous_array:
-        The pixels labeled as ambiguous from the 1st pass
-        (1 = ambiguous).
+    :param reflectance_stack:
+        A 3D Numpy array containing the (un-scaled) reflectance of
+        each of the 6 bands of a tile, and NAN for invalid areas.
 
     :param thermal_array:
-        The thermal band of Landsat TM/ETM+ in un-scaled degrees
-        Kelvin.
+        A 2D Numpy array containing the thermal band in degrees
+        Kelvin, and NAN for invalid areas.
+
+    :param pq_const:
+        An instance of PQAConstants applicable to the reflectance stack
+        supplied
+
+    :param tallies:
+        An instance of `FirstPassTallies` into which the results of
+        the tile are accumulated, or None when the classes of a tile
+        are re-evaluated by the later passes.
+
+    :return:
+        A 2D Numpy array of type uint8, combining the `COLD_CLOUD`,
+        `WARM_CLOUD` and `AMBIGUOUS` classes of each pixel.
+    """
+    # pylint: disable=unused-variable
+    thresh_f1 = pq_const.acca_thresh_f1
+    thresh_f2 = pq_const.acca_thresh_f2
+    thresh_f3 = pq_const.acca_thresh_f3
+    thresh_f4 = pq_const.acca_thresh_f4
+    thresh_f5 = pq_const.acca_thresh_f5
+    thresh_f6 = pq_const.acca_thresh_f6
+    thresh_f7 = pq_const.acca_thresh_f7
+    thresh_f8 = pq_const.acca_thresh_f8
+
+    # Will add in a water mask, to remove cold water bodies that have been
+    # put into the ambigous group. If the water body is high in red
+    # reflectance, it will have made it this far.
+    water_mask = water_test(reflectance_stack)
+
+    # Filters 1 to 3; Band 3 brightness, NDSI and temperature
+    # Snow pixels are tallied over the entire scene
+    ndsi_array = ndsi(reflectance_stack)
+    snow = numexpr.evaluate("ndsi_array >= thresh_f2")
+    potential_cloud = numexpr.evaluate("(b3 > thresh_f1) & "
+                                       "(ndsi_array < thresh_f2) & "
+                                       "(thermal_array < thresh_f3)",
+                                       {'b3': reflectance_stack[2]}, locals())
+
+    # Filter 4; Band 5/6 composite
+    composite = filter4(reflectance_stack, thermal_array)
+    ambiguous = numexpr.evaluate("potential_cloud & "
+                                 "(composite >= thresh_f4)")
+    potential_cloud &= numexpr.evaluate("composite < thresh_f4")
+
+    # All water is unambiguous
+    ambiguous &= ~water_mask
+    del water_mask, ndsi_array
+
+    # Filter 5; Band 4/3 ratio (Simple veg ratio)
+    ratio = filter5(reflectance_stack)
+    ambiguous |= numexpr.evaluate("potential_cloud & (ratio >= thresh_f5)")
+    potential_cloud &= numexpr.evaluate("ratio < thresh_f5")
+
+    # Filter 6; Band 4/2 ratio (Dying/senescing veg)
+    ratio = filter6(reflectance_stack)
+    ambiguous |= numexpr.evaluate("potential_cloud & (ratio >= thresh_f6)")
+    potential_cloud &= numexpr.evaluate("ratio < thresh_f6")
+    f6_survivors = potential_cloud.copy()
+
+    # Filter 7; Band 4/5 ratio (Identify highly reflective soils/rocks)
+    # The results of this query are clouds at first pass
+    ratio = filter7(reflectance_stack)
+    ambiguous |= numexpr.evaluate("potential_cloud & (ratio <= thresh_f7)")
+    potential_cloud &= numexpr.evaluate("ratio > thresh_f7")
+
+    # Filter 8; Band 5/6 composite (Separate warm/cold clouds)
+    cold_cloud = numexpr.evaluate("potential_cloud & "
+                                  "(composite < thresh_f8)")
+    warm_cloud = numexpr.evaluate("potential_cloud & "
+                                  "(composite >= thresh_f8)")
+
+    if tallies is not None:
+        tallies.add(thermal_array, snow, f6_survivors, potential_cloud,
+                    cold_cloud, warm_cloud)
+
+    classes = cold_cloud.astype('uint8')
+    classes[warm_cloud] = WARM_CLOUD
+    classes[ambiguous] |= AMBIGUOUS
+
+    return classes
+
+
+def _ambiguous_classes(ambiguous, thermal_array, bounds):
+    """
+    The two thermal classes of the ambiguous pixels of the second
+    pass of the ACCA algorithm.
+    """
+    lower, upper, nonzero = bounds # pylint: disable=unused-variable
+    query = numexpr.evaluate("ambiguous & (thermal_array > lower) & "
+                             "(thermal_array <= upper)")
+    if nonzero:
+        query2 = numexpr.evaluate("ambiguous & (thermal_array != 0) & "
+                                  "(thermal_array <= lower)")
+    else:
+        query2 = numexpr.evaluate("ambiguous & (thermal_array <= lower)")
+
+    return query, query2
 
-    :param mean_cloud_temp:
-        The mean temperature of the currently identifed cloud pixels.
+
+def acca_2nd_pass(tallies, warm, cloud_tiles, ambiguous_tiles, pq_const,
+                  aux_data=None):
+    """
+    The second pass of the ACCA algorithm.
+
+    :param tallies:
+        An instance of `FirstPassTallies` accumulated over every tile
+        of the scene by the 1st pass.
+
+    :param warm:
+        Whether the currently identified cloud pixels include the
+        warm cloud, or only the cold cloud.
+
+    :param cloud_tiles:
+        An iterable over the tiles of the scene, yielding a 1D Numpy
+        array of the temperatures of the currently identified cloud
+        pixels from the 1st pass. It is consumed once the tallies are
+        evaluated, to resolve the percentiles and the moments about
+        the mean of the temperatures.
+
+    :param ambiguous_tiles:
+        An iterable over the tiles of the scene, yielding a tuple of
+        2D Numpy arrays (ambiguous, thermal_array); the pixels labeled
+        as ambiguous from the 1st pass (True = ambiguous), and the
+        thermal band of Landsat TM/ETM+ in un-scaled degrees Kelvin.
+        It is consumed once the thermal bounds of the classes are
+        evaluated.
 
     :param pq_const:
         An instance of PQAConstants applicable to the reflectance stack
@@ -202,8 +391,11 @@ def acca_2nd_pass(cloud_mask, ambiguous_array, thermal_array,
     :return:
         Depending on the result of the second pass, the acca_second_pass
         function can return None (conditions not, therefore
-        stick with the cloud identified in the first pass), or a cloud
-        mask with with 1 as cloud and 0 as not cloud.
+        stick with the cloud identified in the first pass), or a tuple
+        (bounds, all_classes); the thermal bounds of the classes of
+        ambiguous pixels, and whether both classes (rather than only
+        the lower temperature class) are combined with the first pass
+        cloud.
         Note: Any caller-supplied aux_data dict will be updated
     """
 
@@ -211,24 +403,37 @@ def acca_2nd_pass(cloud_mask, ambiguous_array, thermal_array,
     logging.info('ACCA Pass Two Engaged')
     aux_data['acca_pass_2'] = 'engaged'
 
-    cloud_stddev = numpy.std(thermal_array[cloud_mask], dtype='float64',
-                             ddof=1)
-    cloud_count = numpy.sum(cloud_mask, dtype='float64')
+    cloud_count = numpy.float64(tallies.count(warm=warm))
+    cloud_mean = tallies.mean(warm=warm)
+    mean_cloud_temp = tallies.mean(warm=False)
 
-    aux_data['acca_pass_2_sdev'] = cloud_stddev
+    # the sums of the squared deviates (about the cloud mean), and of
+    # the cubed deviates (about the cold cloud mean) of each tile
+    sums = [0.0, 0.0]
+
+    def deviates():
+        """The cloud temperatures, summing their deviates."""
+        for temperatures in cloud_tiles:
+            sums[0] += numpy.sum((temperatures - cloud_mean) ** 2,
+                                 dtype='float64')
+            sums[1] += numpy.sum((temperatures - mean_cloud_temp) ** 3,
+                                 dtype='float64')
+            yield temperatures
 
     # Histogram Percentiles for new thermal thresholds
-    upper = numpy.percentile(thermal_array[cloud_mask], 97.5)
-    lower = numpy.percentile(thermal_array[cloud_mask], 83.5)
-    upper_max = numpy.percentile(thermal_array[cloud_mask], 98.75)
+    upper, lower, upper_max = tallies.quantiles(warm=warm).percentiles(
+        [97.5, 83.5, 98.75], deviates())
+
+    cloud_stddev = numpy.sqrt(sums[0] / (cloud_count - 1))
+
+    aux_data['acca_pass_2_sdev'] = cloud_stddev
 
     aux_data['acca_pass_2_97_5_percentile'] = upper
     aux_data['acca_pass_2_83_5_percentile'] = lower
     aux_data['acca_pass_2_98_75_percentile'] = upper_max
 
     # Test for negative skewness
-    skew = skewness(thermal_array[cloud_mask], mean_temp=mean_cloud_temp,
-                    stdv_temp=cloud_stddev, count=cloud_count)
+    skew = (sums[1] / cloud_stddev ** 3) / cloud_count
     logging.debug('skew: %s', skew)
 
     aux_data['acca_pass_2_skewness'] = skew
@@ -248,115 +453,72 @@ def acca_2nd_pass(cloud_mask, ambiguous_array, thermal_array,
         else:
             new_upper = upper_max
 
-        #query  = (thermal_array > new_lower) & (thermal_array <= new_upper)
-        query = numexpr.evaluate("((ambiguous_array * thermal_array)"
-                                 "> new_lower) & ((ambiguous_array *"
-                                 "thermal_array) <= new_upper)")
-        query2 = numexpr.evaluate("((ambiguous_array * thermal_array)"
-                                  "<= new_lower)")
-
-        # Compute stats for each query/class
-        # Max, Mean
-        if query.any():
-            qmax = thermal_array[query].max()
-            qmean = thermal_array[query].mean()
-        else:
-            qmax = 295
-            qmean = 295
-
-        if query2.any():
-            qmax2 = thermal_array[query2].max()
-            qmean2 = thermal_array[query2].mean()
-        else:
-            qmax2 = 295
-            qmean2 = 295
-
-        aux_data['acca_pass_2_class_1_max'] = qmax
-        aux_data['acca_pass_2_class_2_max'] = qmax2
-
-        aux_data['acca_pass_2_class_1_mean'] = qmean
-        aux_data['acca_pass_2_class_2_mean'] = qmean2
-
-        # Class percentage of scene
-        qpop = (float(query.sum()) / ambiguous_array.size) * 100
-        qpop2 = (float(query2.sum()) / ambiguous_array.size) * 100
-
-        aux_data['acca_pass_2_class_1_percent'] = qpop
-        aux_data['acca_pass_2_class_2_percent'] = qpop2
-
-        if qpop < pq_const.acca_thermal_effect:
-            if qmean < pq_const.acca_cold_cloud_mean:
-                # Combine all cloud classes
-                return numexpr.evaluate("cloud_mask | query | query2")
-            elif qpop2 < pq_const.acca_thermal_effect:
-                if qmean2 < pq_const.acca_cold_cloud_mean:
-                    # Combine lower threshold clouds and pass 1 clouds
-                    return numexpr.evaluate("cloud_mask | query2")
-        return None  # Keep first pass cloud
-
+        bounds = (new_lower, new_upper, False)
     else:
-        query = numexpr.evaluate("((ambiguous_array * thermal_array)"
-                                 "> lower) & ((ambiguous_array * "
-                                 "thermal_array) <= upper)")
-        query2 = numexpr.evaluate("((ambiguous_array * thermal_array)"
-                                  "!= 0) & ((ambiguous_array * thermal_array)"
-                                  "<= lower)")
-
-        # Compute stats for each query/class
-        # Max, Mean
-        if query.any():
-            qmax = thermal_array[query].max()
-            qmean = thermal_array[query].mean()
-        else:
-            qmax = 295
-            qmean = 295
+        bounds = (lower, upper, True)
+
+    # Compute stats for each query/class, accumulated over the tiles
+    counts = [0, 0]
+    sums = [0.0, 0.0]
+    maxima = [None, None]
+    for ambiguous, thermal_array in ambiguous_tiles:
+        queries = _ambiguous_classes(ambiguous, thermal_array, bounds)
+        for i, query in enumerate(queries):
+            values = thermal_array[query]
+            if values.size:
+                counts[i] += values.size
+                sums[i] += values.sum(dtype='float64')
+                if maxima[i] is None or values.max() > maxima[i]:
+                    maxima[i] = values.max()
+
+    # Max, Mean
+    if counts[0]:
+        qmax = maxima[0]
+        qmean = sums[0] / counts[0]
+    else:
+        qmax = 295
+        qmean = 295
 
-        if query2.any():
-            qmax2 = thermal_array[query2].max()
-            qmean2 = thermal_array[query2].mean()
-        else:
-            qmax2 = 295
-            qmean2 = 295
+    if counts[1]:
+        qmax2 = maxima[1]
+        qmean2 = sums[1] / counts[1]
+    else:
+        qmax2 = 295
+        qmean2 = 295
 
-        aux_data['acca_pass_2_class_1_max'] = qmax
-        aux_data['acca_pass_2_class_2_max'] = qmax2
+    aux_data['acca_pass_2_class_1_max'] = qmax
+    aux_data['acca_pass_2_class_2_max'] = qmax2
 
-        aux_data['acca_pass_2_class_1_mean'] = qmean
-        aux_data['acca_pass_2_class_2_mean'] = qmean2
+    aux_data['acca_pass_2_class_1_mean'] = qmean
+    aux_data['acca_pass_2_class_2_mean'] = qmean2
 
-        # Class percentage of scene
-        qpop = (float(query.sum()) / ambiguous_array.size) * 100
-        qpop2 = (float(query2.sum()) / ambiguous_array.size) * 100
+    # Class percentage of scene
+    qpop = (float(counts[0]) / tallies.pixels) * 100
+    qpop2 = (float(counts[1]) / tallies.pixels) * 100
 
-        aux_data['acca_pass_2_class_1_percent'] = qpop
-        aux_data['acca_pass_2_class_2_percent'] = qpop2
+    aux_data['acca_pass_2_class_1_percent'] = qpop
+    aux_data['acca_pass_2_class_2_percent'] = qpop2
 
-        if qpop < pq_const.acca_thermal_effect:
-            if qmean < pq_const.acca_cold_cloud_mean:
-                # Combine all cloud classes
-                return numexpr.evaluate("cloud_mask | query | query2")
-            elif qpop2 < pq_const.acca_thermal_effect:
-                if qmean2 < pq_const.acca_cold_cloud_mean:
-                    # Combine lower threshold clouds and pass 1 clouds
-                    return numexpr.evaluate("cloud_mask | query2")
-        return None  # Keep fist pass cloud
+    if qpop < pq_const.acca_thermal_effect:
+        if qmean < pq_const.acca_cold_cloud_mean:
+            # Combine all cloud classes
+            return bounds, True
+        elif qpop2 < pq_const.acca_thermal_effect:
+            if qmean2 < pq_const.acca_cold_cloud_mean:
+                # Combine lower threshold clouds and pass 1 clouds
+                return bounds, False
+    return None  # Keep first pass cloud
 
 
-def acca(reflectance_stack, thermal_array, potential_cloud_array, pq_const,
-         aux_data=None):
+def acca(tallies, pq_const, aux_data=None):
     """
-    The first pass processing of the ACCA algorithm.
-
-    :param reflectance_stack:
-        An nD numpy array containing the reflectance values for each
-        band.
+    The first pass processing of the ACCA algorithm; the cloud
+    classes retained from the tallies of `acca_first_pass`, and
+    whether the second pass is engaged.
 
-    :param thermal_array:
-        A 2D Numpy array containing the thermal band.
-
-    :param potential_cloud_array:
-        A 2D Numpy array containing values of 1 for valid areas and NAN for
-        invalid areas.
+    :param tallies:
+        An instance of `FirstPassTallies` accumulated over every tile
+        of the scene.
 
     :param pq_const:
         An instance of PQAConstants applicable to the reflectance stack
@@ -368,208 +530,69 @@ def acca(reflectance_stack, thermal_array, potential_cloud_array, pq_const,
         code for details
 
     :return:
-        An 2D Numpy array cloud mask, with True for non-cloud and False
-        for cloud.
+        A tuple (cloud, ambiguous, second_pass); the classes of the
+        cloud pixels and of the ambiguous pixels (combinations of
+        `COLD_CLOUD`, `WARM_CLOUD` and `AMBIGUOUS`), and a bool
+        indicating whether the second pass is engaged. A cloud class
+        of 0 indicates that every pixel is rejected.
         Note: Any caller-supplied aux_data dict will be updated
     """
 
     aux_data = aux_data or {}  # initialise aux_data to a dictionary
-    dims = reflectance_stack.shape
-
-    #===================================================================
-    # b1 = image_stack[0,:,:]
-    # b2 = image_stack[1,:,:]
-    # b3 = image_stack[2,:,:]
-    # b4 = image_stack[3,:,:]
-    # b5 = image_stack[4,:,:]
-    # b6 = image_stack[5,:,:]
-    # b7 = image_stack[6,:,:]
-    #===================================================================
-
-    # Create the array for Ambiguous Pixels - NAN means not ambiguous
-    ambiguous_array = numpy.ones(
-        potential_cloud_array.shape, dtype=numpy.float32) * NAN
-
-    # Will add in a water mask, to remove cold water bodies that have been
-    # put into the ambigous group. If the water body is high in red
-    # reflectance, it will have made it this far.
-
-    water_mask = water_test(reflectance_stack)
-    query = numexpr.evaluate("where((potential_cloud_array * b3)"
-                             "> thresh_f1, 1, NAN)",
-                             {'b3': reflectance_stack[2],
-                              'thresh_f1': pq_const.acca_thresh_f1,
-                              'NAN': NAN},
-                             locals())
-
-    potential_cloud_array *= query
-
-    # Filter 2: NDSI
-    ndsi_array = ndsi(reflectance_stack)
-    query = numexpr.evaluate("where((potential_cloud_array * ndsi_array)"
-                             "< thresh_f2, 1, NAN)",
-                             {'thresh_f2': pq_const.acca_thresh_f2,
-                              'NAN': NAN}, locals())
-
-    # Find the snow pixels. Sum is used to find the total cloud pixels
-    # as valid pixels = 1.  Sum of ones therefore = count
-    find = numexpr.evaluate("where(ndsi_array >= thresh_f2, 1, 0)",
-                            {'thresh_f2': pq_const.acca_thresh_f2}, locals())
-    snow_pixels = find.sum()  # Sum is used as valid pixels = 1
-    snow_percent = (float(snow_pixels) / find.size) * 100
-
-    potential_cloud_array *= query
 
+    snow_percent = (float(tallies.snow) / tallies.pixels) * 100
     aux_data['acca_pass_1_snow_percent'] = snow_percent
 
-    # Filter 3; Temp. threshold
-    query = numexpr.evaluate("where((potential_cloud_array * thermal_array)"
-                             "< thresh_f3, 1, NAN)",
-                             {'thresh_f3': pq_const.acca_thresh_f3,
-                              'NAN': NAN},
-                             locals())
-    potential_cloud_array *= query
-
-    # Filter 4; Band 5/6 composite
-    _temporary = potential_cloud_array * \
-        filter4(reflectance_stack, thermal_array)
-    query = numexpr.evaluate("where(_temporary < thresh_f4, 1, NAN)",
-                             {'thresh_f4': pq_const.acca_thresh_f4,
-                              'NAN': NAN},
-                             locals())
-
-    # Get ambiguous pixels
-    find = numexpr.evaluate("_temporary >= thresh_f4",
-                            {'thresh_f4': pq_const.acca_thresh_f4}, locals())
-    ambiguous_array[find] = 1
-
-    potential_cloud_array *= query
-
-    # Will add in a water mask, to remove cold water bodies that have been
-    # put into the ambiguous group. If the water body is high in red
-    # reflectance, it will have made it this far.
-
-    ambiguous_array[water_mask] = NAN  # All water is unambiguous
-    del water_mask
-    gc.collect()
-
-    # Filter 5; Band 4/3 ratio (Simple veg ratio)
-    _temporary = potential_cloud_array * filter5(reflectance_stack)
-    query = numexpr.evaluate("where(_temporary < thresh_f5, 1, NAN)",
-                             {'thresh_f5': pq_const.acca_thresh_f5,
-                              'NAN': NAN}, locals())
-
-    # Get ambiguous pixels
-    find = numexpr.evaluate("_temporary >= thresh_f5",
-                            {'thresh_f5': pq_const.acca_thresh_f5}, locals())
-    ambiguous_array[find] = 1
-
-    potential_cloud_array *= query
-
-    # Filter 6; Band 4/2 ratio (Dying/senescing veg)
-    _temporary = potential_cloud_array * filter6(reflectance_stack)
-    query = numexpr.evaluate("where(_temporary < thresh_f6, 1, NAN)",
-                             {'thresh_f6': pq_const.acca_thresh_f6,
-                              'NAN': NAN}, locals())
-
-    # Tally filter 6 survivors
-    f6_surv = numpy.nansum(query)
-
-    # Get ambiguous pixels
-    find = numexpr.evaluate("_temporary >= thresh_f6",
-                            {'thresh_f6': pq_const.acca_thresh_f6,
-                             'NAN': NAN}, locals())
-    ambiguous_array[find] = 1
-
-    potential_cloud_array *= query
-
-    # Filter 7; Band 4/5 ratio (Identify highly reflective soils/rocks)
-    # The results of this query are clouds at first pass
-    _temporary = potential_cloud_array * filter7(reflectance_stack)
-
-    query = numexpr.evaluate("where(_temporary > thresh_f7, 1, NAN)",
-                             {'thresh_f7': pq_const.acca_thresh_f7,
-                              'NAN': NAN}, locals())
-
-    # Tally filter 7 survivors
-    f7_surv = numpy.nansum(query)
-    desert_index = float(f7_surv) / f6_surv
-
+    desert_index = numpy.float64(tallies.f7_survivors) / tallies.f6_survivors
     aux_data['acca_pass_1_desert_index'] = desert_index
 
-    # Get ambiguous pixels
-    find = numexpr.evaluate("_temporary <= thresh_f7",
-                            {'thresh_f7': pq_const.acca_thresh_f7}, locals())
-    ambiguous_array[find] = 1
-
-    potential_cloud_array *= query
-
-    # Filter 8; Band 5/6 composite (Separate warm/cold clouds)
-    _temporary = potential_cloud_array * \
-        filter4(reflectance_stack, thermal_array)
-    cold_cloud = numexpr.evaluate("_temporary < thresh_f8",
-                                  {'thresh_f8': pq_const.acca_thresh_f8},
-                                  locals())
-    warm_cloud = numexpr.evaluate("_temporary >= thresh_f8",
-                                  {'thresh_f8': pq_const.acca_thresh_f8},
-                                  locals())
-
-    cold_cloud_pop = (float(cold_cloud.sum()) / ambiguous_array.size) * 100
-    cold_cloud_mean = numpy.mean(thermal_array[cold_cloud], dtype='float64')
-    warm_cloud_pop = (float(warm_cloud.sum()) / ambiguous_array.size) * 100
-    warm_cloud_mean = numpy.mean(thermal_array[warm_cloud], dtype='float64')
+    cold_cloud_pop = (float(tallies.count(warm=False)) / tallies.pixels) * 100
+    cold_cloud_mean = tallies.mean(warm=False)
+    warm_cloud_pop = (float(tallies.count(cold=False)) / tallies.pixels) * 100
+    warm_cloud_mean = tallies.mean(cold=False)
 
     aux_data['acca_pass_1_cold_cloud_percent'] = cold_cloud_pop
     aux_data['acca_pass_1_cold_cloud_mean'] = cold_cloud_mean
     aux_data['acca_pass_1_warm_cloud_percent'] = warm_cloud_pop
     aux_data['acca_pass_1_warm_cloud_mean'] = warm_cloud_mean
 
-    del query, find, _temporary
-    gc.collect()
-
     # Tests for snow and desert.  If the thresholds aren't breached, Pass two
     # is implemented.
 
     # REDO of tests for pass two engagement
     if desert_index <= pq_const.acca_desert_index and \
        snow_percent > pq_const.acca_snow_threshold:
-        cloud = cold_cloud
-        ambiguous_array[warm_cloud] = 1
-        logging.debug('cold cloud only: %s', cloud.sum())
+        cloud = COLD_CLOUD
+        ambiguous = AMBIGUOUS | WARM_CLOUD
+        cloud_count = tallies.count(warm=False)
+        logging.debug('cold cloud only: %s', cloud_count)
     else:
-        cloud = cold_cloud | warm_cloud
-        logging.debug('combined cloud: %s', cloud.sum())
+        cloud = COLD_CLOUD | WARM_CLOUD
+        ambiguous = AMBIGUOUS
+        cloud_count = tallies.count()
+        logging.debug('combined cloud: %s', cloud_count)
 
-    if cloud.sum() > 0:
+    if cloud_count > 0:
+        mean_temperature = tallies.mean(warm=(cloud & WARM_CLOUD) != 0)
         logging.debug('cold_cloud_pop: %s', cold_cloud_pop)
         logging.debug('desert_index: %s', desert_index)
-        logging.debug('Mean temperature: %s', numpy.mean(
-            thermal_array[cloud], dtype='float'))
+        logging.debug('Mean temperature: %s', mean_temperature)
         if ((cold_cloud_pop > pq_const.acca_cold_cloud_pop) and \
             (desert_index > pq_const.acca_desert_index) and \
-            (numpy.mean(thermal_array[cloud], dtype='float') <
-             pq_const.acca_cold_cloud_mean)):
+            (mean_temperature < pq_const.acca_cold_cloud_mean)):
             # Inititate 2nd Pass Testing
-            r_cloud = acca_2nd_pass(cloud_mask=cloud,
-                                    ambiguous_array=ambiguous_array,
-                                    thermal_array=thermal_array,
-                                    mean_cloud_temp=cold_cloud_mean,
-                                    pq_const=pq_const, aux_data=aux_data)
-            if r_cloud is None:
-                return cloud
-            return r_cloud
+            return cloud, ambiguous, True
 
         elif ((desert_index <= pq_const.acca_desert_index) and
-              (numpy.mean(thermal_array[cloud], dtype='float') <
-               pq_const.acca_cold_cloud_mean)):
-            return cold_cloud
+              (mean_temperature < pq_const.acca_cold_cloud_mean)):
+            return COLD_CLOUD, ambiguous, False
 
         aux_data['acca_desert_index'] = 'failed'
         aux_data['acca_identified_pixels'] = 'all rejected'
-        return numpy.zeros((dims[1], dims[2]), dtype='uint8')
+        return 0, ambiguous, False
 
     aux_data['acca_identified_pixels'] = 'all rejected'
-    return numpy.zeros((dims[1], dims[2]), dtype='uint8')
+    return 0, ambiguous, False
 
 
 def majority_filter(array, iterations=1):
@@ -585,18 +608,19 @@ def majority_filter(array, iterations=1):
 
     :return:
         A 2D np array of type bool.
+
+    :notes:
+        Evaluated via `wagl.morphology.majority_filter`; non-zero
+        values are counted as True, and a pixel is True where more
+        than 4 pixels of its 3x3 window are True.
     """
-    weights_array = [[1, 1, 1], [1, 1, 1], [1, 1, 1]]
-    for _ in range(iterations):
-        array = ndimage.convolve(array, weights_array)
-        array = numexpr.evaluate("array > 4")
-    return array
+    return morphology.majority_filter(array, iterations=iterations)
 
 
 def calc_acca_cloud_mask(blue_dataset, green_dataset, red_dataset,
                          nir_dataset, swir1_dataset, swir2_dataset,
                          kelvin_array, pq_const, contiguity_mask,
-                         aux_data=None):
+                         aux_data=None, tile_lines=None):
     """
     Identifes the location of clouds.
 
@@ -604,6 +628,18 @@ def calc_acca_cloud_mask(blue_dataset, green_dataset, red_dataset,
     Irish, R et al, October 2006, Photogrammetric Engineering & Remote
     Sensing, Vol. 72, No. 10, October 2006, pp. 1179-1188.
 
+    The scene is streamed in tiles of full lines, and no per pixel
+    values are retained between the passes over the tiles. The first
+    pass tallies the classes of each tile, and a histogram of the
+    cloud temperatures. The filters of the first pass are then
+    re-evaluated for each tile by the passes of the second pass;
+    resolving the percentiles and moments of the cloud temperatures,
+    then the statistics of the ambiguous classes, whose pass retains
+    the classes in the buffer of the resulting mask. The final
+    classification re-evaluates the filters only if the second pass
+    isn't engaged. Hence the peak memory is a few tiles and the
+    resulting mask, regardless of the scene size.
+
     :param blue_dataset:
         A `NumPy` or `NumPy-like` dataset that allows indexing
         and returns a `NumPy` dataset containing the blue spectral
@@ -636,6 +672,7 @@ def calc_acca_cloud_mask(blue_dataset, green_dataset, red_dataset,
 
     :param kelvin_array:
         A 2D Nump array containing temperature in degrees Kelvin.
+        It isn't modified.
 
     :param contiguity_mask:
         A 2D Numpy array where 0 = Non-contiguous and 1 = Contiguous.
@@ -645,6 +682,11 @@ def calc_acca_cloud_mask(blue_dataset, green_dataset, red_dataset,
         results and metrics generated during processing - refer to the 
         code for details
 
+    :param tile_lines:
+        The number of lines of each tile. Default is None, in which
+        case the number of lines is given by the tiling memory budget
+        (see `wagl.tiling.plan_strips`).
+
     :return:
         A Boolean ndarray with 1 as non-cloud and 0 as cloud.
         Note: Any caller-supplied aux_data dict will be updated
@@ -653,41 +695,97 @@ def calc_acca_cloud_mask(blue_dataset, green_dataset, red_dataset,
     start_time = datetime.datetime.now()
 
     aux_data = aux_data or {}  # set aux_data to empty dict if undefined
-    dims = (6, kelvin_array.shape[0], kelvin_array.shape[1])
+    lines, samples = kelvin_array.shape
+    plan = plan_strips((lines, samples), tile_lines)
+    tiles = [(slice(*tile[0]), slice(*tile[1])) for tile in plan.tiles()]
 
-    # Contiguity masking
-    null_nan_array = numpy.ones(contiguity_mask.shape, dtype=numpy.float32)
-    if contiguity_mask is not None:
-        null_nan_array[~contiguity_mask] = NAN
-
-    # reflectance_stack contains surface reflectance in un-scaled units
-    reflectance_stack = numpy.zeros(dims, dtype='float32')
+    datasets = [blue_dataset, green_dataset, red_dataset, nir_dataset,
+                swir1_dataset, swir2_dataset]
     scaling_factor = numpy.float32(0.0001)
-    variables = {'scaling_factor': scaling_factor,
-                 'null_nan_array': null_nan_array}
-    expr = "array * scaling_factor * null_nan_array"
-    variables['array'] = blue_dataset
-    reflectance_stack[0] = numexpr.evaluate(expr, variables)
-    variables['array'] = green_dataset
-    reflectance_stack[1] = numexpr.evaluate(expr, variables)
-    variables['array'] = red_dataset
-    reflectance_stack[2] = numexpr.evaluate(expr, variables)
-    variables['array'] = nir_dataset
-    reflectance_stack[3] = numexpr.evaluate(expr, variables)
-    variables['array'] = swir1_dataset
-    reflectance_stack[4] = numexpr.evaluate(expr, variables)
-    variables['array'] = swir2_dataset
-    reflectance_stack[5] = numexpr.evaluate(expr, variables)
-
-    kelvin_array[~contiguity_mask] = NAN
-
-    cloud = acca(reflectance_stack, kelvin_array, null_nan_array,
-                 pq_const, aux_data=aux_data)
+
+    def thermal(idx):
+        """The temperature of a tile, NAN for non-contiguous pixels."""
+        kelvin = numpy.array(kelvin_array[idx], dtype='float32')
+        kelvin[~contiguity_mask[idx]] = NAN
+        return kelvin
+
+    def first_pass(tallies=None):
+        """
+        Yields the first pass classes, and the temperature, of each
+        tile; accumulating the tallies if given.
+        """
+        for idx in tiles:
+            # Contiguity masking
+            null_nan_array = numpy.ones(contiguity_mask[idx].shape,
+                                        dtype=numpy.float32)
+            null_nan_array[~contiguity_mask[idx]] = NAN
+
+            # reflectance_stack contains surface reflectance in un-scaled
+            # units
+            reflectance_stack = numpy.zeros((6,) + null_nan_array.shape,
+                                            dtype='float32')
+            variables = {'scaling_factor': scaling_factor,
+                         'null_nan_array': null_nan_array}
+            expr = "array * scaling_factor * null_nan_array"
+            for i, dataset in enumerate(datasets):
+                variables['array'] = dataset[idx]
+                reflectance_stack[i] = numexpr.evaluate(expr, variables)
+
+            thermal_array = thermal(idx)
+            classes = acca_first_pass(reflectance_stack, thermal_array,
+                                      pq_const, tallies)
+            yield idx, classes, thermal_array
+
+    # First pass; the tallies of the classes
+    tallies = FirstPassTallies()
+    for _ in first_pass(tallies):
+        pass
+
+    cloud_class, ambiguous_class, second_pass = acca(tallies, pq_const,
+                                                     aux_data=aux_data)
+
+    # The buffer of the mask, which holds the first pass classes of
+    # each pixel between the second pass and the final classification
+    cloud = numpy.zeros((lines, samples), dtype='uint8')
+
+    def ambiguous_tiles():
+        """The ambiguous pixels, and the temperature, of each tile."""
+        for idx, classes, thermal_array in first_pass():
+            cloud[idx] = classes
+            yield (classes & ambiguous_class) != 0, thermal_array
+
+    if second_pass:
+        # Inititate 2nd Pass Testing
+        cloud_tiles = (thermal_array[(classes & cloud_class) != 0]
+                       for _, classes, thermal_array in first_pass())
+        second_pass = acca_2nd_pass(tallies, (cloud_class & WARM_CLOUD) != 0,
+                                    cloud_tiles, ambiguous_tiles(), pq_const,
+                                    aux_data=aux_data)
+        classified = ((idx, cloud[idx].copy(), thermal(idx)) for idx in tiles)
+    else:
+        second_pass = None
+        classified = first_pass()
+    del tallies
+
+    # Final classification
+    if cloud_class:
+        for idx, classes, thermal_array in classified:
+            cloud[idx] = (classes & cloud_class) != 0
+            if second_pass is not None:
+                bounds, all_classes = second_pass
+                ambiguous = (classes & ambiguous_class) != 0
+                query, query2 = _ambiguous_classes(ambiguous, thermal_array,
+                                                   bounds)
+                cloud[idx] |= query2
+                if all_classes:
+                    cloud[idx] |= query
+    cloud = cloud.view('bool')
 
     # Apply filtering; gets rid of isolated pixels, and holes.
-    if cloud.sum() > 0:
+    if cloud.any():
         # Majority filtering
-        cloud = majority_filter(cloud, iterations=2)
+        cloud = morphology.majority_filter(cloud, iterations=2,
+                                           tile_lines=plan.tile_shape[0])
 
     # Note this is percent of the array, not just contiguous areas.
     cloud_percent = (float(cloud.sum()) / cloud.size) * 100
@@ -698,7 +796,7 @@ def calc_acca_cloud_mask(blue_dataset, green_dataset, red_dataset,
     # value from ACCA wll be for contiguous areas if the argument null_mask
     # is set. Otherwise the percent of the entire array is returned.
 
-    cloud_mask = ~cloud.astype(numpy.bool)
+    cloud_mask = ~cloud
 
     # Upper cloud prob is 22.5
     # Also if low cloud % or desert region, set to original fmask probability
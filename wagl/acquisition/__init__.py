@@ -17,7 +17,6 @@ import re
 import json
 import datetime
 from xml.etree import ElementTree
-import zipfile
 import tarfile
 from dateutil import parser
 from nested_lookup import nested_lookup
@@ -27,6 +26,7 @@ from .base import Acquisition, AcquisitionsContainer
 from .sentinel import Sentinel2aAcquisition, Sentinel2bAcquisition, s2_index_to_band_id
 from .sentinel import Sentinel2aSinergiseAcquisition, Sentinel2bSinergiseAcquisition
 from .landsat import ACQUISITION_TYPE, LandsatAcquisition
+from .safe import open_archive
 
 from ..mtl import load_mtl
 
@@ -149,6 +149,7 @@ def acquisitions_via_mtl(pathname):
     prod_md = data['PRODUCT_METADATA']
     rad_md = data['MIN_MAX_RADIANCE']
     quant_md = data['MIN_MAX_PIXEL_VALUE']
+    ref_md = data.get('MIN_MAX_REFLECTANCE', {})
 
     # acquisition datetime
     acq_date = prod_md.get('acquisition_date', prod_md['date_acquired'])
@@ -215,10 +216,20 @@ def acquisitions_via_mtl(pathname):
         if attrs.get('supported_band'):
             attrs['solar_azimuth'] = solar_azimuth
             attrs['solar_elevation'] = solar_elevation
-            attrs['min_radiance'] = min_rad
-            attrs['max_radiance'] = max_rad
-            attrs['min_quantize'] = min_quant
-            attrs['max_quantize'] = max_quant
+
+        # calibration of every band, as Fmask also uses the unsupported
+        # (cirrus) band
+        attrs['min_radiance'] = min_rad
+        attrs['max_radiance'] = max_rad
+        attrs['min_quantize'] = min_quant
+        attrs['max_quantize'] = max_quant
+
+        # collection 1 and Landsat 8 products are also calibrated to TOA
+        # reflectance
+        ref_key = 'reflectance_{}_{}'
+        if ref_key.format('minimum', band) in ref_md:
+            attrs['min_reflectance'] = ref_md[ref_key.format('minimum', band)]
+            attrs['max_reflectance'] = ref_md[ref_key.format('maximum', band)]
 
         # band_name is an internal property of acquisitions class
         band_name = attrs.pop('band_name', band_id)
@@ -370,16 +381,15 @@ def acquisitions_via_safe(pathname):
                 return band_id
         return None
 
-    archive = zipfile.ZipFile(pathname)
-    xmlfiles = [s for s in archive.namelist() if "MTD_MSIL1C.xml" in s]
+    archive = open_archive(pathname)
+    xmlfiles = archive.find("MTD_MSIL1C.xml")
 
     if not xmlfiles:
         pattern = basename(pathname.replace('PRD_MSIL1C', 'MTD_SAFL1C'))
         pattern = pattern.replace('.zip', '.xml')
-        xmlfiles = [s for s in archive.namelist() if pattern in s]
+        xmlfiles = archive.find(pattern)
 
-    mtd_xml = archive.read(xmlfiles[0])
-    xml_root = ElementTree.XML(mtd_xml)
+    xml_root = archive.xml(xmlfiles[0])
 
     # platform id, TODO: sensor name
     search_term = './*/Product_Info/*/SPACECRAFT_NAME'
@@ -435,16 +445,15 @@ def acquisitions_via_safe(pathname):
     granule_groups = {}
     for granule_id, images in granules.items():
 
-        granule_xmls = [s for s in archive.namelist() if 'MTD_TL.xml' in s]
+        granule_xmls = archive.find('MTD_TL.xml')
         if not granule_xmls:
             pattern = granule_id.replace('MSI', 'MTD')
             pattern = pattern.replace(''.join(['_N', processing_baseline]),
                                       '.xml')
 
-            granule_xmls = [s for s in archive.namelist() if pattern in s]
+            granule_xmls = archive.find(pattern)
 
-        granule_xml = archive.read(granule_xmls[0])
-        granule_root = ElementTree.XML(granule_xml)
+        granule_root = archive.xml(granule_xmls[0])
 
         # handling different metadata versions for image paths
         # files retrieved from archive.namelist are not prepended with a '/'
@@ -10,7 +10,7 @@ import rasterio
 
 from ..geobox import GriddedGeoBox
 from ..modtran import read_spectral_response
-from ..tiling import generate_tiles
+from ..tiling import plan_tiles
 from ..constants import BandType
 
 class AcquisitionsContainer(object):
@@ -265,7 +265,7 @@ class Acquisition(object):
         A private method for opening the dataset and
         retrieving dataset metadata
         """
-        with rasterio.open(self.uri) as ds:
+        with rasterio.open(self._read_path()) as ds:
             self._samples = ds.width
             self._lines = ds.height
             self._tile_size = ds.block_shapes[0]
@@ -273,6 +273,13 @@ class Acquisition(object):
             self._gridded_geo_box = GriddedGeoBox.from_dataset(ds)
             self._no_data_val =  ds.nodatavals[0]
 
+    def _read_path(self):
+        """
+        The path used to read the data; the uri, unless the sensor
+        provides a cheaper alternative.
+        """
+        return self.uri
+
     @property
     def pathname(self):
         """
@@ -383,7 +390,7 @@ class Acquisition(object):
         If `out` is supplied, it must be a numpy.array into which
         the Acquisition's data will be read.
         """
-        with rasterio.open(self.uri) as ds:
+        with rasterio.open(self._read_path()) as ds:
             data = ds.read(1, out=out, window=window, masked=masked)
 
         return data
@@ -403,7 +410,7 @@ class Acquisition(object):
         the Acquisition's data will be read.
         for this acquisition.
         """
-        with rasterio.open(self.uri) as ds:
+        with rasterio.open(self._read_path()) as ds:
             box = GriddedGeoBox.from_dataset(ds)
             if window is not None:
                 rows = window[0][1] - window[0][0]
@@ -456,9 +463,28 @@ class Acquisition(object):
         """
         pass
 
-    def tiles(self):
+    def tile_plan(self, **kwargs):
+        """
+        The processing tiles and output chunks for this acquisition,
+        planned from a memory budget and the native `tile_size`.
+        Keyword arguments are passed through to
+        `wagl.tiling.plan_tiles`.
+        """
+        return plan_tiles((self.lines, self.samples), self.tile_size,
+                          **kwargs)
+
+    @property
+    def chunks(self):
+        """
+        The chunk shape, in (ysize, xsize) dimensions, of the HDF5
+        image datasets derived from this acquisition.
+        """
+        return self.tile_plan().chunks
+
+    def tiles(self, **kwargs):
         """
         Generate the tiling regime for this acquisition.
+        Keyword arguments are passed through to
+        `wagl.tiling.plan_tiles`.
         """
-        ysize, xsize = self.tile_size
-        return generate_tiles(self.samples, self.lines, xsize, ysize)
+        return self.tile_plan(**kwargs).tiles()
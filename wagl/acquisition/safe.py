@@ -0,0 +1,164 @@
+"""
+Access to the zip archives of Sentinel-2 SAFE products.
+
+Each archive is opened once per process, and retains an index of its
+members, and the parsed XML documents, so that the metadata lookups
+of every band (and the band reads) after the first touch don't
+need to re-open and re-scan the archive.
+"""
+
+from collections import OrderedDict
+import os
+import struct
+import threading
+from xml.etree import ElementTree
+import zipfile
+
+# the number of archives kept open by a process
+ARCHIVE_CACHE_SIZE = 8
+
+_ARCHIVES = OrderedDict()
+_ARCHIVES_LOCK = threading.Lock()
+
+
+class SafeArchive(object):
+
+    """
+    An opened SAFE zip archive.
+
+    :param pathname:
+        A `str` containing the full file pathname of the archive.
+    """
+
+    def __init__(self, pathname):
+        self.pathname = pathname
+        self._archive = zipfile.ZipFile(pathname)
+        self._members = self._archive.namelist()
+        self._index = {info.filename: info for info in
+                       self._archive.infolist()}
+        self._searches = {}
+        self._xml = {}
+        self._read_paths = {}
+        self._lock = threading.Lock()
+
+    def namelist(self):
+        """
+        The members of the archive, in archive order.
+        """
+        return list(self._members)
+
+    def find(self, *patterns):
+        """
+        Return the members whose names contain every one of the
+        patterns, in archive order.
+        """
+        with self._lock:
+            if patterns not in self._searches:
+                self._searches[patterns] = [
+                    s for s in self._members if all(p in s for p in patterns)]
+            return list(self._searches[patterns])
+
+    def read(self, member):
+        """
+        Return the contents of a member as `bytes`.
+        """
+        with self._lock:
+            return self._archive.read(member)
+
+    def xml(self, member):
+        """
+        Return the root `Element` of an XML member. The parsed
+        documents are cached, and shared, so they mustn't be modified.
+        """
+        with self._lock:
+            if member not in self._xml:
+                self._xml[member] = ElementTree.XML(
+                    self._archive.read(member))
+            return self._xml[member]
+
+    def _data_offset(self, info):
+        """
+        The offset (bytes) of a member's data from the start of the
+        archive; the local file header precedes it.
+        """
+        with open(self.pathname, 'rb') as src:
+            src.seek(info.header_offset)
+            header = struct.unpack(zipfile.structFileHeader,
+                                   src.read(zipfile.sizeFileHeader))
+
+        # file name and extra field lengths
+        return (info.header_offset + zipfile.sizeFileHeader + header[10] +
+                header[11])
+
+    def read_path(self, member):
+        """
+        Return the cheapest path for windowed reads of a member, via
+        GDAL/rasterio.
+        Members stored without compression are read directly from
+        their location within the archive (via /vsisubfile/), and
+        don't require GDAL to index the archive. Compressed members,
+        and those not listed in the archive's index (such as
+        directories), are read via the archive (zip://).
+        """
+        member = member.lstrip('/')
+        with self._lock:
+            if member in self._read_paths:
+                return self._read_paths[member]
+
+        info = self._index.get(member)
+        if info is not None and info.compress_type == zipfile.ZIP_STORED:
+            path = '/vsisubfile/{}_{},{}'.format(self._data_offset(info),
+                                                info.file_size,
+                                                self.pathname)
+        else:
+            path = ''.join(['zip://', self.pathname, '!/', member])
+
+        with self._lock:
+            self._read_paths[member] = path
+
+        return path
+
+    def close(self):
+        """
+        Close the archive.
+        """
+        self._archive.close()
+
+
+def open_archive(pathname):
+    """
+    Return the `SafeArchive` of a zip archive, opening it if it isn't
+    already opened by the current process.
+
+    :param pathname:
+        A `str` containing the full file pathname of the archive.
+
+    :return:
+        An instance of a `SafeArchive`.
+    """
+    # archives opened by a parent process aren't shared
+    key = (os.path.abspath(pathname), os.getpid())
+
+    with _ARCHIVES_LOCK:
+        if key in _ARCHIVES:
+            _ARCHIVES.move_to_end(key)
+            return _ARCHIVES[key]
+
+        archive = SafeArchive(pathname)
+        _ARCHIVES[key] = archive
+        while len(_ARCHIVES) > ARCHIVE_CACHE_SIZE:
+            _, evicted = _ARCHIVES.popitem(last=False)
+            evicted.close()
+
+    return archive
+
+
+def close_archives():
+    """
+    Close every archive opened by the current process.
+    """
+    with _ARCHIVES_LOCK:
+        for (_, pid), archive in list(_ARCHIVES.items()):
+            if pid == os.getpid():
+                archive.close()
+        _ARCHIVES.clear()
@@ -2,8 +2,9 @@
 Defines the acquisition classes for the sentinel satellite program for wagl
 """
 
+from collections import OrderedDict
 from xml.etree import ElementTree
-import zipfile
+import threading
 import os
 
 from dateutil import parser
@@ -15,6 +16,157 @@ import pandas
 from scipy import interpolate
 
 from .base import Acquisition
+from .safe import open_archive
+
+# the number of granules whose solar zenith models are retained
+GRANULE_CACHE_SIZE = 4
+
+# the memory (bytes) available to each model for caching evaluated tiles
+SOLAR_ZENITH_CACHE_BYTES = 2**26
+
+_SOLAR_ZENITH_GRIDS = OrderedDict()
+_SOLAR_ZENITH_MODELS = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def _cached(cache, key, factory, maxsize=GRANULE_CACHE_SIZE):
+    """
+    Return the value of `key` from a least recently used `cache`,
+    calling `factory` to create it if need be.
+    """
+    with _CACHE_LOCK:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+    value = factory()
+
+    with _CACHE_LOCK:
+        cache[key] = value
+        while len(cache) > maxsize:
+            cache.popitem(last=False)
+
+    return value
+
+
+def read_solar_zenith_grid(xml_root):
+    """
+    Read the coarse (5km) solar zenith grid from a granule's
+    metadata.
+
+    :param xml_root:
+        The root `Element` of the granule's XML metadata.
+
+    :return:
+        A 2D `NumPy` array of the solar zenith angles in degrees.
+    """
+    search_term = './*/Tile_Angles/Sun_Angles_Grid/Zenith/Values_List'
+    values = xml_root.findall(search_term)[0]
+
+    dims = (len(values), len(values[0].text.split()))
+    data = numpy.zeros(dims, dtype='float32')
+    for i, val in enumerate(values.iter('VALUES')):
+        data[i] = val.text.split()
+
+    return data
+
+
+class SolarZenithModel(object):
+
+    """
+    Evaluates the solar zenith of a granule at the resolution of an
+    acquisition, on demand for a window, rather than across the
+    full dimensions. Recently evaluated windows are cached, so that
+    the bands sharing the model, and the dimensions, reuse them.
+
+    Code adapted from https://github.com/umwilm/SEN2COR.
+
+    :param grid:
+        The coarse solar zenith grid, as read by
+        `read_solar_zenith_grid`.
+
+    :param lines:
+        The number of lines (rows) of the acquisition.
+
+    :param samples:
+        The number of samples (columns) of the acquisition.
+
+    :param cache_bytes:
+        The maximum memory (bytes) used to cache evaluated windows.
+        Default is SOLAR_ZENITH_CACHE_BYTES.
+    """
+
+    def __init__(self, grid, lines, samples,
+                 cache_bytes=SOLAR_ZENITH_CACHE_BYTES):
+        # correct solar_zenith dimensions
+        if lines < samples:
+            last_row = int(grid[0].size * float(lines) / float(samples) + 0.5)
+            solar_zenith = grid[0:last_row, :]
+        elif samples < lines:
+            last_col = int(grid[1].size * float(samples) / float(lines) + 0.5)
+            solar_zenith = grid[:, 0:last_col]
+        else:
+            solar_zenith = grid
+
+        solar_zenith = numpy.clip(numpy.absolute(solar_zenith), 0, 70.0)
+
+        # the spline is defined with the original call signature
+        dims = solar_zenith.shape
+        y = numpy.arange(dims[0], dtype=numpy.float32)
+        x = numpy.arange(dims[1], dtype=numpy.float32)
+        self._spline = interpolate.RectBivariateSpline(x, y, solar_zenith)
+
+        # the grid co-ordinates of each line and sample
+        self._y = numpy.arange(lines) / (lines - 1) * dims[0]
+        self._x = numpy.arange(samples) / (samples - 1) * dims[1]
+
+        self.lines = lines
+        self.samples = samples
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    def _evaluate(self, ys, xs):
+        solar_zenith = numpy.float32(self._spline(self._y[ys], self._x[xs]))
+        return numpy.radians(solar_zenith, out=solar_zenith)
+
+    def __call__(self, window=None):
+        """
+        Return the solar zenith (radians) for a window.
+
+        :param window:
+            A tuple of ((ystart, ystop), (xstart, xstop)) indices.
+            Default is None, which evaluates the full dimensions
+            (and isn't cached).
+
+        :return:
+            A read-only 2D `NumPy` array of type float32.
+        """
+        if window is None:
+            return self._evaluate(slice(None), slice(None))
+
+        key = tuple(slice(*w).indices(n)[:2] for w, n in
+                    zip(window, (self.lines, self.samples)))
+
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        result = self._evaluate(slice(*key[0]), slice(*key[1]))
+        result.flags.writeable = False
+
+        with self._lock:
+            if result.nbytes <= self.cache_bytes and key not in self._cache:
+                self._cache[key] = result
+                self._cached_bytes += result.nbytes
+                while self._cached_bytes > self.cache_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cached_bytes -= evicted.nbytes
+
+        return result
+
 
 def find_all_in(path, s):
     """
@@ -56,16 +208,26 @@ class Sentinel2Acquisition(Acquisition):
                                                    band_id=band_id,
                                                    metadata=metadata)
 
+    def _read_path(self):
+        """
+        The path used to read the data; members of a SAFE archive
+        are read via the cheapest path the archive provides.
+        """
+        if self.uri.startswith('zip://') and '!/' in self.uri:
+            member = self.uri.split('!/', 1)[1]
+            return open_archive(self.pathname).read_path(member)
+        return self.uri
+
     def _get_gps_xml(self):
         """Returns in memory XML tree for gps coordinates"""
-        # open the zip archive and get the xml root
-        archive = zipfile.ZipFile(self.pathname)
-        xml_files = [s for s in archive.namelist() if
-                     ("DATASTRIP" in s) & (".xml" in s)]
+        # get the xml roots via the (cached) archive
+        archive = open_archive(self.pathname)
+        xml_files = archive.find("DATASTRIP", ".xml")
 
         # there could be several matches; loop till we find one with GPS data
+        gps_list = []
         for xml_file in xml_files:
-            xml_root = ElementTree.XML(archive.read(xml_file))
+            xml_root = archive.xml(xml_file)
 
             gps_list = xml_root.findall('./*/Ephemeris/GPS_Points_List')
             if gps_list:
@@ -116,9 +278,7 @@ class Sentinel2Acquisition(Acquisition):
 
     def _get_solar_zenith_xml(self):
         """Returns an in memory XML tree for the granule to retrieve solar zenith"""
-        archive = zipfile.ZipFile(self.pathname)
-        xml_root = ElementTree.XML(archive.read(self.granule_xml))
-        return xml_root
+        return open_archive(self.pathname).xml(self.granule_xml)
 
     def _retrieve_solar_zenith(self):
         """
@@ -127,52 +287,18 @@ class Sentinel2Acquisition(Acquisition):
         This is because the correct radiance measurement won't be
         guaranteed if a different value is used in the inversion.
 
-        Code adapted from https://github.com/umwilm/SEN2COR.
+        The coarse grid is read once per granule, and the model
+        evaluating it is shared by the acquisitions of a granule
+        having the same dimensions.
         """
-        def rbspline(y_coords, x_coords, zdata):
-            """
-            A wrapper providing the call signiture for RectBivariateSpline.
-            Code adapted from https://github.com/umwilm/SEN2COR.
-            """
-            y = numpy.arange(zdata.shape[0], dtype=numpy.float32)
-            x = numpy.arange(zdata.shape[1], dtype=numpy.float32)
-            func = interpolate.RectBivariateSpline(x, y, zdata)
-
-            return func(y_coords, x_coords)
-
-        xml_root = self._get_solar_zenith_xml()
+        granule = (self.pathname, self.granule_xml)
+        grid = _cached(_SOLAR_ZENITH_GRIDS, granule, lambda:
+                       read_solar_zenith_grid(self._get_solar_zenith_xml()))
 
-        # read the low res solar zenith data
-        search_term = './*/Tile_Angles/Sun_Angles_Grid/Zenith/Values_List'
-        values = xml_root.findall(search_term)[0]
-
-        dims = (len(values), len(values[0].text.split()))
-        data = numpy.zeros(dims, dtype='float32')
-        for i, val in enumerate(values.iter('VALUES')):
-            data[i] = val.text.split()
-
-        # correct solar_zenith dimensions
-        if self.lines < self.samples:
-            last_row = int(data[0].size * float(self.lines) /
-                           float(self.samples) + 0.5)
-            solar_zenith = data[0:last_row, :]
-        elif self.samples < self.lines:
-            last_col = int(data[1].size * float(self.samples) /
-                           float(self.lines) + 0.5)
-            solar_zenith = data[:, 0:last_col]
-        else:
-            solar_zenith = data
-
-        numpy.absolute(solar_zenith, out=solar_zenith)
-        numpy.clip(solar_zenith, 0, 70.0, out=solar_zenith)
-
-        # interpolate across the full dimensions of the acquisition
-        dims = solar_zenith.shape
-        y = numpy.arange(self.lines) / (self.lines - 1) * dims[0]
-        x = numpy.arange(self.samples) / (self.samples - 1) * dims[1]
-
-        solar_zenith = numpy.float32(rbspline(y, x, solar_zenith))
-        self._solar_zenith = numpy.radians(solar_zenith, out=solar_zenith)
+        key = granule + (self.lines, self.samples)
+        self._solar_zenith = _cached(_SOLAR_ZENITH_MODELS, key, lambda:
+                                     SolarZenithModel(grid, self.lines,
+                                                      self.samples))
 
     def radiance_data(self, window=None, out_no_data=-999):
         """
@@ -189,19 +315,12 @@ class Sentinel2Acquisition(Acquisition):
         if self._solar_zenith is None:
             self._retrieve_solar_zenith()
 
-        # Python style index
-        if window is None:
-            idx = (slice(None, None), slice(None, None))
-        else:
-            idx = (slice(window[0][0], window[0][1]),
-                   slice(window[1][0], window[1][1]))
-
         # coefficients
         # pylint: disable=unused-argument,unused-variable
         sf = numpy.float32(1 / (self.c1 * self.qv))
         pi_d2 = numpy.float32(numpy.pi * self.d2)
         esun = numpy.float32(self.solar_irradiance / 10)
-        solar_zenith = self._solar_zenith[idx]
+        solar_zenith = self._solar_zenith(window)
         rsf = numpy.float32(self.radiance_scale_factor)
 
         # toa reflectance
@@ -220,7 +339,7 @@ class Sentinel2Acquisition(Acquisition):
 
     def close(self):
         """
-        Set self._solar_zenith back to None to reclaim memory.
+        Release the reference to the (shared) solar zenith model.
         """
         self._solar_zenith = None
         super().close()
@@ -14,17 +14,13 @@ from posixpath import join as ppjoin
 import numpy
 import h5py
 import pandas
-from geopandas import GeoSeries
-import rasterio
-from shapely.geometry import Point
 from shapely.geometry import Polygon
 from shapely import wkt
 from wagl.brdf import get_brdf_data
-from wagl.data import get_pixel
 from wagl.hdf5 import attach_attributes, write_scalar, write_dataframe
 from wagl.hdf5 import read_h5_table, H5CompressionFilter
 from wagl.hdf5 import attach_table_attributes
-from wagl.metadata import extract_ancillary_metadata, read_metadata_tags
+from wagl.ancillary_access import get_pool
 from wagl.constants import DatasetName, POINT_FMT, GroupName, BandType
 from wagl.satellite_solar_angles import create_vertices
 
@@ -469,11 +465,21 @@ def _aggregate_ancillary(ancillary_fnames, write_access):
         fid.close()
 
 
-def aggregate_ancillary(granule_groups):
+def aggregate_ancillary(granule_groups, out_groups=None):
     """
     If the acquisition is part of a `tiled` scene such as Sentinel-2a,
     then we need to average the point measurements gathered from
     all granules.
+
+    :param granule_groups:
+        A `list` of the root HDF5 `Group` for each granule, each
+        containing the ancillary `Group`.
+
+    :param out_groups:
+        A `list` of writeable HDF5 `Group`s, one for each granule in
+        `granule_groups`, to write the averaged ancillary into.
+        Default is None, in which case the averages are written back
+        into `granule_groups`.
     """
     # initialise the mean result
     ozone = vapour = aerosol = elevation = 0.0
@@ -502,7 +508,10 @@ def aggregate_ancillary(granule_groups):
     # output each average value back into the same granule ancillary group
     group_name = ppjoin(GroupName.ANCILLARY_GROUP.value,
                         GroupName.ANCILLARY_AVG_GROUP.value)
-    for granule in granule_groups:
+    if out_groups is None:
+        out_groups = granule_groups
+
+    for granule in out_groups:
         # for the multifile workflow, we only want to write to one granule
         try:
             group = granule.create_group(group_name)
@@ -526,6 +535,136 @@ def aggregate_ancillary(granule_groups):
         attach_attributes(dset, attrs)
 
 
+def grid_cells(lon, lat, cell_size=1.0):
+    """
+    Determine the global grid cell id for each longitude and
+    latitude, whereby cells are numbered row-major from the
+    (-180, 90) corner.
+
+    :param lon:
+        A `NumPy` array of longitudes.
+
+    :param lat:
+        A `NumPy` array of latitudes.
+
+    :param cell_size:
+        The size of a grid cell in degrees. Default is 1.0.
+
+    :return:
+        A `NumPy` array of integer cell ids.
+    """
+    ncols = int(numpy.ceil(360 / cell_size))
+    nrows = int(numpy.ceil(180 / cell_size))
+    col = numpy.clip(numpy.floor((numpy.asarray(lon) + 180) / cell_size),
+                     0, ncols - 1).astype('int64')
+    row = numpy.clip(numpy.floor((90 - numpy.asarray(lat)) / cell_size),
+                     0, nrows - 1).astype('int64')
+
+    return row * ncols + col
+
+
+def points_in_polygon(x, y, polygon):
+    """
+    A vectorised test of whether points lie inside a `Polygon` or
+    `MultiPolygon`, using the even-odd (ray casting) rule across
+    the exterior and interior rings. Points are first filtered by
+    the bounding box of the polygon.
+
+    :param x:
+        A `NumPy` array of x co-ordinates.
+
+    :param y:
+        A `NumPy` array of y co-ordinates.
+
+    :param polygon:
+        A shapely `Polygon` or `MultiPolygon`.
+
+    :return:
+        A boolean `NumPy` array.
+    """
+    x = numpy.asarray(x, dtype='float64')
+    y = numpy.asarray(y, dtype='float64')
+
+    xmin, ymin, xmax, ymax = polygon.bounds
+    inside = numpy.zeros(x.shape, dtype='bool')
+    candidates = numpy.flatnonzero((x >= xmin) & (x <= xmax) &
+                                   (y >= ymin) & (y <= ymax))
+    cx = x[candidates]
+    cy = y[candidates]
+
+    polygons = getattr(polygon, 'geoms', [polygon])
+    rings = [ring for poly in polygons for ring in
+             [poly.exterior] + list(poly.interiors)]
+
+    crossings = numpy.zeros(cx.shape, dtype='bool')
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for ring in rings:
+            vertices = numpy.asarray(ring.coords)
+            for (xi, yi), (xj, yj) in zip(vertices[:-1], vertices[1:]):
+                straddle = (yi > cy) != (yj > cy)
+                xcross = (xj - xi) * (cy - yi) / (yj - yi) + xi
+                crossings ^= straddle & (cx < xcross)
+
+    inside[candidates] = crossings
+
+    return inside
+
+
+def read_aerosol_table(fid, pathname, bounds):
+    """
+    Read the rows of an aerosol `TABLE` that lie within `bounds`.
+    If the `TABLE` has a spatial index (as written by the
+    `aot_converter`), only the rows contained within the grid cells
+    intersecting `bounds` are read from disk.
+
+    :param fid:
+        A h5py `File` object of the aerosol HDF5 file.
+
+    :param pathname:
+        A `str` containing the pathname of the aerosol `TABLE`.
+
+    :param bounds:
+        A 4-tuple (lon_min, lat_min, lon_max, lat_max).
+
+    :return:
+        A `pandas.DataFrame`.
+    """
+    xmin, ymin, xmax, ymax = bounds
+    attrs = fid[pathname].attrs
+
+    if 'spatial_index' in attrs:
+        cell_size = attrs['spatial_index_cell_size']
+        ncols = int(numpy.ceil(360 / cell_size))
+        index = fid[attrs['spatial_index']][:]
+
+        ul_cell, lr_cell = grid_cells([xmin, xmax], [ymax, ymin], cell_size)
+        rows = numpy.arange(ul_cell // ncols, lr_cell // ncols + 1)
+        cols = numpy.arange(ul_cell % ncols, lr_cell % ncols + 1)
+        cells = (rows[:, numpy.newaxis] * ncols + cols).ravel()
+
+        selected = index[numpy.isin(index['cell_id'], cells)]
+
+        # merge contiguous row ranges to minimise the number of reads
+        ranges = []
+        for start, stop in zip(selected['start'], selected['stop']):
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], stop)
+            else:
+                ranges.append((start, stop))
+
+        df = read_h5_table(fid, pathname, rows=ranges)
+    else:
+        df = read_h5_table(fid, pathname)
+
+    lon = df['lon'].values
+    lat = df['lat'].values
+    wh = (lon >= xmin) & (lon <= xmax) & (lat >= ymin) & (lat <= ymax)
+    df = df[wh]
+    df.reset_index(inplace=True, drop=True)
+
+    return df
+
+
 def get_aerosol_data(acquisition, aerosol_dict):
     """
     Extract the aerosol value for an acquisition.
@@ -561,10 +700,12 @@ def get_aerosol_data(acquisition, aerosol_dict):
     data = None
     for pathname, description in zip(pathnames, descr):
         if pathname in fid:
-            df = read_h5_table(fid, pathname)
             aerosol_poly = wkt.loads(fid[pathname].attrs['extents'])
 
             if aerosol_poly.intersects(roi_poly):
+                intersection = aerosol_poly.intersection(roi_poly)
+                df = read_aerosol_table(fid, pathname, intersection.bounds)
+
                 if description == 'AATSR_PIX':
                     abs_diff = (df['timestamp'] - dt).abs()
                     df = df[abs_diff < delta_tolerance]
@@ -573,10 +714,8 @@ def get_aerosol_data(acquisition, aerosol_dict):
                 if df.shape[0] == 0:
                     continue
 
-                intersection = aerosol_poly.intersection(roi_poly)
-                pts = GeoSeries([Point(x, y) for x, y in
-                                 zip(df['lon'], df['lat'])])
-                idx = pts.within(intersection)
+                idx = points_in_polygon(df['lon'].values, df['lat'].values,
+                                        intersection)
                 data = df[idx]['aerosol'].mean()
 
                 if numpy.isfinite(data):
@@ -587,7 +726,7 @@ def get_aerosol_data(acquisition, aerosol_dict):
                                 'extents': wkt.dumps(intersection)}
 
                     # ancillary metadata tracking
-                    md = extract_ancillary_metadata(aerosol_fname)
+                    md = get_pool().metadata(aerosol_fname)
                     for key in md:
                         metadata[key] = md[key]
 
@@ -625,7 +764,8 @@ def get_elevation_data(lonlat, dem_path):
     url = urlparse(datafile, scheme='file').geturl()
 
     try:
-        data = get_pixel(datafile, lonlat) * 0.001  # scale to correct units
+        # scale to correct units
+        data = get_pool().get_pixel(datafile, lonlat) * 0.001
     except IndexError:
         raise AncillaryError("No Elevation data")
 
@@ -633,7 +773,7 @@ def get_elevation_data(lonlat, dem_path):
                 'url': url}
 
     # ancillary metadata tracking
-    md = extract_ancillary_metadata(datafile)
+    md = get_pool().metadata(datafile)
     for key in md:
         metadata[key] = md[key]
 
@@ -650,7 +790,7 @@ def get_ozone_data(ozone_path, lonlat, time):
     url = urlparse(datafile, scheme='file').geturl()
 
     try:
-        data = get_pixel(datafile, lonlat)
+        data = get_pool().get_pixel(datafile, lonlat)
     except IndexError:
         raise AncillaryError("No Ozone data")
 
@@ -659,7 +799,7 @@ def get_ozone_data(ozone_path, lonlat, time):
                 'query_date': time}
 
     # ancillary metadata tracking
-    md = extract_ancillary_metadata(datafile)
+    md = get_pool().metadata(datafile)
     for key in md:
         metadata[key] = md[key]
 
@@ -697,8 +837,7 @@ def get_water_vapour(acquisition, water_vapour_dict, scale_factor=0.1):
         band = 1
 
     # Get the number of bands
-    with rasterio.open(datafile) as src:
-        n_bands = src.count
+    n_bands = get_pool().count(datafile)
 
     # Enable NBAR Near Real Time (NRT) processing
     if band > (n_bands + 1):
@@ -707,7 +846,7 @@ def get_water_vapour(acquisition, water_vapour_dict, scale_factor=0.1):
             band = (int(rasterdoy) - 1) * 4 + int((hour + 3) / 6)
 
     try:
-        data = get_pixel(datafile, geobox.centre_lonlat, band=band)
+        data = get_pool().get_pixel(datafile, geobox.centre_lonlat, band=band)
     except IndexError:
         raise AncillaryError("No Water Vapour data")
 
@@ -718,7 +857,7 @@ def get_water_vapour(acquisition, water_vapour_dict, scale_factor=0.1):
                 'query_date': dt}
 
     # ancillary metadata tracking
-    md = extract_ancillary_metadata(datafile)
+    md = get_pool().metadata(datafile)
     for key in md:
         metadata[key] = md[key]
 
@@ -733,7 +872,8 @@ def ecwmf_elevation(datafile, lonlat):
     2 metres is added to the result before returning.
     """
     try:
-        data = get_pixel(datafile, lonlat) / 9.80665 / 1000.0 + 0.002
+        data = get_pool().get_pixel(datafile, lonlat)
+        data = data / 9.80665 / 1000.0 + 0.002
     except IndexError:
         raise AncillaryError("No Invariant Geo-Potential data")
 
@@ -743,7 +883,7 @@ def ecwmf_elevation(datafile, lonlat):
                 'url': url}
 
     # ancillary metadata tracking
-    md = extract_ancillary_metadata(datafile)
+    md = get_pool().metadata(datafile)
     for key in md:
         metadata[key] = md[key]
 
@@ -765,14 +905,14 @@ def ecwmf_temperature_2metre(input_path, lonlat, time):
         ymd = splitext(basename(f))[0].split('_')[1]
         ancillary_ymd = datetime.datetime.strptime(ymd, '%Y-%m-%d')
         if ancillary_ymd == required_ymd:
-            data = get_pixel(f, lonlat)
+            data = get_pool().get_pixel(f, lonlat)
 
             metadata = {'data_source': 'ECWMF 2 metre Temperature',
                         'url': url,
                         'query_date': time}
 
             # ancillary metadata tracking
-            md = extract_ancillary_metadata(f)
+            md = get_pool().metadata(f)
             for key in md:
                 metadata[key] = md[key]
 
@@ -797,14 +937,14 @@ def ecwmf_dewpoint_temperature(input_path, lonlat, time):
         ymd = splitext(basename(f))[0].split('_')[1]
         ancillary_ymd = datetime.datetime.strptime(ymd, '%Y-%m-%d')
         if ancillary_ymd == required_ymd:
-            data = get_pixel(f, lonlat)
+            data = get_pool().get_pixel(f, lonlat)
 
             metadata = {'data_source': 'ECWMF 2 metre Dewpoint Temperature ',
                         'url': url,
                         'query_date': time}
 
             # ancillary metadata tracking
-            md = extract_ancillary_metadata(f)
+            md = get_pool().metadata(f)
             for key in md:
                 metadata[key] = md[key]
 
@@ -830,14 +970,14 @@ def ecwmf_surface_pressure(input_path, lonlat, time):
         ymd = splitext(basename(f))[0].split('_')[1]
         ancillary_ymd = datetime.datetime.strptime(ymd, '%Y-%m-%d')
         if ancillary_ymd == required_ymd:
-            data = get_pixel(f, lonlat) / 100.0
+            data = get_pool().get_pixel(f, lonlat) / 100.0
 
             metadata = {'data_source': 'ECWMF Surface Pressure',
                         'url': url,
                         'query_date': time}
 
             # ancillary metadata tracking
-            md = extract_ancillary_metadata(f)
+            md = get_pool().metadata(f)
             for key in md:
                 metadata[key] = md[key]
 
@@ -862,14 +1002,14 @@ def ecwmf_water_vapour(input_path, lonlat, time):
         ymd = splitext(basename(f))[0].split('_')[1]
         ancillary_ymd = datetime.datetime.strptime(ymd, '%Y-%m-%d')
         if ancillary_ymd == required_ymd:
-            data = get_pixel(f, lonlat)
+            data = get_pool().get_pixel(f, lonlat)
 
             metadata = {'data_source': 'ECWMF Total Column Water Vapour',
                         'url': url,
                         'query_date': time}
 
             # ancillary metadata tracking
-            md = extract_ancillary_metadata(f)
+            md = get_pool().metadata(f)
             for key in md:
                 metadata[key] = md[key]
 
@@ -899,19 +1039,19 @@ def ecwmf_temperature(input_path, lonlat, time):
         ancillary_ymd = datetime.datetime.strptime(ymd, '%Y-%m-%d')
         if ancillary_ymd == required_ymd:
             bands = list(range(1, 38))
-            data = get_pixel(f, lonlat, bands)[::-1]
+            data = get_pool().get_pixel(f, lonlat, bands)[::-1]
 
             metadata = {'data_source': 'ECWMF Temperature',
                         'url': url,
                         'query_date': time}
 
             # ancillary metadata tracking
-            md = extract_ancillary_metadata(f)
+            md = get_pool().metadata(f)
             for key in md:
                 metadata[key] = md[key]
 
             # internal file metadata (and reverse the ordering)
-            df = read_metadata_tags(f, bands).iloc[::-1]
+            df = get_pool().tags(f, bands).iloc[::-1]
             df.insert(0, 'Temperature', data)
 
             return df, metadata
@@ -941,7 +1081,7 @@ def ecwmf_geo_potential(input_path, lonlat, time):
         ancillary_ymd = datetime.datetime.strptime(ymd, '%Y-%m-%d')
         if ancillary_ymd == required_ymd:
             bands = list(range(1, 38))
-            data = get_pixel(f, lonlat, bands)[::-1]
+            data = get_pool().get_pixel(f, lonlat, bands)[::-1]
             scaled_data = data / 9.80665 / 1000.0
 
             metadata = {'data_source': 'ECWMF Geo-Potential',
@@ -949,12 +1089,12 @@ def ecwmf_geo_potential(input_path, lonlat, time):
                         'query_date': time}
 
             # ancillary metadata tracking
-            md = extract_ancillary_metadata(f)
+            md = get_pool().metadata(f)
             for key in md:
                 metadata[key] = md[key]
 
             # internal file metadata (and reverse the ordering)
-            df = read_metadata_tags(f, bands).iloc[::-1]
+            df = get_pool().tags(f, bands).iloc[::-1]
             df.insert(0, 'GeoPotential', data)
             df.insert(1, 'GeoPotential_Height', scaled_data)
 
@@ -984,19 +1124,19 @@ def ecwmf_relative_humidity(input_path, lonlat, time):
         ancillary_ymd = datetime.datetime.strptime(ymd, '%Y-%m-%d')
         if ancillary_ymd == required_ymd:
             bands = list(range(1, 38))
-            data = get_pixel(f, lonlat, bands)[::-1]
+            data = get_pool().get_pixel(f, lonlat, bands)[::-1]
 
             metadata = {'data_source': 'ECWMF Relative Humidity',
                         'url': url,
                         'query_date': time}
 
             # file level metadata
-            md = extract_ancillary_metadata(f)
+            md = get_pool().metadata(f)
             for key in md:
                 metadata[key] = md[key]
 
             # internal file metadata (and reverse the ordering)
-            df = read_metadata_tags(f, bands).iloc[::-1]
+            df = get_pool().tags(f, bands).iloc[::-1]
             df.insert(0, 'Relative_Humidity', data)
 
             return df, metadata
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+"""
+Pooled access to the ancillary rasters
+--------------------------------------
+
+A batch of scenes queries the same small collection of ancillary
+rasters (ozone, elevation, water vapour, ECWMF) over and over again.
+The `AncillaryPool` keeps a bounded number of those rasters open,
+and memoises the pixel values, band counts and file metadata that
+have already been retrieved, so that each scene processed by a
+worker process only pays for the queries not yet seen by that
+process.
+
+The opened rasters and memoised values are keyed on the version of
+each file (its modification time and size), so that a file updated in
+place (such as a near real time water vapour file that is appended to)
+is reopened, and its previous values discarded, by a long lived
+worker.
+"""
+
+from __future__ import absolute_import
+from collections import OrderedDict
+import copy
+import os
+import threading
+
+import rasterio
+
+from wagl.metadata import extract_ancillary_metadata, read_metadata_tags
+
+
+class AncillaryPool(object):
+
+    """
+    An LRU bounded pool of opened ancillary rasters, along with
+    a memo of the pixel values, band counts and file metadata
+    retrieved from them. A raster that has changed on disk is
+    reopened, and its memoised values discarded.
+
+    :param max_open:
+        The maximum number of rasters to keep open at any one time.
+        The least recently used raster is closed once the limit
+        is exceeded. Default is 16.
+
+    :param max_pixels:
+        The maximum number of (file, pixel, band) values to memoise.
+        Default is 65536.
+    """
+
+    def __init__(self, max_open=16, max_pixels=65536):
+        self.max_open = max_open
+        self.max_pixels = max_pixels
+        self._datasets = OrderedDict()
+        self._pixels = OrderedDict()
+        self._info = {}
+        self._metadata = {}
+        self._tags = {}
+        self._versions = {}
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _version(self, fname):
+        """
+        Return the (fname, st_mtime_ns, st_size) key of the current
+        version of `fname`, discarding the raster and values of any
+        previous version.
+        The caller is expected to hold the lock.
+        """
+        try:
+            stat = os.stat(fname)
+            version = (fname, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            # left for rasterio to report
+            version = (fname, None, None)
+
+        previous = self._versions.get(fname)
+        if previous is not None and previous != version:
+            self._discard(previous)
+        self._versions[fname] = version
+
+        return version
+
+    def _discard(self, version):
+        """
+        Close the raster, and discard the values, of a version.
+        The caller is expected to hold the lock.
+        """
+        ds = self._datasets.pop(version, None)
+        if ds is not None:
+            ds.close()
+        self._info.pop(version, None)
+        self._metadata.pop(version, None)
+        for memo in (self._pixels, self._tags):
+            for key in [k for k in memo if k[0] == version]:
+                del memo[key]
+
+    def _open(self, version):
+        """
+        Return the opened raster for a version, opening it (and
+        closing the least recently used raster) if required.
+        The caller is expected to hold the lock.
+        """
+        ds = self._datasets.pop(version, None)
+        if ds is None:
+            ds = rasterio.open(version[0])
+            self._info[version] = (~ds.transform, ds.count)
+            while len(self._datasets) >= self.max_open:
+                _, lru = self._datasets.popitem(last=False)
+                lru.close()
+
+        self._datasets[version] = ds
+        return ds
+
+    def _raster_info(self, version):
+        """
+        Return the inverse transform and band count for a version.
+        The caller is expected to hold the lock.
+        """
+        info = self._info.get(version)
+        if info is None:
+            self._open(version)
+            info = self._info[version]
+        return info
+
+    def count(self, fname):
+        """
+        Return the number of bands contained within `fname`.
+        """
+        with self._lock:
+            return self._raster_info(self._version(fname))[1]
+
+    def get_pixel(self, fname, lonlat, band=1):
+        """
+        Return a pixel from `fname` at the longitude and latitude given
+        by the tuple `lonlat`. Optionally, the `band` can be specified,
+        either as a single band number or a `list` of band numbers.
+        Behaves as `wagl.data.get_pixel`, but repeated queries for the
+        same (file, pixel, band) are served from memory.
+        """
+        with self._lock:
+            version = self._version(fname)
+            inv_transform, _ = self._raster_info(version)
+            x, y = [int(v) for v in inv_transform * lonlat]
+
+            bands = tuple(band) if isinstance(band, list) else band
+            key = (version, x, y, bands)
+            data = self._pixels.pop(key, None)
+
+            if data is None:
+                ds = self._open(version)
+                data = ds.read(band, window=((y, y + 1), (x, x + 1)))
+                if isinstance(band, list):
+                    data = data.ravel()
+                    data.flags.writeable = False
+                else:
+                    data = data.flat[0]
+
+                while len(self._pixels) >= self.max_pixels:
+                    self._pixels.popitem(last=False)
+
+            self._pixels[key] = data
+
+        # don't hand out the memoised array
+        if isinstance(band, list):
+            return data.copy()
+
+        return data
+
+    def metadata(self, fname):
+        """
+        Return the ancillary metadata for `fname` as given by
+        `wagl.metadata.extract_ancillary_metadata`.
+        The file is only queried the first time each version of it
+        is seen.
+        """
+        with self._lock:
+            version = self._version(fname)
+            md = self._metadata.get(version)
+            if md is None:
+                md = extract_ancillary_metadata(fname)
+                self._metadata[version] = md
+
+        return copy.deepcopy(md)
+
+    def tags(self, fname, bands):
+        """
+        Return the metadata tags for a list of `bands` contained
+        within `fname` as given by `wagl.metadata.read_metadata_tags`.
+        """
+        with self._lock:
+            key = (self._version(fname), tuple(bands))
+            df = self._tags.get(key)
+            if df is None:
+                df = read_metadata_tags(fname, bands)
+                self._tags[key] = df
+
+        return df.copy()
+
+    def close(self):
+        """
+        Close all opened rasters and clear the memoised values.
+        """
+        with self._lock:
+            while self._datasets:
+                _, ds = self._datasets.popitem()
+                ds.close()
+            self._pixels.clear()
+            self._info.clear()
+            self._metadata.clear()
+            self._tags.clear()
+            self._versions.clear()
+
+
+# the pool shared by every scene processed within this process
+_POOL = None
+_POOL_PID = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the `AncillaryPool` shared across all scenes processed
+    within the current process.
+    A forked child process never reuses the open file handles of
+    its parent, and will create its own pool.
+    """
+    global _POOL, _POOL_PID
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_PID != os.getpid():
+            _POOL = AncillaryPool()
+            _POOL_PID = os.getpid()
+        return _POOL
+
+
+def reset_pool():
+    """
+    Close and discard the `AncillaryPool` shared within the current
+    process, for example to release its opened rasters.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None and _POOL_PID == os.getpid():
+            _POOL.close()
+        _POOL = None
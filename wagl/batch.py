@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""
+Multi-scene batch processing
+----------------------------
+
+Processes a list of level-1 datasets within a single long-lived
+process, rather than a cold process per scene.
+The scene-independent state, such as the sensor definitions, TLE
+archives, BRDF directory listings and the pooled ancillary rasters,
+is loaded once and shared by every scene.
+
+Scenes are run concurrently, so that the geometry and ancillary
+retrieval of the next scene overlaps the radiative transfer and
+reflectance of the current scene. The number of scenes in flight is
+bounded by both a worker limit, and an (estimated) memory budget.
+"""
+
+from __future__ import absolute_import
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import traceback
+
+from wagl.acquisition import acquisitions
+from wagl.standardise import card4l
+from wagl.logging import ERROR_LOGGER, STATUS_LOGGER
+
+# a rough estimate of the peak number of bytes held in memory per pixel
+# of a resolution group, while a scene is in flight
+BYTES_PER_PIXEL = 64
+
+
+class MemoryBudget(object):
+
+    """
+    A counting semaphore measured in bytes.
+    A request larger than the entire budget is admitted once
+    nothing else is in flight, so that an oversized scene can't
+    stall the batch.
+
+    :param budget:
+        The number of bytes available. None for an unlimited budget.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.in_use = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes):
+        """
+        Block until `nbytes` can be admitted within the budget.
+        """
+        with self._condition:
+            if self.budget is not None:
+                while (self.in_use > 0 and
+                       self.in_use + nbytes > self.budget):
+                    self._condition.wait()
+            self.in_use += nbytes
+
+    def release(self, nbytes):
+        """
+        Return `nbytes` to the budget.
+        """
+        with self._condition:
+            self.in_use -= nbytes
+            self._condition.notify_all()
+
+
+def scene_footprint(container, granule=None,
+                    bytes_per_pixel=BYTES_PER_PIXEL):
+    """
+    Estimate the peak memory footprint (in bytes) of processing a
+    single granule of an `AcquisitionsContainer`.
+
+    :param container:
+        An instance of an `AcquisitionsContainer`.
+
+    :param granule:
+        The granule id to estimate, or a `list` of granule ids to be
+        processed together. Default is None.
+
+    :param bytes_per_pixel:
+        The estimated peak number of bytes held per pixel for each
+        resolution group.
+        Default is wagl.batch.BYTES_PER_PIXEL.
+
+    :return:
+        An integer containing the estimated number of bytes.
+    """
+    if isinstance(granule, (list, tuple)):
+        granules = granule
+    else:
+        granules = [granule]
+
+    nbytes = 0
+    for grn in granules:
+        for group in container.supported_groups:
+            acq = container.get_acquisitions(granule=grn, group=group)[0]
+            nbytes += acq.lines * acq.samples * bytes_per_pixel
+
+    return nbytes
+
+
+def _run_scene(scene, card4l_kwargs, budget, nbytes):
+    """
+    Process a single (level1, granule, out_fname) scene, writing to
+    a temporary file that is only renamed once the scene completes.
+    """
+    level1, granule, out_fname = scene
+    tmp_fname = '{}.{}.tmp'.format(out_fname, os.getpid())
+    try:
+        card4l(level1, granule, out_fname=tmp_fname, **card4l_kwargs)
+        os.rename(tmp_fname, out_fname)
+    except Exception:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+        raise
+    finally:
+        budget.release(nbytes)
+
+    return out_fname
+
+
+def run_batch(scenes, card4l_kwargs, workers=2, memory_budget=None,
+              bytes_per_pixel=BYTES_PER_PIXEL):
+    """
+    Run `wagl.standardise.card4l` for a list of scenes within the
+    current process.
+
+    :param scenes:
+        A `list` of (level1, granule, out_fname) tuples. Scenes are
+        admitted in the given order. The granule can also be a `list`
+        of granule ids to process together (see `card4l`).
+
+    :param card4l_kwargs:
+        A `dict` containing the remaining keyword arguments for
+        `wagl.standardise.card4l` that are common to every scene.
+
+    :param workers:
+        The maximum number of scenes to have in flight at once.
+        Default is 2.
+
+    :param memory_budget:
+        The maximum number of bytes (as estimated by `scene_footprint`)
+        allowed to be in flight at once. Default is None (unlimited).
+
+    :param bytes_per_pixel:
+        Passed through to `scene_footprint`.
+
+    :return:
+        A `dict` keyed by out_fname, containing None for each
+        successfully processed scene, or the raised exception.
+    """
+    budget = MemoryBudget(memory_budget)
+    futures = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for scene in scenes:
+            level1, granule, out_fname = scene
+            hint = card4l_kwargs.get('acq_parser_hint')
+            try:
+                container = acquisitions(level1, hint=hint)
+                nbytes = scene_footprint(container, granule or None,
+                                         bytes_per_pixel)
+            except Exception as exc:
+                futures[out_fname] = exc
+                tb = traceback.format_exc().splitlines()
+                ERROR_LOGGER.error('Batch-Admit', level1=level1,
+                                   granule=granule, exception=exc.__str__(),
+                                   traceback=tb)
+                continue
+
+            # admission in the order given; blocks until there is room
+            budget.acquire(nbytes)
+            STATUS_LOGGER.info('Batch-Admit', level1=level1,
+                               granule=granule, footprint=nbytes,
+                               in_flight=budget.in_use)
+            futures[out_fname] = executor.submit(_run_scene, scene,
+                                                 card4l_kwargs, budget,
+                                                 nbytes)
+
+    results = {}
+    for out_fname, future in futures.items():
+        if isinstance(future, Exception):
+            results[out_fname] = future
+            continue
+
+        exc = future.exception()
+        results[out_fname] = exc
+        if exc is not None:
+            tb = traceback.format_exception(type(exc), exc,
+                                            exc.__traceback__)
+            ERROR_LOGGER.error('Batch-Scene', out_fname=out_fname,
+                               exception=exc.__str__(),
+                               traceback=''.join(tb).splitlines())
+
+    return results
@@ -23,6 +23,7 @@ estimates is required.
 from __future__ import absolute_import, print_function
 import subprocess
 import datetime
+from functools import lru_cache
 import logging
 import math
 import os
@@ -344,6 +345,56 @@ class BRDFLoader(object):
         return xbar
 
 
+@lru_cache(maxsize=64)
+def _cached_listing(pathname, mtime):
+    """
+    Return, and memoise, the sorted listing of a directory with the
+    given modification time.
+    """
+    return tuple(sorted(os.listdir(pathname)))
+
+
+def _list_directory(pathname):
+    """
+    Return the sorted listing of a BRDF directory, memoised for as
+    long as the directory is unchanged. The BRDF collection is rarely
+    updated, and is otherwise relisted for every band of every scene.
+    """
+    return _cached_listing(pathname, os.stat(pathname).st_mtime_ns)
+
+
+@lru_cache(maxsize=64)
+def _cached_hdf_files(pathname, mtime):
+    """
+    Return, and memoise, the directory containing the BRDF HDF files
+    found beneath `pathname` (with the given modification time),
+    along with the HDF filenames.
+    """
+    hdflist = []
+    hdfhome = None
+    for (hdfhome, _, filelist) in os.walk(pathname):
+        for f in filelist:
+            if f.endswith(".hdf.gz") or f.endswith(".hdf"):
+                hdflist.append(f)
+
+    return hdfhome, tuple(hdflist)
+
+
+def _hdf_files(pathname):
+    """
+    Return the directory containing the BRDF HDF files found beneath
+    `pathname`, along with the HDF filenames, memoised for as long as
+    the modification time of `pathname` is unchanged.
+    """
+    try:
+        mtime = os.stat(pathname).st_mtime_ns
+    except OSError:
+        # as per os.walk, a missing directory contains no files
+        return None, ()
+
+    return _cached_hdf_files(pathname, mtime)
+
+
 def _date_proximity(cmp_date, date_interpreter=lambda x: x):
     """_date_proximity providers a comparator for an interable
     with an interpreter function. Used to find the closest item
@@ -397,7 +448,7 @@ def get_brdf_dirs_modis(brdf_root, scene_date, pattern='%Y.%m.%d'):
     _offset_scene_date = scene_date - offset
 
     dirs = []
-    for dname in sorted(os.listdir(brdf_root)):
+    for dname in _list_directory(brdf_root):
         try:
             dirs.append(datetime.datetime.strptime(dname, pattern).date())
         except ValueError:
@@ -440,7 +491,7 @@ def get_brdf_dirs_pre_modis(brdf_root, scene_date):
     dir_dates = []
 
     # Standardise names be prepended with leading zeros
-    for doy in sorted(os.listdir(brdf_root), key=lambda x: x.zfill(3)):
+    for doy in sorted(_list_directory(brdf_root), key=lambda x: x.zfill(3)):
         dir_dates.append((str(_offset_scene_date.year), doy))
 
     # Add boundary entry for previous year
@@ -520,7 +571,7 @@ def get_brdf_data(acquisition, brdf_primary_path, brdf_secondary_path,
     # BRDF data root directory.
     # Scene dates outside the range of the CSIRO mosaic data
     # should use the pre-MODIS, Jupp-Li BRDF.
-    brdf_dir_list = sorted(os.listdir(brdf_primary_path))
+    brdf_dir_list = _list_directory(brdf_primary_path)
 
     try:
         brdf_dir_range = [brdf_dir_list[0], brdf_dir_list[-1]]
@@ -541,14 +592,7 @@ def get_brdf_data(acquisition, brdf_primary_path, brdf_secondary_path,
     # The following hdflist code was resurrected from the old SVN repo. JS
     # get all HDF files in the input dir
     dbDir = pjoin(brdf_base_dir, brdf_dirs)
-    three_tup = os.walk(dbDir)
-    hdflist = []
-    hdfhome = None
-
-    for (hdfhome, _, filelist) in three_tup:
-        for f in filelist:
-            if f.endswith(".hdf.gz") or f.endswith(".hdf"):
-                hdflist.append(f)
+    hdfhome, hdflist = _hdf_files(dbDir)
 
     results = {}
     for param in BrdfParameters:
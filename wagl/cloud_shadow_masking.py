@@ -10,9 +10,251 @@ import gc
 import numpy as np
 import numexpr
 
-from scipy import ndimage
 from idl_functions import histogram
-from wagl.acca_cloud_masking import majority_filter
+from wagl.morphology import majority_filter, square_dilation
+from wagl.regions import grow_regions
+
+
+# the maximum number of cloud pixels projected at a time
+PROJECTION_CHUNK = 2 ** 18
+
+
+def _origin_map(geoTransform, cindex):
+    """
+    Converts the origin pixel co-ordinates to map units.
+
+    :param geoTransform:
+        Image co-ordinate information (upper left coords, offset and pixel
+        sizes).
+
+    :param cindex:
+        The indices of the cloud locations.
+
+    :return:
+        The coordinates of every cloud pixel as a map units, in two Lists
+        for the x and y positions.
+    """
+
+    omapx = numexpr.evaluate("a*b + c",
+                             {'a': cindex[1],
+                              'b': np.float32(geoTransform[1]),
+                              'c': np.float32(geoTransform[0])})
+
+    omapy = numexpr.evaluate("a - (b*abs(c))",
+                             {'a': np.float32(geoTransform[3]),
+                              'b': cindex[0],
+                              'c': np.float32(geoTransform[5])})
+    return omapx, omapy
+
+
+def _cloud_height(ctherm, surface_temp, lapse_rate):
+    """
+    Determines the height of the cloud.
+
+    Uses a standard environmental lapse rate, the surface temperature,
+    and the temperature of the clouds.
+
+    :param ctherm:
+        The temperature of the cloud pixels.
+
+    :param surface_temp:
+        The surface temperature.
+
+    :param lapse_rate:
+        The environmental lapse rate(s); broadcast against `ctherm`.
+
+    :return:
+        An array of cloud heights.
+    """
+
+    result = numexpr.evaluate("((surface_temp - ctherm)/lapse_rate)*thou",
+                              {'thou': np.float32(1000)}, locals())
+    return result
+
+
+def _shadow_length(cheight, rad_elev):
+    """
+    Determines the length of the shadow cast by the cloud.
+
+    :param cheight:
+        The height of the cloud.
+
+    :param rad_elev:
+        The sun elevation angle in radians.
+
+    :return:
+        An array of shadow lengths.
+    """
+
+    return cheight / np.tan(rad_elev)
+
+
+def _rect_xy(shad_length, rad_cor_az):
+    """
+    Retrieve the x and y distances of projected shadow.
+
+    The distances are in metres from the originating cloud pixel.
+
+    :param shad_length:
+        The length of the shadow in metres.
+
+    :param rad_cor_az:
+        The corrected azimuth angle in radians.
+
+    :return:
+        Two float32 arrays containing the x and y distances from the
+        originating cloud pixel.
+    """
+    # the direction cosines are evaluated once, not per pixel
+    rectx = numexpr.evaluate("shad_length * c",
+                             {'c': np.cos(rad_cor_az)}, locals())
+    recty = numexpr.evaluate("shad_length * s",
+                             {'s': np.sin(rad_cor_az)}, locals())
+
+    return rectx.astype('float32'), recty.astype('float32')
+
+
+def _map2img(new_mapx, new_mapy, geoTransform, dims):
+    """
+    Converts the x and y map locations in image co-ordinates.
+
+    :param new_mapx:
+        The x projected shadow location.
+
+    :param new_mapy:
+        The y projected shadow location.
+
+    :param geoTransform:
+        The Image co-ordinate information (upper left coords, offset
+        and pixel sizes)
+
+    :param dims:
+        The (lines, samples) of the image.
+
+    :return:
+        A tuple (index, valid); the flat (int64) image index of each
+        location, and whether the location is within the image.
+    """
+
+    dct = {'a': np.float32(geoTransform[0]),
+           'b': np.float32(geoTransform[1])}
+
+    imgx = np.round(numexpr.evaluate("(new_mapx - a)/b",
+                                     dct, locals())).astype('int32')
+
+    dct = {'a': np.float32(geoTransform[3]),
+           'b': np.float32(abs(geoTransform[5]))}
+    imgy = np.round(numexpr.evaluate("(a - new_mapy)/b",
+                                     dct, locals())).astype('int32')
+
+    valid = numexpr.evaluate("(imgx>=0) & (imgy>=0) &"
+                             "(imgx<d1) & (imgy<d0)",
+                             {'d1': dims[1], 'd0': dims[0]}, locals())
+
+    index = imgy.astype('int64')
+    index *= dims[1]
+    index += imgx
+
+    return index, valid
+
+
+def project_shadows(cloud, kelvin_array, surface_temp, lapse_rates,
+                    geoTransform, rad_elev, rad_cor_az, semi_major=None,
+                    chunk=PROJECTION_CHUNK):
+    """
+    Projects every cloud pixel, for every lapse rate, to the location
+    of its shadow.
+
+    The projections of each lapse rate are evaluated together, over
+    chunks of the cloud pixels, and scattered directly into the
+    shadow masks via their flat image index.
+
+    :param cloud:
+        A 2D bool Numpy array, True for cloud.
+
+    :param kelvin_array:
+        A 2D Numpy array containing temperature in degrees Kelvin.
+
+    :param surface_temp:
+        The surface temperature.
+
+    :param lapse_rates:
+        A 1D float32 Numpy array of the environmental lapse rates.
+
+    :param geoTransform:
+        The Image co-ordinate information (upper left coords, offset
+        and pixel sizes)
+
+    :param rad_elev:
+        The sun elevation angle in radians.
+
+    :param rad_cor_az:
+        The corrected azimuth angle in radians.
+
+    :param semi_major:
+        The semi-major axis of the ellipsoid of a geographic
+        co-ordinate system. Default is None; a projected co-ordinate
+        system.
+
+    :param chunk:
+        The maximum number of cloud pixels projected at a time.
+
+    :return:
+        A tuple of 2D bool Numpy arrays (shadow, last); the locations
+        of the shadow for any lapse rate, and for the last lapse rate.
+    """
+    dims = cloud.shape
+    shadow = np.zeros(dims, dtype='bool')
+    last = np.zeros(dims, dtype='bool')
+
+    lapse_rate = np.asarray(lapse_rates, dtype='float32').reshape(-1, 1)
+    lines = max(1, chunk // dims[1])
+    for ystart in range(0, dims[0], lines):
+        cindex = np.nonzero(cloud[ystart:ystart + lines])
+        if cindex[0].size == 0:
+            continue
+
+        ctherm = kelvin_array[ystart:ystart + lines][cindex]
+        cindex = (cindex[0] + ystart, cindex[1])
+
+        cheight = _cloud_height(ctherm, surface_temp, lapse_rate)
+        shad_length = _shadow_length(cheight, rad_elev)
+        del cheight
+
+        if semi_major is None:
+            omapx, omapy = _origin_map(geoTransform, cindex)
+            rectx, recty = _rect_xy(shad_length, rad_cor_az)
+            new_mapx = numexpr.evaluate("omapx + rectx")
+            new_mapy = numexpr.evaluate("omapy + recty")
+            del rectx, recty
+        else:
+            R = semi_major
+            d = shad_length
+
+            rlon, rlat = _origin_map(geoTransform, cindex)
+            rlon = np.radians(rlon)
+            rlat = np.radians(rlat)
+
+            rlat2 = np.arcsin(np.sin(rlat) * np.cos(d / R) +
+                              np.cos(rlat) * np.sin(d / R) *
+                              np.cos(rad_cor_az))
+
+            rlon2 = rlon + np.arctan2(np.sin(rad_cor_az) * np.sin(d / R)
+                                      * np.cos(rlat), np.cos(d / R) -
+                                      np.sin(rlat) * np.sin(rlat))
+
+            new_mapy = np.rad2deg(rlat2)
+            new_mapx = np.rad2deg(rlon2)
+            del rlat2, rlon2
+        del shad_length
+
+        index, valid = _map2img(new_mapx, new_mapy, geoTransform, dims)
+        del new_mapx, new_mapy
+
+        shadow.ravel()[index[valid]] = True
+        last.ravel()[index[-1][valid[-1]]] = True
+
+    return shadow, last
 
 
 def cloud_shadow(blue_dataset, green_dataset, red_dataset, nir_dataset,
@@ -137,156 +379,6 @@ def cloud_shadow(blue_dataset, green_dataset, red_dataset, nir_dataset,
     slope_b47b = pq_const.cshadow_slope_b47b
     stdv_mltp = pq_const.cshadow_stdv_multiplier
 
-    def origin_map(geoTransform, cindex):
-        """
-        Converts the origin pixel co-ordinates to map units.
-
-        :param geoTransform:
-            Image co-ordinate information (upper left coords, offset and pixel
-            sizes).
-
-        :param cindex:
-            The indices of the cloud locations.
-
-        :return:
-            The coordinates of every cloud pixel as a map units, in two Lists
-            for the x and y positions.
-        """
-
-        omapx = numexpr.evaluate("a*b + c",
-                                 {'a': cindex[1],
-                                  'b': np.float32(geoTransform[1]),
-                                  'c': np.float32(geoTransform[0])})
-
-        omapy = numexpr.evaluate("a - (b*abs(c))",
-                                 {'a': np.float32(geoTransform[3]),
-                                  'b': cindex[0],
-                                  'c': np.float32(geoTransform[5])})
-        return omapx, omapy
-
-    def cloud_height(ctherm, surface_temp, lapse_rate=np.float32(6.4)):
-        """
-        Determines the height of the cloud.
-
-        Uses a standard environmental lapse rate, the surface temperature,
-        and the temperature of the clouds.
-
-        :param ctherm:
-            The temperature of the cloud pixels.
-
-        :param surface_temp:
-            The surface temperature.
-
-        :param lapse_rate:
-            The environmental lapse rate.
-
-        :return:
-            An array of cloud heights.
-        """
-
-        result = numexpr.evaluate("((surface_temp - ctherm)/lapse_rate)*thou",
-                                  {'thou': np.float32(1000)}, locals())
-        return result
-
-    def shadow_length(cheight, rad_elev):
-        """
-        Determines the length of the shadow cast by the cloud.
-
-        :param cheight:
-            The height of the cloud.
-
-        :param rad_elev:
-            The sun elevation angle in radians.
-
-        :return:
-            An array of shadow lengths.
-        """
-
-        return cheight / np.tan(rad_elev)
-
-    def rect_xy(shad_length, rad_cor_az):
-        """
-        Retrieve the x and y distances of projected shadow.
-
-        The distances are in metres from the originating cloud pixel.
-
-        :param shad_length:
-            The length of the shadow in metres.
-
-        :param rad_cor_az:
-            The corrected azimuth angle in radians.
-
-        :return:
-            A complex array containing the x and y distances from the
-            originating cloud pixel.
-        """
-        rectxy = np.empty(shad_length.shape, dtype='complex64')
-        rectxy.real = numexpr.evaluate("shad_length * cos(rad_cor_az)")
-        rectxy.imag = numexpr.evaluate("shad_length * sin(rad_cor_az)")
-
-        return rectxy
-
-    def mapxy(rect_xy, omapx, omapy):
-        """
-        Convert the x and y locations into map co-ordinates.
-
-        :param rect_xy:
-            The complex array containing the x and y distances.
-
-        :param omapx:
-            The originating x position of the cloud.
-
-        :param omapy:
-            The originating y position of the cloud.
-
-        :return:
-            Two arrays, one for the x co-ordinate, the second for the
-            y co-ordinate.
-        """
-
-        new_mapx = numexpr.evaluate("omapx + real(rect_xy)").astype('float32')
-        new_mapy = numexpr.evaluate("omapy + imag(rect_xy)").astype('float32')
-        return new_mapx, new_mapy
-
-    def map2img(new_mapx, new_mapy, geoTransform, dims):
-        """
-        Converts the x and y map locations in image co-ordinates.
-
-        :param new_mapx:
-            The x projected shadow location.
-
-        :param new_mapy:
-            The y projected shadow location.
-
-        :param geoTransform:
-            The Image co-ordinate information (upper left coords, offset
-            and pixel sizes)
-
-        :return:
-             A tuple containing the indices of the shadow locations.
-        """
-
-        dct = {'a': np.float32(geoTransform[0]),
-               'b': np.float32(geoTransform[1])}
-
-        imgx = np.round(numexpr.evaluate("(new_mapx - a)/b",
-                                         dct, locals())).astype('int32')
-
-        dct = {'a': np.float32(geoTransform[3]),
-               'b': np.float32(abs(geoTransform[5]))}
-        imgy = np.round(numexpr.evaluate("(a - new_mapy)/b",
-                                         dct, locals())).astype('int32')
-
-        mask = numexpr.evaluate("(imgx>=0) & (imgy>=0) &"
-                                "(imgx<d1) & (imgy<d0)",
-                                {'d1': dims[1], 'd0': dims[0]}, locals())
-
-        imgx = imgx[mask]
-        imgy = imgy[mask]
-        del mask
-
-        return (imgy, imgx)
-
     def ndvi(red, nir):
         """
         The NDVI function calculates the Normalised Differenced Vegetation
@@ -386,12 +478,10 @@ def cloud_shadow(blue_dataset, green_dataset, red_dataset, nir_dataset,
 
     start_time = datetime.datetime.now()
 
-    # Get the indices of cloud
-    # need the actual indices rather than a boolean array
-    cindex = np.where(~cloud_mask)
+    cloud = ~cloud_mask
 
     # Return mask with all true there is no cloud
-    if len(cindex[0]) == 0:
+    if not cloud.any():
         aux_data['%s_cloud_shadow_percent' % (cloud_algorithm, )] = 0.0
         logging.info('Cloud Shadow Percent: 0.0')
         cshadow = np.ones(cloud_mask.shape, dtype='bool')
@@ -444,9 +534,6 @@ def cloud_shadow(blue_dataset, green_dataset, red_dataset, nir_dataset,
     variables['array'] = swir2_dataset
     reflectance_stack[5] = numexpr.evaluate(expr, variables)
 
-    # Get the indices of cloud
-    # need the actual indices rather than a boolean array
-    ctherm = kelvin_array[cindex]
     dims = kelvin_array.shape
 
     ndvi = ndvi(red=reflectance_stack[2], nir=reflectance_stack[3])
@@ -480,80 +567,20 @@ def cloud_shadow(blue_dataset, green_dataset, red_dataset, nir_dataset,
 
     del ndvi, non_cloud
 
-    cshadow = np.zeros(dims, dtype='byte')
     # wet, standard and dry
     lapse_rates = np.array([lapse_wet,
                             lapse_standard,
                             lapse_dry], dtype='float32')
 
     if sr.IsGeographic() == 1:
-        R = sr.GetSemiMajor()
-
-        rlon, rlat = origin_map(geoTransform, cindex)
-        rlon = np.radians(rlon)
-        rlat = np.radians(rlat)
-
-        i = 1
-        for lr in lapse_rates:
-
-            cheight = cloud_height(
-                ctherm, surface_temp=surfaceTemp, lapse_rate=lr)
-
-            d = shadow_length(cheight, rad_elev)
-
-            rlat2 = np.arcsin(np.sin(rlat) * np.cos(d / R) +
-                              np.cos(rlat) * np.sin(d / R) *
-                              np.cos(rad_cor_az))
-
-            rlon2 = rlon + np.arctan2(np.sin(rad_cor_az) * np.sin(d / R)
-                                      * np.cos(rlat), np.cos(d / R) -
-                                      np.sin(rlat) * np.sin(rlat))
-
-            rlat2 = np.rad2deg(rlat2)
-            rlon2 = np.rad2deg(rlon2)
-
-            sindex = map2img(new_mapx=rlon2, new_mapy=rlat2,
-                             geoTransform=geoTransform, dims=dims)
-
-            cshadow[sindex] = i
-            i += 1
-
-        del cheight, d, rlon, rlat, rlon2, rlat2, ctherm
-        gc.collect()
-        s_index = numexpr.evaluate("cshadow >= 1")
-
+        semi_major = sr.GetSemiMajor()
     else:
-        omapx, omapy = origin_map(geoTransform, cindex)
-
-        i = 1
-        for lr in lapse_rates:
-
-            cheight = cloud_height(
-                ctherm, surface_temp=surfaceTemp, lapse_rate=lr)
+        semi_major = None
 
-            shad_length = shadow_length(cheight, rad_elev)
-            del cheight
-            gc.collect()
-
-            rectxy = rect_xy(shad_length, rad_cor_az)
-            del shad_length
-            gc.collect()
-
-            new_mapx, new_mapy = mapxy(rectxy, omapx, omapy)
-            del rectxy
-            gc.collect()
-
-            sindex = map2img(new_mapx, new_mapy, geoTransform, dims)
-            del new_mapx, new_mapy
-            gc.collect()
-
-            cshadow[sindex] = i
-            i += 1
-
-        s_index = numexpr.evaluate("cshadow >= 1")
-
-        del cshadow, ctherm, omapx, omapy
-        gc.collect()
+    # the projected shadow of every lapse rate, and of the last (dry)
+    s_index, sindex = project_shadows(cloud, kelvin_array, surfaceTemp,
+                                      lapse_rates, geoTransform, rad_elev,
+                                      rad_cor_az, semi_major=semi_major)
 
     # Only apply spectral tests when growing a region
     # May need to add or change spectral tests to eliminate some landcovers.
@@ -561,14 +588,14 @@ def cloud_shadow(blue_dataset, green_dataset, red_dataset, nir_dataset,
         stng = datetime.datetime.now()
 
         q1 = numexpr.evaluate("(cloud_mask >= 1) & s_index")
-        if contiguity_mask != None:
+        if contiguity_mask is not None:
             q2 = numexpr.evaluate("(contiguity_mask >= 1) & s_index")
-            if land_sea_mask != None:
+            if land_sea_mask is not None:
                 q3 = numexpr.evaluate("(land_sea_mask >= 1) & s_index")
                 q4 = numexpr.evaluate("q1 & q2 & q3")
             else:
                 q4 = numexpr.evaluate("q1 & q2")
-        elif land_sea_mask != None:
+        elif land_sea_mask is not None:
             q3 = numexpr.evaluate("(land_sea_mask >= 1) & s_index")
             q4 = numexpr.evaluate("q1 & q3")
         else:
@@ -621,7 +648,7 @@ def cloud_shadow(blue_dataset, green_dataset, red_dataset, nir_dataset,
         # This is for water that is spectrally very flat and near zero
         above = numexpr.evaluate("stdv < stdv_wt")
         # dilate to get water edges; tends to help with river systems
-        ndimage.binary_dilation(above, s, output=wt)
+        wt = square_dilation(above, 3)
         weights[wt] += 15
 
         # some aussie native bushland is still picked up. Its stdv is
@@ -671,32 +698,16 @@ def cloud_shadow(blue_dataset, green_dataset, red_dataset, nir_dataset,
         del binmean, binstdv, flatwsum, temp_array
         gc.collect()
 
-        grown_regions = np.zeros(dims, dtype='bool').ravel()
-
         # Global stats/masking method
         lmin = lower.min()
         umax = upper.max()
         mask = numexpr.evaluate("(weight_sum >= lmin) & (weight_sum <= umax)")
-        label_array, _ = ndimage.label(mask, structure=s)
-        labels = label_array[sindex]
-        ulabels = np.unique(labels[labels > 0])
-
-        if ulabels.size > 0:  # only apply if labels are identified
-            maxval = np.max(ulabels)  # this will fail if there are no labels
-            h = histogram(label_array, minv=0, maxv=maxval,
-                          reverse_indices='ri')
 
-            # assign other variable names, makes it more readable
-            # when indexing
-            hist = h['histogram']
-            ri = h['ri']
+        # the regions containing a projected shadow pixel
+        grown_regions = grow_regions(mask, sindex, structure=s)
 
-            for i in np.arange(ulabels.shape[0]):
-                if hist[ulabels[i]] == 0:
-                    continue
-                grown_regions[ri[ri[ulabels[i]]:ri[ulabels[i] + 1]]] = 1
-
-            cshadow = grown_regions.reshape(dims)
+        if grown_regions.any():  # only apply if regions are identified
+            cshadow = grown_regions
 
         else:  # if no labels then output no shadow
             cshadow = np.zeros(dims, dtype='byte')
@@ -705,19 +716,19 @@ def cloud_shadow(blue_dataset, green_dataset, red_dataset, nir_dataset,
         cshadow = np.zeros(dims, dtype='byte')
         cshadow[sindex] = 1
 
-    cshadow = majority_filter(array=cshadow, iterations=2)
+    cshadow = majority_filter(cshadow, iterations=2)
 
     # Where a shadow pixel is a cloud pixel, change to no shadow
-    cshadow[cindex] = False
+    cshadow[cloud] = False
 
     # Where a sea pixel is a shadow pixel, change to no shadow
-    if land_sea_mask != None:
+    if land_sea_mask is not None:
         sea = numexpr.evaluate("land_sea_mask == 0")
         cshadow[sea] = False
         del sea
 
     # Where a null pixel is shadow, change to no shadow
-    if contiguity_mask != None:
+    if contiguity_mask is not None:
         null = numexpr.evaluate("contiguity_mask == 0")
         cshadow[null] = False
         del null
@@ -168,6 +168,9 @@ class DatasetName(Enum):
     PQ_YAML = 'METADATA/PQ-METADATA'
     SBT_YAML = 'METADATA/SBT-METADATA'
 
+    # wagl.profiling
+    PROFILE = 'PROFILE'
+
 
 class GroupName(Enum):
     """
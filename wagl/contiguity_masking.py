@@ -6,10 +6,9 @@ from __future__ import absolute_import, print_function
 import logging
 import numpy
 
-from scipy import ndimage
-from idl_functions import histogram
 from wagl.data import stack_data
-from wagl.tiling import generate_tiles
+from wagl.morphology import square_dilation, square_erosion
+from wagl.regions import grow_regions
 
 
 def calc_contiguity_mask(acquisitions, platform_id):
@@ -35,7 +34,7 @@ def calc_contiguity_mask(acquisitions, platform_id):
     """
     cols = acquisitions[0].samples
     rows = acquisitions[0].lines
-    tiles = list(generate_tiles(cols, rows, cols))
+    tiles = list(acquisitions[0].tiles())
 
     logging.debug('Determining pixel contiguity')
     # Create mask array with True for all pixels which are non-zero in all
@@ -52,38 +51,19 @@ def calc_contiguity_mask(acquisitions, platform_id):
     if platform_id == 'LANDSAT_5':
         logging.debug('Finding thermal edge anomalies')
         # Apply thermal edge anomalies
-        struct = numpy.ones((7, 7), dtype='bool')
-        erode = ndimage.binary_erosion(mask, structure=struct)
+        erode = square_erosion(mask, 7)
 
-        dims = mask.shape
-        th_anom = numpy.zeros(dims, dtype='bool').flatten()
-
-        pix_3buff_mask = mask - erode
-        pix_3buff_mask[pix_3buff_mask > 0] = 1
-        edge = pix_3buff_mask == 1
+        # the 3 pixel buffer inside the edge of the contiguous pixels
+        edge = mask & ~erode
 
         low_sat = acquisitions[5].data() == 1
-        low_sat_buff = ndimage.binary_dilation(low_sat, structure=struct)
+        low_sat_buff = square_dilation(low_sat, 7)
 
+        # the low saturation regions that touch the edge
         s = [[1, 1, 1], [1, 1, 1], [1, 1, 1]]
-        low_sat, _ = ndimage.label(low_sat_buff, structure=s)
-
-        labels = low_sat[edge]
-        ulabels = numpy.unique(labels[labels > 0])
-
-        # Histogram method, a lot faster
-        mx = numpy.max(ulabels)
-        h = histogram(low_sat, minv=0, maxv=mx, reverse_indices='ri')
-        hist = h['histogram']
-        ri = h['ri']
-
-        for i in numpy.arange(ulabels.shape[0]):
-            if hist[ulabels[i]] == 0:
-                continue
-            th_anom[ri[ri[ulabels[i]]:ri[ulabels[i] + 1]]] = True
+        th_anom = grow_regions(low_sat_buff, edge, structure=s)
 
-        th_anom = ~(th_anom.reshape(dims))
-        mask &= th_anom
+        mask &= ~th_anom
 
     return mask
 
@@ -4,19 +4,29 @@ Data access functions
 """
 
 from __future__ import absolute_import
-from os.path import join as pjoin, basename, dirname
-import subprocess
+from functools import reduce
+from math import gcd
+from os.path import join as pjoin, basename, dirname, abspath
 import tempfile
 import logging
 import numpy as np
 import h5py
+import gdal
 import rasterio
 
 from rasterio.crs import CRS
 from rasterio.warp import reproject
 from rasterio.enums import Resampling
 from wagl.geobox import GriddedGeoBox
-from wagl.tiling import generate_tiles
+from wagl.tiling import generate_tiles, TiledOutput
+
+GDAL_DTYPES = {'uint8': gdal.GDT_Byte,
+               'uint16': gdal.GDT_UInt16,
+               'int16': gdal.GDT_Int16,
+               'uint32': gdal.GDT_UInt32,
+               'int32': gdal.GDT_Int32,
+               'float32': gdal.GDT_Float32,
+               'float64': gdal.GDT_Float64}
 
 
 def get_pixel(filename, lonlat, band=1):
@@ -141,6 +151,11 @@ def write_img(array, filename, driver='GTiff', geobox=None, nodata=None,
         If `cogtif` is set to True, the default blocksizes will be
         256x256. To override this behaviour, specify them using the
         `options` keyword. Eg {'blockxsize': 512, 'blockysize': 512}.
+        `h5py.Dataset's` are streamed to disk a tile at a time rather
+        than being read into memory. If `cogtif` is set to True, the
+        tiled GeoTiff and its internal overviews are streamed to a
+        temporary file, which is then copied with COPY_SRC_OVERVIEWS
+        to give the COG layout.
     """
     # Get the datatype of the array
     dtype = array.dtype.name
@@ -151,9 +166,10 @@ def write_img(array, filename, driver='GTiff', geobox=None, nodata=None,
         msg = "Datatype not supported: {dt}".format(dt=dtype)
         raise TypeError(msg)
 
-    # convert any bools to uin8
+    # convert any bools to uin8; h5py datasets are converted per tile
     if dtype == 'bool':
-        array = np.uint8(array)
+        if not isinstance(array, h5py.Dataset):
+            array = np.uint8(array)
         dtype = 'uint8'
 
     ndims = array.ndim
@@ -207,73 +223,125 @@ def write_img(array, filename, driver='GTiff', geobox=None, nodata=None,
               'nodata': nodata,
               'predictor': predictor[dtype]}
 
+    if cogtif:
+        if levels is None:
+            levels = [2, 4, 8, 16, 32]
+
+        cog_options = {'tiled': 'yes',
+                       'blockxsize': 256,
+                       'blockysize': 256,
+                       'predictor': predictor[dtype]}
+        if options is not None:
+            cog_options.update(options)
+
+        _write_cogtif(array, filename, dtype, geobox, nodata, tags,
+                      cog_options, levels, resampling)
+        return
+
     if isinstance(array, h5py.Dataset):
-        # TODO: if array is 3D get x & y chunks
-        if array.chunks[1] == array.shape[1]:
-            # GDAL doesn't like tiled or blocksize options to be set
-            # the same length as the columns (probably true for rows as well)
-            array = array[:]
+        if array.chunks is None:
+            y_tile, x_tile = min(lines, 256), samples
         else:
-            y_tile, x_tile = array.chunks
-            tiles = generate_tiles(samples, lines, x_tile, y_tile)
+            y_tile, x_tile = array.chunks[-2:]
 
+        if x_tile == samples:
+            # GDAL doesn't like tiled or blocksize options to be set
+            # the same length as the columns (probably true for rows as
+            # well), so stream strips of whole chunk rows instead
+            y_tile = max(y_tile, 256 // y_tile * y_tile)
+        else:
             # add blocksizes to the creation keywords
             kwargs['tiled'] = 'yes'
             kwargs['blockxsize'] = x_tile
             kwargs['blockysize'] = y_tile
 
+        tiles = generate_tiles(samples, lines, x_tile, y_tile)
+
     # the user can override any derived blocksizes by supplying `options`
     if options is not None:
         for key in options:
             kwargs[key] = options[key]
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        out_fname = pjoin(tmpdir, basename(filename)) if cogtif else filename
-
-        with rasterio.open(out_fname, 'w', **kwargs) as outds:
-            if bands == 1:
-                if isinstance(array, h5py.Dataset):
-                    for tile in tiles:
-                        idx = (slice(tile[0][0], tile[0][1]),
-                               slice(tile[1][0], tile[1][1]))
-                        outds.write(array[idx], 1, window=tile)
-                else:
-                    outds.write(array, 1)
-            else:
-                if isinstance(array, h5py.Dataset):
-                    for tile in tiles:
-                        idx = (slice(tile[0][0], tile[0][1]),
-                               slice(tile[1][0], tile[1][1]))
-                        subs = array[:, idx[0], idx[1]]
-                        for i in range(bands):
-                            outds.write(subs[i], i + 1, window=tile)
+    with rasterio.open(filename, 'w', **kwargs) as outds:
+        if isinstance(array, h5py.Dataset):
+            for tile in tiles:
+                idx = (Ellipsis, slice(tile[0][0], tile[0][1]),
+                       slice(tile[1][0], tile[1][1]))
+                subs = array[idx].astype(dtype, copy=False)
+                if bands == 1:
+                    outds.write(subs, 1, window=tile)
                 else:
                     for i in range(bands):
-                        outds.write(array[i], i + 1)
-            if tags is not None:
-                outds.update_tags(**tags)
+                        outds.write(subs[i], i + 1, window=tile)
+        else:
+            if bands == 1:
+                outds.write(array, 1)
+            else:
+                for i in range(bands):
+                    outds.write(array[i], i + 1)
+        if tags is not None:
+            outds.update_tags(**tags)
+
+
+def _write_cogtif(array, filename, dtype, geobox, nodata, tags, options,
+                  levels, resampling):
+    """
+    Writes a Cloud Optimised GeoTiff, streaming strips of whole block
+    rows from `array` (a `NumPy` array or `h5py.Dataset`) into a
+    temporary tiled GeoTiff with internal overviews/pyramids.
+    For nearest neighbour resampling, the overviews are populated
+    from decimated copies of each strip while it is in memory.
+    Any other resampling method requires the overviews to be
+    computed from the full resolution data once it is written.
+    The temporary file is then copied with COPY_SRC_OVERVIEWS=YES,
+    which places the IFDs ahead of the data, and the overviews
+    ahead of the full resolution data.
+    """
+    if array.ndim == 2:
+        bands = 1
+        lines, samples = array.shape
+    else:
+        bands, lines, samples = array.shape
+
+    # strips span whole blocks, and are aligned to every overview level
+    ysize = reduce(lambda a, b: a * b // gcd(a, b), levels,
+                   int(options['blockysize']))
+    if isinstance(array, h5py.Dataset) and array.chunks is not None:
+        ysize *= max(1, array.chunks[-2] // ysize)
+
+    nearest = resampling == Resampling.nearest
+    with tempfile.TemporaryDirectory(dir=dirname(abspath(filename))) as tmpd:
+        tmp_fname = pjoin(tmpd, basename(filename))
+        outds = TiledOutput(tmp_fname, samples, lines, bands, geobox,
+                            'GTiff', nodata, GDAL_DTYPES[dtype], options,
+                            levels if nearest else None)
+
+        for tile in generate_tiles(samples, lines, samples, ysize):
+            idx = (Ellipsis, slice(tile[0][0], tile[0][1]),
+                   slice(tile[1][0], tile[1][1]))
+            outds.write_tile(array[idx].astype(dtype, copy=False), tile)
 
-            # overviews/pyramids
-            if cogtif:
-                if levels is None:
-                    levels = [2, 4, 8, 16, 32]
-                outds.build_overviews(levels, resampling)
+        if not nearest:
+            outds.build_overviews(levels, resampling.name.upper())
 
-        if cogtif:
-            cmd = ['gdal_translate',
-                   '-co',
-                   'TILED=YES',
-                   '-co',
-                   'COPY_SRC_OVERVIEWS=YES',
-                   '-co',
-                   '{}={}'.format('PREDICTOR', predictor[dtype])]
+        if tags is not None:
+            outds.update_tags(**tags)
 
-            for key, value in options.items():
-                cmd.extend(['-co', '{}={}'.format(key, value)])
+        outds.close()
 
-            cmd.extend([out_fname, filename])
+        co_options = ['{}={}'.format(key.upper(), value)
+                      for key, value in options.items()]
+        co_options.append('COPY_SRC_OVERVIEWS=YES')
 
-            subprocess.check_call(cmd, cwd=dirname(filename))
+        src_ds = gdal.Open(tmp_fname)
+        driver = gdal.GetDriverByName('GTiff')
+        out_ds = driver.CreateCopy(filename, src_ds, options=co_options)
+        if out_ds is None:
+            msg = "Unable to create the COG: {}".format(filename)
+            raise IOError(msg)
+
+        out_ds = None
+        src_ds = None
 
 
 def read_subset(fname, ul_xy, ur_xy, lr_xy, ll_xy, bands=1):
@@ -406,24 +474,54 @@ def reproject_file_to_array(src_filename, src_band=1, dst_geobox=None,
     :return:
         A NumPy array containing the reprojected result.
     """
+    with rasterio.open(src_filename) as src:
+        return reproject_dataset_to_array(src, src_band, dst_geobox,
+                                          resampling)
 
+
+def reproject_dataset_to_array(src, src_band=1, dst_geobox=None,
+                               resampling=Resampling.nearest):
+    """
+    Given an opened image, reproject to the desired coordinate
+    reference system. Many windows can be reprojected from an
+    image that is opened only once.
+
+    :param src:
+        An opened rasterio dataset containing the source image.
+
+    :param src_band:
+        An integer representing the band number to be reprojected.
+        Default is 1, the 1st band.
+
+    :param dst_geobox:
+        An instance of a GriddedGeoBox object containing the
+        destination parameters such as origin, affine, projection,
+        and array dimensions.
+
+    :param resampling:
+        An integer representing the resampling method to be used.
+        check rasterio.warp.RESMPLING for more details.
+        Default is 0, nearest neighbour resampling.
+
+    :return:
+        A NumPy array containing the reprojected result.
+    """
     if not isinstance(dst_geobox, GriddedGeoBox):
         msg = 'dst_geobox must be an instance of a GriddedGeoBox! Type: {}'
         msg = msg.format(type(dst_geobox))
         raise TypeError(msg)
 
-    with rasterio.open(src_filename) as src:
-        # Define a rasterio band
-        rio_band = rasterio.band(src, src_band)
+    # Define a rasterio band
+    rio_band = rasterio.band(src, src_band)
 
-        # Define the output NumPy array
-        dst_arr = np.zeros(dst_geobox.shape, dtype=src.dtypes[0])
+    # Define the output NumPy array
+    dst_arr = np.zeros(dst_geobox.shape, dtype=src.dtypes[0])
 
-        # Get the rasterio proj4 styled dict
-        prj = CRS.from_string(dst_geobox.crs.ExportToProj4())
+    # Get the rasterio proj4 styled dict
+    prj = CRS.from_string(dst_geobox.crs.ExportToProj4())
 
-        reproject(rio_band, dst_arr, dst_transform=dst_geobox.transform,
-                  dst_crs=prj, resampling=resampling)
+    reproject(rio_band, dst_arr, dst_transform=dst_geobox.transform,
+              dst_crs=prj, resampling=resampling)
 
     return dst_arr
 
@@ -7,12 +7,14 @@ from __future__ import absolute_import, print_function
 import numpy
 from scipy import ndimage
 import h5py
+import rasterio
 from rasterio.warp import Resampling
 from wagl.constants import DatasetName, GroupName
 from wagl.margins import pixel_buffer
 from wagl.geobox import GriddedGeoBox
-from wagl.data import reproject_file_to_array
+from wagl.data import reproject_dataset_to_array
 from wagl.hdf5 import H5CompressionFilter, attach_image_attributes
+from wagl.tiling import plan_tiles
 
 
 def filter_dsm(array):
@@ -34,6 +36,80 @@ def filter_dsm(array):
     return filtered
 
 
+def _halo_window(window, shape, halo=1):
+    """
+    Pad a ((ystart, yend), (xstart, xend)) window by `halo` pixels
+    on each side, clipped to the array `shape`. Returns the padded
+    window and the index of the original window within the padded
+    window.
+    """
+    (ystart, yend), (xstart, xend) = window
+    pad_ys = max(0, ystart - halo)
+    pad_ye = min(shape[0], yend + halo)
+    pad_xs = max(0, xstart - halo)
+    pad_xe = min(shape[1], xend + halo)
+
+    padded = ((pad_ys, pad_ye), (pad_xs, pad_xe))
+    idx = (slice(ystart - pad_ys, yend - pad_ys),
+           slice(xstart - pad_xs, xend - pad_xs))
+
+    return padded, idx
+
+
+def buffered_geobox(acquisition, buffer_distance=8000):
+    """
+    Determine the buffered extents of an acquisition, as used for
+    the DSM subset.
+
+    :param acquisition:
+        An instance of an `Acquisition` object.
+
+    :param buffer_distance:
+        A number representing the desired distance (in the same
+        units as the acquisition) in which to calculate the extra
+        number of pixels required to buffer an image.
+        Default is 8000.
+
+    :return:
+        A tuple of the `ImageMargins` in pixel units, and the
+        `GriddedGeoBox` of the buffered image.
+    """
+    geobox = acquisition.gridded_geo_box()
+    shape = geobox.get_shape_yx()
+    margins = pixel_buffer(acquisition, buffer_distance)
+
+    dem_cols = shape[1] + margins.left + margins.right
+    dem_rows = shape[0] + margins.top + margins.bottom
+    dem_origin = geobox.convert_coordinates((0 - margins.left,
+                                             0 - margins.top))
+    dem_geobox = GriddedGeoBox((dem_rows, dem_cols), origin=dem_origin,
+                               pixelsize=geobox.pixelsize,
+                               crs=geobox.crs.ExportToWkt())
+
+    return margins, dem_geobox
+
+
+def dsm_offset(dsm_group, margins):
+    """
+    The (row, column) index of the first pixel of the acquisition
+    within the DSM subset of an elevation `Group`; the margins, plus
+    any padding prepended to the subset by `get_dsm` to align its
+    chunks with those of the acquisition.
+
+    :param dsm_group:
+        The `GroupName.ELEVATION_GROUP` HDF5 `Group`.
+
+    :param margins:
+        The `ImageMargins` of the acquisition.
+
+    :return:
+        A 2-tuple of (row, column).
+    """
+    attrs = dsm_group['PARAMETERS'].attrs
+    return (margins.top + int(attrs.get('top_padding', 0)),
+            margins.left + int(attrs.get('left_padding', 0)))
+
+
 def _get_dsm(acquisition, national_dsm, buffer_distance, out_fname,
              compression=H5CompressionFilter.LZF, filter_opts=None):
     """
@@ -54,6 +130,19 @@ def get_dsm(acquisition, national_dsm, buffer_distance=8000, out_group=None,
     gaussian filter.
     A square margins is applied to the extents.
 
+    The subset is chunked as per the acquisition, and extended at
+    the top and left (by less than a chunk) such that the chunks of
+    the acquisition, offset by the margins, coincide with the chunks
+    of the subset. The extension is recorded as the `top_padding` and
+    `left_padding` attributes of the PARAMETERS `Group`; see
+    `dsm_offset`.
+
+    The subset is reprojected and smoothed in blocks (padded by a
+    1 pixel halo to satisfy the gaussian kernel) that are aligned
+    with the chunks of the output dataset, such that the memory
+    required is independent of the size of the acquisition.
+    The blocks are planned by `wagl.tiling.plan_tiles`.
+
     :param acquisition:
         An instance of an acquisition object.
 
@@ -94,25 +183,23 @@ def get_dsm(acquisition, national_dsm, buffer_distance=8000, out_group=None,
     """
     # Use the 1st acquisition to setup the geobox
     geobox = acquisition.gridded_geo_box()
-    shape = geobox.get_shape_yx()
 
     # buffered image extents/margins
-    margins = pixel_buffer(acquisition, buffer_distance)
+    margins, dem_geobox = buffered_geobox(acquisition, buffer_distance)
 
-    # Get the dimensions and geobox of the new image
-    dem_cols = shape[1] + margins.left + margins.right
-    dem_rows = shape[0] + margins.top + margins.bottom
-    dem_shape = (dem_rows, dem_cols)
-    dem_origin = geobox.convert_coordinates((0 - margins.left,
-                                             0 - margins.top))
+    # extend the subset so the acquisition's chunks are offset by
+    # whole chunks, and the geobox of the new image
+    chunks = acquisition.chunks
+    top_padding = -margins.top % chunks[0]
+    left_padding = -margins.left % chunks[1]
+    dem_rows, dem_cols = dem_geobox.get_shape_yx()
+    dem_shape = (dem_rows + top_padding, dem_cols + left_padding)
+    dem_origin = dem_geobox.convert_coordinates((0 - left_padding,
+                                                 0 - top_padding))
     dem_geobox = GriddedGeoBox(dem_shape, origin=dem_origin,
                                pixelsize=geobox.pixelsize,
                                crs=geobox.crs.ExportToWkt())
 
-    # Retrive the DSM data
-    dsm_data = reproject_file_to_array(national_dsm, dst_geobox=dem_geobox,
-                                       resampling=Resampling.bilinear)
-
     # Output the reprojected result
     # Initialise the output files
     if out_group is None:
@@ -125,14 +212,8 @@ def get_dsm(acquisition, national_dsm, buffer_distance=8000, out_group=None,
     else:
         filter_opts = filter_opts.copy()
 
-    if acquisition.tile_size[0] == 1:
-        filter_opts['chunks'] = (1, dem_cols)
-    else:
-        # TODO: rework the tiling regime for larger dsm
-        # for non single row based tiles, we won't have ideal
-        # matching reads for tiled processing between the acquisition
-        # and the DEM
-        filter_opts['chunks'] = acquisition.tile_size
+    plan = plan_tiles(dem_shape, chunks=chunks)
+    filter_opts['chunks'] = plan.chunks
     kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
 
     group = fid.create_group(GroupName.ELEVATION_GROUP.value)
@@ -142,15 +223,38 @@ def get_dsm(acquisition, national_dsm, buffer_distance=8000, out_group=None,
     param_grp.attrs['right_buffer'] = margins.right
     param_grp.attrs['top_buffer'] = margins.top
     param_grp.attrs['bottom_buffer'] = margins.bottom
+    param_grp.attrs['top_padding'] = top_padding
+    param_grp.attrs['left_padding'] = left_padding
 
     # dataset attributes
     attrs = {'crs_wkt': geobox.crs.ExportToWkt(),
              'geotransform': dem_geobox.transform.to_gdal()}
 
-    # Smooth the DSM
-    dsm_data = filter_dsm(dsm_data)
-    dname = DatasetName.DSM_SMOOTHED.value
-    out_sm_dset = group.create_dataset(dname, data=dsm_data, **kwargs)
+    # the DSM is opened once, and each block reprojected from it
+    with rasterio.open(national_dsm) as src:
+        dname = DatasetName.DSM_SMOOTHED.value
+        out_sm_dset = group.create_dataset(dname, shape=dem_shape,
+                                           dtype=src.dtypes[0], **kwargs)
+
+        # Retrive and smooth the DSM data a block at a time
+        # the halo is only applied internally, retaining the behaviour of
+        # the filter at the edges of the full subset
+        for block in plan.tiles():
+            padded, idx = _halo_window(block, dem_shape)
+            (ystart, yend), (xstart, xend) = padded
+            block_origin = dem_geobox.convert_coordinates((xstart, ystart))
+            block_geobox = GriddedGeoBox((yend - ystart, xend - xstart),
+                                         origin=block_origin,
+                                         pixelsize=geobox.pixelsize,
+                                         crs=geobox.crs.ExportToWkt())
+
+            dsm_data = reproject_dataset_to_array(
+                src, dst_geobox=block_geobox, resampling=Resampling.bilinear)
+
+            # Smooth the DSM
+            out_idx = (slice(*block[0]), slice(*block[1]))
+            out_sm_dset[out_idx] = filter_dsm(dsm_data)[idx]
+
     desc = ("A subset of a Digital Surface Model smoothed with a gaussian "
             "kernel.")
     attrs['description'] = desc
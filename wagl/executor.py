@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+"""
+In-process stage executor
+-------------------------
+
+Expresses a workflow as an explicit graph of stages, each writing its
+results to a HDF5 `Group`, and runs the stages concurrently once their
+dependencies have completed.
+
+All writes to the shared output file go through a single writer (the
+thread that calls `StageGraph.run`). When run concurrently, each stage
+writes to its own scratch HDF5 file on disk, which the writer merges
+into the stage's destination `Group` (and then deletes) before any
+dependent stage is started.
+A stage can therefore freely read its inputs from the shared file.
+"""
+
+from __future__ import absolute_import
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import os
+from os.path import join as pjoin, dirname, abspath
+import tempfile
+import uuid
+
+import h5py
+
+
+class StageGraphError(Exception):
+
+    """
+    Specific error handle for an invalid stage graph.
+    """
+    pass
+
+
+class Stage(object):
+
+    """
+    A single unit of work within a `StageGraph`.
+
+    :param name:
+        A unique `str` identifying the stage.
+
+    :param func:
+        A callable accepting a single argument; the writeable HDF5
+        `Group` to write results to. Its return value is made
+        available via `StageGraph.results`.
+
+    :param dependencies:
+        A `list` of stage names that must complete before this
+        stage is started.
+
+    :param destination:
+        A `str` containing the pathname (relative to the graph's
+        output `Group`) of the `Group` that the results are written
+        into. Default is the graph's output `Group`.
+    """
+
+    def __init__(self, name, func, dependencies=None, destination=None):
+        self.name = name
+        self.func = func
+        self.dependencies = list(dependencies or [])
+        self.destination = destination
+
+
+def merge_group(source, destination):
+    """
+    Recursively copy the attributes, datasets and groups contained
+    within `source` into `destination`, creating any groups that are
+    not already present. A dataset already present within
+    `destination` is an error.
+
+    :param source:
+        A readable `h5py.Group`.
+
+    :param destination:
+        A writeable `h5py.Group`.
+    """
+    for key in source.attrs:
+        dtype = source.attrs.get_id(key).dtype
+        destination.attrs.create(key, source.attrs[key], dtype=dtype)
+
+    for name, obj in source.items():
+        if isinstance(obj, h5py.Group):
+            merge_group(obj, destination.require_group(name))
+        else:
+            source.copy(obj, destination, name=name)
+
+
+class StageGraph(object):
+
+    """
+    A dependency graph of `Stage`s writing to a single HDF5 output
+    `Group`.
+
+    :param out_group:
+        A writeable `h5py.Group` that all stages write into.
+
+    :param profiler:
+        An optional `wagl.profiling.Profiler` used to measure each
+        stage. Default is None.
+
+    :param scratch_dir:
+        The directory within which the scratch files of concurrently
+        run stages are written. Default is None; the directory of the
+        output file.
+    """
+
+    def __init__(self, out_group, profiler=None, scratch_dir=None):
+        self.out_group = out_group
+        self.profiler = profiler
+        self.scratch_dir = scratch_dir
+        self.stages = {}
+        self.results = {}
+        self._order = []
+
+    def add(self, name, func, dependencies=None, destination=None):
+        """
+        Add a stage to the graph. See `Stage` for the parameters.
+        Stages are run in the order in which they are added,
+        wherever the dependencies allow it.
+        """
+        if name in self.stages:
+            msg = "Stage {} is already defined."
+            raise StageGraphError(msg.format(name))
+
+        self.stages[name] = Stage(name, func, dependencies, destination)
+        self._order.append(name)
+
+    def _destination(self, stage):
+        """
+        Return the destination `Group` of a stage.
+        """
+        if not stage.destination:
+            return self.out_group
+        return self.out_group.require_group(stage.destination)
+
+    def _validate(self):
+        """
+        Check that every dependency is defined, and that the
+        graph is acyclic.
+        """
+        for stage in self.stages.values():
+            for dependency in stage.dependencies:
+                if dependency not in self.stages:
+                    msg = "Stage {} depends on an undefined stage {}."
+                    raise StageGraphError(msg.format(stage.name, dependency))
+
+        remaining = {name: len(stage.dependencies)
+                     for name, stage in self.stages.items()}
+        dependents = self._dependents()
+        ready = [name for name, count in remaining.items() if count == 0]
+        visited = 0
+        while ready:
+            name = ready.pop()
+            visited += 1
+            for dependent in dependents[name]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+
+        if visited != len(self.stages):
+            raise StageGraphError("The stage graph contains a cycle.")
+
+    def _dependents(self):
+        """
+        Return a mapping of each stage to the stages that depend on it.
+        """
+        dependents = {name: [] for name in self.stages}
+        for stage in self.stages.values():
+            for dependency in stage.dependencies:
+                dependents[dependency].append(stage.name)
+        return dependents
+
+    def _call(self, stage, out_group):
+        """
+        Call a stage's function, measuring it if there's a profiler.
+        """
+        if self.profiler is None:
+            return stage.func(out_group)
+
+        with self.profiler.profile(stage.name, out_group):
+            return stage.func(out_group)
+
+    def _run_scratch(self, stage, tmpdir):
+        """
+        Run a stage against its own scratch file within tmpdir.
+        """
+        fname = pjoin(tmpdir, '{}-{}.h5'.format(stage.name.replace('/', '-'),
+                                                uuid.uuid4().hex))
+        scratch = h5py.File(fname, 'w')
+        try:
+            result = self._call(stage, scratch)
+        except Exception:
+            scratch.close()
+            os.remove(fname)
+            raise
+
+        return result, scratch
+
+    def run(self, workers=1):
+        """
+        Run all stages in the graph.
+
+        :param workers:
+            The maximum number of stages to run concurrently.
+            Default is 1, which runs every stage in turn within the
+            calling thread, writing directly to the output `Group`.
+
+        :return:
+            A `dict` of each stage's return value keyed by stage name.
+        """
+        self._validate()
+        dependents = self._dependents()
+        remaining = {name: len(stage.dependencies)
+                     for name, stage in self.stages.items()}
+        position = {name: i for i, name in enumerate(self._order)}
+        ready = sorted([n for n, c in remaining.items() if c == 0],
+                       key=position.get)
+
+        def complete(name):
+            for dependent in dependents[name]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+            ready.sort(key=position.get)
+
+        if workers == 1:
+            while ready:
+                stage = self.stages[ready.pop(0)]
+                result = self._call(stage, self._destination(stage))
+                self.results[stage.name] = result
+                complete(stage.name)
+            return self.results
+
+        scratch_dir = self.scratch_dir
+        if scratch_dir is None:
+            scratch_dir = dirname(abspath(self.out_group.file.filename))
+
+        running = {}
+        error = None
+        with tempfile.TemporaryDirectory(dir=scratch_dir) as tmpdir, \
+                ThreadPoolExecutor(max_workers=workers) as executor:
+            while ready or running:
+                while ready and error is None and len(running) < workers:
+                    stage = self.stages[ready.pop(0)]
+                    future = executor.submit(self._run_scratch, stage,
+                                             tmpdir)
+                    running[future] = stage
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        result, scratch = future.result()
+                    except Exception as exc:
+                        # let the running stages finish, but start no more
+                        if error is None:
+                            error = exc
+                        continue
+
+                    # the single writer
+                    fname = scratch.filename
+                    try:
+                        merge_group(scratch, self._destination(stage))
+                    finally:
+                        scratch.close()
+                        os.remove(fname)
+
+                    self.results[stage.name] = result
+                    complete(stage.name)
+
+        if error is not None:
+            raise error
+
+        return self.results
@@ -16,6 +16,7 @@ SUBROUTINE bilinear_interpolation(nrow, ncol, coordinator, s1, s2, s3, s4, &
 
 !f2py depend(ncol), cstart, cend, centreline
 !f2py depend(nrow, ncol), res
+!f2py threadsafe
 
 !       the result array, res, is transposed as it is passed into
 !       fortran. So nrow, and ncol labelled here in fortran are the
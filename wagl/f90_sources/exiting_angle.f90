@@ -12,6 +12,7 @@ SUBROUTINE exiting_angle(nrow, ncol, &
     integer col, row
 
 !f2py depend(nrow, ncol), view, azi, theta, phit, et, azi_et
+!f2py threadsafe
 
 !---------------------------------------------------------------------
 
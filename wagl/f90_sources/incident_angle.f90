@@ -12,6 +12,7 @@ SUBROUTINE incident_angle(nrow, ncol, &
     integer col, row
 
 !f2py depend(nrow, ncol), solar, sazi, theta, phit, it, azi_it
+!f2py threadsafe
 
 !---------------------------------------------------------------------
 
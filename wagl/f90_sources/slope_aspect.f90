@@ -44,6 +44,7 @@ SUBROUTINE slope_aspect(nrow, ncol, nrow_alloc, ncol_alloc, &
 !f2py depend(nrow, ncol), dem
 !f2py depend(nrow_alloc, ncol_alloc), theta, phit
 !f2py depend(ncol), alat
+!f2py threadsafe
 
 !feff2py intent(in) dresx, dresy, spheroid, alat, dem, is_utm
 !feff2py intent(inout) theta, phit
@@ -81,6 +81,7 @@ SUBROUTINE reflectance( &
 !f2py intent(in) it_angle, et_angle, rela_slope, a_mod, b_mod, s_mod, fv, fs, ts, edir_h, edif_h
 !f2py intent(in) ref_lm, ref_brdf, ref_terrain, dn
 !f2py intent(inout) iref_lm, iref_brdf, iref_terrain
+!f2py threadsafe
 
 !   internal parameters
     integer i, j, i_no_data
@@ -30,6 +30,10 @@ from skimage import morphology
 from skimage import measure
 from skimage import segmentation
 
+from wagl.morphology import square_dilation
+from wagl.quantiles import percentiles
+from wagl.tiling import plan_strips
+
 # pylint: disable=invalid-name
 
 
@@ -75,6 +79,27 @@ sun_earth_distance = {
     361: 0.98344, 362: 0.98340, 363: 0.98337, 364: 0.98335, 365: 0.98333, 366: 0.98331
 }
 
+# Solar spectral irradiances of bands 1-7 (band 6 is thermal)
+# see G. Chander et al. RSE 113 (2009) 893-903
+ESUN = {4: [1983.0, 1795.0, 1539.0, 1028.0, 219.8, -1.0, 83.49],
+        5: [1983.0, 1796.0, 1536.0, 1031.0, 220.0, -1.0, 83.44],
+        7: [1997.000, 1812.000, 1533.000, 1039.000, 230.800, -1.0, 84.90]}
+
+# Thermal band calibration constants (K1, K2)
+# see G. Chander et al. RSE 113 (2009) 893-903
+THERMAL_CONSTANTS = {4: (671.62, 1284.30),
+                     5: (607.76, 1260.56),
+                     7: (666.09, 1282.71),
+                     8: (774.89, 1321.08)}
+
+# Band ids used by Fmask for each Landsat number; the reflective bands
+# (in the order of the band stack), the thermal band, and the value of
+# a saturated pixel in the visible bands (the first three)
+FMASK_BANDS = {4: (['1', '2', '3', '4', '5', '7'], '6', 255),
+               5: (['1', '2', '3', '4', '5', '7'], '6', 255),
+               7: (['1', '2', '3', '4', '5', '7'], '61', 255),
+               8: (['2', '3', '4', '5', '6', '7', '9'], '10', 65535)}
+
 # Replacement for original dir() function in this module.
 # Renamed to avoid name collision with builtin.
 
@@ -616,23 +641,7 @@ def nd2toarbt(filename, images=None):
 
         # convert Band6 from radiance to BT
         # fprintf('From Band 6 Radiance to Brightness Temperature\n')
-        # see G. Chander et al. RSE 113 (2009) 893-903
-        K1_L4 = 671.62
-        K2_L4 = 1284.30
-        K1_L5 = 607.76
-        K2_L5 = 1260.56
-        K1_L7 = 666.09
-        K2_L7 = 1282.71
-
-        if Lnum == 7:
-            K1 = K1_L7
-            K2 = K2_L7
-        elif Lnum == 5:
-            K1 = K1_L5
-            K2 = K2_L5
-        elif Lnum == 4:
-            K1 = K1_L4
-            K2 = K2_L4
+        K1, K2 = THERMAL_CONSTANTS[Lnum]
 
         if images != None:
             im_B1 = images[0, :, :].astype(numpy.float32)
@@ -708,18 +717,7 @@ def nd2toarbt(filename, images=None):
             #  esun_L5=[1957.0, 1826.0, 1554.0, 1036.0, 215.0, -1.0, 80.67]
             #  esun_L4=[1957.0, 1825.0, 1557.0, 1033.0, 214.9, -1.0, 80.72]
 
-            # see G. Chander et al. RSE 113 (2009) 893-903
-            esun_L7 = [
-                1997.000, 1812.000, 1533.000, 1039.000, 230.800, -1.0, 84.90]
-            esun_L5 = [1983.0, 1796.0, 1536.0, 1031.0, 220.0, -1.0, 83.44]
-            esun_L4 = [1983.0, 1795.0, 1539.0, 1028.0, 219.8, -1.0, 83.49]
-
-            if Lnum == 7:
-                ESUN = esun_L7
-            elif Lnum == 5:
-                ESUN = esun_L5
-            elif Lnum == 4:
-                ESUN = esun_L4
+            esun = ESUN[Lnum]
 
             #  # Interpolate earth-sun distance with day of year from LEDAPS
             #  dsun_table_doy = [1,15,32,46,60,74,91,106,121,135,152,166,182,196,213,227,242,258,274,288,305,319,335,349,366]
@@ -748,17 +746,17 @@ def nd2toarbt(filename, images=None):
             }
 
             im_B1 = numexpr.evaluate(
-                "a * im_B1 * b / (sun * c)", dict(list(stack.items()) + list({'sun': numpy.float32(ESUN[0])}.items())), locals())
+                "a * im_B1 * b / (sun * c)", dict(list(stack.items()) + list({'sun': numpy.float32(esun[0])}.items())), locals())
             im_B2 = numexpr.evaluate(
-                "a * im_B2 * b / (sun * c)", dict(list(stack.items()) + list({'sun': numpy.float32(ESUN[1])}.items())), locals())
+                "a * im_B2 * b / (sun * c)", dict(list(stack.items()) + list({'sun': numpy.float32(esun[1])}.items())), locals())
             im_B3 = numexpr.evaluate(
-                "a * im_B3 * b / (sun * c)", dict(list(stack.items()) + list({'sun': numpy.float32(ESUN[2])}.items())), locals())
+                "a * im_B3 * b / (sun * c)", dict(list(stack.items()) + list({'sun': numpy.float32(esun[2])}.items())), locals())
             im_B4 = numexpr.evaluate(
-                "a * im_B4 * b / (sun * c)", dict(list(stack.items()) + list({'sun': numpy.float32(ESUN[3])}.items())), locals())
+                "a * im_B4 * b / (sun * c)", dict(list(stack.items()) + list({'sun': numpy.float32(esun[3])}.items())), locals())
             im_B5 = numexpr.evaluate(
-                "a * im_B5 * b / (sun * c)", dict(list(stack.items()) + list({'sun': numpy.float32(ESUN[4])}.items())), locals())
+                "a * im_B5 * b / (sun * c)", dict(list(stack.items()) + list({'sun': numpy.float32(esun[4])}.items())), locals())
             im_B7 = numexpr.evaluate(
-                "a * im_B7 * b / (sun * c)", dict(list(stack.items()) + list({'sun': numpy.float32(ESUN[6])}.items())), locals())
+                "a * im_B7 * b / (sun * c)", dict(list(stack.items()) + list({'sun': numpy.float32(esun[6])}.items())), locals())
 
         # convert from Kelvin to Celcius with 0.01 scale_facor
         im_B6 = numexpr.evaluate("a * ((K2 / log((K1 / im_B6) + one)) - b)", {'a': numpy.float32(
@@ -861,8 +859,7 @@ def nd2toarbt(filename, images=None):
 
         # convert Band6 from radiance to BT
         # fprintf('From Band 6 Radiance to Brightness Temperature\n');
-        K1_B10 = numpy.float32(774.89)
-        K2_B10 = numpy.float32(1321.08)
+        K1_B10, K2_B10 = [numpy.float32(k) for k in THERMAL_CONSTANTS[8]]
         one = numpy.float32(1)
 
         im_B10 = numexpr.evaluate("K2_B10 / log((K1_B10 / im_B10) + one)")
@@ -894,12 +891,314 @@ def nd2toarbt(filename, images=None):
         raise Exception('This sensor is not Landsat 4, 5, 7, or 8!')
 
 
-def plcloud(filename, cldprob=22.5, num_Lst=None, images=None, shadow_prob=False, mask=None, aux_data=None):
+def _nearest_index(start, res, coords_start, coords_res, size, limit):
+    """
+    The indices of the nearest source pixels along one axis, for the
+    pixel centres of a destination grid; as per GDAL's nearest
+    neighbour resampling.
+    """
+    centres = start + (numpy.arange(size) + 0.5) * res
+    index = numpy.floor((centres - coords_start) / coords_res).astype('int')
+    return numpy.clip(index, 0, limit - 1)
+
+
+def acquisitions_toarbt(acquisitions, tile_lines=None):
+    """
+    Calculate the TOA reflectance and brightness temperature of a
+    Landsat scene from its acquisitions; the counterpart of `nd2toarbt`
+    for scenes already opened via `wagl.acquisition.acquisitions`.
+
+    The reflectance is scaled by 10000 and held as int16, and the
+    bands are converted in tiles of `tile_lines` lines, so that the
+    only full scene arrays are the results.
+
+    Unlike `nd2toarbt`, whose reflectance is unrounded float32, the
+    reflectance is rounded to the nearest integer; it differs from that
+    of `nd2toarbt` by at most 0.5. Hence the cloud tests of `plcloud`
+    can flip for the pixels within 0.5 of a threshold (eg a SWIR2
+    reflectance of 300.4 no longer passes `data6 > 300`), and the
+    resulting masks aren't bit-identical to those of `nd2toarbt`.
+
+    :param acquisitions:
+        A list of the scene's Landsat acquisitions. The bands not used
+        by Fmask are ignored.
+
+    :param tile_lines:
+        The number of lines of each tile. Default is None, which
+        derives it from the tiling memory budget (see
+        `wagl.tiling.plan_strips`).
+
+    :return:
+        The list returned by `nd2toarbt`; (temperature band
+        (celcius*100), the int16 reflectance band stack, dim, ul, zen,
+        azi, zc, B1Satu, B2Satu, B3Satu, resolu, geoT, prj)
+    """
+    acqs = {acq.band_id: acq for acq in acquisitions}
+    Lnum = int(acquisitions[0].platform_id[-1])
+    band_ids, thermal_id, saturated = FMASK_BANDS[Lnum]
+    reflective = [acqs[band_id] for band_id in band_ids]
+    thermal = acqs[thermal_id]
+
+    acq = reflective[0]
+    geobox = acq.gridded_geo_box()
+    lines, samples = dim = (acq.lines, acq.samples)
+    ul = geobox.origin
+    resolu = (geobox.pixelsize[0], geobox.pixelsize[0])
+    geoT = geobox.transform.to_gdal()
+    prj = geobox.crs.ExportToWkt()
+    zc = geobox.crs.GetUTMZone()
+    zen = 90 - numpy.float32(acq.solar_elevation)
+    azi = numpy.float32(acq.solar_azimuth)
+
+    # DN to TOA reflectance (with 0.0001 scale_factor) as gain & offset
+    # Landsat 8 is calibrated to reflectance, the others to radiance
+    cos_zen = math.cos(math.radians(zen))
+    scales = []
+    if Lnum == 8:
+        for band in reflective:
+            gain = ((band.max_reflectance - band.min_reflectance) /
+                    (band.max_quantize - band.min_quantize))
+            bias = band.max_reflectance - gain * band.max_quantize
+            scales.append((10000 * gain / cos_zen, 10000 * bias / cos_zen))
+    else:
+        dsun_doy = sun_earth_distance[acq.julian_day()]
+        for band in reflective:
+            esun = ESUN[Lnum][int(band.band_id) - 1]
+            scale = 10000.0 * math.pi * dsun_doy * dsun_doy / (esun * cos_zen)
+            scales.append((scale * band.gain, scale * band.bias))
+
+    # nearest neighbour resampling of a coarser thermal band
+    thm_box = thermal.gridded_geo_box()
+    if (thermal.lines, thermal.samples) != dim:
+        rows = _nearest_index(geobox.transform.f, geobox.transform.e,
+                              thm_box.transform.f, thm_box.transform.e,
+                              lines, thermal.lines)
+        cols = _nearest_index(geobox.transform.c, geobox.transform.a,
+                              thm_box.transform.c, thm_box.transform.a,
+                              samples, thermal.samples)
+    else:
+        rows = numpy.arange(lines)
+        cols = None
+
+    K1, K2 = [numpy.float32(k) for k in THERMAL_CONSTANTS[Lnum]]
+    K = numpy.float32(273.15)
+
+    images = numpy.zeros((len(reflective),) + dim, dtype='int16')
+    Temp = numpy.zeros(dim, dtype='float32')
+    B1Satu = numpy.zeros(dim, dtype='bool')
+    B2Satu = numpy.zeros(dim, dtype='bool')
+    B3Satu = numpy.zeros(dim, dtype='bool')
+
+    for tile in plan_strips(dim, tile_lines).tiles():
+        idx = tuple(slice(*t) for t in tile)
+        ys, ye = tile[0]
+
+        # thermal radiance to BT; Kelvin to Celcius with 0.01 scale_factor
+        tile_rows = rows[ys:ye]
+        window = ((tile_rows.min(), tile_rows.max() + 1),
+                  (0, thermal.samples))
+        dn = thermal.data(window=window)[tile_rows - tile_rows.min()]
+        if cols is not None:
+            dn = dn[:, cols]
+        missing = dn == 0
+        gain, bias = numpy.float32(thermal.gain), numpy.float32(thermal.bias)
+        Temp[idx] = numexpr.evaluate(
+            "100 * (K2 / log((K1 / (gain * dn + bias)) + 1) - K)")
+
+        for i, band in enumerate(reflective):
+            dn = band.data(window=tile)
+            missing |= dn == 0
+            if i < 3:
+                (B1Satu, B2Satu, B3Satu)[i][idx] = dn == saturated
+
+            gain, bias = [numpy.float32(v) for v in scales[i]]
+            toa = numexpr.evaluate("gain * dn + bias")
+            images[i][idx] = numpy.clip(numpy.rint(toa), -32768, 32767)
+
+        # get data ready for Fmask
+        Temp[idx][missing] = -9999
+        images[(slice(None),) + idx][:, missing] = -9999
+
+    # We'll modify the return argument for the Python implementation
+    # (geoT,prj) are added to the list
+    return [Temp, images, dim, ul, zen, azi, zc, B1Satu, B2Satu, B3Satu, resolu, geoT, prj]
+
+
+def _thin_prob(data, num_Lst, idx):
+    """
+    The cirrus probability of a tile; Landsat 8 only.
+    """
+    if num_Lst < 8:
+        return 0  # there is no contribution from the new bands
+
+    cirrus = data[-1][idx].astype('float32')
+    return numexpr.evaluate("cirrus / 400")
+
+
+def _ndvi_ndsi(data2, data3, data4, data5):
+    """
+    The NDVI and NDSI of a tile.
+    """
+    NDVI = numexpr.evaluate("(data4 - data3) / (data4 + data3)")
+    NDSI = numexpr.evaluate("(data2 - data5) / (data2 + data5)")
+
+    NDVI[numexpr.evaluate("(data4 + data3) == 0")] = 0.01
+    NDSI[numexpr.evaluate("(data2 + data5) == 0")] = 0.01
+
+    return NDVI, NDSI
+
+
+def _whiteness(data1, data2, data3, satu_Bv):
+    """
+    The whiteness of a tile; visible bands flatness
+    (sum(abs)/mean < 0.6 => brigt and dark cloud).
+    """
+    visimean = numexpr.evaluate("(data1 + data2 + data3) / 3 ")
+    whiteness = numexpr.evaluate(
+        "(abs(data1 - visimean) + abs(data2 - visimean)+ abs(data3 - visimean)) / visimean")
+    whiteness[satu_Bv] = 0  # If one visible is saturated whiteness == 0
+
+    return whiteness
+
+
+def _potential_cloud_tests(data, Temp, satu_Bv, num_Lst, idx):
+    """
+    The potential cloud, snow and water tests of a tile.
+
+    :param data:
+        The band stack of TOA reflectances (scaled by 10000).
+
+    :param Temp:
+        The brightness temperature (celcius*100).
+
+    :param satu_Bv:
+        The saturation of the visible bands.
+
+    :param num_Lst:
+        The Landsat satellite number.
+
+    :param idx:
+        A tuple of slices defining the tile.
+
+    :return:
+        A tuple of boolean arrays (potential cloud, snow, water).
+    """
+    data1, data2, data3, data4, data5, data6 = [
+        data[i][idx].astype('float32') for i in range(6)]
+    Temp = Temp[idx]
+    satu_Bv = satu_Bv[idx]
+    Thin_prob = _thin_prob(data, num_Lst, idx)
+
+    NDVI, NDSI = _ndvi_ndsi(data2, data3, data4, data5)
+
+    # Basic cloud test
+    idplcd = numexpr.evaluate(
+        "(NDSI < 0.8) & (NDVI < 0.8) & (data6 > 300) & (Temp < 2700)")
+
+    # Snow test
+    # It takes every snow pixels including snow pixel under thin clouds or icy
+    # clouds
+    snow = numexpr.evaluate(
+        "(NDSI > 0.15) & (Temp < 1000) & (data4 > 1100) & (data2 > 1000)")
+
+    # Water test
+    # Zhe's water test (works over thin cloud)
+    water = numexpr.evaluate(
+        "((NDVI < 0.01) & (data4 < 1100)) | ((NDVI < 0.1) & (NDVI > 0) & (data4 < 500))")
+
+    # ################################################ Whiteness test
+    # update idplcd
+    idplcd &= _whiteness(data1, data2, data3, satu_Bv) < 0.7
+
+    # Haze test
+    HOT = numexpr.evaluate("data1 - 0.5 * data3 - 800")  # Haze test
+    idplcd &= numexpr.evaluate("(HOT > 0) | satu_Bv")
+
+    # Ratio4/5>0.75 cloud test
+    idplcd &= numexpr.evaluate("(data4 / data5) > 0.75")
+
+    # Cirrus tests from Landsat 8
+    idplcd |= numexpr.evaluate("Thin_prob > 0.25")
+
+    return idplcd, snow, water
+
+
+def _cloud_probabilities(data, Temp, satu_B2, satu_B3, satu_Bv, num_Lst,
+                         idx, t_wtemp, t_templ, t_temph):
+    """
+    The cloud probabilities of a tile, over water and over land.
+
+    :param t_wtemp:
+        The 82.5 percentile of the clear water temperature.
+
+    :param t_templ:
+        The 17.5 percentile of the clear (land) temperature.
+
+    :param t_temph:
+        The 82.5 percentile of the clear (land) temperature.
+
+    See `_potential_cloud_tests` for the remaining parameters.
+
+    :return:
+        A tuple of float32 arrays (water probability, land probability).
+    """
+    data1, data2, data3, data4, data5 = [
+        data[i][idx].astype('float32') for i in range(5)]
+    Temp = Temp[idx]
+    satu_B2 = satu_B2[idx]
+    satu_B3 = satu_B3[idx]
+    Thin_prob = _thin_prob(data, num_Lst, idx)
+
+    # Get cloud prob over water
+    # temperature test (over water)
+    wTemp_prob = numexpr.evaluate('(t_wtemp - Temp) / 400')
+    wTemp_prob[numexpr.evaluate('wTemp_prob < 0')] = 0
+
+    # Brightness test (over water)
+    t_bright = 1100
+    Brightness_prob = data5 / t_bright
+    Brightness_prob[Brightness_prob > 1] = 1
+    Brightness_prob[Brightness_prob < 0] = 0
+
+    # Final prob mask (water)
+    # cloud over water probability
+    wfinal_prob = numexpr.evaluate(
+        '100 * wTemp_prob * Brightness_prob + 100 * Thin_prob')
+
+    # Temperature test
+    t_buffer = 4 * 100
+    t_tempL = t_templ - t_buffer
+    t_tempH = t_temph + t_buffer
+    Temp_l = t_tempH - t_tempL
+    Temp_prob = (t_tempH - Temp) / Temp_l
+    # Temperature can have prob > 1
+    Temp_prob[Temp_prob < 0] = 0
+    # Temp_prob(Temp_prob > 1) = 1
+
+    NDVI, NDSI = _ndvi_ndsi(data2, data3, data4, data5)
+    NDSI[numexpr.evaluate('satu_B2 & (NDSI < 0)')] = 0
+    NDVI[numexpr.evaluate('satu_B3 & (NDVI > 0)')] = 0
+    whiteness = _whiteness(data1, data2, data3, satu_Bv[idx])
+
+    Vari_prob = 1 - \
+        numpy.maximum(
+            numpy.maximum(numpy.absolute(NDSI), numpy.absolute(NDVI)), whiteness)
+
+    # Final prob mask (land)
+    final_prob = 100 * Temp_prob * Vari_prob + 100 * \
+        Thin_prob  # cloud over land probability
+
+    return wfinal_prob, final_prob
+
+
+def plcloud(filename, cldprob=22.5, num_Lst=None, images=None, shadow_prob=False, mask=None, aux_data=None, acquisitions=None,
+            tile_lines=None):
     """
     Calculates a cloud mask for a landsat 5/7 scene.
 
     :param filename:
         A string containing the file path of the landsat scene MTL file.
+        Ignored if `acquisitions` is given.
 
     :param cldprob:
         The cloud probability for the scene (defaults to 22.5%).
@@ -916,6 +1215,19 @@ def plcloud(filename, cldprob=22.5, num_Lst=None, images=None, shadow_prob=False
     :param shadow_prob:
         A flag indicating if the shadow probability should be calculated or not (required by FMask cloud shadow). Type Bool.
 
+    :param acquisitions:
+        A list of the scene's Landsat acquisitions, already opened via
+        `wagl.acquisition.acquisitions`. If given, the bands are read
+        via the acquisitions (see `acquisitions_toarbt`) rather than
+        re-discovered from the MTL file; the reflectance is then
+        rounded to int16, so the masks can differ from those of the
+        MTL file at the pixels near a threshold. Default is None.
+
+    :param tile_lines:
+        The number of lines of each tile of the spectral tests (and of
+        `acquisitions_toarbt`). Default is None, which derives it from
+        the tiling memory budget (see `wagl.tiling.plan_strips`).
+
     :return:
         Tuple (zen,azi,ptm, temperature band (celcius*100),t_templ,t_temph, water mask, snow mask, cloud mask , shadow probability,dim,ul,resolu,zc).
     """
@@ -925,79 +1237,40 @@ def plcloud(filename, cldprob=22.5, num_Lst=None, images=None, shadow_prob=False
     aux_data = aux_data or {}
     start_time = time.time()
 
-    Temp, data, dim, ul, zen, azi, zc, satu_B1, satu_B2, satu_B3, resolu, geoT, prj = nd2toarbt(
-        filename, images)
-
-    if num_Lst < 8:  # Landsat 4~7
-        Thin_prob = 0  # there is no contribution from the new bands
+    if acquisitions is not None:
+        Temp, data, dim, ul, zen, azi, zc, satu_B1, satu_B2, satu_B3, resolu, geoT, prj = acquisitions_toarbt(
+            acquisitions, tile_lines)
     else:
-        Thin_prob = numexpr.evaluate(
-            "cirrus / 400", {'cirrus': data[-1]}, locals())
+        Temp, data, dim, ul, zen, azi, zc, satu_B1, satu_B2, satu_B3, resolu, geoT, prj = nd2toarbt(
+            filename, images)
 
     Cloud = numpy.zeros(dim, 'uint8')  # cloud mask
     Snow = numpy.zeros(dim, 'uint8')  # Snow mask
     WT = numpy.zeros(dim, 'uint8')  # Water msk
 
     # process only the overlap area
-    if mask == None:
+    if mask is None:
         mask = Temp > -9999
     else:
         mask = mask.astype('bool')
 
     Shadow = numpy.zeros(dim, 'uint8')  # shadow mask
 
-    data1 = data[0, :, :]
-    data2 = data[1, :, :]
-    data3 = data[2, :, :]
-    data4 = data[3, :, :]
-    data5 = data[4, :, :]
-    data6 = data[5, :, :]
-
-    NDVI = numexpr.evaluate("(data4 - data3) / (data4 + data3)")
-    NDSI = numexpr.evaluate("(data2 - data5) / (data2 + data5)")
-
-    NDVI[numexpr.evaluate("(data4 + data3) == 0")] = 0.01
-    NDSI[numexpr.evaluate("(data2 + data5) == 0")] = 0.01
-
     # saturation in the three visible bands
     satu_Bv = numexpr.evaluate("(satu_B1 | satu_B2 | satu_B3)")
     del satu_B1
-    # Basic cloud test
-    idplcd = numexpr.evaluate(
-        "(NDSI < 0.8) & (NDVI < 0.8) & (data6 > 300) & (Temp < 2700)")
 
-    # Snow test
-    # It takes every snow pixels including snow pixel under thin clouds or icy
-    # clouds
-    Snow[numexpr.evaluate(
-        "(NDSI > 0.15) & (Temp < 1000) & (data4 > 1100) & (data2 > 1000)")] = 1
+    # The spectral tests are evaluated in tiles, so that the indices
+    # (NDVI, NDSI, whiteness, HOT) are never held for the full scene
+    tiles = [tuple(slice(*t) for t in tile) for tile in
+             plan_strips(dim, tile_lines).tiles()]
+
+    idplcd = numpy.zeros(dim, 'bool')
+    for idx in tiles:
+        idplcd[idx], Snow[idx], WT[idx] = _potential_cloud_tests(
+            data, Temp, satu_Bv, num_Lst, idx)
     #Snow[mask == 0] = 255
-    # Water test
-    # Zhe's water test (works over thin cloud)
-    WT[numexpr.evaluate(
-        "((NDVI < 0.01) & (data4 < 1100)) | ((NDVI < 0.1) & (NDVI > 0) & (data4 < 500))")] = 1
     WT[mask == 0] = 255
-    # ################################################ Whiteness test
-    # visible bands flatness (sum(abs)/mean < 0.6 => brigt and dark cloud )
-    visimean = numexpr.evaluate("(data1 + data2 + data3) / 3 ")
-    whiteness = numexpr.evaluate(
-        "(abs(data1 - visimean) + abs(data2 - visimean)+ abs(data3 - visimean)) / visimean")
-    del visimean
-
-    # update idplcd
-    whiteness[satu_Bv] = 0  # If one visible is saturated whiteness == 0
-    idplcd &= whiteness < 0.7
-
-    # Haze test
-    HOT = numexpr.evaluate("data1 - 0.5 * data3 - 800")  # Haze test
-    idplcd &= numexpr.evaluate("(HOT > 0) | satu_Bv")
-    del HOT  # need to find thick warm cloud
-
-    # Ratio4/5>0.75 cloud test
-    idplcd &= numexpr.evaluate("(data4 / data5) > 0.75")
-
-    # Cirrus tests from Landsat 8
-    idplcd |= numexpr.evaluate("Thin_prob > 0.25")
 
     ####################################constants##########################
     l_pt = 0.175  # low percent
@@ -1052,72 +1325,47 @@ def plcloud(filename, cldprob=22.5, num_Lst=None, images=None, shadow_prob=False
         if len(F_wtemp) == 0:
             t_wtemp = 0
         else:
-            t_wtemp = scipy.stats.scoreatpercentile(F_wtemp, 100 * h_pt)
-        wTemp_prob = numexpr.evaluate('(t_wtemp - Temp) / 400')
-        wTemp_prob[numexpr.evaluate('wTemp_prob < 0')] = 0
-
-        # Brightness test (over water)
-        t_bright = 1100
-        Brightness_prob = data5 / t_bright
-        Brightness_prob[Brightness_prob > 1] = 1
-        Brightness_prob[Brightness_prob < 0] = 0
-
-        # Final prob mask (water)
-        # cloud over water probability
-        wfinal_prob = numexpr.evaluate(
-            '100 * wTemp_prob * Brightness_prob + 100 * Thin_prob')
-        wclr_max = scipy.stats.scoreatpercentile(
-            wfinal_prob[idwt], 100 * h_pt) + cldprob  # dynamic threshold (land)
-        # wclr_max=50;% fixed threshold (water)
-
-        # release memory
-        del wTemp_prob
-        del Brightness_prob
+            t_wtemp = percentiles(F_wtemp, 100 * h_pt)
 
         # Temperature test
-        t_buffer = 4 * 100
         if len(F_temp) != 0:
             # 0.175 percentile background temperature (low)
-            t_templ = scipy.stats.scoreatpercentile(F_temp, 100 * l_pt)
             # 0.825 percentile background temperature (high)
-            t_temph = scipy.stats.scoreatpercentile(F_temp, 100 * h_pt)
+            t_templ, t_temph = percentiles(F_temp, [100 * l_pt, 100 * h_pt])
         else:
             t_templ = 0
             t_temph = 0
 
-        t_tempL = t_templ - t_buffer
-        t_tempH = t_temph + t_buffer
-        Temp_l = t_tempH - t_tempL
-        Temp_prob = (t_tempH - Temp) / Temp_l
-        # Temperature can have prob > 1
-        Temp_prob[Temp_prob < 0] = 0
-        # Temp_prob(Temp_prob > 1) = 1
-
-        NDSI[numexpr.evaluate('satu_B2 & (NDSI < 0)')] = 0
-        NDVI[numexpr.evaluate('satu_B3 & (NDVI > 0)')] = 0
-
-        Vari_prob = 1 - \
-            numpy.maximum(
-                numpy.maximum(numpy.absolute(NDSI), numpy.absolute(NDVI)), whiteness)
-
         # release memory
-        logging.debug("FMASK releasing memory")
-        del satu_B2
-        del satu_B3
-        del NDSI
-        del NDVI
-        del whiteness
-
-        # Final prob mask (land)
-        final_prob = 100 * Temp_prob * Vari_prob + 100 * \
-            Thin_prob  # cloud over land probability
-        clr_max = scipy.stats.scoreatpercentile(
-            final_prob[idlnd], 100 * h_pt) + cldprob  # dynamic threshold (land)
+        del idclr
+        del F_temp
+        del F_wtemp
+
+        # Final prob mask (water & land)
+        # sampled over the clear pixels for the dynamic thresholds
+        wfinal_samples = numpy.empty(idwt.sum(), dtype='float32')
+        final_samples = numpy.empty(idlnd.sum(), dtype='float32')
+        wstart = start = 0
+        for idx in tiles:
+            wfinal_prob, final_prob = _cloud_probabilities(
+                data, Temp, satu_B2, satu_B3, satu_Bv, num_Lst, idx,
+                t_wtemp, t_templ, t_temph)
+            wsample = wfinal_prob[idwt[idx]]
+            sample = final_prob[idlnd[idx]]
+            wfinal_samples[wstart:wstart + wsample.size] = wsample
+            final_samples[start:start + sample.size] = sample
+            wstart += wsample.size
+            start += sample.size
+
+        wclr_max = percentiles(
+            wfinal_samples, 100 * h_pt) + cldprob  # dynamic threshold (land)
+        # wclr_max=50;% fixed threshold (water)
+        clr_max = percentiles(
+            final_samples, 100 * h_pt) + cldprob  # dynamic threshold (land)
 
         # release memory
-        del Vari_prob
-        del Temp_prob
-        del Thin_prob
+        del wfinal_samples
+        del final_samples
 
         logging.debug('cldprob: %s', cldprob)
         logging.debug('clr_max: %s', clr_max)
@@ -1129,37 +1377,49 @@ def plcloud(filename, cldprob=22.5, num_Lst=None, images=None, shadow_prob=False
         # thin cloud over water : (idplcd & (wfinal_prob > wclr_max) & (WT == 1))
         # high prob cloud (land) : (final_prob > 99.0) & (WT == 0)
         # extremly cold cloud : (Temp < t_templ - 3500)
-        id_final_cld = numexpr.evaluate(
-            '(idplcd & (final_prob > clr_max) & (WT == 0)) | (idplcd & (wfinal_prob > wclr_max) & (WT == 1)) | (Temp < t_templ - 3500)')
-
-        # Star with potential cloud mask
-        # # potential cloud mask
-        Cloud[id_final_cld] = 1
+        # the probabilities are re-evaluated per tile rather than held
+        for idx in tiles:
+            wfinal_prob, final_prob = _cloud_probabilities(
+                data, Temp, satu_B2, satu_B3, satu_Bv, num_Lst, idx,
+                t_wtemp, t_templ, t_temph)
+            id_final_cld = numexpr.evaluate(
+                '(idplcd & (final_prob > clr_max) & (WT == 0)) | (idplcd & (wfinal_prob > wclr_max) & (WT == 1)) | (Temp < t_templ - 3500)',
+                {'idplcd': idplcd[idx], 'WT': WT[idx], 'Temp': Temp[idx]},
+                locals())
+
+            # Star with potential cloud mask
+            # # potential cloud mask
+            Cloud[idx][id_final_cld] = 1
 
         # release memory
-        del final_prob
+        logging.debug("FMASK releasing memory")
+        del satu_B2
+        del satu_B3
         del wfinal_prob
+        del final_prob
         del id_final_cld
 
         # Start with potential cloud shadow mask
         if shadow_prob:
+            data4 = data[3, :, :]
+            data5 = data[4, :, :]
+
             # band 4 flood fill
             nir = data4.astype('float32')
             # estimating background (land) Band 4 ref
-            backg_B4 = scipy.stats.scoreatpercentile(nir[idlnd], 100.0 * l_pt)
+            backg_B4 = percentiles(nir[idlnd], 100.0 * l_pt)
             nir[mask == 0] = backg_B4
             # fill in regional minimum Band 4 ref
             nir = imfill_skimage(nir)
             nir = nir - data4
 
             # band 5 flood fill
-            swir = data5
+            swir = data5.astype('float32')
             # estimating background (land) Band 4 ref
-            backg_B5 = scipy.stats.scoreatpercentile(swir[idlnd], 100.0 * l_pt)
+            backg_B5 = percentiles(swir[idlnd], 100.0 * l_pt)
             swir[mask == 0] = backg_B5
             # fill in regional minimum Band 5 ref
-            swir = imfill_skimage(swir)
-            swir = swir - data5
+            swir = imfill_skimage(swir) - swir
 
             # compute shadow probability
             shadow_prob = numpy.minimum(nir, swir)
@@ -1226,9 +1486,8 @@ def plcloud(filename, cldprob=22.5, num_Lst=None, images=None, shadow_prob=False
         if numpy.sum(cloud_mask) > 0:
             cloud_stddev = numpy.std(
                 cloud_temp, dtype='float64', ddof=1) / 100.0
-            pct_upper = numpy.percentile(cloud_temp, 97.5) / 100.0
-            pct_lower = numpy.percentile(cloud_temp, 83.5) / 100.0
-            pct_upper_max = numpy.percentile(cloud_temp, 98.75) / 100.0
+            pct_upper, pct_lower, pct_upper_max = percentiles(
+                cloud_temp, [97.5, 83.5, 98.75]) / 100.0
 
             logging.debug("FMASK Standard Deviation: %f C", cloud_stddev)
             aux_data['FMASK_std_dev_degC'] = cloud_stddev
@@ -1585,22 +1844,17 @@ def fcssm(Sun_zen, Sun_azi, ptm, Temp, t_templ, t_temph, Water, Snow, plcim, pls
         # fprintf('Dilate #d pixels for cloud & #d pixels for shadow
         # objects\n',cldpix,sdpix)
 
-        # NOTE: An alternative for a structuring element would be to use the iterations parameter of binary_dilation()
-        # The number of iterations is equal to the number of dilations if using
-        # a 3x3 structuring element. JS 16/12/2013
+        # NOTE: The square structuring elements are separable, and the
+        # dilations are evaluated via wagl.morphology
         SEc = 2 * cldpix + 1
-        SEc = numpy.ones((SEc, SEc), 'uint8')
         SEs = 2 * sdpix + 1
-        SEs = numpy.ones((SEs, SEs), 'uint8')
         SEsn = 2 * snpix + 1
-        SEsn = numpy.ones((SEsn, SEsn), 'uint8')
 
         # dilate shadow first
         # NOTE: The original transcription returned the inverse, i.e.
         # cloud_shadow = 0 rather than 1. We'll try inverting it outside this
         # function in order to preserve the original return values of Fmask
-        shadow_cal = scipy.ndimage.morphology.binary_dilation(
-            shadow_cal, structure=SEs)
+        shadow_cal = square_dilation(shadow_cal, SEs)
 
         #     # find shadow within plshadow
         #     shadow_cal(shadow_test~=1)=0
@@ -1611,10 +1865,9 @@ def fcssm(Sun_zen, Sun_azi, ptm, Temp, t_templ, t_temph, Water, Snow, plcim, pls
         # NOTE: The original transcription returned the inverse, i.e. cloud = 0
         # rather than 1. We'll try inverting it outside this function in order
         # to preserve the original return values of Fmask
-        cloud_cal = scipy.ndimage.morphology.binary_dilation(
-            segm_cloud_tmp, structure=SEc)
+        cloud_cal = square_dilation(segm_cloud_tmp, SEc)
 
-        Snow = scipy.ndimage.morphology.binary_dilation(Snow, structure=SEsn)
+        Snow = square_dilation(Snow, SEsn)
 
     cs_final[Water == 1] = 1
     # mask from plcloud
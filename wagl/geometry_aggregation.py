@@ -0,0 +1,731 @@
+#!/usr/bin/env python
+
+"""
+Deriving coarser resolution geometry
+------------------------------------
+
+The resolution groups of a multi-resolution sensor share the same
+CRS and extent, with pixel sizes that are integer multiples of the
+finest group. Rather than independently computing the geometry
+products for every resolution group, they can be computed once for
+the finest group, and derived for the coarser groups by aggregating
+each block of fine pixels that make up a coarse pixel.
+
+Quantities that are evaluated at the pixel centre (longitude,
+latitude and the satellite and solar angles) are taken at the centre
+of each block; decimation for odd factors, or the mean of the central
+2x2 pixels for even factors. Terrain quantities are averaged across
+the whole block, and masks take the majority value of the block.
+Angles measured in azimuth are averaged as unit vectors.
+
+Each derived dataset records the derivation within its attributes:
+
+    * derived_from; the pathname of the source dataset
+    * derivation_method; the `Aggregation` applied
+    * aggregation_factor; the (y, x) block size in fine pixels
+    * aggregation_max_deviation; the largest absolute difference
+      between a derived value and any fine value within its block
+    * aggregation_mean_deviation; the mean of the per-pixel differences
+    * aggregation_error_bound; a bound on the absolute difference
+      between a derived value and an independent computation of the
+      quantity at the centre of the coarse pixel (see below)
+
+For masks, the maximum and mean deviation is the fraction of blocks
+whose fine pixels don't unanimously agree, and there is no error
+bound.
+
+The deviations describe the variation within each block. The error
+bound is against an independent evaluation at the coarse pixel
+centres. The fine pixels aggregated by a block are placed
+symmetrically about the centre of the coarse pixel, so the first order
+terms of a Taylor expansion about the centre cancel, and the
+difference is bounded (to second order) by:
+
+    0.5 * (max|f_yy| * var_y + max|f_xx| * var_x)
+
+where f_yy and f_xx are the second differences of the fine data
+across the block (and its neighbouring pixels), and var_y and var_x are the mean squared offsets
+(in fine pixels) of the aggregated pixels from the centre; zero for
+the decimation of odd factors, 1/4 for the central 2x2 pixels of even
+factors, and (n**2 - 1) / 12 for the mean of n pixels. The bound
+holds for quantities that vary smoothly across a block (the angles,
+coordinates and time), and is indicative only for the terrain
+quantities, whose independent coarse computation is from the coarse
+DSM. `derivation_error` measures the actual difference when
+validating the derived datasets against an independent computation.
+"""
+
+from __future__ import absolute_import, print_function
+from enum import Enum
+from posixpath import basename
+
+import numpy
+import h5py
+
+from wagl.constants import DatasetName, GroupName
+from wagl.dsm import buffered_geobox
+from wagl.geobox import GriddedGeoBox
+from wagl.hdf5 import H5CompressionFilter, attach_table_attributes
+from wagl.satellite_solar_angles import convert_to_lonlat, create_boxline
+
+# the number of coarse rows aggregated at a time
+STRIP_ROWS = 256
+
+
+class GeometryAlignmentError(Exception):
+
+    """
+    Specific error handle for grids that can't be derived from one
+    another by block aggregation.
+    """
+    pass
+
+
+class Aggregation(Enum):
+
+    """
+    The methods of aggregating a block of fine pixels.
+    """
+    CENTRE = 'centre'
+    MEAN = 'mean'
+    CIRCULAR_CENTRE = 'circular-centre'
+    CIRCULAR_MEAN = 'circular-mean'
+    MAJORITY = 'majority'
+
+
+AGGREGATION_METHODS = {
+    DatasetName.LON.value: Aggregation.CIRCULAR_CENTRE,
+    DatasetName.LAT.value: Aggregation.CENTRE,
+    DatasetName.SATELLITE_VIEW.value: Aggregation.CENTRE,
+    DatasetName.SATELLITE_AZIMUTH.value: Aggregation.CIRCULAR_CENTRE,
+    DatasetName.SOLAR_ZENITH.value: Aggregation.CENTRE,
+    DatasetName.SOLAR_AZIMUTH.value: Aggregation.CIRCULAR_CENTRE,
+    DatasetName.RELATIVE_AZIMUTH.value: Aggregation.CIRCULAR_CENTRE,
+    DatasetName.TIME.value: Aggregation.CENTRE,
+    DatasetName.DSM.value: Aggregation.MEAN,
+    DatasetName.DSM_SMOOTHED.value: Aggregation.MEAN,
+    DatasetName.SLOPE.value: Aggregation.MEAN,
+    DatasetName.ASPECT.value: Aggregation.CIRCULAR_MEAN,
+    DatasetName.INCIDENT.value: Aggregation.MEAN,
+    DatasetName.AZIMUTHAL_INCIDENT.value: Aggregation.CIRCULAR_MEAN,
+    DatasetName.EXITING.value: Aggregation.MEAN,
+    DatasetName.AZIMUTHAL_EXITING.value: Aggregation.CIRCULAR_MEAN,
+    DatasetName.RELATIVE_SLOPE.value: Aggregation.CIRCULAR_MEAN,
+    DatasetName.SELF_SHADOW.value: Aggregation.MAJORITY,
+    DatasetName.COMBINED_SHADOW.value: Aggregation.MAJORITY,
+    DatasetName.CAST_SHADOW_FMT.value.format(source='SUN'):
+        Aggregation.MAJORITY,
+    DatasetName.CAST_SHADOW_FMT.value.format(source='SATELLITE'):
+        Aggregation.MAJORITY}
+
+# satellite-solar tables that are independent of the resolution
+RESOLUTION_INDEPENDENT_TABLES = [DatasetName.SPHEROID.value,
+                                 DatasetName.ORBITAL_ELEMENTS.value,
+                                 DatasetName.SATELLITE_MODEL.value,
+                                 DatasetName.SATELLITE_TRACK.value]
+
+
+def aggregation_method(dataset):
+    """
+    Return the `Aggregation` to use for a dataset; looked up by name,
+    otherwise the majority for boolean datasets and the mean for all
+    others.
+    """
+    method = AGGREGATION_METHODS.get(basename(dataset.name))
+    if method is None:
+        if dataset.dtype == numpy.bool_:
+            method = Aggregation.MAJORITY
+        else:
+            method = Aggregation.MEAN
+
+    return method
+
+
+def aggregation_window(fine_geobox, coarse_geobox, tolerance=1e-6):
+    """
+    Determine the block aggregation that maps a fine resolution
+    grid onto a coarse resolution grid.
+
+    :param fine_geobox:
+        An instance of a `GriddedGeoBox` defining the fine grid.
+
+    :param coarse_geobox:
+        An instance of a `GriddedGeoBox` defining the coarse grid.
+
+    :param tolerance:
+        The tolerance, in pixels, of the grid alignment checks.
+
+    :return:
+        A tuple of the ((row_start, row_stop), (col_start, col_stop))
+        window of the fine grid covered by the coarse grid, and the
+        (y, x) aggregation factor.
+
+    :raises:
+        `GeometryAlignmentError` when the coarse grid isn't an
+        aggregation of the fine grid, or extends beyond it.
+    """
+    if fine_geobox.crs.ExportToWkt() != coarse_geobox.crs.ExportToWkt():
+        raise GeometryAlignmentError("The grids have differing CRS's.")
+
+    factor = []
+    for fine, coarse in zip(fine_geobox.pixelsize, coarse_geobox.pixelsize):
+        ratio = coarse / fine
+        if abs(ratio - round(ratio)) > tolerance or round(ratio) < 1:
+            msg = "Pixel size {} isn't a multiple of {}."
+            raise GeometryAlignmentError(msg.format(coarse, fine))
+        factor.append(int(round(ratio)))
+    factor_x, factor_y = factor
+
+    col, row = ~fine_geobox.transform * coarse_geobox.origin
+    if (abs(col - round(col)) > tolerance or
+            abs(row - round(row)) > tolerance):
+        raise GeometryAlignmentError("The grid origins aren't aligned.")
+
+    col, row = int(round(col)), int(round(row))
+    rows, cols = coarse_geobox.shape
+    window = ((row, row + rows * factor_y), (col, col + cols * factor_x))
+
+    fine_rows, fine_cols = fine_geobox.shape
+    if (row < 0 or col < 0 or window[0][1] > fine_rows or
+            window[1][1] > fine_cols):
+        msg = "The coarse grid extends beyond the fine grid."
+        raise GeometryAlignmentError(msg)
+
+    return window, (factor_y, factor_x)
+
+
+def _centre_slices(factor):
+    """
+    The slices of the pixel(s) at the centre of a block.
+    """
+    slices = []
+    for size in factor:
+        start = (size - 1) // 2
+        slices.append(slice(start, size - start))
+    return slices
+
+
+def _nanmean(data, axis):
+    """
+    Mean ignoring NaN's, returning NaN (without warning) for
+    all NaN blocks.
+    """
+    valid = ~numpy.isnan(data)
+    count = valid.sum(axis=axis)
+    total = numpy.where(valid, data, 0).sum(axis=axis)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return total / count
+
+
+def aggregate_blocks(data, factor, method, no_data=None):
+    """
+    Aggregate each (y, x) `factor` sized block of a 2D array.
+
+    :param data:
+        A 2D `NumPy` array whose dimensions are multiples of `factor`.
+
+    :param factor:
+        A (y, x) tuple of the block size.
+
+    :param method:
+        An `Aggregation` enum.
+
+    :param no_data:
+        The value marking pixels to exclude from the aggregation.
+        A block without any valid pixels is set to `no_data`.
+        Default is None (all pixels are valid). Ignored for
+        `Aggregation.MAJORITY`.
+
+    :return:
+        A tuple of the aggregated array, and an array of the
+        per-pixel deviations (see the module description); NaN
+        wherever a block has no valid pixels.
+    """
+    factor_y, factor_x = factor
+    rows = data.shape[0] // factor_y
+    cols = data.shape[1] // factor_x
+    blocks = data.reshape(rows, factor_y, cols, factor_x).swapaxes(1, 2)
+    axis = (2, 3)
+
+    if method == Aggregation.MAJORITY:
+        count = blocks.sum(axis=axis)
+        size = factor_y * factor_x
+        # ties are resolved to False
+        result = (2 * count) > size
+        deviation = ((count > 0) & (count < size)).astype('float64')
+        return result.astype(data.dtype), deviation
+
+    blocks = blocks.astype('float64')
+    if no_data is not None:
+        blocks[blocks == no_data] = numpy.nan
+
+    if method in (Aggregation.CENTRE, Aggregation.CIRCULAR_CENTRE):
+        slice_y, slice_x = _centre_slices(factor)
+        sample = blocks[:, :, slice_y, slice_x]
+    else:
+        sample = blocks
+
+    if method in (Aggregation.CIRCULAR_CENTRE, Aggregation.CIRCULAR_MEAN):
+        radians = numpy.radians(sample)
+        result = numpy.degrees(numpy.arctan2(_nanmean(numpy.sin(radians),
+                                                      axis),
+                                             _nanmean(numpy.cos(radians),
+                                                      axis)))
+
+        # retain the [0, 360) convention where the block uses it
+        with numpy.errstate(invalid='ignore'):
+            positive = numpy.where(numpy.isnan(blocks), numpy.inf,
+                                   blocks).min(axis=axis) >= 0
+            result[positive & (result < 0)] += 360.0
+            result[result >= 360.0] -= 360.0
+
+        difference = blocks - result[:, :, numpy.newaxis, numpy.newaxis]
+        difference = numpy.abs((difference + 180.0) % 360.0 - 180.0)
+    else:
+        result = _nanmean(sample, axis)
+        difference = numpy.abs(blocks -
+                               result[:, :, numpy.newaxis, numpy.newaxis])
+
+    valid = ~numpy.isnan(difference)
+    deviation = numpy.where(valid, difference, -numpy.inf).max(axis=axis)
+    deviation[~valid.any(axis=axis)] = numpy.nan
+
+    if no_data is not None:
+        result[numpy.isnan(result)] = no_data
+
+    return result, deviation
+
+
+def _offset_variance(factor, method):
+    """
+    The mean squared (y, x) offset, in fine pixels, of the pixels
+    aggregated by a block from the centre of the block.
+    """
+    if method in (Aggregation.CENTRE, Aggregation.CIRCULAR_CENTRE):
+        sizes = [s.stop - s.start for s in _centre_slices(factor)]
+    else:
+        sizes = factor
+    return [(n * n - 1) / 12.0 for n in sizes]
+
+
+def _curvature(data, axis, circular):
+    """
+    The largest absolute second difference of a 2D array along an
+    axis, within the 3x3 neighbourhood of each pixel (such that the
+    curvature between the pixels at the edge of a block is accounted
+    for); angular differences if `circular`.
+    """
+    if data.shape[axis] < 3:
+        return numpy.zeros(data.shape)
+
+    first = numpy.diff(data, axis=axis)
+    if circular:
+        first = (first + 180.0) % 360.0 - 180.0
+    second = numpy.abs(numpy.diff(first, axis=axis))
+
+    pad = [(0, 0), (0, 0)]
+    pad[axis] = (1, 1)
+    second = numpy.pad(second, pad, mode='edge')
+
+    rows, cols = data.shape
+    padded = numpy.pad(second, 1, mode='edge')
+    result = second
+    for y in range(3):
+        for x in range(3):
+            result = numpy.fmax(result, padded[y:y + rows, x:x + cols])
+    return result
+
+
+def aggregation_error_bound(data, factor, method, no_data=None):
+    """
+    Bound the difference between the aggregate of each block and an
+    independent evaluation at the centre of the block, from the
+    curvature of the fine data (see the module description).
+
+    :param data:
+        A 2D `NumPy` array whose dimensions are multiples of `factor`.
+
+    :param factor:
+        A (y, x) tuple of the block size.
+
+    :param method:
+        An `Aggregation` enum, other than `Aggregation.MAJORITY`.
+
+    :param no_data:
+        The value marking pixels to exclude.
+        Default is None (all pixels are valid).
+
+    :return:
+        An array of the bound for each block; NaN wherever a block
+        has no valid second differences.
+    """
+    factor_y, factor_x = factor
+    rows = data.shape[0] // factor_y
+    cols = data.shape[1] // factor_x
+    circular = method in (Aggregation.CIRCULAR_CENTRE,
+                          Aggregation.CIRCULAR_MEAN)
+
+    data = data.astype('float64')
+    if no_data is not None:
+        data[data == no_data] = numpy.nan
+
+    bound = numpy.zeros((rows, cols))
+    valid = numpy.zeros((rows, cols), dtype='bool')
+    for axis, variance in enumerate(_offset_variance(factor, method)):
+        curvature = _curvature(data, axis, circular)
+        blocks = curvature.reshape(rows, factor_y, cols,
+                                   factor_x).swapaxes(1, 2)
+        finite = ~numpy.isnan(blocks)
+        maximum = numpy.where(finite, blocks, 0).max(axis=(2, 3))
+        bound += 0.5 * maximum * variance
+        valid |= finite.any(axis=(2, 3))
+
+    bound[~valid] = numpy.nan
+    return bound
+
+
+def aggregate_dataset(dataset, coarse_geobox, out_group, dataset_name=None,
+                      method=None, compression=H5CompressionFilter.LZF,
+                      filter_opts=None):
+    """
+    Derive a coarse resolution image dataset from a fine resolution
+    image dataset, recording the deviations of the fine values within
+    each block, and the bound on the difference from an independent
+    computation, in the derived dataset's attributes.
+
+    :param dataset:
+        A `h5py.Dataset` of the HDF5 IMAGE CLASS containing the
+        fine resolution data. The `geotransform` and `crs_wkt`
+        attributes define its grid.
+
+    :param coarse_geobox:
+        An instance of a `GriddedGeoBox` defining the coarse grid.
+
+    :param out_group:
+        A writeable HDF5 `Group` object.
+
+    :param dataset_name:
+        The name of the output dataset. Default is the basename
+        of `dataset`.
+
+    :param method:
+        An `Aggregation` enum. Default is determined by
+        `aggregation_method`.
+
+    :param compression:
+        The compression filter to use.
+        Default is H5CompressionFilter.LZF
+
+    :filter_opts:
+        A dict of key value pairs available to the given configuration
+        instance of H5CompressionFilter. For example
+        H5CompressionFilter.LZF has the keywords *chunks* and *shuffle*
+        available.
+        Default is None, which will use the default settings for the
+        chosen H5CompressionFilter instance.
+
+    :return:
+        A `dict` containing the maximum and mean deviation, and the
+        error bound (NaN for masks).
+    """
+    fine_geobox = GriddedGeoBox.from_h5_dataset(dataset)
+    window, factor = aggregation_window(fine_geobox, coarse_geobox)
+
+    if dataset_name is None:
+        dataset_name = basename(dataset.name)
+
+    if method is None:
+        method = aggregation_method(dataset)
+
+    if filter_opts is None:
+        filter_opts = {}
+    else:
+        filter_opts = filter_opts.copy()
+
+    shape = coarse_geobox.get_shape_yx()
+    if dataset.chunks is not None:
+        filter_opts['chunks'] = tuple(min(c, s) for c, s in
+                                      zip(dataset.chunks, shape))
+
+    kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
+    no_data = dataset.attrs.get('no_data_value')
+    if no_data is not None:
+        kwargs['fillvalue'] = no_data
+
+    out_dset = out_group.create_dataset(dataset_name, shape=shape,
+                                        dtype=dataset.dtype, **kwargs)
+
+    (row_start, _), (col_start, col_stop) = window
+    factor_y, factor_x = factor
+    max_deviation = 0.0
+    total_deviation = 0.0
+    count = 0
+    error_bound = numpy.nan if method == Aggregation.MAJORITY else 0.0
+    for ystart in range(0, shape[0], STRIP_ROWS):
+        yend = min(ystart + STRIP_ROWS, shape[0])
+        idx = (slice(row_start + ystart * factor_y,
+                     row_start + yend * factor_y),
+               slice(col_start, col_stop))
+        data = dataset[idx]
+        result, deviation = aggregate_blocks(data, factor, method, no_data)
+        out_dset[ystart:yend] = result
+
+        if method != Aggregation.MAJORITY:
+            bound = aggregation_error_bound(data, factor, method, no_data)
+            if (~numpy.isnan(bound)).any():
+                error_bound = max(error_bound, float(numpy.nanmax(bound)))
+
+        valid = ~numpy.isnan(deviation)
+        if valid.any():
+            max_deviation = max(max_deviation, float(deviation[valid].max()))
+            total_deviation += float(deviation[valid].sum())
+            count += int(valid.sum())
+
+    mean_deviation = total_deviation / count if count else 0.0
+    deviations = {'aggregation_max_deviation': max_deviation,
+                  'aggregation_mean_deviation': mean_deviation,
+                  'aggregation_error_bound': error_bound}
+
+    # the source attributes, placed on the coarse grid
+    for key in dataset.attrs:
+        dtype = dataset.attrs.get_id(key).dtype
+        out_dset.attrs.create(key, dataset.attrs[key], dtype=dtype)
+
+    out_dset.attrs['geotransform'] = coarse_geobox.transform.to_gdal()
+    out_dset.attrs['derived_from'] = dataset.name
+    out_dset.attrs['derivation_method'] = method.value
+    out_dset.attrs['aggregation_factor'] = factor
+    for key in deviations:
+        if not numpy.isnan(deviations[key]):
+            out_dset.attrs[key] = deviations[key]
+
+    return deviations
+
+
+def _require_group(out_group, group_name):
+    """
+    Return the named group of `out_group`, creating it if required.
+    """
+    if group_name not in out_group:
+        out_group.create_group(group_name)
+    return out_group[group_name]
+
+
+def derive_group(fine_group, coarse_geobox, out_group, dataset_names=None,
+                 compression=H5CompressionFilter.LZF, filter_opts=None):
+    """
+    Derive the image datasets of a fine resolution geometry group
+    (such as `GroupName.INCIDENT_GROUP`) for a coarse resolution grid.
+    The derived datasets are written to a group of the same name
+    within `out_group`.
+
+    :param fine_group:
+        The fine resolution HDF5 `Group`.
+
+    :param coarse_geobox:
+        An instance of a `GriddedGeoBox` defining the coarse grid.
+
+    :param out_group:
+        A writeable HDF5 `Group` object.
+
+    :param dataset_names:
+        A `list` of the names of the datasets to derive. Default is
+        every IMAGE CLASS dataset within `fine_group`.
+
+    :param compression:
+        The compression filter to use.
+        Default is H5CompressionFilter.LZF
+
+    :filter_opts:
+        A dict of key value pairs available to the given configuration
+        instance of H5CompressionFilter.
+        Default is None.
+
+    :return:
+        A `dict` of the deviations keyed by dataset name.
+
+    :raises:
+        `GeometryAlignmentError` if any of the datasets can't be
+        derived, prior to anything being written.
+    """
+    if dataset_names is None:
+        dataset_names = [name for name, obj in fine_group.items()
+                         if isinstance(obj, h5py.Dataset) and
+                         obj.attrs.get('CLASS') == 'IMAGE']
+
+    # check all datasets prior to writing any
+    for dname in dataset_names:
+        geobox = GriddedGeoBox.from_h5_dataset(fine_group[dname])
+        aggregation_window(geobox, coarse_geobox)
+
+    group_name = basename(fine_group.name)
+    grp = _require_group(out_group, group_name)
+
+    deviations = {}
+    for dname in dataset_names:
+        deviations[dname] = aggregate_dataset(fine_group[dname],
+                                              coarse_geobox, grp, dname,
+                                              compression=compression,
+                                              filter_opts=filter_opts)
+
+    return deviations
+
+
+def derive_elevation(acquisition, fine_group, buffer_distance, out_group,
+                     compression=H5CompressionFilter.LZF, filter_opts=None):
+    """
+    Derive the buffered DSM of a coarse resolution acquisition from
+    the buffered DSM of a fine resolution acquisition.
+    See `wagl.dsm.get_dsm`.
+
+    :param acquisition:
+        An instance of an `Acquisition` object from the coarse
+        resolution group.
+
+    :param fine_group:
+        The fine resolution `GroupName.ELEVATION_GROUP` HDF5 `Group`.
+
+    :param buffer_distance:
+        A number representing the desired distance (in the same
+        units as the acquisition) in which to buffer an image.
+
+    :param out_group:
+        A writeable HDF5 `Group` object.
+
+    :return:
+        A `dict` of the deviations keyed by dataset name.
+
+    :raises:
+        `GeometryAlignmentError` if the coarse buffered extent
+        isn't contained by the fine buffered extent.
+    """
+    margins, dem_geobox = buffered_geobox(acquisition, buffer_distance)
+    dname = DatasetName.DSM_SMOOTHED.value
+    deviations = derive_group(fine_group, dem_geobox, out_group, [dname],
+                              compression, filter_opts)
+
+    param_grp = out_group[GroupName.ELEVATION_GROUP.value].create_group(
+        'PARAMETERS')
+    param_grp.attrs['left_buffer'] = margins.left
+    param_grp.attrs['right_buffer'] = margins.right
+    param_grp.attrs['top_buffer'] = margins.top
+    param_grp.attrs['bottom_buffer'] = margins.bottom
+
+    return deviations
+
+
+def derive_satellite_solar(acquisition, fine_group, out_group,
+                           compression=H5CompressionFilter.LZF,
+                           filter_opts=None):
+    """
+    Derive the satellite and solar angles of a coarse resolution
+    acquisition from those of a fine resolution acquisition.
+    See `wagl.satellite_solar_angles.calculate_angles`.
+
+    The angle images are aggregated, the resolution independent
+    tables are copied, the centreline is taken from the centre row
+    of each block, and the boxline is recalculated from the derived
+    satellite view angles.
+
+    :param acquisition:
+        An instance of an `Acquisition` object from the coarse
+        resolution group.
+
+    :param fine_group:
+        The fine resolution `GroupName.SAT_SOL_GROUP` HDF5 `Group`.
+
+    :param out_group:
+        A writeable HDF5 `Group` object.
+
+    :return:
+        A `dict` of the deviations keyed by dataset name.
+    """
+    geobox = acquisition.gridded_geo_box()
+    dataset_names = [DatasetName.SATELLITE_VIEW.value,
+                     DatasetName.SATELLITE_AZIMUTH.value,
+                     DatasetName.SOLAR_ZENITH.value,
+                     DatasetName.SOLAR_AZIMUTH.value,
+                     DatasetName.RELATIVE_AZIMUTH.value,
+                     DatasetName.TIME.value]
+    deviations = derive_group(fine_group, geobox, out_group, dataset_names,
+                              compression, filter_opts)
+    grp = out_group[GroupName.SAT_SOL_GROUP.value]
+
+    for dname in RESOLUTION_INDEPENDENT_TABLES:
+        fine_group.copy(fine_group[dname], grp, name=dname)
+
+    fine_geobox = GriddedGeoBox.from_h5_dataset(
+        fine_group[DatasetName.SATELLITE_VIEW.value])
+    window, factor = aggregation_window(fine_geobox, geobox)
+    (row_start, _), (col_start, _) = window
+
+    # the centreline of the row at the centre of each block
+    rows = geobox.shape[0]
+    fine_rows = row_start + numpy.arange(rows) * factor[0] + factor[0] // 2
+    fine_centreline = fine_group[DatasetName.CENTRELINE.value]
+    centreline = fine_centreline[:][fine_rows]
+    row_index = numpy.arange(rows)
+    col_index = (centreline['col_index'] - col_start) // factor[1]
+    lon, lat = convert_to_lonlat(geobox, col_index, row_index)
+    centreline['row_index'] = row_index
+    centreline['col_index'] = col_index
+    centreline['longitude'] = lon
+    centreline['latitude'] = lat
+
+    kwargs = H5CompressionFilter.LZF.config().dataset_compression_kwargs()
+    dname = DatasetName.CENTRELINE.value
+    cent_dset = grp.create_dataset(dname, data=centreline, **kwargs)
+    attrs = {k: v for k, v in fine_centreline.attrs.items()
+             if not k.startswith('FIELD_')}
+    attrs['derived_from'] = fine_centreline.name
+    attach_table_attributes(cent_dset, title=attrs.pop('TITLE', 'Centreline'),
+                            attrs=attrs)
+
+    create_boxline(acquisition, grp[DatasetName.SATELLITE_VIEW.value][:],
+                   cent_dset, grp, acquisition.maximum_view_angle)
+
+    return deviations
+
+
+def derivation_error(derived_dataset, independent_dataset):
+    """
+    Compare a derived dataset against its independently computed
+    equivalent, such as when validating the derivation for a sensor.
+
+    :param derived_dataset:
+        A `NumPy` or `h5py.Dataset` containing the derived data.
+
+    :param independent_dataset:
+        A `NumPy` or `h5py.Dataset` containing the independently
+        computed data.
+
+    :return:
+        A `dict` containing the maximum and mean absolute difference
+        (for angles measured in azimuth, the angular difference),
+        or for boolean data, the fraction of differing pixels.
+    """
+    derived = derived_dataset[:]
+    independent = independent_dataset[:]
+
+    if derived.dtype == numpy.bool_:
+        difference = (derived != independent).astype('float64')
+        return {'max': float(difference.max()),
+                'mean': float(difference.mean())}
+
+    difference = numpy.abs(derived.astype('float64') - independent)
+    method = None
+    if isinstance(derived_dataset, h5py.Dataset):
+        method = aggregation_method(derived_dataset)
+        no_data = derived_dataset.attrs.get('no_data_value')
+        if no_data is not None:
+            valid = (derived != no_data) & (independent != no_data)
+            difference = difference[valid]
+
+    if method in (Aggregation.CIRCULAR_CENTRE, Aggregation.CIRCULAR_MEAN):
+        difference = numpy.abs((difference + 180.0) % 360.0 - 180.0)
+
+    if difference.size == 0:
+        return {'max': 0.0, 'mean': 0.0}
+
+    return {'max': float(difference.max()),
+            'mean': float(difference.mean())}
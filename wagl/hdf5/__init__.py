@@ -17,6 +17,10 @@ import pandas
 from .compression import H5CompressionFilter, BloscCompression, BloscShuffle
 from .compression import H5CompressionConfig, H5lzf, H5gzip, H5zstandard
 from .compression import H5bitshuffle, H5mafisc, H5blosc
+from .compression import DatasetClass, dataset_class_config
+from .chunk_writer import ChunkWriter
+from .consolidate import create_external_links, create_virtual_datasets
+from .consolidate import link_datasets, repack
 
 DEFAULT_IMAGE_CLASS = {'CLASS': 'IMAGE',
                        'IMAGE_VERSION': '1.2',
@@ -195,7 +199,12 @@ def write_h5_image(data, dset_name, group, compression=H5CompressionFilter.LZF,
         filter_opts = {}
 
     kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
-    dset = group.create_dataset(dset_name, data=data, **kwargs)
+    dset = group.create_dataset(dset_name, shape=data.shape, dtype=data.dtype,
+                                **kwargs)
+
+    # chunks are compressed in parallel
+    with ChunkWriter() as writer:
+        writer.write(dset, tuple(slice(None) for _ in data.shape), data)
 
     minv = data.min()
     maxv = data.max()
@@ -372,7 +381,7 @@ def write_dataframe(df, dset_name, group, compression=H5CompressionFilter.LZF,
     attach_table_attributes(dset, title=title, attrs=attributes)
 
 
-def read_h5_table(fid, dataset_name, dataframe=True):
+def read_h5_table(fid, dataset_name, dataframe=True, rows=None):
     """
     Read a HDF5 `TABLE` as a `pandas.DataFrame`.
 
@@ -388,6 +397,12 @@ def read_h5_table(fid, dataset_name, dataframe=True):
         or as NumPy structured array. Default is True
         which is to return as a `pandas.DataFrame`.
 
+    :param rows:
+        A `list` of (start, stop) tuples detailing the ranges of
+        rows to read from the `TABLE`. The ranges are read and
+        concatenated in the order given.
+        Default is None, which will read all rows.
+
     :return:
         Either a `pandas.DataFrame` (Default) or a NumPy structured
         array.
@@ -395,6 +410,13 @@ def read_h5_table(fid, dataset_name, dataframe=True):
     dset = fid[dataset_name]
     idx_names = None
 
+    if rows is None:
+        table = dset[:]
+    elif len(rows) == 0:
+        table = dset[0:0]
+    else:
+        table = numpy.concatenate([dset[start:stop] for start, stop in rows])
+
     # grab the index names if we have them
     idx_names = dset.attrs.get('index_names')
 
@@ -404,12 +426,12 @@ def read_h5_table(fid, dataset_name, dataframe=True):
             dtypes = [dset.attrs['{}_dtype'.format(name)] for name in
                       col_names]
             dtype = numpy.dtype(list(zip(col_names, dtypes)))
-            data = pandas.DataFrame.from_records(dset[:].astype(dtype),
+            data = pandas.DataFrame.from_records(table.astype(dtype),
                                                  index=idx_names)
         else:
-            data = pandas.DataFrame.from_records(dset[:], index=idx_names)
+            data = pandas.DataFrame.from_records(table, index=idx_names)
     else:
-        data = dset[:]
+        data = table
 
     return data
 
@@ -460,8 +482,8 @@ def create_external_link(fname, dataset_path, out_fname, new_dataset_path):
         A `str` containing the dataset path within `out_fname` that will
         link to `fname:dataset_path`.
     """
-    with h5py.File(out_fname) as fid:
-        fid[new_dataset_path] = h5py.ExternalLink(fname, dataset_path)
+    create_external_links([(fname, dataset_path, new_dataset_path)],
+                          out_fname)
 
     return
 
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+"""
+Parallel chunk compression
+--------------------------
+
+HDF5 applies a dataset's filter pipeline to each chunk in turn, within
+the thread that writes the data. For the larger image datasets, the
+compression becomes the bottleneck of an otherwise cheap write.
+
+The `ChunkWriter` instead applies the filter pipeline to whole chunks
+within a pool of threads (the compressors release the GIL), and
+commits the encoded chunks via HDF5's direct chunk write. The filter
+pipeline is taken from the dataset itself, so the encoded chunks are
+decoded by the standard filters.
+
+Pipelines containing a filter without a Python encoder (such as the
+dynamically loaded blosc and bitshuffle filters), and writes that
+aren't aligned with the chunk boundaries, are written through h5py
+as per usual.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+import zlib
+
+import numpy
+import h5py
+
+try:
+    import lzf
+except ImportError:
+    lzf = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# the default number of threads used to encode chunks
+CHUNK_WORKERS = min(8, os.cpu_count() or 1)
+
+# HDF5 filter ids
+FILTER_DEFLATE = h5py.h5z.FILTER_DEFLATE
+FILTER_SHUFFLE = h5py.h5z.FILTER_SHUFFLE
+FILTER_LZF = 32000
+FILTER_ZSTANDARD = 32015
+
+
+def _shuffle(buf, itemsize, cd_values):
+    """
+    The HDF5 byte shuffle filter.
+    """
+    if itemsize == 1:
+        return buf
+    data = numpy.frombuffer(buf, dtype='uint8').reshape(-1, itemsize)
+    return data.T.tobytes()
+
+
+def _deflate(buf, itemsize, cd_values):
+    """
+    The HDF5 deflate (gzip) filter.
+    """
+    level = cd_values[0] if cd_values else 6
+    result = zlib.compress(buf, level)
+
+    # the HDF5 filter fails when the result doesn't fit the input buffer
+    if len(result) > len(buf):
+        return None
+    return result
+
+
+def _lzf(buf, itemsize, cd_values):
+    """
+    The h5py LZF filter.
+    """
+    return lzf.compress(buf, len(buf))
+
+
+def _zstandard(buf, itemsize, cd_values):
+    """
+    The Zstandard filter (https://github.com/aparamon/HDF5Plugin-Zstandard).
+    """
+    level = cd_values[0] if cd_values else 3
+    return zstandard.ZstdCompressor(level=level).compress(buf)
+
+
+ENCODERS = {FILTER_SHUFFLE: _shuffle,
+            FILTER_DEFLATE: _deflate}
+
+if lzf is not None:
+    ENCODERS[FILTER_LZF] = _lzf
+
+if zstandard is not None:
+    ENCODERS[FILTER_ZSTANDARD] = _zstandard
+
+
+def filter_pipeline(dataset):
+    """
+    Return the filter pipeline of a dataset as a `list` of
+    (filter_id, optional, cd_values) tuples, or None if any of the
+    filters lack an encoder, or the dataset isn't chunked.
+    """
+    if dataset.chunks is None:
+        return None
+
+    plist = dataset.id.get_create_plist()
+    pipeline = []
+    for i in range(plist.get_nfilters()):
+        filter_id, flags, cd_values, _ = plist.get_filter(i)
+        if filter_id not in ENCODERS:
+            return None
+        optional = bool(flags & h5py.h5z.FLAG_OPTIONAL)
+        pipeline.append((filter_id, optional, tuple(cd_values)))
+
+    return pipeline
+
+
+def encode_chunk(data, pipeline):
+    """
+    Apply a filter pipeline to a full chunk of data.
+
+    :param data:
+        A contiguous `NumPy` array, with the shape and datatype of
+        a dataset chunk.
+
+    :param pipeline:
+        A filter pipeline as returned by `filter_pipeline`.
+
+    :return:
+        A tuple of the encoded `bytes`, and the filter mask. As with
+        HDF5, an optional filter that fails is skipped, and recorded
+        in the filter mask.
+    """
+    buf = data.tobytes()
+    itemsize = data.dtype.itemsize
+    filter_mask = 0
+    for i, (filter_id, optional, cd_values) in enumerate(pipeline):
+        result = ENCODERS[filter_id](buf, itemsize, cd_values)
+        if result is None:
+            if not optional:
+                raise IOError("Filter {} failed.".format(filter_id))
+            filter_mask |= 1 << i
+            continue
+        buf = result
+
+    return buf, filter_mask
+
+
+def _chunk_aligned(dataset, idx):
+    """
+    Return the (start, stop) of each dimension if the selection `idx`
+    covers whole chunks, otherwise None.
+    """
+    if not isinstance(idx, tuple):
+        idx = (idx,)
+
+    if len(idx) != dataset.ndim:
+        return None
+
+    bounds = []
+    for sel, size, chunk in zip(idx, dataset.shape, dataset.chunks):
+        if not isinstance(sel, slice) or sel.step not in (None, 1):
+            return None
+        start, stop, _ = sel.indices(size)
+        if start % chunk or (stop % chunk and stop != size) or stop <= start:
+            return None
+        bounds.append((start, stop))
+
+    return bounds
+
+
+class ChunkWriter(object):
+
+    """
+    Writes chunk aligned blocks of data to chunked HDF5 datasets,
+    encoding the chunks concurrently within a pool of threads.
+    All HDF5 calls are made from the thread that owns the writer.
+
+    :param workers:
+        The number of threads used to encode chunks.
+        Default is wagl.hdf5.chunk_writer.CHUNK_WORKERS.
+        A value of 1 writes everything through h5py, as there's
+        nothing to be gained from encoding the chunks in Python.
+
+    :param max_pending:
+        The maximum number of encoded chunks held in memory before
+        they're committed. Default is 4 times the number of workers.
+
+    :example:
+        >>> with ChunkWriter() as writer:
+        >>>     for tile in tiles:
+        >>>         idx = (slice(*tile[0]), slice(*tile[1]))
+        >>>         writer.write(dataset, idx, calculate(tile))
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        self.workers = CHUNK_WORKERS if workers is None else workers
+        if max_pending is None:
+            max_pending = 4 * max(self.workers, 1)
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._pipelines = {}
+        self._executor = None
+        if self.workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def _pipeline(self, dataset):
+        key = dataset.id.id
+        if key not in self._pipelines:
+            self._pipelines[key] = filter_pipeline(dataset)
+        return self._pipelines[key]
+
+    def write(self, dataset, idx, data):
+        """
+        Write `data` to `dataset[idx]`.
+        Chunk aligned selections of a dataset whose filters can be
+        encoded are written via direct chunk writes, all others are
+        written through h5py (after any pending chunks).
+        """
+        bounds = None
+        if self._executor is not None:
+            pipeline = self._pipeline(dataset)
+            if pipeline is not None:
+                bounds = _chunk_aligned(dataset, idx)
+
+        if bounds is None:
+            self.flush()
+            dataset[idx] = data
+            return
+
+        data = numpy.asarray(data)
+        chunks = dataset.chunks
+        dtype = dataset.dtype
+        fillvalue = dataset.fillvalue
+        data = numpy.broadcast_to(data, tuple(stop - start for start, stop
+                                              in bounds))
+
+        # the chunk origins covered by the selection
+        origins = numpy.stack(numpy.meshgrid(
+            *[numpy.arange(start, stop, chunk) for (start, stop), chunk in
+              zip(bounds, chunks)], indexing='ij'), axis=-1)
+
+        for origin in origins.reshape(-1, len(chunks)):
+            origin = tuple(int(o) for o in origin)
+            src = tuple(slice(o - start, min(o + c, stop) - start)
+                        for o, c, (start, stop) in zip(origin, chunks, bounds))
+            block = data[src]
+
+            # edge chunks are padded out to the full chunk
+            if block.shape != chunks:
+                chunk = numpy.full(chunks, fillvalue, dtype=dtype)
+                chunk[tuple(slice(0, s) for s in block.shape)] = block
+            else:
+                chunk = numpy.ascontiguousarray(block, dtype=dtype)
+
+            self._submit(dataset, origin, chunk, pipeline)
+
+    def _submit(self, dataset, origin, chunk, pipeline):
+        while len(self._pending) >= self.max_pending:
+            self._commit()
+
+        future = self._executor.submit(encode_chunk, chunk, pipeline)
+        self._pending.append((dataset, origin, future))
+
+    def _commit(self):
+        # chunks are committed in the order they were written
+        dataset, origin, future = self._pending.popleft()
+        buf, filter_mask = future.result()
+        dataset.id.write_direct_chunk(origin, buf, filter_mask)
+
+    def flush(self):
+        """
+        Commit all pending chunks.
+        """
+        while self._pending:
+            self._commit()
+
+    def close(self):
+        """
+        Commit all pending chunks, and release the pool of threads.
+        """
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # don't mask the original error
+            self._pending.clear()
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            return
+        self.close()
@@ -60,7 +60,11 @@ class H5CompressionFilter(IntEnum):
         """
         Return the appropriate compression filter configuration
         class.
+        Any per dataset class settings (the `DATASET_CLASSES` key of
+        `filter_opts`) are ignored here; they're resolved to a filter
+        and its options by `dataset_class_config`.
         """
+        kwargs.pop(DATASET_CLASSES, None)
         switch = {H5CompressionFilter.LZF: H5lzf,
                   H5CompressionFilter.GZIP: H5gzip,
                   H5CompressionFilter.BITSHUFFLE: H5bitshuffle,
@@ -76,6 +80,77 @@ class H5CompressionFilter(IntEnum):
         return switch.get(self)(compression_filter=self, **kwargs)
     
 
+class DatasetClass(Enum):
+
+    """
+    The classes of dataset written by wagl, which can each be given
+    their own compression settings via the `DATASET_CLASSES` key of
+    `filter_opts`.
+    ANGLES covers all the float32 images; the angles, lon/lat, DSM,
+    interpolated coefficients and surface brightness temperature.
+    """
+
+    REFLECTANCE = 'reflectance'
+    ANGLES = 'angles'
+    MASK = 'mask'
+    TABLE = 'table'
+
+
+# the filter_opts key for the per dataset class compression settings
+DATASET_CLASSES = 'dataset_classes'
+
+
+def dataset_class_config(compression, filter_opts, dataset_class):
+    """
+    Resolve the compression filter and filter options for a class of
+    dataset.
+
+    :param compression:
+        The default H5CompressionFilter.
+
+    :param filter_opts:
+        A dict containing any additional keyword arguments when
+        generating the configuration for the `compression` filter.
+        It may also contain the `DATASET_CLASSES` key, mapping a
+        `DatasetClass` value to a dict containing the name of the
+        H5CompressionFilter under `compression`, plus the keyword
+        arguments for that filter, eg:
+        {'dataset_classes': {'mask': {'compression': 'GZIP',
+                                      'aggression': 6}}}.
+        These are the settings emitted by
+        `wagl.hdf5.compression_benchmark`.
+
+    :param dataset_class:
+        A `DatasetClass`.
+
+    :return:
+        A tuple of (H5CompressionFilter, filter_opts). Classes
+        without their own settings use `compression` and the
+        remaining `filter_opts`.
+
+    :example:
+        >>> opts = {'dataset_classes': {'mask': {'compression': 'GZIP'}}}
+        >>> dataset_class_config(H5CompressionFilter.LZF, opts,
+        ...                      DatasetClass.MASK)
+        (<H5CompressionFilter.GZIP: 7>, {})
+    """
+    if filter_opts is None or DATASET_CLASSES not in filter_opts:
+        return compression, filter_opts
+
+    classes = filter_opts[DATASET_CLASSES]
+    if dataset_class.value not in classes:
+        opts = {key: value for key, value in filter_opts.items()
+                if key != DATASET_CLASSES}
+        return compression, opts
+
+    opts = dict(classes[dataset_class.value])
+    name = opts.pop('compression', compression.name)
+    if isinstance(opts.get('shuffle_id'), str):
+        opts['shuffle_id'] = BloscShuffle[opts['shuffle_id']]
+
+    return H5CompressionFilter[name], opts
+
+
 class BloscCompression(IntEnum):
 
     """
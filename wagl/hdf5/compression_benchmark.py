@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+
+"""
+Compression benchmarks
+----------------------
+
+Measures the write throughput, read throughput and compression ratio
+of the HDF5 compression filters (see `wagl.hdf5.compression`), and
+their shuffle and chunk options, over representative samples of each
+class of dataset written by wagl (see `DatasetClass`).
+
+The samples are either synthetic, or taken from an existing wagl
+output file. The benchmarks are run within in-memory files, with the
+chunk cache disabled, such that the encoding and decoding are measured
+rather than the storage.
+
+The recommended configuration for each class of dataset is emitted
+as a `filter_opts` dict that can be given directly to `card4l` (see
+`wagl.hdf5.compression.dataset_class_config`).
+"""
+
+from __future__ import absolute_import, print_function
+import time
+
+import numpy
+import h5py
+import pandas
+from scipy import ndimage
+
+from wagl.hdf5.compression import H5CompressionFilter, BloscShuffle
+from wagl.hdf5.compression import DatasetClass, DATASET_CLASSES
+
+# the (rows, columns) of the sampled images
+SAMPLE_SHAPE = (1024, 1024)
+
+# the chunk shapes benchmarked for the image classes
+CHUNK_SHAPES = [(128, 128), (256, 256), (512, 512)]
+
+# the default throughput (MB/s) that a recommended configuration must
+# sustain; the best compression ratio is selected amongst those that do
+MIN_WRITE_MBS = 100.0
+MIN_READ_MBS = 200.0
+
+# the filters whose options include the byte shuffle filter
+SHUFFLE_FILTERS = [H5CompressionFilter.LZF, H5CompressionFilter.GZIP,
+                   H5CompressionFilter.ZSTANDARD]
+
+BLOSC_FILTERS = [H5CompressionFilter.BLOSC_LZ, H5CompressionFilter.BLOSC_LZ4,
+                 H5CompressionFilter.BLOSC_LZ4HC,
+                 H5CompressionFilter.BLOSC_SNAPPY,
+                 H5CompressionFilter.BLOSC_ZLIB,
+                 H5CompressionFilter.BLOSC_ZSTANDARD]
+
+
+def _smooth_field(shape, scale, rng):
+    """
+    A smoothly varying random field in the interval [0, 1].
+    """
+    field = ndimage.gaussian_filter(rng.standard_normal(shape), scale)
+    field -= field.min()
+    return field / field.max()
+
+
+def synthetic_samples(shape=SAMPLE_SHAPE, seed=0):
+    """
+    Generate a synthetic sample for each `DatasetClass`.
+
+    * REFLECTANCE; int16 surface reflectance, with sensor noise,
+      and a no data (-999) region outside of a rotated scene.
+    * ANGLES; float32 angles that vary smoothly across the scene.
+    * MASK; a bool mask of clustered features.
+    * TABLE; a compound table of point based results.
+
+    :param shape:
+        The (rows, columns) of the images.
+        Default is wagl.hdf5.compression_benchmark.SAMPLE_SHAPE.
+
+    :param seed:
+        The seed for the random number generator. Default is 0.
+
+    :return:
+        A `dict` keyed by `DatasetClass`, containing a `NumPy` array.
+    """
+    rng = numpy.random.RandomState(seed)
+    rows, cols = shape
+    y, x = numpy.mgrid[0:rows, 0:cols].astype('float64')
+
+    # scene footprint rotated ~12 degrees within the image
+    rotated = (x - cols / 2.0) * 0.978 + (y - rows / 2.0) * 0.208
+    inside = numpy.abs(rotated) < 0.4 * cols
+    reflectance = (_smooth_field(shape, 8, rng) * 3000 + 200 +
+                   rng.normal(0, 30, shape))
+    reflectance = reflectance.astype('int16')
+    reflectance[~inside] = -999
+
+    angles = (30.0 + 0.002 * x + 0.001 * y + 1e-7 * x * y).astype('float32')
+
+    mask = _smooth_field(shape, 4, rng) > 0.6
+
+    table_dtype = numpy.dtype([('row_index', 'int32'),
+                               ('col_index', 'int32'),
+                               ('latitude', 'float64'),
+                               ('longitude', 'float64'),
+                               ('value', 'float32')])
+    table = numpy.zeros(rows * 10, dtype=table_dtype)
+    table['row_index'] = numpy.arange(table.size) // cols
+    table['col_index'] = numpy.arange(table.size) % cols
+    table['latitude'] = -35.0 + table['row_index'] * 0.00025
+    table['longitude'] = 149.0 + table['col_index'] * 0.00025
+    table['value'] = rng.normal(0.5, 0.05, table.size)
+
+    return {DatasetClass.REFLECTANCE: reflectance,
+            DatasetClass.ANGLES: angles,
+            DatasetClass.MASK: mask,
+            DatasetClass.TABLE: table}
+
+
+def dataset_class(dataset):
+    """
+    Classify a `h5py.Dataset` as a `DatasetClass`, or None if it
+    doesn't belong to any class.
+    """
+    if dataset.dtype.names is not None:
+        return DatasetClass.TABLE
+
+    if dataset.ndim != 2:
+        return None
+
+    if dataset.dtype in (numpy.bool_, numpy.uint8):
+        return DatasetClass.MASK
+
+    if dataset.dtype == numpy.int16:
+        return DatasetClass.REFLECTANCE
+
+    if dataset.dtype == numpy.float32:
+        return DatasetClass.ANGLES
+
+    return None
+
+
+def file_samples(fname, shape=SAMPLE_SHAPE):
+    """
+    Sample each `DatasetClass` from an existing HDF5 file, such as
+    the output of `card4l`. The first dataset found for each class
+    is used, with the images being subset to `shape` from the centre
+    of the image.
+
+    :param fname:
+        A `str` containing the full file pathname of the HDF5 file.
+
+    :param shape:
+        The maximum (rows, columns) to sample from an image.
+        Default is wagl.hdf5.compression_benchmark.SAMPLE_SHAPE.
+
+    :return:
+        A `dict` keyed by `DatasetClass`, containing a `NumPy` array.
+    """
+    samples = {}
+
+    def sample(name, obj):
+        if not isinstance(obj, h5py.Dataset):
+            return
+        class_ = dataset_class(obj)
+        if class_ is None or class_ in samples:
+            return
+
+        if class_ == DatasetClass.TABLE:
+            samples[class_] = obj[()]
+            return
+
+        idx = tuple(slice(max(0, (size - length) // 2),
+                          max(0, (size - length) // 2) + length)
+                    for size, length in zip(obj.shape, shape))
+        samples[class_] = obj[idx]
+
+    with h5py.File(fname, 'r') as fid:
+        fid.visititems(sample)
+
+    return samples
+
+
+def candidate_configs(filters=None):
+    """
+    The compression configurations to benchmark.
+
+    :param filters:
+        A `list` of `H5CompressionFilter`'s.
+        Default is None, whereby every filter is used.
+
+    :return:
+        A `list` of (H5CompressionFilter, filter_opts) tuples.
+        Filters supporting the byte shuffle filter are included with
+        and without it, and the blosc filters with both its byte and
+        bit shuffle.
+    """
+    if filters is None:
+        filters = list(H5CompressionFilter)
+
+    configs = []
+    for compression in filters:
+        if compression in SHUFFLE_FILTERS:
+            for shuffle in [False, True]:
+                configs.append((compression, {'shuffle': shuffle}))
+        elif compression in BLOSC_FILTERS:
+            for shuffle_id in [BloscShuffle.SHUFFLE, BloscShuffle.BITSHUFFLE]:
+                configs.append((compression, {'shuffle_id': shuffle_id}))
+        else:
+            configs.append((compression, {}))
+
+    return configs
+
+
+def filter_available(compression, filter_opts=None):
+    """
+    Test whether a compression filter is available to the HDF5
+    library, such as whether a dynamically loaded filter can be
+    found.
+    """
+    opts = {} if filter_opts is None else dict(filter_opts)
+    opts['chunks'] = (4,)
+    try:
+        kwargs = compression.config(**opts).dataset_compression_kwargs()
+        with h5py.File('filter-available.h5', 'w', driver='core',
+                       backing_store=False) as fid:
+            dset = fid.create_dataset('data', data=numpy.arange(16),
+                                      **kwargs)
+            fid.flush()
+            return bool((dset[()] == numpy.arange(16)).all())
+    except Exception:  # pylint: disable=broad-except
+        return False
+
+
+def benchmark_config(data, compression, filter_opts, chunks=True,
+                     repeats=3):
+    """
+    Benchmark a single compression configuration for an array.
+
+    :param data:
+        A `NumPy` array.
+
+    :param compression:
+        A `H5CompressionFilter`.
+
+    :param filter_opts:
+        A dict of keyword arguments for the `compression` filter's
+        configuration, excluding `chunks`.
+
+    :param chunks:
+        The chunk shape of the dataset. Default is True (h5py's
+        automatic chunking).
+
+    :param repeats:
+        The number of times to repeat the write and read; the fastest
+        of each is reported. Default is 3.
+
+    :return:
+        A `dict` containing the write_mbs and read_mbs (decimal
+        megabytes of uncompressed data per second), and the
+        compression ratio (uncompressed/stored).
+    """
+    opts = dict(filter_opts)
+    opts['chunks'] = chunks
+    kwargs = compression.config(**opts).dataset_compression_kwargs()
+    file_kwargs = {'driver': 'core', 'backing_store': False,
+                   'rdcc_nbytes': 0}
+
+    write_time = read_time = numpy.inf
+    for _ in range(repeats):
+        with h5py.File('benchmark.h5', 'w', **file_kwargs) as fid:
+            dset = fid.create_dataset('data', shape=data.shape,
+                                      dtype=data.dtype, **kwargs)
+            start = time.perf_counter()
+            dset[...] = data
+            fid.flush()
+            write_time = min(write_time, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            result = dset[()]
+            read_time = min(read_time, time.perf_counter() - start)
+            stored = dset.id.get_storage_size()
+
+    if not numpy.array_equal(result, data):
+        msg = "{} failed to round trip the data".format(compression.name)
+        raise ValueError(msg)
+
+    megabytes = data.nbytes / 1e6
+    return {'write_mbs': megabytes / write_time,
+            'read_mbs': megabytes / read_time,
+            'ratio': data.nbytes / max(stored, 1)}
+
+
+def run_benchmarks(samples, configs=None, chunk_shapes=None, repeats=3):
+    """
+    Benchmark each compression configuration, and chunk shape, for
+    each sample. Unavailable filters are skipped.
+
+    :param samples:
+        A `dict` keyed by `DatasetClass` containing a `NumPy` array,
+        as returned by `synthetic_samples` or `file_samples`.
+
+    :param configs:
+        A `list` of (H5CompressionFilter, filter_opts) tuples.
+        Default is `candidate_configs()`.
+
+    :param chunk_shapes:
+        A `list` of the (rows, columns) chunk shapes to benchmark for
+        the image samples. The tables use h5py's automatic chunking.
+        Default is wagl.hdf5.compression_benchmark.CHUNK_SHAPES.
+
+    :param repeats:
+        Passed through to `benchmark_config`.
+
+    :return:
+        A `pandas.DataFrame` with a row for each benchmark, containing
+        the dataset_class, compression, filter_opts, chunks, write_mbs,
+        read_mbs and ratio.
+    """
+    if configs is None:
+        configs = candidate_configs()
+
+    if chunk_shapes is None:
+        chunk_shapes = CHUNK_SHAPES
+
+    records = []
+    for compression, filter_opts in configs:
+        if not filter_available(compression, filter_opts):
+            continue
+
+        for class_, data in samples.items():
+            if data.ndim == 2:
+                shapes = [tuple(min(c, s) for c, s in zip(chunks, data.shape))
+                          for chunks in chunk_shapes]
+                shapes = sorted(set(shapes))
+            else:
+                shapes = [True]
+
+            for chunks in shapes:
+                result = benchmark_config(data, compression, filter_opts,
+                                          chunks, repeats)
+                result.update({'dataset_class': class_.value,
+                               'compression': compression.name,
+                               'filter_opts': filter_opts,
+                               'chunks': chunks})
+                records.append(result)
+
+    columns = ['dataset_class', 'compression', 'filter_opts', 'chunks',
+               'write_mbs', 'read_mbs', 'ratio']
+
+    return pandas.DataFrame(records, columns=columns)
+
+
+def _serialisable(filter_opts):
+    """
+    Convert enum valued filter options to their names.
+    """
+    return {key: getattr(value, 'name', value)
+            for key, value in filter_opts.items()}
+
+
+def recommend(results, min_write_mbs=MIN_WRITE_MBS,
+              min_read_mbs=MIN_READ_MBS):
+    """
+    Select a compression configuration for each class of dataset;
+    the best compression ratio amongst those configurations that
+    sustain both `min_write_mbs` and `min_read_mbs`. If none do,
+    then the configuration with the fastest writes is selected.
+
+    :param results:
+        A `pandas.DataFrame` as returned by `run_benchmarks`.
+
+    :param min_write_mbs:
+        The minimum write throughput (MB/s).
+        Default is wagl.hdf5.compression_benchmark.MIN_WRITE_MBS.
+
+    :param min_read_mbs:
+        The minimum read throughput (MB/s).
+        Default is wagl.hdf5.compression_benchmark.MIN_READ_MBS.
+
+    :return:
+        A `dict` that can be given as `filter_opts` to `card4l`, i.e.
+        {'dataset_classes': {<class>: {'compression': <name>, ...}}}.
+        The chunks aren't included, as the chunks of the images are
+        given by `wagl.tiling.plan_tiles`.
+    """
+    classes = {}
+    for class_, group in results.groupby('dataset_class'):
+        valid = group[(group['write_mbs'] >= min_write_mbs) &
+                      (group['read_mbs'] >= min_read_mbs)]
+        if valid.empty:
+            best = group.loc[group['write_mbs'].idxmax()]
+        else:
+            best = valid.sort_values(['ratio', 'write_mbs'],
+                                     ascending=False).iloc[0]
+
+        config = {'compression': best['compression']}
+        config.update(_serialisable(best['filter_opts']))
+        classes[class_] = config
+
+    return {DATASET_CLASSES: classes}
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+"""
+Consolidation of HDF5 files
+---------------------------
+
+The multifile workflow writes the results of each task to its own
+HDF5 file, and combines them into a single file for easier access.
+An external link per dataset reopens the output file for each link,
+and a reader resolves each link by opening another file.
+
+Here the links are created in batches, opening the output and each
+input file once. Alternatively each dataset can be mapped as a
+virtual dataset; the metadata (shape, datatype and attributes) is
+held in the consolidated file, and the source files are only opened
+when the data is read. External links and virtual datasets within the
+sources are resolved to the files that actually contain the data, so
+a reader never traverses more than one file to get to the data.
+
+The `repack` of a consolidated file copies all the data into a single
+contiguous file, leaving no references to other files.
+"""
+
+from collections import OrderedDict
+from posixpath import join as ppjoin, dirname as pdirname
+from posixpath import basename as pbasename
+import os
+
+import h5py
+
+from .compression import H5CompressionFilter
+
+
+def _grouped(links):
+    """
+    Group the links by the filename of their source, retaining the
+    order of the links.
+    """
+    groups = OrderedDict()
+    for fname, dataset_path, new_dataset_path in links:
+        groups.setdefault(fname, []).append((dataset_path, new_dataset_path))
+    return groups
+
+
+def _link_target(fname, target):
+    """
+    The filename of the target of a link from within fname; relative
+    filenames are relative to the directory of fname.
+    """
+    if target == '.':
+        return fname
+
+    candidate = os.path.join(os.path.dirname(fname), target)
+    if not os.path.isabs(target) and os.path.exists(candidate):
+        return candidate
+
+    return target
+
+
+def _objects(fid, path, new_path):
+    """
+    Recursively yield each group and dataset (obj, new_path) under
+    fid:path, resolving soft and external links, such that each obj
+    is opened from the file that actually contains it.
+    """
+    # the root group isn't a link
+    link = fid.get(path, getlink=True) if path.strip('/') else None
+    if isinstance(link, h5py.SoftLink):
+        for item in _objects(fid, link.path, new_path):
+            yield item
+        return
+
+    if isinstance(link, h5py.ExternalLink):
+        target = _link_target(fid.filename, link.filename)
+        with h5py.File(target, 'r') as target_fid:
+            for item in _objects(target_fid, link.path, new_path):
+                yield item
+        return
+
+    obj = fid[path]
+    yield obj, new_path
+    if isinstance(obj, h5py.Group):
+        for key in obj:
+            for item in _objects(fid, ppjoin(obj.name, key),
+                                 ppjoin(new_path, key)):
+                yield item
+
+
+def _copy_attributes(source, dest):
+    """
+    Copy the attributes of an object, retaining their datatypes.
+    """
+    for key in source.attrs:
+        dtype = source.attrs.get_id(key).dtype
+        dest.attrs.create(key, source.attrs[key], dtype=dtype)
+
+
+def _source_space(fname, dataset_name, src_space):
+    """
+    The dataspace of a source of a virtual dataset. The extent of a
+    source mapped in its entirety isn't retained by HDF5, and is taken
+    from the source itself.
+    """
+    if src_space.get_select_type() != h5py.h5s.SEL_ALL:
+        return src_space
+
+    with h5py.File(fname, 'r') as fid:
+        return h5py.h5s.create_simple(fid[dataset_name].shape)
+
+
+def _virtual_sources(dataset):
+    """
+    The (vspace, filename, dataset_name, src_space) mappings of a
+    dataset; the mappings of a virtual dataset, else the whole of the
+    dataset.
+    """
+    fname = dataset.file.filename
+    if dataset.is_virtual:
+        sources = []
+        for vmap in dataset.virtual_sources():
+            src_fname = _link_target(fname, vmap.file_name)
+            src_space = _source_space(src_fname, vmap.dset_name,
+                                      vmap.src_space)
+            sources.append((vmap.vspace, src_fname, vmap.dset_name,
+                            src_space))
+        return sources
+
+    space = h5py.h5s.create_simple(dataset.shape)
+    return [(space, fname, dataset.name, space)]
+
+
+def _require_parent(fid, dataset_path):
+    """
+    The group that will contain the dataset, created if required.
+    """
+    return fid.require_group(pdirname(dataset_path) or '/')
+
+
+def _create_virtual_dataset(dataset, fid, new_dataset_path):
+    """
+    Create a virtual dataset mapping the whole of a dataset (or the
+    sources of a virtual dataset). Scalar and empty datasets are
+    copied, as their storage is negligible.
+    """
+    parent = _require_parent(fid, new_dataset_path)
+    name = pbasename(new_dataset_path)
+
+    if dataset.shape is None or dataset.shape == () or dataset.size == 0:
+        parent.copy(dataset, parent, name=name)
+        return
+
+    dcpl = h5py.h5p.create(h5py.h5p.DATASET_CREATE)
+    for vspace, fname, dataset_name, src_space in _virtual_sources(dataset):
+        dcpl.set_virtual(vspace, fname.encode('utf-8'),
+                         dataset_name.encode('utf-8'), src_space)
+
+    space = h5py.h5s.create_simple(dataset.shape)
+    dsid = h5py.h5d.create(parent.id, name.encode('utf-8'),
+                           dataset.id.get_type(), space, dcpl=dcpl)
+    _copy_attributes(dataset, h5py.Dataset(dsid))
+
+
+def create_external_links(links, out_fname):
+    """
+    Creates an external link for each of `links`, opening
+    `out_fname` once.
+
+    :param links:
+        An iterable of (fname, dataset_path, new_dataset_path) tuples;
+        the link `out_fname:new_dataset_path` will refer to
+        `fname:dataset_path`.
+
+    :param out_fname:
+        A `str` for the output filename that will contain the links.
+        The file is created if it doesn't exist.
+
+    :return:
+        None.
+    """
+    with h5py.File(out_fname, 'a') as fid:
+        for fname, dataset_path, new_dataset_path in links:
+            fid[new_dataset_path] = h5py.ExternalLink(fname, dataset_path)
+
+
+def create_virtual_datasets(links, out_fname):
+    """
+    Maps each of `links` into `out_fname` as a virtual dataset,
+    opening `out_fname` and each source file once.
+
+    The groups under a linked group are created in `out_fname`,
+    along with their attributes, and each dataset is mapped as a
+    virtual dataset with the attributes of its source. External
+    links and virtual datasets within the sources are resolved to the
+    files that contain the data.
+
+    :param links:
+        An iterable of (fname, dataset_path, new_dataset_path) tuples;
+        `out_fname:new_dataset_path` will map the dataset (or group of
+        datasets) `fname:dataset_path`.
+
+    :param out_fname:
+        A `str` for the output filename that will contain the virtual
+        datasets. The file is created if it doesn't exist.
+
+    :return:
+        None.
+    """
+    with h5py.File(out_fname, 'a') as fid:
+        for fname, paths in _grouped(links).items():
+            with h5py.File(fname, 'r') as src:
+                for dataset_path, new_dataset_path in paths:
+                    for obj, new_path in _objects(src, dataset_path,
+                                                  new_dataset_path):
+                        if isinstance(obj, h5py.Group):
+                            _copy_attributes(obj, fid.require_group(new_path))
+                        else:
+                            _create_virtual_dataset(obj, fid, new_path)
+
+
+def link_datasets(links, out_fname, virtual=False):
+    """
+    Consolidates the datasets given by `links` into `out_fname`,
+    either via external links, or as virtual datasets.
+
+    :param links:
+        An iterable of (fname, dataset_path, new_dataset_path) tuples.
+
+    :param out_fname:
+        A `str` for the output filename.
+
+    :param virtual:
+        A `bool`; if True the datasets are mapped as virtual datasets,
+        otherwise (default) they're external links.
+
+    :return:
+        None.
+    """
+    if virtual:
+        create_virtual_datasets(links, out_fname)
+    else:
+        create_external_links(links, out_fname)
+
+
+def _copy_dataset(dataset, group, name, compression, filter_opts):
+    """
+    Copy the data of a dataset into group:name. The storage of a
+    regular dataset is copied as is, whereas a virtual dataset is
+    written out with the given compression.
+    """
+    if not dataset.is_virtual:
+        group.copy(dataset, group, name=name)
+        return
+
+    kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
+    dset = group.create_dataset(name, shape=dataset.shape,
+                                dtype=dataset.dtype, **kwargs)
+    for idx in dset.iter_chunks():
+        dset[idx] = dataset[idx]
+
+    _copy_attributes(dataset, dset)
+
+
+def repack(fname, out_fname, compression=H5CompressionFilter.LZF,
+           filter_opts=None):
+    """
+    Copies the contents of `fname` into a single self contained file,
+    resolving all soft and external links, and writing out the data
+    of all virtual datasets.
+
+    :param fname:
+        A `str` containing the filename of the (consolidated) file.
+
+    :param out_fname:
+        A `str` for the output filename.
+
+    :param compression:
+        The compression filter used for the data of the virtual
+        datasets; all other datasets retain their storage.
+        Default is H5CompressionFilter.LZF
+
+    :param filter_opts:
+        A dict of key value pairs available to the given configuration
+        instance of H5CompressionFilter.
+        Default is None, which will use the default settings for the
+        chosen H5CompressionFilter instance.
+
+    :return:
+        None.
+    """
+    if filter_opts is None:
+        filter_opts = {}
+
+    with h5py.File(fname, 'r') as src, h5py.File(out_fname, 'w') as fid:
+        _copy_attributes(src, fid)
+        for key in src:
+            for obj, new_path in _objects(src, '/' + key, '/' + key):
+                if isinstance(obj, h5py.Group):
+                    _copy_attributes(obj, fid.require_group(new_path))
+                else:
+                    _copy_dataset(obj, _require_parent(fid, new_path),
+                                  pbasename(new_path), compression,
+                                  filter_opts)
@@ -10,9 +10,10 @@ import h5py
 
 from wagl.constants import DatasetName, GroupName
 from wagl.geobox import GriddedGeoBox
-from wagl.tiling import generate_tiles
+from wagl.tiling import plan_tiles
 from wagl.data import as_array
 from wagl.hdf5 import H5CompressionFilter, attach_image_attributes
+from wagl.hdf5 import ChunkWriter
 from wagl.__exiting_angle import exiting_angle
 from wagl.__incident_angle import incident_angle
 
@@ -108,8 +109,8 @@ def incident_angles(satellite_solar_group, slope_aspect_group, out_group=None,
         filter_opts = {}
 
     grp = fid[GroupName.INCIDENT_GROUP.value]
-    tile_size = solar_zenith_dataset.chunks
-    filter_opts['chunks'] = tile_size
+    plan = plan_tiles(shape, chunks=solar_zenith_dataset.chunks)
+    filter_opts['chunks'] = plan.chunks
     kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
     no_data = -999
     kwargs['shape'] = shape
@@ -137,40 +138,41 @@ def incident_angles(satellite_solar_group, slope_aspect_group, out_group=None,
     attach_image_attributes(azi_inc_dset, attrs)
 
     # process by tile
-    for tile in generate_tiles(cols, rows, tile_size[1], tile_size[0]):
-        # Row and column start and end locations
-        ystart = tile[0][0]
-        xstart = tile[1][0]
-        yend = tile[0][1]
-        xend = tile[1][1]
-        idx = (slice(ystart, yend), slice(xstart, xend))
-
-        # Tile size
-        ysize = yend - ystart
-        xsize = xend - xstart
-
-        # Read the data for the current tile
-        # Convert to required datatype and transpose
-        sol_zen = as_array(solar_zenith_dataset[idx],
-                           dtype=numpy.float32, transpose=True)
-        sol_azi = as_array(solar_azimuth_dataset[idx],
-                           dtype=numpy.float32, transpose=True)
-        slope = as_array(slope_dataset[idx],
-                         dtype=numpy.float32, transpose=True)
-        aspect = as_array(aspect_dataset[idx],
-                          dtype=numpy.float32, transpose=True)
-
-        # Initialise the work arrays
-        incident = numpy.zeros((ysize, xsize), dtype='float32')
-        azi_incident = numpy.zeros((ysize, xsize), dtype='float32')
-
-        # Process the current tile
-        incident_angle(xsize, ysize, sol_zen, sol_azi, slope, aspect,
-                       incident.transpose(), azi_incident.transpose())
-
-        # Write the current tile to disk
-        incident_dset[idx] = incident
-        azi_inc_dset[idx] = azi_incident
+    with ChunkWriter() as writer:
+        for tile in plan.tiles():
+            # Row and column start and end locations
+            ystart = tile[0][0]
+            xstart = tile[1][0]
+            yend = tile[0][1]
+            xend = tile[1][1]
+            idx = (slice(ystart, yend), slice(xstart, xend))
+
+            # Tile size
+            ysize = yend - ystart
+            xsize = xend - xstart
+
+            # Read the data for the current tile
+            # Convert to required datatype and transpose
+            sol_zen = as_array(solar_zenith_dataset[idx],
+                               dtype=numpy.float32, transpose=True)
+            sol_azi = as_array(solar_azimuth_dataset[idx],
+                               dtype=numpy.float32, transpose=True)
+            slope = as_array(slope_dataset[idx],
+                             dtype=numpy.float32, transpose=True)
+            aspect = as_array(aspect_dataset[idx],
+                              dtype=numpy.float32, transpose=True)
+
+            # Initialise the work arrays
+            incident = numpy.zeros((ysize, xsize), dtype='float32')
+            azi_incident = numpy.zeros((ysize, xsize), dtype='float32')
+
+            # Process the current tile
+            incident_angle(xsize, ysize, sol_zen, sol_azi, slope, aspect,
+                           incident.transpose(), azi_incident.transpose())
+
+            # Write the current tile to disk
+            writer.write(incident_dset, idx, incident)
+            writer.write(azi_inc_dset, idx, azi_incident)
 
     if out_group is None:
         return fid
@@ -248,8 +250,8 @@ def exiting_angles(satellite_solar_group, slope_aspect_group, out_group=None,
         filter_opts = {}
 
     grp = fid[GroupName.EXITING_GROUP.value]
-    tile_size = satellite_view_dataset.chunks
-    filter_opts['chunks'] = tile_size
+    plan = plan_tiles(shape, chunks=satellite_view_dataset.chunks)
+    filter_opts['chunks'] = plan.chunks
     kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
     no_data = -999
     kwargs['shape'] = shape
@@ -277,40 +279,41 @@ def exiting_angles(satellite_solar_group, slope_aspect_group, out_group=None,
     attach_image_attributes(azi_exit_dset, attrs)
 
     # process by tile
-    for tile in generate_tiles(cols, rows, tile_size[1], tile_size[0]):
-        # Row and column start and end locations
-        ystart = tile[0][0]
-        xstart = tile[1][0]
-        yend = tile[0][1]
-        xend = tile[1][1]
-        idx = (slice(ystart, yend), slice(xstart, xend))
-
-        # Tile size
-        ysize = yend - ystart
-        xsize = xend - xstart
-
-        # Read the data for the current tile
-        # Convert to required datatype and transpose
-        sat_view = as_array(satellite_view_dataset[idx],
-                            dtype=numpy.float32, transpose=True)
-        sat_azi = as_array(satellite_azimuth_dataset[idx],
-                           dtype=numpy.float32, transpose=True)
-        slope = as_array(slope_dataset[idx],
-                         dtype=numpy.float32, transpose=True)
-        aspect = as_array(aspect_dataset[idx],
-                          dtype=numpy.float32, transpose=True)
-
-        # Initialise the work arrays
-        exiting = numpy.zeros((ysize, xsize), dtype='float32')
-        azi_exiting = numpy.zeros((ysize, xsize), dtype='float32')
-
-        # Process the current tile
-        exiting_angle(xsize, ysize, sat_view, sat_azi, slope, aspect,
-                      exiting.transpose(), azi_exiting.transpose())
-
-        # Write the current to disk
-        exiting_dset[idx] = exiting
-        azi_exit_dset[idx] = azi_exiting
+    with ChunkWriter() as writer:
+        for tile in plan.tiles():
+            # Row and column start and end locations
+            ystart = tile[0][0]
+            xstart = tile[1][0]
+            yend = tile[0][1]
+            xend = tile[1][1]
+            idx = (slice(ystart, yend), slice(xstart, xend))
+
+            # Tile size
+            ysize = yend - ystart
+            xsize = xend - xstart
+
+            # Read the data for the current tile
+            # Convert to required datatype and transpose
+            sat_view = as_array(satellite_view_dataset[idx],
+                                dtype=numpy.float32, transpose=True)
+            sat_azi = as_array(satellite_azimuth_dataset[idx],
+                               dtype=numpy.float32, transpose=True)
+            slope = as_array(slope_dataset[idx],
+                             dtype=numpy.float32, transpose=True)
+            aspect = as_array(aspect_dataset[idx],
+                              dtype=numpy.float32, transpose=True)
+
+            # Initialise the work arrays
+            exiting = numpy.zeros((ysize, xsize), dtype='float32')
+            azi_exiting = numpy.zeros((ysize, xsize), dtype='float32')
+
+            # Process the current tile
+            exiting_angle(xsize, ysize, sat_view, sat_azi, slope, aspect,
+                          exiting.transpose(), azi_exiting.transpose())
+
+            # Write the current to disk
+            writer.write(exiting_dset, idx, exiting)
+            writer.write(azi_exit_dset, idx, azi_exiting)
 
     if out_group is None:
         return fid
@@ -400,8 +403,8 @@ def relative_azimuth_slope(incident_angles_group, exiting_angles_group,
         filter_opts = {}
 
     grp = fid[GroupName.REL_SLP_GROUP.value]
-    tile_size = azimuth_incident_dataset.chunks
-    filter_opts['chunks'] = tile_size
+    plan = plan_tiles(shape, chunks=azimuth_incident_dataset.chunks)
+    filter_opts['chunks'] = plan.chunks
     kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
     no_data = -999
     kwargs['shape'] = shape
@@ -422,23 +425,24 @@ def relative_azimuth_slope(incident_angles_group, exiting_angles_group,
     attach_image_attributes(out_dset, attrs)
 
     # process by tile
-    for tile in generate_tiles(cols, rows, tile_size[1], tile_size[0]):
-        # Row and column start and end locations
-        ystart, yend = tile[0]
-        xstart, xend = tile[1]
-        idx = (slice(ystart, yend), slice(xstart, xend))
-
-        # Read the data for the current tile
-        azi_inc = azimuth_incident_dataset[idx]
-        azi_exi = azimuth_exiting_dataset[idx]
-
-        # Process the tile
-        rel_azi = azi_inc - azi_exi
-        rel_azi[rel_azi <= -180.0] += 360.0
-        rel_azi[rel_azi > 180.0] -= 360.0
-
-        # Write the current tile to disk
-        out_dset[idx] = rel_azi
+    with ChunkWriter() as writer:
+        for tile in plan.tiles():
+            # Row and column start and end locations
+            ystart, yend = tile[0]
+            xstart, xend = tile[1]
+            idx = (slice(ystart, yend), slice(xstart, xend))
+
+            # Read the data for the current tile
+            azi_inc = azimuth_incident_dataset[idx]
+            azi_exi = azimuth_exiting_dataset[idx]
+
+            # Process the tile
+            rel_azi = azi_inc - azi_exi
+            rel_azi[rel_azi <= -180.0] += 360.0
+            rel_azi[rel_azi > 180.0] -= 360.0
+
+            # Write the current tile to disk
+            writer.write(out_dset, idx, rel_azi)
 
     if out_group is None:
         return fid
@@ -14,7 +14,7 @@ import h5py
 import numexpr
 
 from wagl.constants import DatasetName, Workflow, GroupName, Method
-from wagl.hdf5 import H5CompressionFilter, find, create_external_link
+from wagl.hdf5 import H5CompressionFilter, find, link_datasets
 from wagl.hdf5 import write_h5_image, read_h5_table
 
 DEFAULT_ORIGIN = (0, 0)
@@ -490,7 +490,7 @@ def interpolate(acq, coefficient, ancillary_group, satellite_solar_group,
         filter_opts = {}
     else:
         filter_opts = filter_opts.copy()
-    filter_opts['chunks'] = acq.tile_size
+    filter_opts['chunks'] = acq.chunks
 
     group = fid[GroupName.INTERP_GROUP.value]
 
@@ -518,15 +518,18 @@ def interpolate(acq, coefficient, ancillary_group, satellite_solar_group,
         return fid
 
 
-def link_interpolated_data(data, out_fname):
+def link_interpolated_data(data, out_fname, virtual=False):
     """
     Links the individual interpolated results into a
-    single file for easier access.
+    single file for easier access; as external links, or
+    as virtual datasets if `virtual` is True.
     """
+    links = []
     for key in data:
         fname = data[key]
         with h5py.File(fname, 'r') as fid:
             dataset_names = find(fid, dataset_class='IMAGE')
 
-        for dname in dataset_names:
-            create_external_link(fname, dname, out_fname, dname)
+        links.extend((fname, dname, dname) for dname in dataset_names)
+
+    link_datasets(links, out_fname, virtual)
@@ -11,3 +11,7 @@ INTERFACE_LOGGER = logging.getLogger('luigi-interface')
 STATUS_LOGGER = wrap_logger(logging.getLogger('status'),
                             processors=[JSONRenderer(indent=1, sort_keys=True)])
 
+
+PROFILE_LOGGER = wrap_logger(logging.getLogger('profile'),
+                             processors=[JSONRenderer(indent=1,
+                                                      sort_keys=True)])
@@ -176,7 +176,7 @@ def create_lon_lat_grids(acquisition, out_group=None,
     if filter_opts is None:
         filter_opts = {}
 
-    filter_opts['chunks'] = acquisition.tile_size
+    filter_opts['chunks'] = acquisition.chunks
     kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
     lon_dset = grp.create_dataset(DatasetName.LON.value, data=result, **kwargs)
     attach_image_attributes(lon_dset, attrs)
@@ -270,7 +270,7 @@ def create_lon_grid(acquisition, out_fname=None,
     if filter_opts is None:
         filter_opts = {}
 
-    filter_opts['chunks'] = acquisition.tile_size
+    filter_opts['chunks'] = acquisition.chunks
     kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
 
     lon_grid = create_grid(geobox, get_lon_coordinate, depth)
@@ -334,7 +334,7 @@ def create_lat_grid(acquisition, out_fname=None,
     if filter_opts is None:
         filter_opts = {}
 
-    filter_opts['chunks'] = acquisition.tile_size
+    filter_opts['chunks'] = acquisition.chunks
     kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
 
     lat_grid = create_grid(geobox, get_lat_coordinate, depth)
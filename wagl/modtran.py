@@ -21,11 +21,12 @@ import pandas as pd
 from wagl.constants import Workflow, BandType, DatasetName, GroupName, Albedos
 from wagl.constants import POINT_FMT, ALBEDO_FMT, POINT_ALBEDO_FMT
 from wagl.constants import AtmosphericCoefficients as AC
-from wagl.hdf5 import write_dataframe, read_h5_table, create_external_link
+from wagl.hdf5 import write_dataframe, read_h5_table, link_datasets
 from wagl.hdf5 import VLEN_STRING, write_scalar, H5CompressionFilter
 from wagl.modtran_profiles import MIDLAT_SUMMER_ALBEDO, TROPICAL_ALBEDO
 from wagl.modtran_profiles import MIDLAT_SUMMER_TRANSMITTANCE, SBT_FORMAT
 from wagl.modtran_profiles import TROPICAL_TRANSMITTANCE, THERMAL_TRANSMITTANCE
+from wagl.profiling import profile
 
 
 def prepare_modtran(acquisitions, coordinate, albedos, basedir, modtran_exe):
@@ -294,7 +295,8 @@ def run_modtran(acquisitions, atmospherics_group, workflow, npoints, point,
                          ALBEDO_FMT.format(a=albedo.value))
         group_path = ppjoin(base_path, ALBEDO_FMT.format(a=albedo.value))
 
-        subprocess.check_call([modtran_exe], cwd=workpath)
+        with profile('modtran', point=point, albedo=albedo.value):
+            subprocess.check_call([modtran_exe], cwd=workpath)
         chn_fname = glob.glob(pjoin(workpath, '*.chn'))[0]
 
         if albedo == Albedos.ALBEDO_TH:
@@ -947,10 +949,11 @@ def calculate_solar_radiation(flux_data, spectral_response, levels=36,
     return df
 
 
-def link_atmospheric_results(input_targets, out_fname, npoints, workflow):
+def link_atmospheric_results(input_targets, out_fname, npoints, workflow,
+                             virtual=False):
     """
-    Uses h5py's ExternalLink to combine the atmospheric results into
-    a single file.
+    Uses h5py's ExternalLink (or a virtual dataset) to combine the
+    atmospheric results into a single file.
 
     :param input_targets:
         A `list` of luigi.LocalTargets.
@@ -965,6 +968,10 @@ def link_atmospheric_results(input_targets, out_fname, npoints, workflow):
     :param workflow:
         An Enum given by wagl.constants.Workflow.
 
+    :param virtual:
+        A `bool`; if True the results are mapped as virtual datasets,
+        otherwise (default) they're external links.
+
     :return:
         None. Results from each file in `input_targets` are linked
         into the output file.
@@ -973,6 +980,7 @@ def link_atmospheric_results(input_targets, out_fname, npoints, workflow):
     nbar_atmospherics = False
     sbt_atmospherics = False
     attributes = []
+    links = []
     for fname in input_targets:
         with h5py.File(fname.path, 'r') as fid:
             points = list(fid[base_group_name].keys())
@@ -1005,7 +1013,9 @@ def link_atmospheric_results(input_targets, out_fname, npoints, workflow):
 
                 for dset in datasets:
                     dname = ppjoin(grp_path, dset)
-                    create_external_link(fname.path, dname, out_fname, dname)
+                    links.append((fname.path, dname, dname))
+
+    link_datasets(links, out_fname, virtual)
 
     with h5py.File(out_fname) as fid:
         group = fid[GroupName.ATMOSPHERIC_RESULTS_GRP.value]
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+"""
+Morphology
+----------
+
+Binary morphology of the pixel quality masks with square structuring
+elements; the dilation, erosion and majority filter of a mask.
+
+The results are identical to those of `scipy.ndimage`; the dilation
+and erosion match `binary_dilation` and `binary_erosion` with a
+`numpy.ones((size, size))` structure (and the default border value of
+0), and the majority filter matches thresholding the `convolve`
+(default mode of 'reflect') of the mask with a `numpy.ones((size,
+size))` kernel at half the window size.
+
+Dilation and erosion are separable for a square structuring element,
+and are evaluated on the mask packed 8 pixels per byte. The lines are
+combined via the van Herk/Gil-Werman running maximum (minimum), which
+requires 3 operations per byte regardless of the window size, and the
+samples via log2(size) shifts of the packed bits.
+The majority filter counts the pixels of each window from an integral
+image.
+
+Each operation can be evaluated over strips of `tile_lines` lines,
+including a halo of the lines required by the window, to bound the
+temporary memory.
+"""
+
+from __future__ import absolute_import
+import numpy
+
+from wagl.tiling import generate_tiles
+
+
+def _radius(size):
+    """
+    The radius of a square window of odd size.
+    """
+    if size < 1 or size % 2 == 0:
+        raise ValueError('The window size must be a positive odd integer')
+    return size // 2
+
+
+def _as_mask(array):
+    """
+    A boolean view or copy of an array, True for non-zero values.
+    """
+    array = numpy.asarray(array)
+    if array.ndim != 2:
+        raise ValueError('A 2D array is required')
+    if array.dtype != numpy.bool_:
+        array = array != 0
+    return array
+
+
+def _tiled(func, mask, halo, tile_lines):
+    """
+    Evaluate func over strips of tile_lines lines of the mask,
+    including halo lines either side of each strip.
+    """
+    lines, samples = mask.shape
+    if tile_lines is None or tile_lines >= lines:
+        return func(mask)
+
+    result = numpy.empty(mask.shape, dtype='bool')
+    for tile in generate_tiles(samples, lines, samples, tile_lines):
+        ystart, yend = tile[0]
+        hstart = max(ystart - halo, 0)
+        hend = min(yend + halo, lines)
+        strip = func(mask[hstart:hend])
+        result[ystart:yend] = strip[ystart - hstart:yend - hstart]
+
+    return result
+
+
+def _pack(mask, radius):
+    """
+    Pack the samples of the mask 8 per byte, with room for the radius
+    of the window beyond the last sample.
+    """
+    nbytes = (mask.shape[1] + radius + 7) // 8
+    packed = numpy.zeros((mask.shape[0], nbytes), dtype='uint8')
+    packed[:, :(mask.shape[1] + 7) // 8] = numpy.packbits(mask, axis=1)
+    return packed
+
+
+def _shift(packed, offset):
+    """
+    Shift the packed samples by offset pixels (result[:, i] =
+    packed[:, i - offset]), filling with zeros.
+    """
+    result = numpy.zeros_like(packed)
+    nbytes = packed.shape[1]
+    nshift, bits = divmod(abs(offset), 8)
+    if nshift >= nbytes:
+        return result
+
+    # the first sample of each byte is its most significant bit
+    if offset >= 0:
+        source = packed[:, :nbytes - nshift]
+        result[:, nshift:] = source >> bits
+        if bits:
+            result[:, nshift + 1:] |= source[:, :-1] << (8 - bits)
+    else:
+        source = packed[:, nshift:]
+        result[:, :nbytes - nshift] = source << bits
+        if bits:
+            result[:, :nbytes - nshift - 1] |= source[:, 1:] >> (8 - bits)
+
+    return result
+
+
+def _window_samples(packed, size, ufunc):
+    """
+    Combine the packed samples over a centred window via doubling
+    shifts.
+    """
+    # combine the preceding size samples, ie window[i] spans
+    # [i - size + 1, i], then centre the window
+    window = None
+    length = 0
+    span = packed
+    width = 1
+    remaining = size
+    while remaining:
+        if remaining & 1:
+            if window is None:
+                window = span
+            else:
+                window = ufunc(window, _shift(span, length))
+            length += width
+        remaining >>= 1
+        if remaining:
+            span = ufunc(span, _shift(span, width))
+            width *= 2
+
+    return _shift(window, -(size // 2))
+
+
+def _window_lines(packed, size, ufunc):
+    """
+    Combine the packed lines over a centred window via the van Herk/
+    Gil-Werman algorithm; the prefix and suffix accumulations within
+    blocks of size lines.
+    """
+    radius = size // 2
+    lines = packed.shape[0]
+    nblocks = -(-(lines + 2 * radius) // size)
+    padded = numpy.zeros((nblocks * size, packed.shape[1]), dtype='uint8')
+    padded[radius:radius + lines] = packed
+
+    blocks = padded.reshape(nblocks, size, -1)
+    prefix = ufunc.accumulate(blocks, axis=1).reshape(padded.shape)
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1]
+    suffix = suffix.reshape(padded.shape)
+
+    return ufunc(suffix[:lines], prefix[size - 1:size - 1 + lines])
+
+
+def _square(mask, size, ufunc):
+    """
+    Combine the mask over a square window, the border being False.
+    """
+    radius = _radius(size)
+    if radius == 0 or mask.size == 0:
+        return mask.copy()
+
+    packed = _pack(mask, radius)
+    packed = _window_lines(packed, size, ufunc)
+    packed = _window_samples(packed, size, ufunc)
+
+    return numpy.unpackbits(packed, axis=1,
+                            count=mask.shape[1]).view('bool')
+
+
+def square_dilation(mask, size, tile_lines=None):
+    """
+    Dilate a mask with a square structuring element.
+
+    :param mask:
+        A 2D `NumPy` array; non-zero values are True.
+
+    :param size:
+        An odd integer; the edge length of the structuring element.
+
+    :param tile_lines:
+        If not None (default), the dilation is evaluated over strips
+        of this many lines.
+
+    :return:
+        A 2D `NumPy` array of type bool, identical to
+        `ndimage.binary_dilation(mask, numpy.ones((size, size)))`.
+    """
+    mask = _as_mask(mask)
+    func = lambda strip: _square(strip, size, numpy.bitwise_or)
+    return _tiled(func, mask, _radius(size), tile_lines)
+
+
+def square_erosion(mask, size, tile_lines=None):
+    """
+    Erode a mask with a square structuring element. Pixels within
+    `size // 2` of the edge of the array are False.
+
+    :param mask:
+        A 2D `NumPy` array; non-zero values are True.
+
+    :param size:
+        An odd integer; the edge length of the structuring element.
+
+    :param tile_lines:
+        If not None (default), the erosion is evaluated over strips
+        of this many lines.
+
+    :return:
+        A 2D `NumPy` array of type bool, identical to
+        `ndimage.binary_erosion(mask, numpy.ones((size, size)))`.
+    """
+    mask = _as_mask(mask)
+    func = lambda strip: _square(strip, size, numpy.bitwise_and)
+    return _tiled(func, mask, _radius(size), tile_lines)
+
+
+def _majority(mask, size, iterations):
+    """
+    The majority filter via an integral image.
+    """
+    radius = _radius(size)
+    threshold = size * size // 2
+    lines, samples = mask.shape
+
+    # the window sums are exact under the wrap around of the unsigned
+    # integers, as a sum never exceeds size * size
+    dtype = 'uint16' if size * size < 2 ** 16 else 'uint32'
+    for _ in range(iterations):
+        # 'symmetric' padding is the 'reflect' mode of scipy.ndimage
+        padded = numpy.pad(mask, radius, mode='symmetric')
+
+        integral = numpy.zeros((padded.shape[0] + 1, padded.shape[1] + 1),
+                               dtype=dtype)
+        numpy.cumsum(padded, axis=0, dtype=dtype, out=integral[1:, 1:])
+        numpy.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+        del padded
+
+        counts = integral[size:, size:] - integral[:lines, size:]
+        counts -= integral[size:, :samples]
+        counts += integral[:lines, :samples]
+        mask = counts > threshold
+
+    return mask
+
+
+def majority_filter(mask, iterations=1, size=3, tile_lines=None):
+    """
+    Applies a majority filter to a mask; a pixel is True if more than
+    half of the pixels of the window centred on it are True. The
+    array is reflected about its edges.
+
+    :param mask:
+        A 2D `NumPy` array; non-zero values are True.
+
+    :param iterations:
+        The number of iterations of the filter. Default is 1.
+
+    :param size:
+        An odd integer; the edge length of the window. Default is 3.
+
+    :param tile_lines:
+        If not None (default), the filter is evaluated over strips of
+        this many lines.
+
+    :return:
+        A 2D `NumPy` array of type bool.
+    """
+    mask = _as_mask(mask)
+    if mask.size == 0 or iterations < 1:
+        return mask.copy()
+
+    func = lambda strip: _majority(strip, size, iterations)
+    return _tiled(func, mask, _radius(size) * iterations, tile_lines)
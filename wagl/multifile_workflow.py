@@ -54,9 +54,12 @@ from wagl.modtran import link_atmospheric_results
 from wagl.interpolation import _interpolate, link_interpolated_data
 from wagl.temperature import _surface_brightness_temperature
 from wagl.pq import can_pq, _run_pq
-from wagl.hdf5 import create_external_link, H5CompressionFilter
+from wagl.hdf5 import H5CompressionFilter, link_datasets, repack
 from wagl.logging import ERROR_LOGGER
 
+# registers the event handlers that profile each Task
+from wagl import task_profiling  # noqa: F401
+
 
 @luigi.Task.event_handler(luigi.Event.FAILURE)
 def on_failure(task, exception):
@@ -68,6 +71,23 @@ def on_failure(task, exception):
                        traceback=traceback.format_exc().splitlines())
 
 
+class Consolidation(luigi.Config):
+
+    """
+    How the results of the individual tasks are combined into a
+    single file. Configured via the [Consolidation] section of the
+    luigi configuration.
+
+    virtual: map the datasets as HDF5 virtual datasets, rather than
+             external links.
+    repack: copy all the data of the final output into a single
+            self contained file.
+    """
+
+    virtual = luigi.BoolParameter()
+    repack = luigi.BoolParameter()
+
+
 class WorkRoot(luigi.Task):
 
     """
@@ -340,7 +360,7 @@ class Atmospherics(luigi.Task):
         nvertices = self.vertices[0] * self.vertices[1]
         with self.output().temporary_path() as out_fname:
             link_atmospheric_results(self.input(), out_fname, nvertices,
-                                     self.workflow)
+                                     self.workflow, Consolidation().virtual)
 
 
 @requires(Atmospherics)
@@ -453,7 +473,7 @@ class InterpolateCoefficients(luigi.Task):
             fnames[key] = value.path
 
         with self.output().temporary_path() as out_fname:
-            link_interpolated_data(fnames, out_fname)
+            link_interpolated_data(fnames, out_fname, Consolidation().virtual)
 
 
 @inherits(CalculateLonLatGrids)
@@ -851,7 +871,7 @@ class DataStandardisation(luigi.Task):
     def run(self):
         with self.output().temporary_path() as out_fname:
             fnames = [target.path for target in self.input()]
-            link_standard_data(fnames, out_fname)
+            link_standard_data(fnames, out_fname, Consolidation().virtual)
             sbt_only = self.workflow == Workflow.SBT
             if self.pixel_quality and can_pq(self.level1, self.acq_parser_hint) and not sbt_only:
                 _run_pq(self.level1, out_fname, self.group, self.land_sea_path,
@@ -874,6 +894,10 @@ class LinkwaglOutputs(luigi.Task):
     method = luigi.EnumParameter(enum=Method, default=Method.SHEAR)
     dsm_fname = luigi.Parameter(significant=False)
     buffer_distance = luigi.FloatParameter(default=8000, significant=False)
+    compression = luigi.EnumParameter(enum=H5CompressionFilter,
+                                      default=H5CompressionFilter.LZF,
+                                      significant=False)
+    filter_opts = luigi.DictParameter(default=None, significant=False)
 
     def requires(self):
         container = acquisitions(self.level1, self.acq_parser_hint)
@@ -891,26 +915,36 @@ class LinkwaglOutputs(luigi.Task):
         return luigi.LocalTarget(out_fname)
 
     def run(self):
-        with self.output().temporary_path() as out_fname:
-            for root, _, files in os.walk(self.work_root):
-                # skip any private files
-                if basename(root)[0] == '_':
-                    continue
+        links = []
+        for root, _, files in os.walk(self.work_root):
+            # skip any private files
+            if basename(root)[0] == '_':
+                continue
+
+            for file_ in files:
+                if splitext(file_)[1] == '.h5':
+                    fname = pjoin(root, file_)
+                    grp_name = basename(dirname(fname.replace(self.work_root, '')))
 
-                for file_ in files:
-                    if splitext(file_)[1] == '.h5':
-                        fname = pjoin(root, file_)
-                        grp_name = basename(dirname(fname.replace(self.work_root, '')))
+                    with h5py.File(fname, 'r') as fid:
+                        groups = [g for g in fid]
 
-                        with h5py.File(fname, 'r') as fid:
-                            groups = [g for g in fid]
+                    for pth in groups:
+                        new_path = ppjoin(self.granule, grp_name, pth)
+                        links.append((fname, pth, new_path))
 
-                        for pth in groups:
-                            new_path = ppjoin(self.granule, grp_name, pth)
-                            create_external_link(fname, pth, out_fname,
-                                                 new_path)
+        consolidation = Consolidation()
+        with self.output().temporary_path() as out_fname:
+            if consolidation.repack:
+                link_fname = '{}.links'.format(out_fname)
+                link_datasets(links, link_fname, consolidation.virtual)
+                repack(link_fname, out_fname, self.compression,
+                       self.filter_opts)
+                os.remove(link_fname)
+            else:
+                link_datasets(links, out_fname, consolidation.virtual)
 
-            with h5py.File(out_fname) as fid:
+            with h5py.File(out_fname, 'a') as fid:
                 fid.attrs['level1_uri'] = self.level1
 
 
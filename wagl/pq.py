@@ -6,8 +6,7 @@ Contains the pixel quality workflow as well as a few utilities.
 
 from __future__ import absolute_import, print_function
 import os
-from os.path import join as pjoin, dirname
-from glob import glob
+from os.path import dirname
 import logging
 import numpy
 import h5py
@@ -142,7 +141,7 @@ class PQAResult(object):
         else:
             fopts = filter_opts.copy()
 
-        fopts['chunks'] = acq.tile_size
+        fopts['chunks'] = acq.chunks
         attrs = self.aux_data.copy()
         attrs['crs_wkt'] = self.geobox.crs.ExportToWkt()
         attrs['geotransform'] = self.geobox.transform.to_gdal()
@@ -294,10 +293,14 @@ def run_pq(level1, input_group, land_sea_path, out_group,
     if pq_const.run_cloud:
         aux_data = {}   # for collecting result metadata
 
-        # TODO: pass in scene metadata via acquisitions or mtl reader
-        mtl = glob(pjoin(level1, '*/*_MTL.txt'))[0]
-        mask = fmask_cloud_mask(mtl, null_mask=contiguity_mask,
-                                sat_tag=platform_id, aux_data=aux_data)
+        # Fmask reads the bands via the acquisitions, including the
+        # (unsupported) cirrus band, from every resolution group
+        fmask_acqs = [acq for group in container.groups for acq in
+                      container.get_acquisitions(group,
+                                                 only_supported_bands=False)]
+        mask = fmask_cloud_mask(None, null_mask=contiguity_mask,
+                                sat_tag=platform_id, aux_data=aux_data,
+                                acquisitions=fmask_acqs)
 
         # set the result
         pqa_result.set_mask(mask, pq_const.fmask)
@@ -346,7 +349,6 @@ def run_pq(level1, input_group, land_sea_path, out_group,
 
     # parameters for cloud shadow masks
     land_sea_mask = pqa_result.get_mask(pq_const.land_sea)
-    temperature = get_landsat_temperature(acqs, pq_const)
 
     # Clear the cached datasets
     for acq in acqs:
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+
+"""
+Stage profiling
+---------------
+
+A lightweight instrumentation API for recording the resources used by
+the stages of a workflow:
+
+* wall time
+* CPU time of the calling thread
+* CPU time of child processes (such as MODTRAN)
+* the resident set size of the process at the start of the
+  measurement, and its peak during the measurement (sampled)
+* the resident set size high-water mark of the process lifetime
+* the bytes read and written by the process (where available)
+* the growth of the HDF5 file being written to
+
+Measurements are taken via the `Profiler.profile` context manager,
+the module level `profile` context manager (which records against the
+profiler of the enclosing measurement within the same thread), or the
+`profiled` decorator. Each completed measurement is emitted to the
+`PROFILE_LOGGER` as a structured log record, and retained by its
+`Profiler`, which can write them as a `PROFILE` table.
+
+The peak RSS of a measurement is sampled from /proc/self/statm by a
+single thread (every `RSS_INTERVAL` seconds) while any measurement is
+running, and is NaN where /proc is unavailable. The lifetime
+high-water mark (`process_max_rss`) is only the peak of the process
+so far, and not of the measurement.
+
+The child process CPU time, RSS and I/O counters are process wide,
+and as such are shared by any measurements running concurrently.
+When a `wagl.executor.StageGraph` runs stages concurrently, each stage
+writes to its own scratch file, and `hdf5_bytes` is the size of that
+scratch file.
+"""
+
+from __future__ import absolute_import
+from functools import wraps
+import os
+import sys
+import threading
+import time
+
+import numpy
+import pandas
+
+from wagl.constants import DatasetName
+from wagl.hdf5 import H5CompressionFilter, write_dataframe
+from wagl.logging import PROFILE_LOGGER
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# ru_maxrss is reported in bytes on macOS, and kilobytes elsewhere
+RSS_SCALE = 1 if sys.platform == 'darwin' else 1024
+
+# the number of seconds between samples of the resident set size
+RSS_INTERVAL = 0.05
+
+_ACTIVE = threading.local()
+
+
+def _max_rss():
+    """
+    The resident set size high-water mark (bytes) of the process
+    lifetime.
+    """
+    if resource is None:
+        return numpy.nan
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_SCALE
+
+
+def _thread_cpu_time():
+    """
+    The CPU time (seconds) of the calling thread. `time.thread_time`
+    is only available from Python 3.7; otherwise the thread's resource
+    usage is used where the platform provides it (Linux), and failing
+    that the CPU time of the whole process.
+    """
+    if hasattr(time, 'thread_time'):
+        return time.thread_time()
+
+    if resource is not None and hasattr(resource, 'RUSAGE_THREAD'):
+        usage = resource.getrusage(resource.RUSAGE_THREAD)
+        return usage.ru_utime + usage.ru_stime
+
+    return time.process_time()
+
+
+def _current_rss():
+    """
+    The current resident set size (bytes) of the process, or NaN if
+    unavailable (only Linux provides /proc/self/statm).
+    """
+    try:
+        with open('/proc/self/statm') as src:
+            pages = int(src.read().split()[1])
+        return float(pages * os.sysconf('SC_PAGE_SIZE'))
+    except (IOError, OSError, IndexError, ValueError):
+        return numpy.nan
+
+
+class _RSSSampler(object):
+
+    """
+    Samples the resident set size of the process within a single
+    thread, while there are measurements running, retaining the peak
+    observed during each measurement.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._peaks = {}
+        self._thread = None
+
+    def _run(self):
+        while True:
+            time.sleep(RSS_INTERVAL)
+            rss = _current_rss()
+            with self._lock:
+                if not self._peaks:
+                    self._thread = None
+                    return
+                for key, peak in self._peaks.items():
+                    self._peaks[key] = numpy.fmax(peak, rss)
+
+    def start(self, key):
+        """
+        Start sampling for a measurement; returns the current RSS.
+        """
+        rss = _current_rss()
+        with self._lock:
+            self._peaks[key] = rss
+            if self._thread is None and not numpy.isnan(rss):
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        return rss
+
+    def stop(self, key):
+        """
+        Stop sampling for a measurement; returns the peak RSS.
+        """
+        rss = _current_rss()
+        with self._lock:
+            return float(numpy.fmax(self._peaks.pop(key, rss), rss))
+
+
+_RSS_SAMPLER = _RSSSampler()
+
+
+def _children_cpu_time():
+    """
+    The user and system CPU time (seconds) of the terminated child
+    processes.
+    """
+    if resource is None:
+        return numpy.nan
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _io_counters():
+    """
+    The bytes read and written by the process via system calls, or
+    NaN's if unavailable (only Linux provides them).
+    """
+    try:
+        with open('/proc/self/io') as src:
+            counters = dict(line.split(':') for line in src)
+        return float(counters['rchar']), float(counters['wchar'])
+    except (IOError, OSError, KeyError, ValueError):
+        return numpy.nan, numpy.nan
+
+
+def _file_size(group):
+    """
+    The size (bytes) of the HDF5 file containing `group`.
+    """
+    if group is None:
+        return numpy.nan
+    return float(group.file.id.get_filesize())
+
+
+def _stack():
+    if not hasattr(_ACTIVE, 'stack'):
+        _ACTIVE.stack = []
+    return _ACTIVE.stack
+
+
+class Measurement(object):
+
+    """
+    The resources used by a single named unit of work; either used as
+    a context manager, or via explicit calls to `start` and `stop`.
+
+    :param profiler:
+        The `Profiler` that the measurement is recorded against.
+
+    :param name:
+        A `str` identifying the unit of work, eg a stage name.
+
+    :param group:
+        The `h5py.Group` being written to, used to measure the growth
+        of its file. Default is None.
+
+    :param tags:
+        Additional key value pairs to include in the record.
+    """
+
+    def __init__(self, profiler, name, group=None, **tags):
+        self.profiler = profiler
+        self.name = name
+        self.group = group
+        self.tags = tags
+        self.record = None
+        self._start = None
+
+    def start(self):
+        """
+        Start the measurement.
+        """
+        stack = _stack()
+        parent = stack[-1].name if stack else ''
+        stack.append(self)
+
+        self._start = {'parent': parent,
+                       'start_time': time.time(),
+                       'wall': time.perf_counter(),
+                       'cpu': _thread_cpu_time(),
+                       'children_cpu': _children_cpu_time(),
+                       'rss': _RSS_SAMPLER.start(id(self)),
+                       'io': _io_counters(),
+                       'file_size': _file_size(self.group)}
+        return self
+
+    def stop(self, status='success'):
+        """
+        Stop the measurement, and record the result against the
+        profiler.
+
+        :param status:
+            A `str` describing the outcome of the unit of work.
+            Default is 'success'.
+
+        :return:
+            A `dict` containing the record.
+        """
+        stack = _stack()
+        if self in stack:
+            stack.remove(self)
+
+        start = self._start
+        read_bytes, write_bytes = _io_counters()
+        peak_rss = _RSS_SAMPLER.stop(id(self))
+        record = {'name': self.name,
+                  'parent': start['parent'],
+                  'status': status,
+                  'start_time': start['start_time'],
+                  'wall_time': time.perf_counter() - start['wall'],
+                  'cpu_time': _thread_cpu_time() - start['cpu'],
+                  'children_cpu_time': (_children_cpu_time() -
+                                        start['children_cpu']),
+                  'start_rss': start['rss'],
+                  'peak_rss': peak_rss,
+                  'peak_rss_increase': peak_rss - start['rss'],
+                  'process_max_rss': _max_rss(),
+                  'read_bytes': read_bytes - start['io'][0],
+                  'write_bytes': write_bytes - start['io'][1],
+                  'hdf5_bytes': _file_size(self.group) - start['file_size']}
+        record.update(self.tags)
+
+        self.record = record
+        self.profiler.add(record)
+        return record
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop('success' if exc_type is None else 'failure')
+
+
+class Profiler(object):
+
+    """
+    Collects the records of each `Measurement`, and emits them as
+    structured log records.
+
+    :param tags:
+        Key value pairs to include in every record, eg the level1
+        dataset and granule.
+
+    :param keep:
+        If True (default), the records are retained, otherwise they're
+        only logged.
+    """
+
+    def __init__(self, keep=True, **tags):
+        self.tags = tags
+        self.keep = keep
+        self.records = []
+        self._lock = threading.Lock()
+
+    def profile(self, name, group=None, **tags):
+        """
+        Return a `Measurement` of a named unit of work, for use as a
+        context manager. See `Measurement` for the parameters.
+
+        :example:
+            >>> profiler = Profiler(level1='LC80900842017...')
+            >>> with profiler.profile('slope-aspect', out_group):
+            >>>     slope_aspect_arrays(...)
+        """
+        return Measurement(self, name, group, **tags)
+
+    def add(self, record):
+        """
+        Add a completed record; called by `Measurement.stop`.
+        """
+        for key, value in self.tags.items():
+            record.setdefault(key, value)
+
+        PROFILE_LOGGER.info('Profile', **record)
+        if self.keep:
+            with self._lock:
+                self.records.append(record)
+
+    def dataframe(self):
+        """
+        Return the records as a `pandas.DataFrame`.
+        """
+        with self._lock:
+            records = list(self.records)
+
+        return pandas.DataFrame(records)
+
+    def write(self, group, dataset_name=DatasetName.PROFILE.value,
+              compression=H5CompressionFilter.LZF, filter_opts=None):
+        """
+        Write the records as a HDF5 `TABLE` dataset.
+
+        :param group:
+            The `h5py.Group` to write the table into.
+
+        :param dataset_name:
+            The name of the table. Default is 'PROFILE'.
+
+        :param compression:
+            The compression filter to use. Default is
+            H5CompressionFilter.LZF.
+
+        :param filter_opts:
+            A dict of key value pairs for the compression filter.
+        """
+        df = self.dataframe()
+        if df.empty:
+            return
+
+        for column in df.columns:
+            if df[column].dtype == object:
+                df[column] = df[column].fillna('').astype(str)
+
+        attrs = {'description': ('The resources used by each stage; '
+                                 'times are in seconds and sizes in '
+                                 'bytes.')}
+        write_dataframe(df, dataset_name, group, compression,
+                        title='Stage profile', attrs=attrs,
+                        filter_opts=filter_opts)
+
+
+# records measurements made outside of any profiler; logged only
+DEFAULT_PROFILER = Profiler(keep=False)
+
+
+def profile(name, group=None, **tags):
+    """
+    Return a `Measurement` of a named unit of work, recorded against
+    the `Profiler` of the enclosing measurement within the calling
+    thread, or `DEFAULT_PROFILER` if there is none.
+
+    :example:
+        >>> with profile('modtran', point=3, albedo='0'):
+        >>>     subprocess.check_call([modtran_exe], cwd=workpath)
+    """
+    stack = _stack()
+    profiler = stack[-1].profiler if stack else DEFAULT_PROFILER
+    return Measurement(profiler, name, group, **tags)
+
+
+def profiled(name=None):
+    """
+    A decorator that measures each call of a function via `profile`.
+
+    :param name:
+        The name of the measurement. Default is the function's
+        qualified name.
+    """
+    def decorator(func):
+        label = name or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+_TASK_MEASUREMENTS = {}
+
+
+def task_started(task):
+    """
+    Start a measurement of a luigi task; for the START event.
+    """
+    measurement = profile(task.get_task_family(), task_id=task.task_id,
+                          level1=getattr(task, 'level1', ''))
+    _TASK_MEASUREMENTS[task.task_id] = measurement.start()
+
+
+def task_stopped(task, status):
+    """
+    Stop the measurement of a luigi task; for the SUCCESS and FAILURE
+    events.
+    """
+    measurement = _TASK_MEASUREMENTS.pop(task.task_id, None)
+    if measurement is not None:
+        measurement.stop(status)
@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+
+"""
+Histogram quantiles
+-------------------
+
+Percentiles of large samples (such as the temperatures of the clear
+land pixels of a scene) evaluated from a single pass histogram, rather
+than by sorting the sample for every percentile that is required.
+
+Precision
+~~~~~~~~~
+
+The percentiles follow the definition of `numpy.percentile` (and
+`scipy.stats.scoreatpercentile`); linear interpolation between the
+two order statistics that bracket the fractional rank
+`q / 100 * (n - 1)`.
+
+* Samples of no more than `exact_size` values are sorted, and the
+  percentiles are exact.
+* Integer samples (whose range spans no more than `MAX_INTEGER_BINS`
+  values) are histogrammed with a bin per value, and the percentiles
+  are exact.
+* Otherwise the sample is histogrammed into `bins` bins of equal width
+  spanning its range. With `refine=True` (default) a second pass
+  gathers the values of the (few) bins containing the required order
+  statistics, and only those are sorted; the percentiles are exact.
+  With `refine=False` the order statistics are estimated by assuming
+  the values are uniformly distributed within their bin, and the
+  absolute error of a percentile is no more than the bin width
+  (`(max - min) / bins`), which is given by the `resolution`
+  attribute.
+
+Exact results agree with `numpy.percentile` up to the floating point
+rounding of the interpolation, which is evaluated in float64.
+The sample must not contain NaN's; the percentiles of an empty sample
+are NaN.
+
+Streamed samples
+~~~~~~~~~~~~~~~~
+
+`StreamedQuantiles` evaluates the percentiles of a float32 sample that
+is supplied in blocks (such as the tiles of a scene), without ever
+holding the sample. The values are histogrammed by the upper 16 bits
+of their (order preserving) float32 bit pattern as the blocks are
+added, and a second pass over the same blocks histograms the values
+of the bins containing the required order statistics by their lower
+16 bits; each of those bins is a single float32 value, so the
+percentiles are exact. The memory held is a few fixed size histograms,
+regardless of the sample size.
+"""
+
+from __future__ import absolute_import
+import numpy
+
+# samples of no more than this size are sorted
+EXACT_SIZE = 10000
+
+# the number of bins of the histogram of a floating point sample
+HISTOGRAM_BINS = 65536
+
+# the largest range of an integer sample histogrammed at full resolution
+MAX_INTEGER_BINS = 2 ** 24
+
+# the number of values binned at a time, bounding the temporary memory
+BLOCK_SIZE = 2 ** 20
+
+# the bits of the float32 keys of a streamed sample, binned by each pass
+KEY_SHIFT = 16
+KEY_BINS = 2 ** KEY_SHIFT
+KEY_MASK = KEY_BINS - 1
+SIGN_BIT = numpy.uint32(2 ** 31)
+
+
+def _ranks(q, size):
+    """
+    The order statistics bracketing, and the interpolation weight
+    between them, of each percentile of a sample of `size` values.
+    """
+    q = numpy.asarray(q, dtype='float64')
+    if numpy.any((q < 0) | (q > 100)):
+        raise ValueError('Percentiles must be in the range [0, 100]')
+
+    rank = q / 100.0 * (size - 1)
+    lower = numpy.floor(rank).astype('int64')
+    upper = numpy.minimum(lower + 1, size - 1)
+    return lower, upper, rank - lower
+
+
+def _interpolate(lower, weight, values):
+    """
+    Interpolate the percentiles from the values of the `lower` and
+    then the upper order statistics.
+    """
+    low = values[:lower.size].reshape(lower.shape)
+    high = values[lower.size:].reshape(lower.shape)
+
+    result = low + (high - low) * weight
+    if result.ndim == 0:
+        return float(result)
+    return result
+
+
+def _empty(weight):
+    """The percentiles of an empty sample."""
+    # as per scipy.stats.scoreatpercentile
+    result = numpy.full(weight.shape, numpy.nan)
+    return float(result) if result.ndim == 0 else result
+
+
+class HistogramQuantiles(object):
+
+    """
+    Evaluates any number of percentiles of a sample from its histogram.
+
+    :param data:
+        A `NumPy` array of the sample values; it is flattened.
+
+    :param bins:
+        The number of histogram bins used for a floating point sample.
+        Default is `HISTOGRAM_BINS`.
+
+    :param exact_size:
+        Samples of no more than this number of values are sorted
+        instead of histogrammed. Default is `EXACT_SIZE`.
+
+    :param refine:
+        If True (default), the order statistics of a floating point
+        sample are resolved exactly from the values of the bins
+        containing them, otherwise they're estimated to within a bin
+        width.
+
+    :example:
+        >>> quantiles = HistogramQuantiles(temperature[clear_land])
+        >>> low, high = quantiles.percentiles([17.5, 82.5])
+    """
+
+    def __init__(self, data, bins=HISTOGRAM_BINS, exact_size=EXACT_SIZE,
+                 refine=True):
+        data = numpy.asarray(data).ravel()
+
+        self.size = data.size
+        self.refine = refine
+        self.resolution = 0.0
+        self._data = None
+        self._sorted = None
+        self._index = None
+        self._counts = None
+        self._integer = False
+
+        if data.size <= exact_size:
+            self._sorted = numpy.sort(data).astype('float64')
+            return
+
+        self._minv = data.min()
+        maxv = data.max()
+
+        if numpy.issubdtype(data.dtype, numpy.integer):
+            span = int(maxv) - int(self._minv) + 1
+            if span <= MAX_INTEGER_BINS:
+                self._integer = True
+                self._minv = int(self._minv)
+                self._bins = span
+                self._width = 1.0
+                self._counts = self._histogram(data)
+                return
+
+        self._minv = float(self._minv)
+        span = float(maxv) - self._minv
+        if span == 0:
+            self._sorted = numpy.array([self._minv])
+            return
+
+        self._bins = bins
+        self._width = span / bins
+        self.resolution = self._width
+
+        if refine:
+            # retained to gather the values of the required bins
+            self._data = data
+            itype = 'uint16' if bins <= 2 ** 16 else 'uint32'
+            self._index = numpy.empty(data.size, dtype=itype)
+        self._counts = self._histogram(data, self._index)
+
+    def _histogram(self, data, index=None):
+        """
+        The count of the values in each bin, evaluated in blocks.
+        If given, `index` is filled with the bin of each value.
+        """
+        counts = numpy.zeros(self._bins, dtype='int64')
+        for start in range(0, data.size, BLOCK_SIZE):
+            block = self._bin_index(data[start:start + BLOCK_SIZE])
+            counts += numpy.bincount(block, minlength=self._bins)
+            if index is not None:
+                index[start:start + BLOCK_SIZE] = block
+
+        return counts
+
+    def _bin_index(self, data):
+        """
+        The histogram bin of each value; a monotonic function of the
+        values, so that the bins partition the sorted sample.
+        """
+        if self._integer:
+            return (data.astype('int64') - self._minv).astype('intp')
+
+        # evaluated at the precision of the sample, as it only needs to
+        # be monotonic; the index is held as compactly as possible
+        dtype = numpy.result_type(data.dtype, numpy.float32)
+        index = numpy.subtract(data, self._minv, dtype=dtype)
+        index *= dtype.type(1.0 / self._width)
+        numpy.minimum(index, self._bins - 1, out=index)
+        itype = 'uint16' if self._bins <= 2 ** 16 else 'uint32'
+        return index.astype(itype)
+
+    def _ranks(self, q):
+        """
+        The order statistics bracketing, and the interpolation weight
+        between them, of each percentile.
+        """
+        return _ranks(q, self.size)
+
+    def _order_statistics(self, ranks):
+        """
+        The values of the sorted sample at the given ranks.
+        """
+        if self._sorted is not None:
+            if self._sorted.size == 1:
+                return numpy.full(ranks.shape, self._sorted[0])
+            return self._sorted[ranks]
+
+        # the bin containing each order statistic, and its rank within
+        cumulative = numpy.cumsum(self._counts)
+        bins = numpy.searchsorted(cumulative, ranks, side='right')
+        start = cumulative[bins] - self._counts[bins]
+
+        if self._integer:
+            # a bin per value
+            return (self._minv + bins).astype('float64')
+
+        if self._data is None:
+            offset = (ranks - start + 0.5) / self._counts[bins]
+            return self._minv + (bins + offset) * self._width
+
+        # gather and sort the values of the required bins only
+        needed = numpy.unique(bins)
+        lookup = numpy.zeros(self._bins, dtype='bool')
+        lookup[needed] = True
+        values = self._data[lookup[self._index]]
+        values = numpy.sort(values).astype('float64')
+
+        # the offset of each required bin within the gathered values
+        offsets = numpy.cumsum(self._counts[needed]) - self._counts[needed]
+        position = offsets[numpy.searchsorted(needed, bins)] + ranks - start
+
+        return values[position]
+
+    def percentiles(self, q):
+        """
+        Evaluate the percentiles of the sample.
+
+        :param q:
+            A scalar or sequence of percentiles in the range [0, 100].
+
+        :return:
+            A float64 scalar or `NumPy` array of the same shape as `q`.
+        """
+        lower, upper, weight = self._ranks(q)
+        if self.size == 0:
+            return _empty(weight)
+
+        ranks = numpy.concatenate([lower.ravel(), upper.ravel()])
+        return _interpolate(lower, weight, self._order_statistics(ranks))
+
+
+def _float32_keys(data):
+    """
+    The float32 bit patterns of the values, as uint32 keys ordered as
+    the values are; the sign bit is set for the positive values, and
+    every bit is flipped for the negative values.
+    """
+    bits = numpy.asarray(data, dtype='float32').ravel().view('uint32')
+    negative = (bits & SIGN_BIT) != 0
+    return numpy.where(negative, ~bits, bits | SIGN_BIT)
+
+
+def _float32_values(keys):
+    """The float32 values of their keys; the inverse of `_float32_keys`."""
+    keys = numpy.asarray(keys, dtype='uint32')
+    positive = (keys & SIGN_BIT) != 0
+    bits = numpy.where(positive, keys & ~SIGN_BIT, ~keys)
+    return bits.view('float32')
+
+
+class StreamedQuantiles(object):
+
+    """
+    Evaluates any number of percentiles of a float32 sample supplied in
+    blocks, from two passes over the blocks; the first (`add`) as the
+    sample is produced, and the second when the percentiles are
+    evaluated.
+
+    :example:
+        >>> quantiles = StreamedQuantiles()
+        >>> for tile in tiles:
+        ...     quantiles.add(temperature(tile))
+        >>> low, high = quantiles.percentiles(
+        ...     [17.5, 82.5], (temperature(tile) for tile in tiles))
+    """
+
+    def __init__(self):
+        self.size = 0
+        self._counts = numpy.zeros(KEY_BINS, dtype='int64')
+
+    def add(self, data):
+        """
+        Add a block of the sample.
+
+        :param data:
+            A `NumPy` array of sample values; it is flattened, and
+            held as float32.
+        """
+        keys = _float32_keys(data)
+        self.size += keys.size
+        self._counts += numpy.bincount(keys >> KEY_SHIFT,
+                                       minlength=KEY_BINS)
+
+    def combine(self, other):
+        """
+        The quantiles of the union of two samples.
+
+        :param other:
+            An instance of `StreamedQuantiles`.
+
+        :return:
+            A new instance of `StreamedQuantiles`.
+        """
+        result = StreamedQuantiles()
+        result.size = self.size + other.size
+        result._counts = self._counts + other._counts
+        return result
+
+    def percentiles(self, q, blocks):
+        """
+        Evaluate the percentiles of the sample.
+
+        :param q:
+            A scalar or sequence of percentiles in the range [0, 100].
+
+        :param blocks:
+            An iterable yielding the blocks of the sample again, as
+            they were added (though in any order).
+
+        :return:
+            A float64 scalar or `NumPy` array of the same shape as `q`.
+        """
+        lower, upper, weight = _ranks(q, self.size)
+        if self.size == 0:
+            return _empty(weight)
+
+        # the bin containing each order statistic, and its rank within
+        ranks = numpy.concatenate([lower.ravel(), upper.ravel()])
+        cumulative = numpy.cumsum(self._counts)
+        bins = numpy.searchsorted(cumulative, ranks, side='right')
+        ranks = ranks - (cumulative[bins] - self._counts[bins])
+
+        # histogram the values of the required bins by their lower bits
+        needed = numpy.unique(bins)
+        counts = numpy.zeros(needed.size * KEY_BINS, dtype='int64')
+        for block in blocks:
+            keys = _float32_keys(block)
+            row = numpy.searchsorted(needed, keys >> KEY_SHIFT)
+            numpy.minimum(row, needed.size - 1, out=row)
+            inside = needed[row] == keys >> KEY_SHIFT
+            counts += numpy.bincount(row[inside] * KEY_BINS +
+                                     (keys[inside] & KEY_MASK),
+                                     minlength=counts.size)
+        counts = counts.reshape(needed.size, KEY_BINS)
+
+        if not numpy.array_equal(counts.sum(axis=1), self._counts[needed]):
+            raise ValueError('The blocks differ from those added')
+
+        rows = numpy.searchsorted(needed, bins)
+        cumulative = numpy.cumsum(counts, axis=1)
+        low_bits = [numpy.searchsorted(cumulative[row], rank, side='right')
+                    for row, rank in zip(rows, ranks)]
+        keys = (bins.astype('uint32') << KEY_SHIFT) | numpy.array(
+            low_bits, dtype='uint32')
+        values = _float32_values(keys).astype('float64')
+
+        return _interpolate(lower, weight, values)
+
+
+def percentiles(data, q, **kwargs):
+    """
+    Evaluate the percentiles of a sample via `HistogramQuantiles`.
+
+    :param data:
+        A `NumPy` array of the sample values.
+
+    :param q:
+        A scalar or sequence of percentiles in the range [0, 100].
+
+    :param kwargs:
+        Any keyword arguments accepted by `HistogramQuantiles`.
+
+    :return:
+        A float64 scalar or `NumPy` array of the same shape as `q`.
+    """
+    return HistogramQuantiles(data, **kwargs).percentiles(q)
@@ -17,7 +17,8 @@ from wagl.constants import AtmosphericCoefficients as AC
 from wagl.constants import ArdProducts as AP
 from wagl.data import as_array
 from wagl.hdf5 import H5CompressionFilter, attach_image_attributes
-from wagl.hdf5 import create_external_link, find
+from wagl.hdf5 import link_datasets, find
+from wagl.hdf5 import ChunkWriter
 from wagl.metadata import create_ard_yaml
 from wagl.__surface_reflectance import reflectance
 
@@ -219,7 +220,7 @@ def calculate_reflectance(acquisition, interpolation_group,
         filter_opts = {}
     else:
         filter_opts = filter_opts.copy()
-    filter_opts['chunks'] = acquisition.tile_size
+    filter_opts['chunks'] = acquisition.chunks
 
     kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
     grp = fid[GroupName.STANDARD_GROUP.value]
@@ -263,64 +264,65 @@ def calculate_reflectance(acquisition, interpolation_group,
     attach_image_attributes(nbart_dset, attrs)
 
     # process by tile
-    for tile in acquisition.tiles():
-        # tile indices
-        idx = (slice(tile[0][0], tile[0][1]), slice(tile[1][0], tile[1][1]))
-
-        # define some static arguments
-        acq_args = {'window': tile,
-                    'out_no_data': NO_DATA_VALUE}
-        f32_args = {'dtype': numpy.float32, 'transpose': True}
-
-        # Read the data corresponding to the current tile for all dataset
-        # Convert the datatype if required and transpose
-        band_data = as_array(acquisition.radiance_data(**acq_args), **f32_args)
+    with ChunkWriter() as writer:
+        for tile in acquisition.tiles():
+            # tile indices
+            idx = (slice(tile[0][0], tile[0][1]), slice(tile[1][0], tile[1][1]))
+
+            # define some static arguments
+            acq_args = {'window': tile,
+                        'out_no_data': NO_DATA_VALUE}
+            f32_args = {'dtype': numpy.float32, 'transpose': True}
+
+            # Read the data corresponding to the current tile for all dataset
+            # Convert the datatype if required and transpose
+            band_data = as_array(acquisition.radiance_data(**acq_args), **f32_args)
         
-        shadow = as_array(shadow_dataset[idx], numpy.int8, transpose=True)
-        solar_zenith = as_array(solar_zenith_dset[idx], **f32_args)
-        solar_azimuth = as_array(solar_azimuth_dset[idx], **f32_args)
-        satellite_view = as_array(satellite_v_dset[idx], **f32_args)
-        relative_angle = as_array(relative_a_dset[idx], **f32_args)
-        slope = as_array(slope_dataset[idx], **f32_args)
-        aspect = as_array(aspect_dataset[idx], **f32_args)
-        incident_angle = as_array(incident_angle_dataset[idx], **f32_args)
-        exiting_angle = as_array(exiting_angle_dataset[idx], **f32_args)
-        relative_slope = as_array(relative_s_dset[idx], **f32_args)
-        a_mod = as_array(a_dataset[idx], **f32_args)
-        b_mod = as_array(b_dataset[idx], **f32_args)
-        s_mod = as_array(s_dataset[idx], **f32_args)
-        fs = as_array(fs_dataset[idx], **f32_args)
-        fv = as_array(fv_dataset[idx], **f32_args)
-        ts = as_array(ts_dataset[idx], **f32_args)
-        direct = as_array(dir_dataset[idx], **f32_args)
-        diffuse = as_array(dif_dataset[idx], **f32_args)
-
-        # Allocate the output arrays
-        xsize, ysize = band_data.shape # band_data has been transposed
-        ref_lm = numpy.zeros((ysize, xsize), dtype='int16')
-        ref_brdf = numpy.zeros((ysize, xsize), dtype='int16')
-        ref_terrain = numpy.zeros((ysize, xsize), dtype='int16')
-
-        # Allocate the work arrays (single row of data)
-        ref_lm_work = numpy.zeros(xsize, dtype='float32')
-        ref_brdf_work = numpy.zeros(xsize, dtype='float32')
-        ref_terrain_work = numpy.zeros(xsize, dtype='float32')
-
-        # Run terrain correction
-        reflectance(xsize, ysize, rori, brdf_iso, brdf_vol, brdf_geo,
-                    acquisition.reflectance_adjustment, kwargs['fillvalue'],
-                    band_data, shadow, solar_zenith, solar_azimuth,
-                    satellite_view, relative_angle, slope, aspect,
-                    incident_angle, exiting_angle, relative_slope, a_mod,
-                    b_mod, s_mod, fs, fv, ts, direct, diffuse, ref_lm_work,
-                    ref_brdf_work, ref_terrain_work, ref_lm.transpose(),
-                    ref_brdf.transpose(), ref_terrain.transpose())
-
-
-        # Write the current tile to disk
-        lmbrt_dset[idx] = ref_lm
-        nbar_dset[idx] = ref_brdf
-        nbart_dset[idx] = ref_terrain
+            shadow = as_array(shadow_dataset[idx], numpy.int8, transpose=True)
+            solar_zenith = as_array(solar_zenith_dset[idx], **f32_args)
+            solar_azimuth = as_array(solar_azimuth_dset[idx], **f32_args)
+            satellite_view = as_array(satellite_v_dset[idx], **f32_args)
+            relative_angle = as_array(relative_a_dset[idx], **f32_args)
+            slope = as_array(slope_dataset[idx], **f32_args)
+            aspect = as_array(aspect_dataset[idx], **f32_args)
+            incident_angle = as_array(incident_angle_dataset[idx], **f32_args)
+            exiting_angle = as_array(exiting_angle_dataset[idx], **f32_args)
+            relative_slope = as_array(relative_s_dset[idx], **f32_args)
+            a_mod = as_array(a_dataset[idx], **f32_args)
+            b_mod = as_array(b_dataset[idx], **f32_args)
+            s_mod = as_array(s_dataset[idx], **f32_args)
+            fs = as_array(fs_dataset[idx], **f32_args)
+            fv = as_array(fv_dataset[idx], **f32_args)
+            ts = as_array(ts_dataset[idx], **f32_args)
+            direct = as_array(dir_dataset[idx], **f32_args)
+            diffuse = as_array(dif_dataset[idx], **f32_args)
+
+            # Allocate the output arrays
+            xsize, ysize = band_data.shape # band_data has been transposed
+            ref_lm = numpy.zeros((ysize, xsize), dtype='int16')
+            ref_brdf = numpy.zeros((ysize, xsize), dtype='int16')
+            ref_terrain = numpy.zeros((ysize, xsize), dtype='int16')
+
+            # Allocate the work arrays (single row of data)
+            ref_lm_work = numpy.zeros(xsize, dtype='float32')
+            ref_brdf_work = numpy.zeros(xsize, dtype='float32')
+            ref_terrain_work = numpy.zeros(xsize, dtype='float32')
+
+            # Run terrain correction
+            reflectance(xsize, ysize, rori, brdf_iso, brdf_vol, brdf_geo,
+                        acquisition.reflectance_adjustment, kwargs['fillvalue'],
+                        band_data, shadow, solar_zenith, solar_azimuth,
+                        satellite_view, relative_angle, slope, aspect,
+                        incident_angle, exiting_angle, relative_slope, a_mod,
+                        b_mod, s_mod, fs, fv, ts, direct, diffuse, ref_lm_work,
+                        ref_brdf_work, ref_terrain_work, ref_lm.transpose(),
+                        ref_brdf.transpose(), ref_terrain.transpose())
+
+
+            # Write the current tile to disk
+            writer.write(lmbrt_dset, idx, ref_lm)
+            writer.write(nbar_dset, idx, ref_brdf)
+            writer.write(nbart_dset, idx, ref_terrain)
 
     # close any still opened files, arrays etc associated with the acquisition
     acquisition.close()
@@ -329,27 +331,33 @@ def calculate_reflectance(acquisition, interpolation_group,
         return fid
 
 
-def link_standard_data(input_fnames, out_fname):
+def link_standard_data(input_fnames, out_fname, virtual=False):
     # TODO: incorporate linking for multi-granule and multi-group
     #       datasets
     """
     Links the individual reflectance and surface temperature
-    results into a single file for easier access.
+    results into a single file for easier access; as external
+    links, or as virtual datasets if `virtual` is True.
     """
+    links = []
+    metadata = {}
     for fname in input_fnames:
         with h5py.File(fname, 'r') as fid:
             dataset_names = find(fid, dataset_class='IMAGE')
 
-        for dname in dataset_names:
-            create_external_link(fname, dname, out_fname, dname)
+            # the first file containing each yaml document
+            for yaml_dname in [DatasetName.NBAR_YAML.value,
+                               DatasetName.SBT_YAML.value]:
+                if yaml_dname in fid:
+                    metadata.setdefault(yaml_dname, fname)
 
-        # metadata
-        with h5py.File(fname, 'r') as fid:
-            with h5py.File(out_fname) as out_fid:
-                yaml_dname = DatasetName.NBAR_YAML.value
-                if yaml_dname in fid and yaml_dname not in out_fid:
-                    fid.copy(yaml_dname, out_fid, name=yaml_dname)
+        links.extend((fname, dname, dname) for dname in dataset_names)
+
+    link_datasets(links, out_fname, virtual)
 
-                yaml_dname = DatasetName.SBT_YAML.value
-                if yaml_dname in fid and yaml_dname not in out_fid:
+    # metadata
+    with h5py.File(out_fname, 'a') as out_fid:
+        for yaml_dname, fname in metadata.items():
+            if yaml_dname not in out_fid:
+                with h5py.File(fname, 'r') as fid:
                     fid.copy(yaml_dname, out_fid, name=yaml_dname)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+Region selection
+----------------
+
+Selection of the connected components (regions) of a labelled array
+via lookup tables over the label ids, rather than looping over the
+labels in Python.
+"""
+
+from __future__ import absolute_import
+import numpy
+from scipy import ndimage
+
+
+def label_lookup(labels, selected, nlabels=None):
+    """
+    Create a lookup table flagging the selected label ids.
+
+    :param labels:
+        A `NumPy` array of non-negative integer label ids, as given
+        by `scipy.ndimage.label`, where 0 is the background.
+
+    :param selected:
+        A `NumPy` array of the label ids to select. The background
+        (0) is never selected.
+
+    :param nlabels:
+        The maximum label id. If None (default), then the maximum
+        of `labels` is used.
+
+    :return:
+        A 1D `NumPy` array of type bool, of length `nlabels` + 1, that
+        is True for the selected label ids.
+    """
+    if nlabels is None:
+        nlabels = int(labels.max()) if labels.size else 0
+
+    lookup = numpy.zeros(nlabels + 1, dtype='bool')
+    lookup[selected] = True
+    lookup[0] = False
+
+    return lookup
+
+
+def components_touching(labels, seeds, nlabels=None):
+    """
+    Select the labelled components that contain at least one seed
+    pixel.
+
+    :param labels:
+        A `NumPy` array of non-negative integer label ids, as given
+        by `scipy.ndimage.label`, where 0 is the background.
+
+    :param seeds:
+        The seed pixels; either a boolean `NumPy` array of the same
+        shape as `labels`, or an index (such as returned by
+        `numpy.where`).
+
+    :param nlabels:
+        The maximum label id, eg as returned by `scipy.ndimage.label`.
+        If None (default), then the maximum of `labels` is used.
+
+    :return:
+        A `NumPy` array of type bool, of the same shape as `labels`,
+        that is True for every pixel of the selected components.
+    """
+    lookup = label_lookup(labels, labels[seeds], nlabels)
+    return lookup[labels]
+
+
+def grow_regions(mask, seeds, structure=None):
+    """
+    Select the connected regions of `mask` that contain at least one
+    seed pixel.
+
+    :param mask:
+        A boolean `NumPy` array of the candidate pixels.
+
+    :param seeds:
+        The seed pixels; either a boolean `NumPy` array of the same
+        shape as `mask`, or an index (such as returned by
+        `numpy.where`).
+
+    :param structure:
+        The structuring element defining the connectivity; see
+        `scipy.ndimage.label`. Default is None (4-connectivity).
+
+    :return:
+        A `NumPy` array of type bool, of the same shape as `mask`.
+    """
+    labels, nlabels = ndimage.label(mask, structure=structure)
+    return components_touching(labels, seeds, nlabels)
@@ -15,6 +15,7 @@ from osgeo import osr
 from wagl.constants import DatasetName, GroupName, TrackIntersection
 from wagl.hdf5 import H5CompressionFilter, attach_image_attributes
 from wagl.hdf5 import attach_table_attributes, write_scalar, attach_attributes
+from wagl.hdf5 import ChunkWriter
 from wagl.tle import load_tle
 from wagl.__sat_sol_angles import angle
 from wagl.__satellite_model import set_satmod
@@ -906,7 +907,7 @@ def calculate_angles(acquisition, lon_lat_group, out_group=None,
         filter_opts = {}
     else:
         filter_opts = filter_opts.copy()
-    filter_opts['chunks'] = acquisition.tile_size
+    filter_opts['chunks'] = acquisition.chunks
 
     grp = fid[GroupName.SAT_SOL_GROUP.value]
 
@@ -1001,47 +1002,48 @@ def calculate_angles(acquisition, lon_lat_group, out_group=None,
     x_cent = np.zeros((acquisition.lines), dtype=out_dtype)
     n_cent = np.zeros((acquisition.lines), dtype=out_dtype)
 
-    for tile in acquisition.tiles():
-        idx = (slice(tile[0][0], tile[0][1]), slice(tile[1][0], tile[1][1]))
-
-        # read the lon and lat tile
-        lon_data = longitude[idx]
-        lat_data = latitude[idx]
-
-        # may not be processing full row wise (all columns)
-        dims = lon_data.shape
-        col_offset = idx[1].start
-
-        view = np.full(dims, no_data, dtype=out_dtype)
-        azi = np.full(dims, no_data, dtype=out_dtype)
-        asol = np.full(dims, no_data, dtype=out_dtype)
-        soazi = np.full(dims, no_data, dtype=out_dtype)
-        rela_angle = np.full(dims, no_data, dtype=out_dtype)
-        time = np.full(dims, no_data, dtype=out_dtype)
-
-        # loop each row within each tile (which itself could be a single row)
-        for i in range(lon_data.shape[0]):
-            row_id = idx[0].start + i + 1 # FORTRAN 1 based index
-
-            stat = angle(dims[1], acquisition.lines, row_id, col_offset, lat_data[i],
-                         lon_data[i], spheroid[0], orbital_elements[0],
-                         acquisition.decimal_hour(), century, trackpoints, smodel[0], track[0],
-                         view[i], azi[i], asol[i], soazi[i], rela_angle[i],
-                         time[i], x_cent, n_cent)
-                         # x_cent[idx[0]], n_cent[idx[0]])
-
-            if stat != 0:
-                msg = ("Error in calculating angles at row: {}.\n"
-                       "No interval found in track!")
-                raise RuntimeError(msg.format(row_id - 1))
-
-        # output to disk
-        sat_v_ds[idx] = view
-        sat_az_ds[idx] = azi
-        sol_z_ds[idx] = asol
-        sol_az_ds[idx] = soazi
-        rel_az_ds[idx] = rela_angle
-        time_ds[idx] = time
+    with ChunkWriter() as writer:
+        for tile in acquisition.tiles():
+            idx = (slice(tile[0][0], tile[0][1]), slice(tile[1][0], tile[1][1]))
+
+            # read the lon and lat tile
+            lon_data = longitude[idx]
+            lat_data = latitude[idx]
+
+            # may not be processing full row wise (all columns)
+            dims = lon_data.shape
+            col_offset = idx[1].start
+
+            view = np.full(dims, no_data, dtype=out_dtype)
+            azi = np.full(dims, no_data, dtype=out_dtype)
+            asol = np.full(dims, no_data, dtype=out_dtype)
+            soazi = np.full(dims, no_data, dtype=out_dtype)
+            rela_angle = np.full(dims, no_data, dtype=out_dtype)
+            time = np.full(dims, no_data, dtype=out_dtype)
+
+            # loop each row within each tile (which itself could be a single row)
+            for i in range(lon_data.shape[0]):
+                row_id = idx[0].start + i + 1 # FORTRAN 1 based index
+
+                stat = angle(dims[1], acquisition.lines, row_id, col_offset, lat_data[i],
+                             lon_data[i], spheroid[0], orbital_elements[0],
+                             acquisition.decimal_hour(), century, trackpoints, smodel[0], track[0],
+                             view[i], azi[i], asol[i], soazi[i], rela_angle[i],
+                             time[i], x_cent, n_cent)
+                             # x_cent[idx[0]], n_cent[idx[0]])
+
+                if stat != 0:
+                    msg = ("Error in calculating angles at row: {}.\n"
+                           "No interval found in track!")
+                    raise RuntimeError(msg.format(row_id - 1))
+
+            # output to disk
+            writer.write(sat_v_ds, idx, view)
+            writer.write(sat_az_ds, idx, azi)
+            writer.write(sol_z_ds, idx, asol)
+            writer.write(sol_az_ds, idx, soazi)
+            writer.write(rel_az_ds, idx, rela_angle)
+            writer.write(time_ds, idx, time)
 
     # outputs
     # TODO: rework create_boxline so that it reads tiled data effectively
@@ -29,7 +29,7 @@ def saturation_mask(band_array, under_sat=1, over_sat=255, use_numexpr=True):
 
     if len(band_array) == 0:
         return None
-    assert isinstance(band_array, numpy.ndarry), 'Input is not valid'
+    assert isinstance(band_array, numpy.ndarray), 'Input is not valid'
 
     if use_numexpr:
         msg = ('numexpr used: numexpr.evaluate("(band_array != {under_sat}) & '
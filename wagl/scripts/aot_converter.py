@@ -12,7 +12,8 @@ import h5py
 import pandas
 from shapely.geometry import Polygon
 from shapely import wkt
-from wagl.hdf5 import write_dataframe
+from wagl.ancillary import grid_cells
+from wagl.hdf5 import write_dataframe, write_h5_table
 
 
 def read_pix(filename):
@@ -97,10 +98,49 @@ def read_cmp(filename):
     return df, extents
 
 
-def run(aerosol_path, output_filename):
+def spatial_index(df, cell_size=1.0):
+    """
+    Sort the aerosol table by global grid cell, and create an index
+    detailing the range of rows [start, stop) contained within each
+    occupied grid cell. This allows a reader to only read the rows
+    of interest.
+
+    :param df:
+        A `pandas.DataFrame` containing `lon` and `lat` columns.
+
+    :param cell_size:
+        The size of a grid cell in degrees. Default is 1.0.
+
+    :return:
+        A 2-tuple containing the sorted `pandas.DataFrame`, and a
+        NumPy structured array with the fields `cell_id`, `start`
+        and `stop`.
+    """
+    cells = grid_cells(df['lon'].values, df['lat'].values, cell_size)
+    order = numpy.argsort(cells, kind='mergesort')
+    df = df.iloc[order]
+    df.reset_index(inplace=True, drop=True)
+    cells = cells[order]
+
+    cell_ids, start, counts = numpy.unique(cells, return_index=True,
+                                           return_counts=True)
+
+    dtype = numpy.dtype([('cell_id', 'int64'), ('start', 'int64'),
+                         ('stop', 'int64')])
+    index = numpy.zeros(cell_ids.shape, dtype=dtype)
+    index['cell_id'] = cell_ids
+    index['start'] = start
+    index['stop'] = start + counts
+
+    return df, index
+
+
+def run(aerosol_path, output_filename, cell_size=1.0):
     """
     Converts all the .pix and .cmp files found in `aerosol_path`
     to a HDF5 file.
+    Each table is sorted by a global grid of `cell_size` degrees,
+    and a spatial index of the grid cells is written alongside it.
     """
     # define a case switch
     func = {'pix': read_pix, 'cmp': read_cmp}
@@ -120,8 +160,15 @@ def run(aerosol_path, output_filename):
 
             # read/write
             df, extents = func[ext](fname)
+            df, index = spatial_index(df, cell_size)
+            index_path = ppjoin(ext, 'SPATIAL-INDEX', grp_name)
+            write_h5_table(index, index_path, fid, title='SPATIAL-INDEX',
+                           attrs={'cell_size': cell_size})
+
             attrs = {'extents': wkt.dumps(extents),
-                     'source filename': fname}
+                     'source filename': fname,
+                     'spatial_index': index_path,
+                     'spatial_index_cell_size': cell_size}
             write_dataframe(df, out_path, fid, attrs=attrs)
 
     fid.close()
@@ -135,6 +182,9 @@ def _parser():
                         help="The input directory to the AATSR data.")
     parser.add_argument("--out_fname", required=True,
                         help="The output filename.")
+    parser.add_argument("--cell-size", default=1.0, type=float,
+                        help=("The grid cell size in degrees used for the "
+                              "spatial index. Default is 1.0."))
 
     return parser
 
@@ -143,4 +193,4 @@ def main():
     """ Main execution. """
     parser = _parser()
     args = parser.parse_args()
-    run(args.indir, args.out_fname)
+    run(args.indir, args.out_fname, args.cell_size)
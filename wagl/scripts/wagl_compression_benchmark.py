@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the HDF5 compression filters over representative samples
+of each class of dataset written by wagl, and emits the recommended
+configuration as a JSON styled `filter_opts` for `card4l`, eg:
+
+    wagl_compression_benchmark --out-filename filter-opts.json
+    luigi ... --filter-opts "$(cat filter-opts.json)"
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+
+import pandas
+
+from wagl.hdf5 import H5CompressionFilter
+from wagl.hdf5.compression_benchmark import synthetic_samples, file_samples
+from wagl.hdf5.compression_benchmark import candidate_configs, run_benchmarks
+from wagl.hdf5.compression_benchmark import recommend, SAMPLE_SHAPE
+from wagl.hdf5.compression_benchmark import CHUNK_SHAPES, MIN_WRITE_MBS
+from wagl.hdf5.compression_benchmark import MIN_READ_MBS
+
+
+def run(out_filename, input_filename=None, filters=None, chunk_edges=None,
+        repeats=3, min_write_mbs=MIN_WRITE_MBS, min_read_mbs=MIN_READ_MBS,
+        report_filename=None):
+    """
+    Run the benchmarks, print the results, and write the
+    recommended `filter_opts` to `out_filename`.
+    """
+    if input_filename is None:
+        samples = synthetic_samples()
+    else:
+        samples = file_samples(input_filename)
+
+    if chunk_edges is None:
+        chunk_shapes = CHUNK_SHAPES
+    else:
+        chunk_shapes = [(edge, edge) for edge in chunk_edges]
+
+    results = run_benchmarks(samples, candidate_configs(filters),
+                             chunk_shapes, repeats)
+
+    with pandas.option_context('display.max_rows', None,
+                               'display.width', 120):
+        print(results.sort_values(['dataset_class', 'ratio'],
+                                  ascending=[True, False]).to_string(
+                                      index=False))
+
+    if report_filename is not None:
+        results.to_csv(report_filename, index=False)
+
+    recommendation = recommend(results, min_write_mbs, min_read_mbs)
+    with open(out_filename, 'w') as src:
+        json.dump(recommendation, src, indent=4, sort_keys=True)
+
+    print(json.dumps(recommendation, indent=4, sort_keys=True))
+
+
+def _parser():
+    """ Argument parser. """
+    description = ("Benchmark the HDF5 compression filters, and emit the "
+                   "recommended filter options for each class of dataset.")
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--out-filename", required=True,
+                        help=("The filename of the JSON file to contain the "
+                              "recommended filter options."))
+    parser.add_argument("--input-filename", default=None,
+                        help=("A wagl output file to sample the datasets "
+                              "from. Default is to use synthetic samples "
+                              "of {} pixels.".format(SAMPLE_SHAPE)))
+    parser.add_argument("--filters", nargs='+', default=None,
+                        choices=list(H5CompressionFilter),
+                        type=lambda compression: H5CompressionFilter[compression],
+                        help="The compression filters to benchmark.")
+    parser.add_argument("--chunk-edges", nargs='+', default=None, type=int,
+                        help=("The edge lengths of the square chunks to "
+                              "benchmark for images. Default is {}."
+                              .format([c[0] for c in CHUNK_SHAPES])))
+    parser.add_argument("--repeats", default=3, type=int,
+                        help="The number of repeats for each benchmark.")
+    parser.add_argument("--min-write-mbs", default=MIN_WRITE_MBS,
+                        type=float,
+                        help=("The minimum write throughput (MB/s) of a "
+                              "recommended filter. Default is {}."
+                              .format(MIN_WRITE_MBS)))
+    parser.add_argument("--min-read-mbs", default=MIN_READ_MBS, type=float,
+                        help=("The minimum read throughput (MB/s) of a "
+                              "recommended filter. Default is {}."
+                              .format(MIN_READ_MBS)))
+    parser.add_argument("--report-filename", default=None,
+                        help="A CSV file to contain the full results.")
+
+    return parser
+
+
+def main():
+    """ Main execution. """
+    parser = _parser()
+    args = parser.parse_args()
+    run(args.out_filename, args.input_filename, args.filters,
+        args.chunk_edges, args.repeats, args.min_write_mbs,
+        args.min_read_mbs, args.report_filename)
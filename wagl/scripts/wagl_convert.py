@@ -10,7 +10,7 @@ from __future__ import print_function
 
 import os
 from os.path import join as pjoin, normpath, dirname, exists, basename
-from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 import argparse
 
 from posixpath import basename as pbasename
@@ -41,13 +41,14 @@ yaml.add_representer(numpy.float64, Representer.represent_float)
 yaml.add_representer(numpy.ndarray, Representer.represent_list)
 
 
-def convert_image(dataset, output_directory):
+def convert_image(dataset, output_directory, cogtif=False):
     """
     Converts a HDF5 `IMAGE` Class dataset to a compressed GeoTiff,
     with deflate zlevel 1 compression.
     Any attributes stored with the image will be written as dataset
     level metadata tags, and not band level tags.
     All attributes will also be written to a yaml file.
+    The dataset is streamed to disk a tile at a time.
 
     :param dataset:
         A HDF5 `IMAGE` Class dataset.
@@ -56,6 +57,10 @@ def convert_image(dataset, output_directory):
         A filesystem path to the directory that will be the root
         directory for any images extracted.
 
+    :param cogtif:
+        If set to True, create a tiled GeoTiff with internal
+        overviews (Cloud Optimised GeoTiff). Default is False.
+
     :return:
         None, outputs are written directly to disk.
     """
@@ -76,7 +81,8 @@ def convert_image(dataset, output_directory):
                   'compress': 'deflate'
               },
               'tags': tags,
-              'nodata': no_data}
+              'nodata': no_data,
+              'cogtif': cogtif}
 
     base_fname = pjoin(output_directory, normpath(dataset.name.strip('/')))
     out_fname = ''.join([base_fname, '.tif'])
@@ -159,7 +165,7 @@ def convert_scalar(dataset, output_directory):
         yaml.dump(tags, src, default_flow_style=False, indent=4)
 
 
-def extract(output_directory, group, name):
+def extract(output_directory, group, name, cogtif=False):
     """
     A simple utility that sends an object to the appropriate
     extraction utility.
@@ -169,7 +175,7 @@ def extract(output_directory, group, name):
     obj_class = obj.attrs.get('CLASS')
 
     if obj_class == 'IMAGE':
-        convert_image(obj, output_directory)
+        convert_image(obj, output_directory, cogtif)
     elif obj_class == 'TABLE':
         convert_table(group, dataset_name, output_directory)
     elif obj_class == 'SCALAR':
@@ -178,18 +184,36 @@ def extract(output_directory, group, name):
         return None
 
 
-def run(fname, outdir, pathname):
-    """ Run dataset conversion tree. """
+def _extract_task(fname, outdir, group_name, names, cogtif):
+    """
+    Worker task for extracting a list of objects contained within
+    `group_name`. Each worker opens its own file handle.
+    """
+    with h5py.File(fname, 'r') as fid:
+        group = fid[group_name]
+        for name in names:
+            extract(outdir, group, name, cogtif)
+
+
+def run(fname, outdir, pathname, cogtif=False, workers=1):
+    """
+    Run dataset conversion tree.
+    The objects found are distributed across a pool of `workers`
+    processes, such that the datasets of a granule are converted
+    concurrently.
+    """
     # note: lower level h5py access is required in order to visit links
     with h5py.File(fname, 'r') as fid:
         if pathname in fid:
             obj = fid[pathname]
             if isinstance(obj, h5py.Group):
+                group_name = obj.name
+                names = []
                 root = h5py.h5g.open(obj.id, b'.')
-                root.links.visit(partial(extract, outdir, obj))
+                root.links.visit(names.append)
             elif isinstance(obj, h5py.Dataset):
-                name = pbasename(obj.name).encode('utf-8')
-                extract(outdir, obj.parent, name)
+                group_name = obj.parent.name
+                names = [pbasename(obj.name).encode('utf-8')]
             else:
                 return
         else:
@@ -197,6 +221,18 @@ def run(fname, outdir, pathname):
             print(msg.format(pathname=pathname, fname=fname))
             return
 
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_extract_task, fname, outdir,
+                                       group_name, [name], cogtif)
+                       for name in names]
+
+            # raise any exceptions encountered by the workers
+            for future in futures:
+                future.result()
+    else:
+        _extract_task(fname, outdir, group_name, names, cogtif)
+
 
 def _parser():
     """ Argument parser. """
@@ -210,6 +246,12 @@ def _parser():
     parser.add_argument("--pathname", default="/",
                         help=("The pathname to either a Dataset or a Group. "
                               "Default is '/', which is root level."))
+    parser.add_argument("--cogtif", action='store_true',
+                        help=("Convert IMAGE datasets to Cloud Optimised "
+                              "GeoTiffs."))
+    parser.add_argument("--workers", default=1, type=int,
+                        help=("The number of worker processes used to "
+                              "convert datasets concurrently. Default is 1."))
 
     return parser
 
@@ -218,4 +260,4 @@ def main():
     """ Main execution. """
     parser = _parser()
     args = parser.parse_args()
-    run(args.filename, args.outdir, args.pathname)
+    run(args.filename, args.outdir, args.pathname, args.cogtif, args.workers)
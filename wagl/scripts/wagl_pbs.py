@@ -13,6 +13,8 @@ import uuid
 import argparse
 
 from wagl.tiling import scatter
+from wagl.work_queue import LEASE, MAX_ATTEMPTS
+from wagl.scripts.wagl_queue_worker import create_queue
 
 
 PBS_RESOURCES = ("""#!/bin/bash
@@ -51,6 +53,32 @@ done;
 wait
 """)
 
+QUEUE_NODE_TEMPLATE = ("""{pbs_resources}
+source {env}
+
+{daemon}
+
+wagl_queue_worker --queue {queue} --slots {slots}
+""")
+
+QUEUE_DSH_TEMPLATE = ("""{pbs_resources}
+DAEMONS=({daemons})
+
+for i in "${{!DAEMONS[@]}}"; do
+  X=$(($i+1))
+  pbsdsh -n $((16 *$X)) -- bash -l -c "source {env}; ${{DAEMONS[$i]}}; \\
+    wagl_queue_worker --queue {queue} --slots {slots}" &
+done;
+wait
+""")
+
+# the luigi command run by a queue worker for each scene; a failed task
+# exits with a non-zero status so that the scene is retried
+QUEUE_COMMAND = ("luigi {options} --level1-list {{scene_list}} "
+                 "--outdir {outdir} --workers {workers}{scheduler} "
+                 "--retcode-task-failed 1 --retcode-scheduling-error 1 "
+                 "--retcode-missing-data 1")
+
 
 FMT1 = 'level1-scenes-{jobid}.txt'
 FMT2 = 'jobid-{jobid}.bash'
@@ -156,19 +184,79 @@ def _submit_multiple(scattered, options, env, batchid, batch_logdir,
             subprocess.call(['qsub', out_fname])
 
 
+def _submit_queue(scenes, options, env, batchid, batch_logdir, batch_outdir,
+                  local_scheduler, pbs_resources, test, nodes, dsh, slots,
+                  lease, max_attempts):
+    """
+    Submit jobs whose workers pull scenes from a shared work queue,
+    rather than processing a fixed block of scenes per node.
+    """
+    print("Executing Batch: {}".format(batchid))
+    queue_dir = pjoin(batch_logdir, 'queue')
+
+    # every node uses its own scheduler, so the command is the same
+    # for every worker
+    scheduler = ' --local-scheduler' if local_scheduler and not dsh else ''
+    command = QUEUE_COMMAND.format(options=options, outdir=batch_outdir,
+                                   workers=max(1, 16 // slots),
+                                   scheduler=scheduler)
+
+    if not exists(batch_outdir):
+        os.makedirs(batch_outdir)
+
+    queue = create_queue(queue_dir, [s.strip() for s in scenes if s.strip()],
+                         command, lease, max_attempts)
+    print("Queue: {} {}".format(queue_dir, queue.counts()))
+
+    jobids = [uuid.uuid4().hex[0:6] for _ in range(nodes)]
+    jobdirs = [pjoin(batch_logdir, 'jobid-{}'.format(jobid))
+               for jobid in jobids]
+    for jobdir in jobdirs:
+        if not exists(jobdir):
+            os.makedirs(jobdir)
+
+    if dsh:
+        daemons = ['"{}"\n'.format(DAEMON_FMT.format(jobdir))
+                   for jobdir in jobdirs]
+        pbs = QUEUE_DSH_TEMPLATE.format(pbs_resources=pbs_resources, env=env,
+                                        daemons=''.join(daemons),
+                                        queue=queue_dir, slots=slots)
+        out_fnames = [pjoin(batch_logdir, FMT2.format(jobid=batchid))]
+        with open(out_fnames[0], 'w') as src:
+            src.write(pbs)
+    else:
+        out_fnames = []
+        for jobid, jobdir in zip(jobids, jobdirs):
+            daemon = '' if local_scheduler else DAEMON_FMT.format(jobdir)
+            pbs = QUEUE_NODE_TEMPLATE.format(pbs_resources=pbs_resources,
+                                             env=env, daemon=daemon,
+                                             queue=queue_dir, slots=slots)
+            out_fname = pjoin(jobdir, FMT2.format(jobid=jobid))
+            with open(out_fname, 'w') as src:
+                src.write(pbs)
+            out_fnames.append(out_fname)
+
+    for out_fname in out_fnames:
+        if test:
+            print("Mocking... Submitting Job: {} ...Mocking".format(out_fname))
+            print("qsub {}".format(out_fname))
+        else:
+            os.chdir(dirname(out_fname))
+            print("Submitting Job: {}".format(out_fname))
+            subprocess.call(['qsub', out_fname])
+
+
 # pylint: disable=too-many-arguments
 def run(level1, vertices='(5, 5)', workflow='standard', method='linear',
         pixel_quality=False, outdir=None, logdir=None, env=None, nodes=10,
         project=None, queue='normal', hours=48, buffer_distance=8000,
         email='your.name@something.com', local_scheduler=False, dsh=False,
-        test=False, singlefile=False, task=None):
+        test=False, singlefile=False, task=None, work_queue=False, slots=1,
+        lease=LEASE, max_attempts=MAX_ATTEMPTS):
     """Base level program."""
     with open(level1, 'r') as src:
         scenes = src.readlines()
 
-    # scattered = scatter(filter_scenes(scenes), nodes)
-    scattered = scatter(scenes, nodes)
-
     batchid = uuid.uuid4().hex[0:10]
     batch_logdir = pjoin(logdir, 'batchid-{}'.format(batchid))
     batch_outdir = pjoin(outdir, 'batchid-{}'.format(batchid))
@@ -199,6 +287,15 @@ def run(level1, vertices='(5, 5)', workflow='standard', method='linear',
     else:
         print("Submitting Batch: {}".format(batchid))
 
+    if work_queue:
+        _submit_queue(scenes, options, env, batchid, batch_logdir,
+                      batch_outdir, local_scheduler, pbs_resources, test,
+                      nodes, dsh, slots, lease, max_attempts)
+        return
+
+    # scattered = scatter(filter_scenes(scenes), nodes)
+    scattered = scatter(scenes, nodes)
+
     if dsh:
         _submit_dsh(scattered, options, env, batchid, batch_logdir,
                     batch_outdir, pbs_resources, test)
@@ -212,7 +309,8 @@ def _parser():
     description = ("Equally partition a list of scenes in n nodes and submit "
                    "into the PBS queue. Optionally submit as multiple "
                    "jobs into the PBS queue, or as a single job "
-                   "and executed using PBSDSH.")
+                   "and executed using PBSDSH. Alternatively the nodes "
+                   "can pull scenes from a shared work queue.")
     formatter = argparse.ArgumentDefaultsHelpFormatter
     parser = argparse.ArgumentParser(description=description,
                                      formatter_class=formatter)
@@ -262,6 +360,20 @@ def _parser():
                               "wagl.multifile_workflow module and run "
                               "each scene listed in level1-list through to "
                               "that Task level."))
+    parser.add_argument("--work-queue", action='store_true',
+                        help=("Dispatch the scenes via a shared work queue "
+                              "that each node pulls scenes from until it is "
+                              "empty, rather than a fixed block per node."))
+    parser.add_argument("--slots", type=int, default=1,
+                        help=("The number of scenes each node processes "
+                              "concurrently from the work queue."))
+    parser.add_argument("--lease", type=int, default=LEASE,
+                        help=("The number of seconds before the scene of an "
+                              "unresponsive node is returned to the work "
+                              "queue."))
+    parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS,
+                        help=("The maximum number of attempts at processing "
+                              "a scene from the work queue."))
     parser.add_argument("--test", action='store_true',
                         help=("Test job execution (Don't submit the job to "
                               "the PBS queue)."))
@@ -276,7 +388,7 @@ def main():
         args.pixel_quality, args.outdir, args.logdir, args.env, args.nodes,
         args.project, args.queue, args.hours, args.buffer_distance,
         args.email, args.local_scheduler, args.dsh, args.test, args.singlefile,
-        args.task)
+        args.task, args.work_queue, args.slots, args.lease, args.max_attempts)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""
+A worker that pulls level1 scenes from a shared work queue, as set up
+by `wagl_pbs --work-queue`, and runs the queue's command for each scene
+until the queue is exhausted.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+from os.path import join as pjoin
+import subprocess
+import uuid
+
+from wagl.work_queue import WorkQueue, run_worker, LEASE, MAX_ATTEMPTS
+
+CONFIG_FNAME = 'config.json'
+
+
+def create_queue(path, scenes, command, lease=LEASE,
+                 max_attempts=MAX_ATTEMPTS):
+    """
+    Create a work queue of scenes, along with the command (and lease
+    settings) to be used by every worker.
+
+    :param path:
+        The directory of the queue.
+
+    :param scenes:
+        A `list` of the level1 scenes to queue.
+
+    :param command:
+        A `str` containing the shell command run for each scene. The
+        command is formatted with `scene_list`; the filename of a
+        list containing the scene.
+
+    :param lease:
+        The number of seconds a lease lasts without being renewed.
+
+    :param max_attempts:
+        The maximum number of attempts at processing a scene.
+
+    :return:
+        A `WorkQueue`.
+    """
+    queue = WorkQueue(path, lease, max_attempts)
+    config = {'command': command, 'lease': lease,
+              'max_attempts': max_attempts}
+    with open(pjoin(path, CONFIG_FNAME), 'w') as src:
+        json.dump(config, src, indent=4)
+
+    queue.enqueue(scenes)
+
+    return queue
+
+
+def run_scene(queue, command, scene):
+    """
+    Run the command for a single scene; a non-zero exit status
+    raises a CalledProcessError.
+    """
+    list_dir = pjoin(queue.path, 'scene-lists')
+    os.makedirs(list_dir, exist_ok=True)
+    scene_list = pjoin(list_dir, '{}.txt'.format(uuid.uuid4().hex))
+    with open(scene_list, 'w') as src:
+        src.write('{}\n'.format(scene))
+
+    subprocess.check_call(command.format(scene_list=scene_list), shell=True)
+
+
+def run(queue_path, slots=1, wait=True):
+    """
+    Process the scenes of a queue until it is exhausted.
+    """
+    with open(pjoin(queue_path, CONFIG_FNAME), 'r') as src:
+        config = json.load(src)
+
+    queue = WorkQueue(queue_path, config['lease'], config['max_attempts'])
+    results = run_worker(queue,
+                         lambda scene: run_scene(queue, config['command'],
+                                                 scene),
+                         slots=slots, wait=wait)
+
+    failures = [scene for scene, exc in results if exc is not None]
+    print("Attempts: {}, failures: {}".format(len(results), len(failures)))
+    print("Queue: {}".format(queue.counts()))
+
+
+def _parser():
+    """ Argument parser. """
+    description = ("Pull level1 scenes from a shared work queue, and run "
+                   "the queue's command for each scene until the queue is "
+                   "exhausted.")
+    formatter = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(description=description,
+                                     formatter_class=formatter)
+    parser.add_argument("--queue", required=True,
+                        help="The directory of the work queue.")
+    parser.add_argument("--slots", type=int, default=1,
+                        help="The number of scenes to process concurrently.")
+    parser.add_argument("--no-wait", action='store_true',
+                        help=("Exit once there are no pending scenes, "
+                              "rather than waiting on the scenes leased by "
+                              "other workers."))
+    return parser
+
+
+def main():
+    """ Main execution. """
+    parser = _parser()
+    args = parser.parse_args()
+    run(args.queue, args.slots, not args.no_wait)
+
+
+if __name__ == '__main__':
+    main()
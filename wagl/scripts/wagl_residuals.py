@@ -8,7 +8,10 @@ reference file, with the equivalent dataset from a test file.
 from __future__ import print_function
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
+from os.path import dirname, join as pjoin
+import tempfile
 
 from posixpath import join as ppjoin
 from posixpath import basename as pbasename
@@ -17,34 +20,119 @@ import numpy
 import h5py
 import pandas
 
-from idl_functions import histogram
 from wagl.hdf5 import read_scalar, read_h5_table, write_dataframe
-from wagl.hdf5 import write_h5_image, write_h5_table, write_scalar
+from wagl.hdf5 import create_image_dataset, write_h5_table, write_scalar
+from wagl.hdf5 import attach_attributes
 from wagl.hdf5 import H5CompressionFilter, VLEN_STRING, find
 from wagl.geobox import GriddedGeoBox
+from wagl.tiling import generate_tiles
 
+# the approximate number of elements read per tile
+MAX_PIXELS = 2**22
 
-def distribution(data):
+
+def _tile_indices(dset, max_pixels=None):
+    """
+    Yields index tuples covering `dset` in tiles aligned with the
+    chunk layout of the dataset. The tile height is expanded to a
+    multiple of the chunk height such that a tile holds roughly
+    `max_pixels` elements, which avoids a very large number of
+    iterations for datasets chunked along single rows.
+    `NumPy` arrays and contiguous datasets are tiled in strips.
+    """
+    if max_pixels is None:
+        max_pixels = MAX_PIXELS
+
+    lines, samples = dset.shape[-2:]
+    chunks = getattr(dset, 'chunks', None)
+    if chunks is None:
+        ychunk, xchunk = min(lines, 256), samples
+    else:
+        ychunk, xchunk = chunks[-2:]
+
+    ytile = ychunk * max(1, max_pixels // (ychunk * samples))
+    xtile = xchunk if ytile == ychunk and xchunk < samples else samples
+
+    for tile in generate_tiles(samples, lines, xtile, ytile):
+        idx = (slice(*tile[0]), slice(*tile[1]))
+        yield (Ellipsis,) + idx
+
+
+def evaluate(ref_data, test_data):
+    """
+    Evaluate the image residual.
+    Caters for boolean types.
+    TODO: geobox intersection if dimensions are different.
+    TODO: handle no data values
+    TODO: handle classification datasets
+    TODO: handle bitwise datasets
+    """
+    if ref_data.dtype.name == 'bool':
+        result = numpy.logical_xor(ref_data, test_data).astype('uint8')
+    else:
+        result = ref_data - test_data
+    return result
+
+
+def distribution(dset, omin, omax, absolute=False, nbins=256):
     """
-    Evaluates the distribution of a `NumPy` array. Floating point
-    arrays will use 256 bins, while integer arrays will use
-    a binsize of 1.
+    Evaluates the distribution of a `h5py.Dataset` (or `NumPy` array)
+    by accumulating a fixed bin histogram over chunk aligned tiles,
+    such that the dataset is never read into memory in its entirety.
+    Floating point datasets will use 256 bins, while integer datasets
+    will use a binsize of 1. NaN's are excluded.
+
+    :param dset:
+        A `h5py.Dataset` or `NumPy` array.
+
+    :param omin:
+        The minimum value contained within `dset` (after taking
+        the absolute value if `absolute` is set).
+
+    :param omax:
+        The maximum value contained within `dset` (after taking
+        the absolute value if `absolute` is set).
+
+    :param absolute:
+        If set to True, the distribution of the absolute values
+        of `dset` is evaluated. Default is False.
+
+    :param nbins:
+        The number of bins to use for floating point datasets.
+        Default is 256.
+
+    :return:
+        A `dict` with the keys `histogram`, `omin`, `omax` and `loc`,
+        consistent with the IDL styled `histogram` function.
     """
-    if data.dtype.name in ['float', 'float32', 'float64']:
-        try:
-            h = histogram(data, omin='omin', omax='omax', locations='loc',
-                          nbins=256, nan=True)
-        except ValueError:
-            h = {}
-            h['histogram'] = numpy.zeros((256), dtype='uint32')
-            h['omin'] = 0
-            h['omax'] = 0
-            h['loc'] = numpy.zeros((256), dtype=data.dtype.name)
-            h['histogram'][0] = data.size
+    floating = dset.dtype.kind == 'f'
+
+    if floating:
+        binsize = (omax - omin) / (nbins - 1)
+        loc = (omin + numpy.arange(nbins) * binsize).astype(dset.dtype)
     else:
-        h = histogram(data, omin='omin', omax='omax', locations='loc')
+        binsize = 1
+        nbins = int(omax) - int(omin) + 1
+        loc = numpy.arange(omin, omax + 1, dtype=dset.dtype)
+
+    hist = numpy.zeros((nbins,), dtype='uint32')
+
+    for idx in _tile_indices(dset):
+        data = dset[idx]
+        if absolute:
+            data = numpy.abs(data)
+        if floating:
+            data = data[~numpy.isnan(data)]
+            if binsize == 0:
+                hist[0] += data.size
+                continue
+            bins = numpy.floor((data - omin) / binsize).astype('int64')
+            numpy.clip(bins, 0, nbins - 1, out=bins)
+        else:
+            bins = data.ravel().astype('int64') - int(omin)
+        hist += numpy.bincount(bins.ravel(), minlength=nbins).astype('uint32')
 
-    return h
+    return {'histogram': hist, 'omin': omin, 'omax': omax, 'loc': loc}
 
 
 def image_residual(ref_fid, test_fid, pathname, out_fid,
@@ -56,6 +144,12 @@ def image_residual(ref_fid, test_fid, pathname, out_fid,
     calculated and recorded as TABLE CLASS Datasets.
     Any NaN's in IMAGE datasets will be handled automatically.
 
+    The residual is evaluated and written a tile at a time, with
+    the tiles aligned to the chunks of the reference dataset. The
+    min, max and difference counts are accumulated in the same
+    pass, and the distributions are accumulated from a second pass
+    over the written residual.
+
     :param ref_fid:
         A h5py file object (essentially the root Group), containing
         the reference data.
@@ -92,31 +186,10 @@ def image_residual(ref_fid, test_fid, pathname, out_fid,
         None; This routine will only return None or a print statement,
         this is essential for the HDF5 visit routine.
     """
-    def evaluate(ref_dset, test_dset):
-        """
-        Evaluate the image residual.
-        Caters for boolean types.
-        TODO: geobox intersection if dimensions are different.
-        TODO: handle no data values
-        TODO: handle classification datasets
-        TODO: handle bitwise datasets
-        """
-        if ref_dset.dtype.name == 'bool':
-            result = numpy.logical_xor(ref_dset, test_dset).astype('uint8')
-        else:
-            result = ref_dset[:] - test_dset
-        return result
-
     class_name = 'IMAGE'
     ref_dset = ref_fid[pathname]
     test_dset = test_fid[pathname]
 
-    # ignore no data values for the time being
-    residual = evaluate(ref_dset, test_dset)
-    min_residual = numpy.nanmin(residual)
-    max_residual = numpy.nanmax(residual)
-    pct_difference = (residual != 0).sum() / residual.size * 100
-
     if filter_opts is None:
         fopts = {}
     else:
@@ -125,6 +198,39 @@ def image_residual(ref_fid, test_fid, pathname, out_fid,
 
     geobox = GriddedGeoBox.from_dataset(ref_dset)
 
+    if ref_dset.dtype.name == 'bool':
+        dtype = numpy.dtype('uint8')
+    else:
+        dtype = numpy.result_type(ref_dset.dtype, test_dset.dtype)
+
+    base_dname = pbasename(pathname)
+    group_name = ref_dset.parent.name.strip('/')
+    dname = ppjoin('RESULTS', class_name, 'RESIDUALS', group_name, base_dname)
+    residual = create_image_dataset(out_fid, dname, ref_dset.shape, dtype,
+                                    compression, filter_opts=fopts)
+
+    # ignore no data values for the time being
+    min_residual = numpy.nan
+    max_residual = numpy.nan
+    ndifferent = 0
+    for idx in _tile_indices(residual):
+        result = evaluate(ref_dset[idx], test_dset[idx])
+        residual[idx] = result
+        min_residual = numpy.fmin(min_residual, numpy.fmin.reduce(result,
+                                                                  axis=None))
+        max_residual = numpy.fmax(max_residual, numpy.fmax.reduce(result,
+                                                                  axis=None))
+        ndifferent += numpy.count_nonzero(result)
+
+    pct_difference = ndifferent / residual.size * 100
+
+    # an entirely NaN residual has no range
+    if numpy.isnan(min_residual):
+        min_residual = max_residual = dtype.type(0)
+    else:
+        min_residual = dtype.type(min_residual)
+        max_residual = dtype.type(max_residual)
+
     # output residual
     attrs = {
         'crs_wkt': geobox.crs.ExportToWkt(),
@@ -132,16 +238,13 @@ def image_residual(ref_fid, test_fid, pathname, out_fid,
         'description': 'Residual',
         'min_residual': min_residual,
         'max_residual': max_residual,
-        'percent_difference': pct_difference
+        'percent_difference': pct_difference,
+        'IMAGE_MINMAXRANGE': [min_residual, max_residual]
         }
-
-    base_dname = pbasename(pathname)
-    group_name = ref_dset.parent.name.strip('/')
-    dname = ppjoin('RESULTS', class_name, 'RESIDUALS', group_name, base_dname)
-    write_h5_image(residual, dname, out_fid, compression, attrs, fopts)
+    attach_attributes(residual, attrs)
 
     # residuals distribution
-    h = distribution(residual)
+    h = distribution(residual, min_residual, max_residual)
     hist = h['histogram']
 
     attrs = {
@@ -162,8 +265,13 @@ def image_residual(ref_fid, test_fid, pathname, out_fid,
     write_h5_table(table, dname, out_fid, compression, attrs=attrs,
                    filter_opts=fopts)
 
-    # cumulative distribution
-    h = distribution(numpy.abs(residual))
+    # cumulative distribution; range of the absolute residuals
+    abs_max = max(abs(min_residual), abs(max_residual))
+    if min_residual <= 0 <= max_residual:
+        abs_min = 0
+    else:
+        abs_min = min(abs(min_residual), abs(max_residual))
+    h = distribution(residual, abs_min, abs_max, absolute=True)
     hist = h['histogram']
     cdf = numpy.cumsum(hist / hist.sum())
 
@@ -196,6 +304,39 @@ def image_residual(ref_fid, test_fid, pathname, out_fid,
         test_fid.copy(test_dset, out_grp)
 
 
+def _image_residual_task(reference_fname, test_fname, pathname, out_fname,
+                         compression, save_inputs, filter_opts):
+    """
+    Worker task for evaluating the residual of a single IMAGE
+    Dataset into its own output file. This allows IMAGE Datasets
+    to be evaluated concurrently in separate processes.
+    """
+    with h5py.File(reference_fname, 'r') as ref_fid,\
+        h5py.File(test_fname, 'r') as test_fid,\
+        h5py.File(out_fname, 'w') as out_fid:
+
+        image_residual(ref_fid, test_fid, pathname, out_fid, compression,
+                       save_inputs, filter_opts)
+
+    return out_fname
+
+
+def _merge(src_fname, out_fid):
+    """
+    Copy every Dataset contained within `src_fname` into `out_fid`
+    at the same pathname. The raw (compressed) chunks are copied
+    as is.
+    """
+    def _copy(src_fid, name, obj):
+        """ Copy a Dataset, creating any parent Groups as required. """
+        if isinstance(obj, h5py.Dataset):
+            out_grp = out_fid.require_group(obj.parent.name)
+            src_fid.copy(obj, out_grp)
+
+    with h5py.File(src_fname, 'r') as src_fid:
+        src_fid.visititems(partial(_copy, src_fid))
+
+
 def scalar_residual(ref_fid, test_fid, pathname, out_fid, save_inputs):
     """
     Undertake a simple equivalency test, rather than a numerical
@@ -523,39 +664,91 @@ def table_results(table_group, compression=H5CompressionFilter.LZF,
                     title='EQUIVALENCY-RESULTS', filter_opts=filter_opts)
 
 
+def _collect(ref_fid, test_fid, images, others, pathname):
+    """
+    Sort each pathname found within the reference file into IMAGE
+    Datasets and all other objects; used as a HDF5 visit routine.
+    """
+    pathname = pathname.decode('utf-8')
+    if pathname in test_fid:
+        if ref_fid[pathname].attrs.get('CLASS') == 'IMAGE':
+            images.append(pathname)
+            return None
+    others.append(pathname.encode('utf-8'))
+
+
 def run(reference_fname, test_fname, out_fname, compression, save_inputs,
-        filter_opts):
-    """ Run the residuals analysis. """
+        filter_opts, workers=1):
+    """
+    Run the residuals analysis.
+    IMAGE Datasets are evaluated concurrently by a pool of `workers`
+    processes, each writing to a temporary file that is merged into
+    `out_fname` upon completion.
+    """
+    images = []
+    others = []
+
     # note: lower level h5py access is required in order to visit links
     with h5py.File(reference_fname, 'r') as ref_fid:
         with h5py.File(test_fname, 'r') as test_fid:
-            with h5py.File(out_fname, 'w') as out_fid:
-                root = h5py.h5g.open(ref_fid.id, b'/')
-                root.links.visit(partial(residuals, ref_fid, test_fid,
-                                         out_fid, compression, save_inputs, filter_opts))
-
-                # create singular TABLES for each Dataset CLASS
-
-                # IMAGE
-                try:
-                    grp = out_fid[ppjoin('RESULTS', 'IMAGE')]
-                    image_results(grp, compression, filter_opts)
-                except KeyError:
-                    pass
-
-                # SCALAR
-                try:
-                    grp = out_fid[ppjoin('RESULTS', 'SCALAR')]
-                    scalar_results(grp)
-                except KeyError:
-                    pass
-
-                # TABLE
-                try:
-                    grp = out_fid[ppjoin('RESULTS', 'TABLE')]
-                    table_results(grp)
-                except KeyError:
-                    pass
+            root = h5py.h5g.open(ref_fid.id, b'/')
+            root.links.visit(partial(_collect, ref_fid, test_fid, images,
+                                     others))
+
+    with tempfile.TemporaryDirectory(dir=dirname(out_fname) or None) as tmpdir:
+        tmp_fnames = []
+        if workers > 1 and images:
+            tmp_fnames = [pjoin(tmpdir, 'residual-{}.h5'.format(i))
+                          for i in range(len(images))]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_image_residual_task,
+                                           reference_fname, test_fname,
+                                           pathname, fname, compression,
+                                           save_inputs, filter_opts)
+                           for pathname, fname in zip(images, tmp_fnames)]
+
+                # raise any exceptions encountered by the workers
+                for future in futures:
+                    future.result()
+
+        with h5py.File(reference_fname, 'r') as ref_fid:
+            with h5py.File(test_fname, 'r') as test_fid:
+                with h5py.File(out_fname, 'w') as out_fid:
+                    if tmp_fnames:
+                        for fname in tmp_fnames:
+                            _merge(fname, out_fid)
+                    else:
+                        for pathname in images:
+                            image_residual(ref_fid, test_fid, pathname,
+                                           out_fid, compression, save_inputs,
+                                           filter_opts)
+
+                    for pathname in others:
+                        residuals(ref_fid, test_fid, out_fid, compression,
+                                  save_inputs, filter_opts, pathname)
+
+                    # create singular TABLES for each Dataset CLASS
+
+                    # IMAGE
+                    try:
+                        grp = out_fid[ppjoin('RESULTS', 'IMAGE')]
+                        image_results(grp, compression, filter_opts)
+                    except KeyError:
+                        pass
+
+                    # SCALAR
+                    try:
+                        grp = out_fid[ppjoin('RESULTS', 'SCALAR')]
+                        scalar_results(grp)
+                    except KeyError:
+                        pass
+
+                    # TABLE
+                    try:
+                        grp = out_fid[ppjoin('RESULTS', 'TABLE')]
+                        table_results(grp)
+                    except KeyError:
+                        pass
 
 
 def _parser():
@@ -583,6 +776,10 @@ def _parser():
     parser.add_argument("--save-inputs", action='store_true',
                         help=("Save the reference and test datasets "
                               "alongside the residual/difference datasets."))
+    parser.add_argument("--workers", default=1, type=int,
+                        help=("The number of worker processes used to "
+                              "evaluate IMAGE datasets concurrently. "
+                              "Default is 1."))
 
     return parser
 
@@ -592,4 +789,4 @@ def main():
     parser = _parser()
     args = parser.parse_args()
     run(args.test_filename, args.reference_filename, args.out_filename,
-        args.compression, args.save_inputs, args.filter_opts)
+        args.compression, args.save_inputs, args.filter_opts, args.workers)
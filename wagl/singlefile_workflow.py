@@ -30,12 +30,16 @@ import luigi
 from luigi.util import inherits
 
 from wagl.acquisition import acquisitions
+from wagl.batch import run_batch
 from wagl.constants import Workflow, Method
 from wagl.hdf5 import H5CompressionFilter
 from wagl.standardise import card4l
 
 from wagl.logging import ERROR_LOGGER, INTERFACE_LOGGER
 
+# registers the event handlers that profile each Task
+from wagl import task_profiling  # noqa: F401
+
 
 @luigi.Task.event_handler(luigi.Event.FAILURE)
 def on_failure(task, exception):
@@ -80,6 +84,9 @@ class DataStandardisation(luigi.Task):
     acq_parser_hint = luigi.OptionalParameter(default='')
     buffer_distance = luigi.FloatParameter(default=8000, significant=False)
     h5_driver = luigi.OptionalParameter(default='', significant=False)
+    stage_workers = luigi.IntParameter(default=1, significant=False)
+    combine_granules = luigi.BoolParameter()
+    derive_geometry = luigi.BoolParameter()
 
     def output(self):
         fmt = '{label}.wagl.h5'
@@ -94,15 +101,23 @@ class DataStandardisation(luigi.Task):
         else:
             ecmwf_path = None
 
+        # process every granule of the scene within a single file
+        if self.combine_granules:
+            container = acquisitions(self.level1, hint=self.acq_parser_hint)
+            granule = container.granules
+        else:
+            granule = self.granule
+
         with self.output().temporary_path() as out_fname:
-            card4l(self.level1, self.granule, self.workflow, self.vertices,
+            card4l(self.level1, granule, self.workflow, self.vertices,
                    self.method, self.pixel_quality, self.land_sea_path,
                    self.tle_path, self.aerosol, self.brdf_path,
                    self.brdf_premodis_path, self.ozone_path, self.water_vapour,
                    self.dem_path, self.dsm_fname, self.invariant_height_fname,
                    self.modtran_exe, out_fname, ecmwf_path, self.rori,
                    self.buffer_distance, self.compression, self.filter_opts,
-                   self.h5_driver, self.acq_parser_hint)
+                   self.h5_driver, self.acq_parser_hint, self.stage_workers,
+                   self.derive_geometry)
 
 
 @inherits(DataStandardisation)
@@ -122,7 +137,8 @@ class ARD(luigi.WrapperTask):
         for level1 in level1_list:
             container = acquisitions(level1)
             outdir = pjoin(self.outdir, '{}.wagl'.format(container.label))
-            for granule in container.granules:
+            granules = [''] if self.combine_granules else container.granules
+            for granule in granules:
                 kwargs = {'level1': level1,
                           'granule': granule,
                           'workflow': self.workflow,
@@ -146,9 +162,109 @@ class ARD(luigi.WrapperTask):
                           'compression': self.compression,
                           'filter_opts': self.filter_opts,
                           'buffer_distance': self.buffer_distance,
-                          'h5_driver': self.h5_driver}
+                          'h5_driver': self.h5_driver,
+                          'stage_workers': self.stage_workers,
+                          'combine_granules': self.combine_granules,
+                          'derive_geometry': self.derive_geometry}
                 yield DataStandardisation(**kwargs)
 
-        
+
+
+@inherits(DataStandardisation)
+class ARDBatch(luigi.Task):
+
+    """
+    Runs the standardised product workflow for each level1 entry
+    within this single long-lived task, sharing the scene independent
+    state (sensor definitions, TLE archives, BRDF listings, pooled
+    ancillary rasters) across scenes, and overlapping the stages of
+    consecutive scenes.
+    """
+
+    level1_list = luigi.Parameter()
+    workers = luigi.IntParameter(default=2, significant=False)
+    memory_budget = luigi.IntParameter(default=0, significant=False)
+
+    # override here so it's not required at the command line or config
+    level1 = luigi.OptionalParameter(default='', significant=False)
+
+    def _scenes(self):
+        # parsed once per task, as output() is called repeatedly
+        scenes = getattr(self, '_scene_list', None)
+        if scenes is not None:
+            return scenes
+
+        with open(self.level1_list) as src:
+            level1_list = [level1.strip() for level1 in src.readlines()]
+
+        scenes = []
+        for level1 in level1_list:
+            container = acquisitions(level1, hint=self.acq_parser_hint)
+            outdir = pjoin(self.outdir, '{}.wagl'.format(container.label))
+            if self.combine_granules:
+                out_fname = pjoin(outdir,
+                                  '{}.wagl.h5'.format(basename(level1)))
+                scenes.append((level1, container.granules, out_fname))
+                continue
+
+            for granule in container.granules:
+                label = granule if granule else basename(level1)
+                out_fname = pjoin(outdir, '{}.wagl.h5'.format(label))
+                scenes.append((level1, granule, out_fname))
+
+        self._scene_list = scenes
+        return scenes
+
+    def output(self):
+        return [luigi.LocalTarget(scene[2]) for scene in self._scenes()]
+
+    def run(self):
+        if self.workflow == Workflow.STANDARD or self.workflow == Workflow.SBT:
+            ecmwf_path = self.ecmwf_path
+        else:
+            ecmwf_path = None
+
+        card4l_kwargs = {'workflow': self.workflow,
+                         'vertices': self.vertices,
+                         'method': self.method,
+                         'pixel_quality': self.pixel_quality,
+                         'landsea': self.land_sea_path,
+                         'tle_path': self.tle_path,
+                         'aerosol': self.aerosol,
+                         'brdf_path': self.brdf_path,
+                         'brdf_premodis_path': self.brdf_premodis_path,
+                         'ozone_path': self.ozone_path,
+                         'water_vapour': self.water_vapour,
+                         'dem_path': self.dem_path,
+                         'dsm_fname': self.dsm_fname,
+                         'invariant_fname': self.invariant_height_fname,
+                         'modtran_exe': self.modtran_exe,
+                         'ecmwf_path': ecmwf_path,
+                         'rori': self.rori,
+                         'buffer_distance': self.buffer_distance,
+                         'compression': self.compression,
+                         'filter_opts': self.filter_opts,
+                         'h5_driver': self.h5_driver,
+                         'acq_parser_hint': self.acq_parser_hint,
+                         'workers': self.stage_workers,
+                         'derive_geometry': self.derive_geometry}
+
+        # only process the scenes not yet completed
+        scenes = []
+        for scene in self._scenes():
+            target = luigi.LocalTarget(scene[2])
+            if not target.exists():
+                target.makedirs()
+                scenes.append(scene)
+
+        budget = self.memory_budget * 1024**2 if self.memory_budget else None
+        results = run_batch(scenes, card4l_kwargs, self.workers, budget)
+
+        failed = [fname for fname, exc in results.items() if exc is not None]
+        if failed:
+            msg = "{} of {} scenes failed: {}"
+            raise RuntimeError(msg.format(len(failed), len(results), failed))
+
+
 if __name__ == '__main__':
     luigi.run()
@@ -5,14 +5,17 @@ Calculates the slope and aspect for a given elevation dataset.
 """
 
 from __future__ import absolute_import, print_function
+from concurrent.futures import ThreadPoolExecutor
 import numpy
 import h5py
 
 from wagl.data import as_array
 from wagl.constants import DatasetName, GroupName
+from wagl.dsm import dsm_offset
 from wagl.margins import pixel_buffer
 from wagl.satellite_solar_angles import setup_spheroid
 from wagl.hdf5 import H5CompressionFilter, attach_image_attributes
+from wagl.tiling import plan_tiles
 from wagl.__slope_aspect import slope_aspect
 
 
@@ -33,9 +36,13 @@ def _slope_aspect_arrays(acquisition, dsm_fname, buffer_distance, out_fname,
 
 def slope_aspect_arrays(acquisition, dsm_group, buffer_distance,
                         out_group=None, compression=H5CompressionFilter.LZF,
-                        filter_opts=None):
+                        filter_opts=None, workers=1):
     """
     Calculates slope and aspect.
+    The calculation is undertaken a block at a time, with each block
+    aligned to the output chunks and read from the DSM with a 1 pixel
+    halo, such that the memory required is independent of the size
+    of the acquisition.
 
     :param acquisition:
         An instance of an acquisition object.
@@ -79,6 +86,10 @@ def slope_aspect_arrays(acquisition, dsm_group, buffer_distance,
         Default is None, which will use the default settings for the
         chosen H5CompressionFilter instance.
 
+    :param workers:
+        The number of threads used to calculate blocks concurrently.
+        Default is 1.
+
     :return:
         An opened `h5py.File` object, that is either in-memory using the
         `core` driver, or on disk.
@@ -101,27 +112,17 @@ def slope_aspect_arrays(acquisition, dsm_group, buffer_distance,
     _, y_origin = geobox.origin
     x_res, y_res = geobox.pixelsize
 
-    # Get acquisition dimensions and add 1 pixel top, bottom, left & right
+    # Get acquisition dimensions
     cols, rows = geobox.get_shape_xy()
-    ncol = cols + 2
-    nrow = rows + 2
 
     # elevation dataset
     elevation = dsm_group[DatasetName.DSM_SMOOTHED.value]
     ele_rows, ele_cols  = elevation.shape
 
-    # TODO: check that the index is correct
-    # Define the index to read the DEM subset
-    ystart, ystop = (margins.top - 1, ele_rows - (margins.bottom - 1))
-    xstart, xstop = (margins.left - 1, ele_cols - (margins.right - 1))
-    idx = (slice(ystart, ystop), slice(xstart, xstop))
-
-    subset = as_array(elevation[idx], dtype=numpy.float32, transpose=True)
-
-    # Define an array of latitudes
-    # This will be ignored if is_utm == True
-    alat = numpy.array([y_origin - i * y_res for i in range(-1, nrow - 1)],
-                       dtype=numpy.float64)  # yes, I did mean float64.
+    # Define the index to read the DEM subset (including the halo)
+    row_offset, col_offset = dsm_offset(dsm_group, margins)
+    ystart, ystop = (row_offset - 1, ele_rows - (margins.bottom - 1))
+    xstart, xstop = (col_offset - 1, ele_cols - (margins.right - 1))
 
     # Output the reprojected result
     # Initialise the output files
@@ -138,7 +139,7 @@ def slope_aspect_arrays(acquisition, dsm_group, buffer_distance,
         filter_opts = {}
     else:
         filter_opts = filter_opts.copy()
-    filter_opts['chunks'] = acquisition.tile_size
+    filter_opts['chunks'] = acquisition.chunks
 
     group = fid[GroupName.SLP_ASP_GROUP.value]
 
@@ -151,18 +152,61 @@ def slope_aspect_arrays(acquisition, dsm_group, buffer_distance,
     no_data = -999
     kwargs['fillvalue'] = no_data
 
-    # Define the output arrays. These will be transposed upon input
-    slope = numpy.zeros((rows, cols), dtype='float32')
-    aspect = numpy.zeros((rows, cols), dtype='float32')
-
-    slope_aspect(ncol, nrow, cols, rows, x_res, y_res, spheroid, alat, is_utm,
-                 subset, slope.transpose(), aspect.transpose())
-
     # output datasets
     dname = DatasetName.SLOPE.value
-    slope_dset = group.create_dataset(dname, data=slope, **kwargs)
+    slope_dset = group.create_dataset(dname, shape=(rows, cols),
+                                      dtype='float32', **kwargs)
     dname = DatasetName.ASPECT.value
-    aspect_dset = group.create_dataset(dname, data=aspect, **kwargs)
+    aspect_dset = group.create_dataset(dname, shape=(rows, cols),
+                                       dtype='float32', **kwargs)
+
+    def calculate(tile):
+        """
+        Calculate the slope and aspect for a single block, reading the
+        DSM with a 1 pixel halo (top, bottom, left & right).
+        """
+        (ys, ye), (xs, xe) = tile
+        idx = (slice(ys + ystart, ye + ystart + 2),
+               slice(xs + xstart, xe + xstart + 2))
+        subset = as_array(elevation[idx], dtype=numpy.float32,
+                          transpose=True)
+        nrow, ncol = ye - ys + 2, xe - xs + 2
+
+        # Define an array of latitudes for the block (including the halo)
+        # This will be ignored if is_utm == True
+        alat = numpy.array([y_origin - i * y_res for i in
+                            range(ys - 1, ye + 1)],
+                           dtype=numpy.float64)  # yes, I did mean float64.
+
+        # Define the output arrays. These will be transposed upon input
+        slope = numpy.zeros((nrow - 2, ncol - 2), dtype='float32')
+        aspect = numpy.zeros((nrow - 2, ncol - 2), dtype='float32')
+
+        slope_aspect(ncol, nrow, ncol - 2, nrow - 2, x_res, y_res, spheroid,
+                     alat, is_utm, subset, slope.transpose(),
+                     aspect.transpose())
+
+        return tile, slope, aspect
+
+    def write(result):
+        """ Write a block of slope and aspect to disk. """
+        tile, slope, aspect = result
+        idx = (slice(*tile[0]), slice(*tile[1]))
+        slope_dset[idx] = slope
+        aspect_dset[idx] = aspect
+
+    tiles = list(plan_tiles((rows, cols), chunks=slope_dset.chunks).tiles())
+
+    if workers > 1:
+        # submit blocks in batches to bound the number of results
+        # held in memory prior to being written
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for i in range(0, len(tiles), workers):
+                for result in executor.map(calculate, tiles[i:i + workers]):
+                    write(result)
+    else:
+        for tile in tiles:
+            write(calculate(tile))
 
     # attach some attributes to the image datasets
     attrs = {'crs_wkt': geobox.crs.ExportToWkt(),
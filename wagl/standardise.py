@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+from functools import partial
 from os.path import join as pjoin
 import tempfile
 
@@ -9,11 +10,16 @@ from structlog.processors import JSONRenderer
 import h5py
 
 from wagl.acquisition import acquisitions
-from wagl.ancillary import collect_ancillary
-from wagl.constants import ArdProducts as AP, GroupName, Workflow, BandType
+from wagl.ancillary import collect_ancillary, aggregate_ancillary
+from wagl.constants import ArdProducts as AP, DatasetName, GroupName
+from wagl.constants import Workflow, BandType
 from wagl.constants import ALBEDO_FMT, POINT_FMT, POINT_ALBEDO_FMT
 from wagl.dsm import get_dsm
-from wagl.hdf5 import H5CompressionFilter
+from wagl.executor import StageGraph
+from wagl.geometry_aggregation import GeometryAlignmentError, derive_group
+from wagl.geometry_aggregation import derive_elevation, derive_satellite_solar
+from wagl.hdf5 import H5CompressionFilter, DatasetClass
+from wagl.hdf5 import dataset_class_config
 from wagl.incident_exiting_angles import incident_angles, exiting_angles
 from wagl.incident_exiting_angles import relative_azimuth_slope
 from wagl.interpolation import interpolate
@@ -30,6 +36,7 @@ from wagl.temperature import surface_brightness_temperature
 from wagl.pq import can_pq, run_pq
 
 from wagl.logging import STATUS_LOGGER
+from wagl.profiling import Profiler
 
 
 # pylint disable=too-many-arguments
@@ -38,7 +45,8 @@ def card4l(level1, granule, workflow, vertices, method, pixel_quality, landsea,
            water_vapour, dem_path, dsm_fname, invariant_fname, modtran_exe,
            out_fname, ecmwf_path=None, rori=0.52, buffer_distance=8000,
            compression=H5CompressionFilter.LZF, filter_opts=None,
-           h5_driver=None, acq_parser_hint=None):
+           h5_driver=None, acq_parser_hint=None, workers=1,
+           derive_geometry=False):
     """
     CEOS Analysis Ready Data for Land.
     A workflow for producing standardised products that meet the
@@ -49,7 +57,12 @@ def card4l(level1, granule, workflow, vertices, method, pixel_quality, landsea,
         dataset.
 
     :param granule:
-        A string containing the granule id to process.
+        A string containing the granule id to process, or a `list`
+        of granule ids to process together within `out_fname`.
+        Multiple granules are processed concurrently (see `workers`),
+        and the ancillary point measurements of every granule are
+        averaged (`wagl.ancillary.aggregate_ancillary`) before the
+        atmospherics of any granule are evaluated.
 
     :param workflow:
         An enum from wagl.constants.Workflow representing which
@@ -147,6 +160,9 @@ def card4l(level1, granule, workflow, vertices, method, pixel_quality, landsea,
     :param filter_opts:
         A dict containing any additional keyword arguments when
         generating the configuration for the given compression Filter.
+        Compression settings for each class of dataset can be given
+        via the 'dataset_classes' key; see
+        `wagl.hdf5.compression.dataset_class_config`.
         Default is None.
 
     :param h5_driver:
@@ -160,229 +176,504 @@ def card4l(level1, granule, workflow, vertices, method, pixel_quality, landsea,
     :param acq_parser_hint:
         A string containing any hints to provide the acquisitions
         loader with.
-    """
-    tp5_fmt = pjoin(POINT_FMT, ALBEDO_FMT, ''.join([POINT_ALBEDO_FMT, '.tp5']))
-    nvertices = vertices[0] * vertices[1]
 
+    :param workers:
+        The maximum number of workflow stages to run concurrently.
+        Stages are run as soon as the stages they depend on have
+        completed, and all writes to `out_fname` go through a single
+        writer. See `wagl.executor.StageGraph`.
+        Default is 1, which runs each stage in turn.
+
+    :param derive_geometry:
+        A `bool` indicating whether or not to compute the geometry
+        (longitude/latitude, satellite/solar angles, DSM, slope/aspect,
+        incident/exiting angles and cast shadow) only for the
+        highest resolution group, and derive it for every other
+        resolution group by block aggregation.
+        A group whose grid isn't an aggregation of the highest
+        resolution grid is computed independently.
+        The deviations within each block of a derived dataset, and
+        a bound on its difference from an independent computation,
+        are recorded in its attributes. See
+        `wagl.geometry_aggregation`.
+        Default is False.
+    """
     container = acquisitions(level1, hint=acq_parser_hint)
 
     # TODO: pass through an acquisitions container rather than pathname
     with h5py.File(out_fname, 'w', driver=h5_driver) as fid:
         fid.attrs['level1_uri'] = level1
 
-        for grp_name in container.supported_groups:
-            log = STATUS_LOGGER.bind(level1=container.label, granule=granule,
-                                     granule_group=grp_name)
+        if isinstance(granule, (list, tuple)):
+            granules = list(granule)
+        else:
+            granules = [granule]
+
+        # the averaged ancillary is the only dependency between granules
+        barrier = 'aggregate-ancillary' if len(granules) > 1 else None
+
+        profiler = Profiler(level1=container.label)
+        graph = StageGraph(fid, profiler)
+        for grn in granules:
+            _add_stages(graph, container, level1, grn, workflow, vertices,
+                        method, pixel_quality, landsea, tle_path, aerosol,
+                        brdf_path, brdf_premodis_path, ozone_path,
+                        water_vapour, dem_path, dsm_fname, invariant_fname,
+                        modtran_exe, ecmwf_path, rori, buffer_distance,
+                        compression, filter_opts, acq_parser_hint, barrier,
+                        derive_geometry)
+
+        if barrier:
+            _add_ancillary_barrier(graph, container.label, granules, barrier)
+
+        def write_profile():
+            """The resources used by each stage."""
+            profiler.write(fid, DatasetName.PROFILE.value,
+                           *dataset_class_config(compression, filter_opts,
+                                                 DatasetClass.TABLE))
+
+        try:
+            graph.run(workers)
+        except Exception:
+            # retain the profile of the failed run, without masking
+            # the original exception
+            try:
+                write_profile()
+            except Exception as exc:
+                STATUS_LOGGER.warning('Profile-Write-Failed',
+                                      level1=container.label,
+                                      exception=exc.__str__())
+            raise
+
+        write_profile()
+
+
+def _add_ancillary_barrier(graph, label, granules, barrier):
+    """
+    Add the stage that averages the ancillary of every granule, once
+    each granule's ancillary has been retrieved. The atmospherics of
+    each granule depend on this stage (see `_add_stages`), so the
+    averages are computed once and shared by every granule.
 
-            # root group for a given granule and resolution group
-            root = fid.create_group(ppjoin(granule, grp_name))
-            acqs = container.get_acquisitions(granule=granule, group=grp_name)
+    :param graph:
+        The `StageGraph`, whose output `Group` contains a `Group`
+        for each granule.
 
-            # longitude and latitude
-            log.info('Latitude-Longitude')
-            create_lon_lat_grids(acqs[0], root, compression, filter_opts)
+    :param label:
+        The label of the level1 dataset, used for logging.
 
-            # satellite and solar angles
-            log.info('Satellite-Solar-Angles')
-            calculate_angles(acqs[0], root[GroupName.LON_LAT_GROUP.value],
-                             root, compression, filter_opts, tle_path)
-
-            if workflow == Workflow.STANDARD or workflow == Workflow.NBAR:
-
-                # DEM
-                log.info('DEM-retriveal')
-                get_dsm(acqs[0], dsm_fname, buffer_distance, root, compression,
-                        filter_opts)
-
-                # slope & aspect
-                log.info('Slope-Aspect')
-                slope_aspect_arrays(acqs[0],
-                                    root[GroupName.ELEVATION_GROUP.value],
-                                    buffer_distance, root, compression,
-                                    filter_opts)
-
-                # incident angles
-                log.info('Incident-Angles')
-                incident_angles(root[GroupName.SAT_SOL_GROUP.value],
-                                root[GroupName.SLP_ASP_GROUP.value],
-                                root, compression, filter_opts)
-
-                # exiting angles
-                log.info('Exiting-Angles')
-                exiting_angles(root[GroupName.SAT_SOL_GROUP.value],
-                               root[GroupName.SLP_ASP_GROUP.value],
-                               root, compression, filter_opts)
-
-                # relative azimuth slope
-                log.info('Relative-Azimuth-Angles')
-                incident_group_name = GroupName.INCIDENT_GROUP.value
-                exiting_group_name = GroupName.EXITING_GROUP.value
-                relative_azimuth_slope(root[incident_group_name],
-                                       root[exiting_group_name],
-                                       root, compression, filter_opts)
-
-                # self shadow
-                log.info('Self-Shadow')
-                self_shadow(root[incident_group_name],
-                            root[exiting_group_name], root, compression,
-                            filter_opts)
-
-                # cast shadow solar source direction
-                log.info('Cast-Shadow-Solar-Direction')
-                dsm_group_name = GroupName.ELEVATION_GROUP.value
-                calculate_cast_shadow(acqs[0], root[dsm_group_name],
-                                      root[GroupName.SAT_SOL_GROUP.value],
-                                      buffer_distance, root, compression,
-                                      filter_opts)
+    :param granules:
+        A `list` of the granule ids.
 
-                # cast shadow satellite source direction
-                log.info('Cast-Shadow-Satellite-Direction')
-                calculate_cast_shadow(acqs[0], root[dsm_group_name],
-                                      root[GroupName.SAT_SOL_GROUP.value],
-                                      buffer_distance, root, compression,
-                                      filter_opts, False)
+    :param barrier:
+        The name of the stage.
+    """
+    root = graph.out_group
 
-                # combined shadow masks
-                log.info('Combined-Shadow')
-                combine_shadow_masks(root[GroupName.SHADOW_GROUP.value],
-                                     root[GroupName.SHADOW_GROUP.value],
-                                     root[GroupName.SHADOW_GROUP.value],
-                                     root, compression, filter_opts)
+    def aggregate(out_group):
+        STATUS_LOGGER.info('Aggregate-Ancillary', level1=label,
+                           granules=granules)
+        aggregate_ancillary([root[grn] for grn in granules],
+                            [out_group.require_group(grn)
+                             for grn in granules])
 
-        # nbar and sbt ancillary
-        log = STATUS_LOGGER.bind(level1=container.label, granule=granule,
-                                 granule_group=None)
+    graph.add(barrier, aggregate,
+              [ppjoin(grn, 'ancillary') for grn in granules])
 
-        # granule root group
-        root = fid[granule]
 
-        # get the highest resoltion group cotaining supported bands
-        acqs, grp_name = container.get_highest_resolution(granule=granule)
+def _add_stages(graph, container, level1, granule, workflow, vertices, method,
+                pixel_quality, landsea, tle_path, aerosol, brdf_path,
+                brdf_premodis_path, ozone_path, water_vapour, dem_path,
+                dsm_fname, invariant_fname, modtran_exe, ecmwf_path, rori,
+                buffer_distance, compression, filter_opts, acq_parser_hint,
+                ancillary_barrier=None, derive_geometry=False):
+    """
+    Add the stages, and their dependencies, required to produce the
+    standardised products for a single granule to a `StageGraph`.
+    See `card4l` for a description of the parameters.
+    If given, `ancillary_barrier` names the stage that must complete
+    between this granule's ancillary retrieval and its atmospherics.
+    If `derive_geometry` is set, the geometry stages of all but the
+    highest resolution group derive their results from the highest
+    resolution group.
+
+    Stage names and destinations are given relative to the `granule`
+    root group, i.e. '<granule>/<resolution group>/<stage>'.
+    """
+    tp5_fmt = pjoin(POINT_FMT, ALBEDO_FMT, ''.join([POINT_ALBEDO_FMT, '.tp5']))
+    nvertices = vertices[0] * vertices[1]
+    root = graph.out_group
+    nbar = workflow == Workflow.STANDARD or workflow == Workflow.NBAR
+    sbt = workflow == Workflow.STANDARD or workflow == Workflow.SBT
+
+    # compression filter and options for each class of dataset
+    angles, reflectance_filters, masks, tables = [
+        dataset_class_config(compression, filter_opts, dataset_class)
+        for dataset_class in [DatasetClass.ANGLES, DatasetClass.REFLECTANCE,
+                              DatasetClass.MASK, DatasetClass.TABLE]]
+
+    def logger(grp_name=None):
+        return STATUS_LOGGER.bind(level1=container.label, granule=granule,
+                                  granule_group=grp_name)
+
+    def name(*args):
+        return ppjoin(granule or '', *args)
+
+    # get the highest resoltion group cotaining supported bands
+    high_acqs, high_grp_name = container.get_highest_resolution(
+        granule=granule)
+
+    def derived(compute, derive, group_name, log):
+        # derive from the highest resolution group, or compute if the
+        # grids aren't aligned
+        def stage(out_group):
+            fine_group = root[name(high_grp_name)][group_name]
+            try:
+                log.info('Derive-Geometry', group=group_name)
+                derive(fine_group, out_group)
+            except GeometryAlignmentError as exc:
+                log.info('Derive-Geometry-Fallback', group=group_name,
+                         reason=str(exc))
+                compute(out_group)
+        return stage
+
+    def add_geometry(grp_name, stage, func, dependencies, derive, group_name,
+                     log):
+        # add a geometry stage, deriving it when required
+        stage_name = name(grp_name, stage)
+        if derive_geometry and grp_name != high_grp_name:
+            func = derived(func, derive, group_name, log)
+            dependencies = dependencies + [name(high_grp_name, stage)]
+        graph.add(stage_name, func, dependencies, name(grp_name))
+
+    for grp_name in container.supported_groups:
+        log = logger(grp_name)
+        acq = container.get_acquisitions(granule=granule, group=grp_name)[0]
+        res_path = name(grp_name)
+
+        def res_group(grp_name=grp_name):
+            # root group for a given granule and resolution group
+            return root[name(grp_name)]
 
-        grn_con = container.get_granule(granule=granule, container=True)
-        res_group = root[grp_name]
+        def lon_lat(out_group, acq=acq, log=log):
+            log.info('Latitude-Longitude')
+            create_lon_lat_grids(acq, out_group, *angles)
 
-        log.info('Ancillary-Retrieval')
+        def sat_sol(out_group, acq=acq, log=log, res_group=res_group):
+            log.info('Satellite-Solar-Angles')
+            calculate_angles(acq, res_group()[GroupName.LON_LAT_GROUP.value],
+                             out_group, *angles, tle_path)
+
+        def derive_images(fine_group, out_group, dataset_names=None,
+                          filters=angles, acq=acq):
+            derive_group(fine_group, acq.gridded_geo_box(), out_group,
+                         dataset_names, *filters)
+
+        def derive_sat_sol(fine_group, out_group, acq=acq):
+            derive_satellite_solar(acq, fine_group, out_group, *angles)
+
+        add_geometry(grp_name, 'lon-lat', lon_lat, [], derive_images,
+                     GroupName.LON_LAT_GROUP.value, log)
+        add_geometry(grp_name, 'sat-sol', sat_sol, [name(grp_name, 'lon-lat')],
+                     derive_sat_sol, GroupName.SAT_SOL_GROUP.value, log)
+
+        if not nbar:
+            continue
+
+        def dsm(out_group, acq=acq, log=log):
+            log.info('DEM-retriveal')
+            get_dsm(acq, dsm_fname, buffer_distance, out_group, *angles)
+
+        def slope_aspect(out_group, acq=acq, log=log, res_group=res_group):
+            log.info('Slope-Aspect')
+            slope_aspect_arrays(acq,
+                                res_group()[GroupName.ELEVATION_GROUP.value],
+                                buffer_distance, out_group, *angles)
+
+        def incident(out_group, log=log, res_group=res_group):
+            log.info('Incident-Angles')
+            grp = res_group()
+            incident_angles(grp[GroupName.SAT_SOL_GROUP.value],
+                            grp[GroupName.SLP_ASP_GROUP.value],
+                            out_group, *angles)
+
+        def exiting(out_group, log=log, res_group=res_group):
+            log.info('Exiting-Angles')
+            grp = res_group()
+            exiting_angles(grp[GroupName.SAT_SOL_GROUP.value],
+                           grp[GroupName.SLP_ASP_GROUP.value],
+                           out_group, *angles)
+
+        def relative_slope(out_group, log=log, res_group=res_group):
+            log.info('Relative-Azimuth-Angles')
+            grp = res_group()
+            relative_azimuth_slope(grp[GroupName.INCIDENT_GROUP.value],
+                                   grp[GroupName.EXITING_GROUP.value],
+                                   out_group, *angles)
+
+        def shadow(out_group, log=log, res_group=res_group):
+            log.info('Self-Shadow')
+            grp = res_group()
+            self_shadow(grp[GroupName.INCIDENT_GROUP.value],
+                        grp[GroupName.EXITING_GROUP.value], out_group,
+                        *masks)
+
+        def cast_shadow(out_group, solar_source, acq=acq, log=log,
+                        res_group=res_group):
+            if solar_source:
+                log.info('Cast-Shadow-Solar-Direction')
+            else:
+                log.info('Cast-Shadow-Satellite-Direction')
+            grp = res_group()
+            calculate_cast_shadow(acq, grp[GroupName.ELEVATION_GROUP.value],
+                                  grp[GroupName.SAT_SOL_GROUP.value],
+                                  buffer_distance, out_group, *masks,
+                                  solar_source)
+
+        def combined_shadow(out_group, log=log, res_group=res_group):
+            log.info('Combined-Shadow')
+            grp = res_group()[GroupName.SHADOW_GROUP.value]
+            combine_shadow_masks(grp, grp, grp, out_group, *masks)
+
+        def derive_dsm(fine_group, out_group, acq=acq):
+            derive_elevation(acq, fine_group, buffer_distance, out_group,
+                             *angles)
+
+        sat_sol_slp_asp = [name(grp_name, 'sat-sol'),
+                           name(grp_name, 'slope-aspect')]
+        dsm_sat_sol = [name(grp_name, 'dsm'), name(grp_name, 'sat-sol')]
+        sun = DatasetName.CAST_SHADOW_FMT.value.format(source='SUN')
+        satellite = DatasetName.CAST_SHADOW_FMT.value.format(
+            source='SATELLITE')
+
+        add_geometry(grp_name, 'dsm', dsm, [], derive_dsm,
+                     GroupName.ELEVATION_GROUP.value, log)
+        add_geometry(grp_name, 'slope-aspect', slope_aspect,
+                     [name(grp_name, 'dsm')],
+                     partial(derive_images,
+                             dataset_names=[DatasetName.SLOPE.value,
+                                            DatasetName.ASPECT.value]),
+                     GroupName.SLP_ASP_GROUP.value, log)
+        add_geometry(grp_name, 'incident', incident, sat_sol_slp_asp,
+                     derive_images, GroupName.INCIDENT_GROUP.value, log)
+        add_geometry(grp_name, 'exiting', exiting, sat_sol_slp_asp,
+                     derive_images, GroupName.EXITING_GROUP.value, log)
+        add_geometry(grp_name, 'cast-shadow-sun',
+                     partial(cast_shadow, solar_source=True), dsm_sat_sol,
+                     partial(derive_images, dataset_names=[sun],
+                             filters=masks),
+                     GroupName.SHADOW_GROUP.value, log)
+        add_geometry(grp_name, 'cast-shadow-satellite',
+                     partial(cast_shadow, solar_source=False), dsm_sat_sol,
+                     partial(derive_images, dataset_names=[satellite],
+                             filters=masks),
+                     GroupName.SHADOW_GROUP.value, log)
+
+        # cheap functions of the above; computed from the derived inputs
+        graph.add(name(grp_name, 'relative-slope'), relative_slope,
+                  [name(grp_name, 'incident'), name(grp_name, 'exiting')],
+                  res_path)
+        graph.add(name(grp_name, 'self-shadow'), shadow,
+                  [name(grp_name, 'incident'), name(grp_name, 'exiting')],
+                  res_path)
+        graph.add(name(grp_name, 'combined-shadow'), combined_shadow,
+                  [name(grp_name, 'self-shadow'),
+                   name(grp_name, 'cast-shadow-sun'),
+                   name(grp_name, 'cast-shadow-satellite')], res_path)
+
+    # nbar and sbt ancillary
+    granule_log = logger()
+
+    grn_con = container.get_granule(granule=granule, container=True)
+
+    def ancillary(out_group):
+        granule_log.info('Ancillary-Retrieval')
         nbar_paths = {'aerosol_dict': aerosol,
                       'water_vapour_dict': water_vapour,
                       'ozone_path': ozone_path,
                       'dem_path': dem_path,
                       'brdf_path': brdf_path,
                       'brdf_premodis_path': brdf_premodis_path}
+        res_group = root[name(high_grp_name)]
         collect_ancillary(grn_con, res_group[GroupName.SAT_SOL_GROUP.value],
                           nbar_paths, ecmwf_path, invariant_fname,
-                          vertices, root, compression, filter_opts)
+                          vertices, out_group, *tables)
 
+    def tp5(out_group):
         # atmospherics
-        log.info('Atmospherics')
+        granule_log.info('Atmospherics')
 
-        ancillary_group = root[GroupName.ANCILLARY_GROUP.value]
+        ancillary_group = root[name(GroupName.ANCILLARY_GROUP.value)]
 
         # satellite/solar angles and lon/lat for a resolution group
+        res_group = root[name(high_grp_name)]
         sat_sol_grp = res_group[GroupName.SAT_SOL_GROUP.value]
         lon_lat_grp = res_group[GroupName.LON_LAT_GROUP.value]
 
         # TODO: supported acqs in different groups pointing to different response funcs
         # tp5 files
-        tp5_data, _ = format_tp5(acqs, ancillary_group, sat_sol_grp,
-                                 lon_lat_grp, workflow, root)
+        tp5_data, _ = format_tp5(high_acqs, ancillary_group, sat_sol_grp,
+                                 lon_lat_grp, workflow, out_group)
+        return tp5_data
 
-        # atmospheric inputs group
-        inputs_grp = root[GroupName.ATMOSPHERIC_INPUTS_GRP.value]
+    def radiative_transfer(out_group, point, albedo):
+        tp5_data = graph.results[name('tp5')]
+        if (point, albedo) not in tp5_data:
+            return
 
-        # radiative transfer for each point and albedo
-        for key in tp5_data:
-            point, albedo = key
+        # atmospheric inputs group
+        inputs_grp = root[name(GroupName.ATMOSPHERIC_INPUTS_GRP.value)]
 
-            log.info('Radiative-Transfer', point=point, albedo=albedo.value)
-            with tempfile.TemporaryDirectory() as tmpdir:
+        granule_log.info('Radiative-Transfer', point=point,
+                         albedo=albedo.value)
+        with tempfile.TemporaryDirectory() as tmpdir:
 
-                prepare_modtran(acqs, point, [albedo], tmpdir, modtran_exe)
+            prepare_modtran(high_acqs, point, [albedo], tmpdir, modtran_exe)
 
-                # tp5 data
-                fname = pjoin(tmpdir,
-                              tp5_fmt.format(p=point, a=albedo.value))
-                with open(fname, 'w') as src:
-                    src.writelines(tp5_data[key])
+            # tp5 data
+            fname = pjoin(tmpdir,
+                          tp5_fmt.format(p=point, a=albedo.value))
+            with open(fname, 'w') as src:
+                src.writelines(tp5_data[(point, albedo)])
 
-                run_modtran(acqs, inputs_grp, workflow, nvertices, point,
-                            [albedo], modtran_exe, tmpdir, root, compression,
-                            filter_opts)
+            run_modtran(high_acqs, inputs_grp, workflow, nvertices, point,
+                        [albedo], modtran_exe, tmpdir, out_group, *tables)
 
+    def coefficients(out_group):
         # atmospheric coefficients
-        log.info('Coefficients')
-        results_group = root[GroupName.ATMOSPHERIC_RESULTS_GRP.value]
-        calculate_coefficients(results_group, root, compression, filter_opts)
-
-        # interpolate coefficients
-        for grp_name in container.supported_groups:
-            log = STATUS_LOGGER.bind(level1=container.label, granule=granule,
-                                     granule_group=grp_name)
-            log.info('Interpolation')
-
-            # acquisitions and available bands for the current group level
-            acqs = container.get_acquisitions(granule=granule, group=grp_name)
-            nbar_acqs = [acq for acq in acqs if
-                         acq.band_type == BandType.REFLECTIVE]
-            sbt_acqs = [acq for acq in acqs if
-                        acq.band_type == BandType.THERMAL]
-
-            res_group = root[grp_name]
-            sat_sol_grp = res_group[GroupName.SAT_SOL_GROUP.value]
-            comp_grp = root[GroupName.COEFFICIENTS_GROUP.value]
-
-            for coefficient in workflow.atmos_coefficients:
-                if coefficient in Workflow.NBAR.atmos_coefficients:
-                    band_acqs = nbar_acqs
-                else:
-                    band_acqs = sbt_acqs
-
-                for acq in band_acqs:
-                    log.info('Interpolate', band_id=acq.band_id,
-                             coefficient=coefficient.value)
-                    interpolate(acq, coefficient, ancillary_group, sat_sol_grp,
-                                comp_grp, res_group, compression, filter_opts,
-                                method)
-
-            # standardised products
-            band_acqs = []
-            if workflow == Workflow.STANDARD or workflow == Workflow.NBAR:
-                band_acqs.extend(nbar_acqs)
-
-            if workflow == Workflow.STANDARD or workflow == Workflow.SBT:
-                band_acqs.extend(sbt_acqs)
+        granule_log.info('Coefficients')
+        results_group = root[name(GroupName.ATMOSPHERIC_RESULTS_GRP.value)]
+        calculate_coefficients(results_group, out_group, *tables)
+
+    graph.add(name('ancillary'), ancillary,
+              [name(high_grp_name, 'sat-sol')], name())
+    dependencies = [name('ancillary'), name(high_grp_name, 'sat-sol')]
+    if ancillary_barrier:
+        dependencies.append(ancillary_barrier)
+
+    graph.add(name('tp5'), tp5, dependencies, name())
+
+    rtm_stages = []
+    for point in range(nvertices):
+        for albedo in workflow.albedos:
+            stage_name = name('radiative-transfer', POINT_FMT.format(p=point),
+                              ALBEDO_FMT.format(a=albedo.value))
+            graph.add(stage_name,
+                      partial(radiative_transfer, point=point, albedo=albedo),
+                      [name('tp5')], name())
+            rtm_stages.append(stage_name)
+
+    graph.add(name('coefficients'), coefficients, rtm_stages, name())
+
+    # interpolate coefficients
+    for grp_name in container.supported_groups:
+        log = logger(grp_name)
+        res_path = name(grp_name)
+
+        # acquisitions and available bands for the current group level
+        acqs = container.get_acquisitions(granule=granule, group=grp_name)
+        nbar_acqs = [acq for acq in acqs if
+                     acq.band_type == BandType.REFLECTIVE]
+        sbt_acqs = [acq for acq in acqs if
+                    acq.band_type == BandType.THERMAL]
+
+        def res_group(grp_name=grp_name):
+            return root[name(grp_name)]
+
+        def interpolation(out_group, acq, coefficient, log=log,
+                          res_group=res_group):
+            log.info('Interpolate', band_id=acq.band_id,
+                     coefficient=coefficient.value)
+            ancillary_group = root[name(GroupName.ANCILLARY_GROUP.value)]
+            comp_grp = root[name(GroupName.COEFFICIENTS_GROUP.value)]
+            sat_sol_grp = res_group()[GroupName.SAT_SOL_GROUP.value]
+            interpolate(acq, coefficient, ancillary_group, sat_sol_grp,
+                        comp_grp, out_group, *angles, method)
+
+        interp_stages = {}
+        for coefficient in workflow.atmos_coefficients:
+            if coefficient in Workflow.NBAR.atmos_coefficients:
+                band_acqs = nbar_acqs
+            else:
+                band_acqs = sbt_acqs
 
             for acq in band_acqs:
-                interp_grp = res_group[GroupName.INTERP_GROUP.value]
-
-                if acq.band_type == BandType.THERMAL:
-                    log.info('SBT', band_id=acq.band_id)
-                    surface_brightness_temperature(acq, interp_grp, res_group,
-                                                   compression, filter_opts)
-                else:
-                    slp_asp_grp = res_group[GroupName.SLP_ASP_GROUP.value]
-                    rel_slp_asp = res_group[GroupName.REL_SLP_GROUP.value]
-                    incident_grp = res_group[GroupName.INCIDENT_GROUP.value]
-                    exiting_grp = res_group[GroupName.EXITING_GROUP.value]
-                    shadow_grp = res_group[GroupName.SHADOW_GROUP.value]
-
-                    log.info('Surface-Reflectance', band_id=acq.band_id)
-                    calculate_reflectance(acq, interp_grp, sat_sol_grp,
-                                          slp_asp_grp, rel_slp_asp,
-                                          incident_grp, exiting_grp,
-                                          shadow_grp, ancillary_group,
-                                          rori, res_group, compression,
-                                          filter_opts)
-
+                stage_name = name(grp_name, 'interpolate', acq.band_name,
+                                  coefficient.value)
+                graph.add(stage_name,
+                          partial(interpolation, acq=acq,
+                                  coefficient=coefficient),
+                          [name('coefficients'), name(grp_name, 'sat-sol')],
+                          res_path)
+                interp_stages.setdefault(acq.band_name, []).append(stage_name)
+
+        # standardised products
+        band_acqs = []
+        if nbar:
+            band_acqs.extend(nbar_acqs)
+
+        if sbt:
+            band_acqs.extend(sbt_acqs)
+
+        def temperature(out_group, acq, log=log, res_group=res_group):
+            log.info('SBT', band_id=acq.band_id)
+            interp_grp = res_group()[GroupName.INTERP_GROUP.value]
+            surface_brightness_temperature(acq, interp_grp, out_group,
+                                           *angles)
+
+        def reflectance(out_group, acq, log=log, res_group=res_group):
+            grp = res_group()
+            interp_grp = grp[GroupName.INTERP_GROUP.value]
+            sat_sol_grp = grp[GroupName.SAT_SOL_GROUP.value]
+            slp_asp_grp = grp[GroupName.SLP_ASP_GROUP.value]
+            rel_slp_asp = grp[GroupName.REL_SLP_GROUP.value]
+            incident_grp = grp[GroupName.INCIDENT_GROUP.value]
+            exiting_grp = grp[GroupName.EXITING_GROUP.value]
+            shadow_grp = grp[GroupName.SHADOW_GROUP.value]
+            ancillary_group = root[name(GroupName.ANCILLARY_GROUP.value)]
+
+            log.info('Surface-Reflectance', band_id=acq.band_id)
+            calculate_reflectance(acq, interp_grp, sat_sol_grp, slp_asp_grp,
+                                  rel_slp_asp, incident_grp, exiting_grp,
+                                  shadow_grp, ancillary_group, rori,
+                                  out_group, *reflectance_filters)
+
+        product_stages = []
+        for acq in band_acqs:
+            dependencies = list(interp_stages.get(acq.band_name, []))
+            if acq.band_type == BandType.THERMAL:
+                func = partial(temperature, acq=acq)
+                stage_name = name(grp_name, 'sbt', acq.band_name)
+            else:
+                func = partial(reflectance, acq=acq)
+                stage_name = name(grp_name, 'reflectance', acq.band_name)
+                dependencies.extend([name(grp_name, 'relative-slope'),
+                                     name(grp_name, 'combined-shadow')])
+
+            graph.add(stage_name, func, dependencies, res_path)
+            product_stages.append(stage_name)
+
+        def metadata(out_group, band_acqs=band_acqs):
             # metadata yaml's
-            if workflow == Workflow.STANDARD or workflow == Workflow.NBAR:
-                create_ard_yaml(band_acqs, ancillary_group, res_group)
-
-            if workflow == Workflow.STANDARD or workflow == Workflow.SBT:
-                create_ard_yaml(band_acqs, ancillary_group, res_group, True)
-
-            # pixel quality
-            sbt_only = workflow == Workflow.SBT
-            if pixel_quality and can_pq(level1, acq_parser_hint) and not sbt_only:
-                run_pq(level1, res_group, landsea, res_group, compression, filter_opts, AP.NBAR, acq_parser_hint)
-                run_pq(level1, res_group, landsea, res_group, compression, filter_opts, AP.NBART, acq_parser_hint)
+            ancillary_group = root[name(GroupName.ANCILLARY_GROUP.value)]
+            if nbar:
+                create_ard_yaml(band_acqs, ancillary_group, out_group)
+
+            if sbt:
+                create_ard_yaml(band_acqs, ancillary_group, out_group, True)
+
+        graph.add(name(grp_name, 'metadata'), metadata,
+                  product_stages + [name('ancillary')], res_path)
+
+        # pixel quality
+        sbt_only = workflow == Workflow.SBT
+        if pixel_quality and can_pq(level1, acq_parser_hint) and not sbt_only:
+            def pq(out_group, product, res_group=res_group):
+                run_pq(level1, res_group(), landsea, out_group, *masks,
+                       product, acq_parser_hint)
+
+            graph.add(name(grp_name, 'pq', AP.NBAR.value),
+                      partial(pq, product=AP.NBAR), product_stages, res_path)
+            graph.add(name(grp_name, 'pq', AP.NBART.value),
+                      partial(pq, product=AP.NBART),
+                      [name(grp_name, 'pq', AP.NBAR.value)], res_path)
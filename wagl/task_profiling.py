@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+"""
+Luigi task profiling
+--------------------
+
+The luigi event handlers that measure each task via
+`wagl.profiling`. The handlers are registered once, when this module
+is first imported, no matter how many workflows import it.
+"""
+
+from __future__ import absolute_import
+import luigi
+
+from wagl.profiling import task_started, task_stopped
+
+
+@luigi.Task.event_handler(luigi.Event.START)
+def on_start(task):
+    """Start profiling the Task."""
+    task_started(task)
+
+
+@luigi.Task.event_handler(luigi.Event.SUCCESS)
+def on_success(task):
+    """Record the Task profile."""
+    task_stopped(task, 'success')
+
+
+@luigi.Task.event_handler(luigi.Event.FAILURE)
+def on_failure(task, exception):
+    """Record the profile of the failed Task."""
+    task_stopped(task, 'failure')
@@ -128,7 +128,7 @@ def surface_brightness_temperature(acquisition, interpolation_group,
         filter_opts = {}
     else:
         filter_opts = filter_opts.copy()
-    filter_opts['chunks'] = acq.tile_size
+    filter_opts['chunks'] = acq.chunks
 
     group = fid[GroupName.STANDARD_GROUP.value]
     kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
@@ -14,12 +14,13 @@ import numpy
 import h5py
 
 from wagl.constants import DatasetName, GroupName
+from wagl.dsm import dsm_offset
 from wagl.geobox import GriddedGeoBox
 from wagl.margins import pixel_buffer
 from wagl.satellite_solar_angles import setup_spheroid
 from wagl.hdf5 import H5CompressionFilter, attach_image_attributes
-from wagl.hdf5 import create_external_link
-from wagl.tiling import generate_tiles
+from wagl.hdf5 import create_external_links
+from wagl.tiling import plan_tiles
 from wagl.__cast_shadow_mask import cast_shadow_main
 
 
@@ -99,10 +100,10 @@ def self_shadow(incident_angles_group, exiting_angles_group, out_group=None,
 
     grp = fid[GroupName.SHADOW_GROUP.value]
 
-    tile_size = exiting_angle.chunks
-    filter_opts['chunks'] = tile_size
-    kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
     cols, rows = geobox.get_shape_xy()
+    plan = plan_tiles((rows, cols), chunks=exiting_angle.chunks)
+    filter_opts['chunks'] = plan.chunks
+    kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
     kwargs['shape'] = (rows, cols)
     kwargs['dtype'] = 'bool'
 
@@ -119,7 +120,7 @@ def self_shadow(incident_angles_group, exiting_angles_group, out_group=None,
     attach_image_attributes(out_dset, attrs)
 
     # process by tile
-    for tile in generate_tiles(cols, rows, tile_size[1], tile_size[0]):
+    for tile in plan.tiles():
         # Row and column start locations
         ystart, yend = tile[0]
         xstart, xend = tile[1]
@@ -412,7 +413,11 @@ def calculate_cast_shadow(acquisition, dsm_group, satellite_solar_group,
 
     zenith_angle = satellite_solar_group[zenith_name][:]
     azimuth_angle = satellite_solar_group[azimuth_name][:]
-    elevation = dsm_group[DatasetName.DSM_SMOOTHED.value][:]
+
+    # exclude any padding prepended to align the chunks of the subset
+    row_offset, col_offset = dsm_offset(dsm_group, margins)
+    elevation = dsm_group[DatasetName.DSM_SMOOTHED.value][
+        row_offset - margins.top:, col_offset - margins.left:]
 
     # block height and width of the window/submatrix used in the cast
     # shadow algorithm
@@ -568,10 +573,10 @@ def combine_shadow_masks(self_shadow_group, cast_shadow_sun_group,
         filter_opts = filter_opts.copy()
 
     grp = fid[GroupName.SHADOW_GROUP.value]
-    tile_size = cast_sun.chunks
-    filter_opts['chunks'] = tile_size
-    kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
     cols, rows = geobox.get_shape_xy()
+    plan = plan_tiles((rows, cols), chunks=cast_sun.chunks)
+    filter_opts['chunks'] = plan.chunks
+    kwargs = compression.config(**filter_opts).dataset_compression_kwargs()
     kwargs['shape'] = (rows, cols)
     kwargs['dtype'] = 'bool'
 
@@ -590,7 +595,7 @@ def combine_shadow_masks(self_shadow_group, cast_shadow_sun_group,
     attach_image_attributes(out_dset, attrs)
 
     # process by tile
-    for tile in generate_tiles(cols, rows, tile_size[1], tile_size[0]):
+    for tile in plan.tiles():
         # Row and column start locations
         ystart, yend = tile[0]
         xstart, xend = tile[1]
@@ -610,11 +615,14 @@ def link_shadow_datasets(self_shadow_fname, cast_shadow_sun_fname,
     """
     group_path = GroupName.SHADOW_GROUP.value
     dname_fmt = DatasetName.CAST_SHADOW_FMT.value
+    links = []
     dname = ppjoin(group_path, DatasetName.SELF_SHADOW.value)
-    create_external_link(self_shadow_fname, dname, out_fname, dname)
+    links.append((self_shadow_fname, dname, dname))
 
     dname = ppjoin(group_path, dname_fmt.format(source='SUN'))
-    create_external_link(cast_shadow_sun_fname, dname, out_fname, dname)
+    links.append((cast_shadow_sun_fname, dname, dname))
 
     dname = ppjoin(group_path, dname_fmt.format(source='SATELLITE'))
-    create_external_link(cast_shadow_satellite_fname, dname, out_fname, dname)
+    links.append((cast_shadow_satellite_fname, dname, dname))
+
+    create_external_links(links, out_fname)
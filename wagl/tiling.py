@@ -17,9 +17,20 @@
 # ===============================================================================
 
 from __future__ import absolute_import, print_function
+from math import gcd
 import gdal
 import numpy
 
+# the default memory budget (in bytes) for a single processing tile
+TILE_MEMORY_BUDGET = 2**27
+
+# a rough estimate of the working memory (in bytes) held per pixel
+# by the tiled stages, covering the inputs, outputs and temporaries
+TILE_BYTES_PER_PIXEL = 64
+
+# the default edge length of the chunks of the HDF5 image datasets
+CHUNK_EDGE = 256
+
 
 def generate_tiles(samples, lines, xtile=None, ytile=None):
     """
@@ -94,14 +105,211 @@ def generate_tiles(samples, lines, xtile=None, ytile=None):
     return tiles
 
 
+def _aligned_tiles(shape, alignment, max_pixels):
+    """
+    Generates a list of tile indices for a 2D array, whereby each
+    tile is a whole multiple of `alignment` (except at the trailing
+    edges), and contains at most roughly `max_pixels` pixels. Tiles
+    are extended along the columns first, then down the rows.
+    Use `plan_tiles` to derive the alignment and `max_pixels`.
+
+    :param shape:
+        A 2-tuple (rows, columns) of the array dimensions.
+
+    :param alignment:
+        A 2-tuple (rows, columns) of the unit that every tile is
+        a multiple of.
+
+    :param max_pixels:
+        The desired maximum number of pixels per tile.
+
+    :return:
+        Each tuple in the generator contains
+        ((ystart,yend),(xstart,xend)).
+    """
+    rows, cols = shape
+    ychunk, xchunk = alignment
+
+    xtile = xchunk * max(1, -(-min(cols, max_pixels // ychunk) // xchunk))
+    ytile = ychunk * max(1, max_pixels // (ychunk * xtile))
+
+    return generate_tiles(cols, rows, xtile, ytile)
+
+
+class TilePlan(object):
+
+    """
+    The processing tiles and output chunks for a 2D array.
+    Each tile is a whole multiple of both the output `chunks`, and
+    the block layout of the source data (except at the trailing
+    edges), such that the tiles are read from whole source blocks,
+    and written as whole chunks.
+
+    :param shape:
+        A 2-tuple (rows, columns) of the array dimensions.
+
+    :param chunks:
+        A 2-tuple (rows, columns) of the output dataset chunks.
+
+    :param alignment:
+        A 2-tuple (rows, columns) of the unit that every tile is
+        a multiple of.
+
+    :param max_pixels:
+        The desired maximum number of pixels per tile. A single
+        `alignment` unit is used if it exceeds `max_pixels`.
+    """
+
+    def __init__(self, shape, chunks, alignment, max_pixels):
+        self.shape = tuple(shape)
+        self.chunks = tuple(chunks)
+        self.alignment = tuple(alignment)
+        self.max_pixels = max_pixels
+
+    def tiles(self):
+        """
+        Generate the tiles; each tuple in the generator contains
+        ((ystart,yend),(xstart,xend)).
+        """
+        for (ystart, yend), (xstart, xend) in _aligned_tiles(
+                self.shape, self.alignment, self.max_pixels):
+            yield ((int(ystart), int(yend)), (int(xstart), int(xend)))
+
+    @property
+    def tile_shape(self):
+        """
+        The (rows, columns) of a full (non-edge) tile.
+        """
+        (ystart, yend), (xstart, xend) = next(self.tiles())
+        return (yend - ystart, xend - xstart)
+
+    def __repr__(self):
+        return ("TilePlan(shape={}, chunks={}, tile_shape={})"
+                .format(self.shape, self.chunks, self.tile_shape))
+
+
+def plan_tiles(shape, block_shape=None, chunks=None,
+               bytes_per_pixel=TILE_BYTES_PER_PIXEL,
+               memory_budget=TILE_MEMORY_BUDGET, chunk_edge=CHUNK_EDGE):
+    """
+    Plan the processing tiles and output chunks of a 2D array from
+    a memory budget and the block layout of the source data.
+    Rather than processing the native blocks of the source (which
+    for most Landsat GeoTIFFs are a single row), tiles are sized
+    to fill the memory budget.
+
+    :param shape:
+        A 2-tuple (rows, columns) of the array dimensions.
+
+    :param block_shape:
+        A 2-tuple (rows, columns) of the block layout of the source
+        data, eg an acquisition's `tile_size` or the chunks of a
+        HDF5 dataset. Default is None (no source alignment).
+        A block layout that can't be aligned to within the memory
+        budget (such as a single block spanning the whole image) is
+        ignored, and the tiles are aligned to the chunks alone.
+
+    :param chunks:
+        A 2-tuple (rows, columns) of the output dataset chunks.
+        Default is None, whereby chunks of up to `chunk_edge` pixels
+        square are used, independent of the source block layout.
+
+    :param bytes_per_pixel:
+        The working memory (in bytes) held per pixel of a tile.
+        Default is wagl.tiling.TILE_BYTES_PER_PIXEL.
+
+    :param memory_budget:
+        The memory budget (in bytes) for a single tile.
+        Default is wagl.tiling.TILE_MEMORY_BUDGET.
+
+    :param chunk_edge:
+        The edge length of the derived chunks.
+        Default is wagl.tiling.CHUNK_EDGE.
+
+    :return:
+        An instance of a `TilePlan`.
+
+    :example:
+        >>> plan = plan_tiles((7841, 7691), (1, 7691))
+        >>> plan.chunks
+        (256, 256)
+        >>> plan.tile_shape
+        (256, 7691)
+    """
+    rows, cols = shape
+    if chunks is None:
+        chunks = (min(rows, chunk_edge), min(cols, chunk_edge))
+    chunks = tuple(min(c, s) for c, s in zip(chunks, shape))
+
+    max_pixels = max(1, memory_budget // bytes_per_pixel)
+
+    alignment = chunks
+    if block_shape is not None:
+        # the least common multiple of the chunks and source blocks
+        aligned = tuple(min(c * b // gcd(c, b), s) for c, b, s in
+                        zip(chunks, block_shape, shape))
+
+        # the budget takes precedence, unless the chunks exceed it too
+        if (aligned[0] * aligned[1] <= max_pixels or
+                chunks[0] * chunks[1] > max_pixels):
+            alignment = aligned
+
+    return TilePlan(shape, chunks, alignment, max_pixels)
+
+
+def plan_strips(shape, lines=None, bytes_per_pixel=TILE_BYTES_PER_PIXEL,
+                memory_budget=TILE_MEMORY_BUDGET):
+    """
+    Plan processing tiles of whole lines (strips) of a 2D array via
+    `plan_tiles`, such as those of the streamed cloud masks.
+
+    :param shape:
+        A 2-tuple (rows, columns) of the array dimensions.
+
+    :param lines:
+        The number of lines of each strip. Default is None, whereby
+        each strip has as many lines as the memory budget allows.
+
+    :param bytes_per_pixel:
+        The working memory (in bytes) held per pixel of a strip.
+        Default is wagl.tiling.TILE_BYTES_PER_PIXEL.
+
+    :param memory_budget:
+        The memory budget (in bytes) for a single strip.
+        Default is wagl.tiling.TILE_MEMORY_BUDGET.
+
+    :return:
+        An instance of a `TilePlan`.
+
+    :example:
+        >>> plan_strips((7841, 7691)).tile_shape
+        (272, 7691)
+        >>> plan_strips((7841, 7691), 100).tile_shape
+        (100, 7691)
+    """
+    rows, cols = shape
+    if lines is None:
+        return plan_tiles(shape, chunks=(1, cols),
+                          bytes_per_pixel=bytes_per_pixel,
+                          memory_budget=memory_budget)
+
+    # a single chunk of the given lines per strip
+    return plan_tiles(shape, chunks=(lines, cols), memory_budget=0)
+
+
 class TiledOutput(object):
 
     def __init__(self, out_fname, samples=None, lines=None, bands=1,
-                 geobox=None, fmt="ENVI", nodata=None, dtype=gdal.GDT_Byte):
+                 geobox=None, fmt="ENVI", nodata=None, dtype=gdal.GDT_Byte,
+                 options=None, levels=None):
         """
         A class to aid in data processing using a tiling scheme.
         The `TiledOutput` class takes care of writing each tile/chunk
         of data to disk.
+        Optionally, internal overviews/pyramids can be populated as
+        each tile is written, by decimating the tile in memory
+        (nearest neighbour), rather than re-reading the full
+        resolution image from disk once it has been written.
 
         :param out_fname:
             A string containing the full filepath name used for
@@ -131,6 +339,19 @@ class TiledOutput(object):
             An integer indicating datatype for the output image.
             Default is gdal.GDT_Byte which corresponds to 1.
 
+        :param options:
+            A `dict` of GDAL creation options for the given `fmt`,
+            eg {'tiled': 'yes', 'compress': 'deflate'}.
+            Default is None.
+
+        :param levels:
+            A `list` of integers containing the overview/pyramid
+            decimation factors, eg [2, 4, 8, 16, 32]. The overviews
+            are populated during `write_tile`, and as such each tile
+            written must start on a multiple of every level, and end
+            either on a multiple of every level or at the image edge.
+            Default is None; no overviews are created.
+
         :example:
             >>> a = numpy.random.randint(0, 256, (1000, 1000)).astype('uint8')
             >>> tiles = generate_tiles(a.shape[1], a.shape[0], 100, 100)
@@ -196,16 +417,26 @@ class TiledOutput(object):
                    "Lines: {nl}").format(ns=samples, nl=lines)
             raise TypeError(msg)
 
+        if options is None:
+            options = {}
+        creation_opts = ['{}={}'.format(key.upper(), value)
+                         for key, value in options.items()]
+
         driver = gdal.GetDriverByName(fmt)
-        self.outds = driver.Create(out_fname, samples, lines, bands, dtype)
+        self.outds = driver.Create(out_fname, samples, lines, bands, dtype,
+                                   creation_opts)
 
         self.nodata = nodata
         self.geobox = geobox
         self.bands = bands
+        self.samples = samples
+        self.lines = lines
+        self.levels = [] if levels is None else list(levels)
 
         self._set_geobox()
         self._set_bands_lookup()
         self._set_nodata()
+        self._set_overviews()
         self.closed = False
 
     def _set_geobox(self):
@@ -214,12 +445,20 @@ class TiledOutput(object):
         image.
         """
         if self.geobox is not None:
-            transform = self.geobox.affine.to_gdal()
-            projection = bytes(self.geobox.crs.ExportToWkt())
+            transform = self.geobox.transform.to_gdal()
+            projection = self.geobox.crs.ExportToWkt()
 
             self.outds.SetGeoTransform(transform)
             self.outds.SetProjection(projection)
 
+    def _set_overviews(self):
+        """
+        Create, but don't compute, the overview levels (if any).
+        The overviews are populated as each tile is written.
+        """
+        if self.levels:
+            self.outds.BuildOverviews('NONE', self.levels)
+
     def _set_bands_lookup(self):
         """
         Define a dictionary that points to each raster band object on disk.
@@ -267,12 +506,54 @@ class TiledOutput(object):
             for i in range(self.bands):
                 band = i + 1
                 self.out_bands[band].WriteArray(array[i], xstart, ystart)
+                self._write_overviews(array[i], tile, band)
                 self.out_bands[band].FlushCache()
         else:
             band = 1 if raster_band is None else raster_band
             self.out_bands[band].WriteArray(array, xstart, ystart)
+            self._write_overviews(array, tile, band)
             self.out_bands[band].FlushCache()
 
+    def _write_overviews(self, array, tile, raster_band):
+        """
+        Decimate a 2D tile (nearest neighbour using the centre pixel
+        of each block, consistent with GDAL) and write the result to
+        each of the overview levels.
+        """
+        (ystart, yend), (xstart, xend) = tile
+        for i, level in enumerate(self.levels):
+            aligned = (ystart % level == 0 and xstart % level == 0 and
+                       (yend % level == 0 or yend == self.lines) and
+                       (xend % level == 0 or xend == self.samples))
+            if not aligned:
+                msg = ("Tile {} is not aligned with overview level "
+                       "{}").format(tile, level)
+                raise ValueError(msg)
+
+            rows = numpy.arange(ystart // level, -(-yend // level))
+            cols = numpy.arange(xstart // level, -(-xend // level))
+            rows = numpy.minimum(rows * level + level // 2, yend - 1) - ystart
+            cols = numpy.minimum(cols * level + level // 2, xend - 1) - xstart
+
+            overview = self.out_bands[raster_band].GetOverview(i)
+            overview.WriteArray(array[rows][:, cols], xstart // level,
+                                ystart // level)
+
+    def update_tags(self, **tags):
+        """
+        Attach dataset level metadata to the output image.
+        """
+        self.outds.SetMetadata({k: str(v) for k, v in tags.items()})
+
+    def build_overviews(self, levels, resampling='NEAREST'):
+        """
+        Compute overviews/pyramids from the full resolution data
+        already written to disk. Used when a resampling method
+        other than the nearest neighbour decimation applied by
+        `write_tile` is required.
+        """
+        self.outds.BuildOverviews(resampling, list(levels))
+
     def close(self):
         """
         Close the output image and flush everything still in cache to disk.
@@ -6,7 +6,7 @@ from __future__ import absolute_import, print_function
 import datetime
 import re
 import os
-from functools import cmp_to_key
+from functools import cmp_to_key, lru_cache
 
 import ephem
 
@@ -16,6 +16,30 @@ TLE_ENTRY_RE = (r'^([1])(\s+)([%(NUMBER)s%(CLASSIFICATION)s]+)(\s+)'
                 r'([\-\+])(\d+)(\s+)(\d+)(\s+)(\d+)(\s)^([2])(.+)$')
 
 
+@lru_cache(maxsize=32)
+def _cached_tle_text(pathname, mtime):
+    """
+    Read, and memoise, the contents of a TLE file with the given
+    modification time.
+    """
+    with open(pathname, 'r') as fd:
+        return fd.read()
+
+
+def _read_tle_text(pathname):
+    """
+    Read the contents of a TLE file, memoised for as long as the file
+    is unchanged. The archives are large and rarely change, and are
+    otherwise reparsed for every scene.
+    Returns None if the file can't be read; a missing file isn't
+    memoised, so a file that appears later is found.
+    """
+    try:
+        return _cached_tle_text(pathname, os.stat(pathname).st_mtime_ns)
+    except (IOError, OSError):
+        return None
+
+
 def load_tle(acquisition, data_root, date_radius=45):
     """
     Loads satellite TLE (two-line element) for the given date and time.
@@ -58,11 +82,8 @@ def load_tle_from_archive(acquisition, data_root, day_radius=45):
     tle_archive_path = os.path.join(data_root, name,
                                     'TLE', '%s_ARCHIVE.txt' % acquisition.tag)
 
-    text = ''
-    try:
-        with open(tle_archive_path, 'r') as fd:
-            text = fd.read()
-    except IOError:
+    text = _read_tle_text(tle_archive_path)
+    if text is None:
         # no TLE archive file exists
         return None
 
@@ -99,13 +120,15 @@ def load_tle_from_files(acquisition, data_root, day_range=45):
 
     def open_tle(tle_path, center_datetime):
         """Open the TLE file and read."""
-        with open(tle_path, 'r') as fd:
-            tle_text = fd.readlines()
-            if acquisition.tag == 'LS5':
-                tle1, tle2 = tle_text[7:9]
-            if acquisition.tag == 'LS7':
-                tle1, tle2 = tle_text[1:3]
-            return ephem.readtle(acquisition.platform_id, tle1, tle2)
+        tle_text = _read_tle_text(tle_path)
+        if tle_text is None:
+            raise IOError("Unable to read {}".format(tle_path))
+        tle_text = tle_text.splitlines(True)
+        if acquisition.tag == 'LS5':
+            tle1, tle2 = tle_text[7:9]
+        if acquisition.tag == 'LS7':
+            tle1, tle2 = tle_text[1:3]
+        return ephem.readtle(acquisition.platform_id, tle1, tle2)
 
     center_datetime = acquisition.acquisition_datetime
     scene_doy = center_datetime.strftime('%j')  # Note format: '%03d'
@@ -0,0 +1,482 @@
+#!/usr/bin/env python
+
+"""
+Shared work queue
+-----------------
+
+A queue of scenes held on a shared filesystem, from which the workers
+of several nodes pull scenes until the queue is exhausted. A node that
+draws slow scenes simply pulls fewer of them, rather than finishing
+last while the other nodes idle.
+
+Each item is a small JSON file that moves between the directories of
+the queue:
+
+    pending/  waiting to be claimed
+    leased/   claimed by a worker, for the duration of a lease
+    done/     completed
+    failed/   failed on every one of its attempts
+
+Every transition is an atomic rename within the one filesystem, so
+only a single worker can claim an item, and no locking (which is
+unreliable on parallel filesystems such as Lustre) is required.
+
+A worker renews the lease of an item (via its modification time) while
+processing it. The lease of a worker that has died expires, and the
+item is returned to the queue. Items are retried up to `max_attempts`
+times before being moved to failed/. Processing is at least once; an
+item whose lease expires while its (slow, but alive) worker is still
+processing it can be processed twice.
+
+The lease times are measured against the clock of the filesystem
+itself, rather than the clock of each node.
+"""
+
+from __future__ import absolute_import
+import json
+import os
+from os.path import join as pjoin
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from wagl.logging import ERROR_LOGGER, STATUS_LOGGER
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+STATES = (PENDING, LEASED, DONE, FAILED)
+
+# the default number of seconds a lease lasts without being renewed
+LEASE = 600
+
+# the default number of attempts at processing an item
+MAX_ATTEMPTS = 3
+
+ITEM_FMT = '{:08d}.json'
+
+
+def worker_id():
+    """
+    An identifier unique to the current process.
+    """
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+def _write_json(data, fname):
+    """
+    Atomically write data as JSON to fname.
+    """
+    tmp_fname = '{}.{}.tmp'.format(fname, uuid.uuid4().hex)
+    with open(tmp_fname, 'w') as src:
+        json.dump(data, src)
+    os.replace(tmp_fname, fname)
+
+
+def _read_json(fname):
+    """
+    Read a JSON file.
+    """
+    with open(fname, 'r') as src:
+        return json.load(src)
+
+
+class Lease(object):
+
+    """
+    An item of the queue claimed by a worker.
+
+    :param name:
+        The filename of the item within each state directory.
+
+    :param item:
+        A `dict` containing the item; its `scene`, the number of
+        `attempts` (including the current one), the `errors` of
+        the previous attempts, and the `token` of the lease.
+    """
+
+    def __init__(self, name, item):
+        self.name = name
+        self.item = item
+
+    @property
+    def scene(self):
+        """The scene of the item."""
+        return self.item['scene']
+
+    @property
+    def attempts(self):
+        """The number of attempts, including the current one."""
+        return self.item['attempts']
+
+    @property
+    def token(self):
+        """A token unique to the lease."""
+        return self.item['token']
+
+
+class WorkQueue(object):
+
+    """
+    A work queue held within a directory of a shared filesystem.
+
+    :param path:
+        The directory of the queue. The directory (and the state
+        directories within it) is created if it doesn't exist.
+
+    :param lease:
+        The number of seconds a lease lasts without being renewed.
+        Default is wagl.work_queue.LEASE.
+
+    :param max_attempts:
+        The maximum number of attempts at processing an item.
+        Default is wagl.work_queue.MAX_ATTEMPTS.
+    """
+
+    def __init__(self, path, lease=LEASE, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._clock = pjoin(path, 'clock', worker_id())
+
+        for dname in STATES + ('clock',):
+            os.makedirs(pjoin(path, dname), exist_ok=True)
+
+    def _fname(self, state, name):
+        return pjoin(self.path, state, name)
+
+    def items(self, state):
+        """
+        The filenames of the items of a given state, in queue order.
+        """
+        names = os.listdir(pjoin(self.path, state))
+        return sorted(n for n in names if n.endswith('.json'))
+
+    def counts(self):
+        """
+        A `dict` of the number of items of each state.
+        """
+        return {state: len(self.items(state)) for state in STATES}
+
+    def now(self):
+        """
+        The current time of the filesystem; the modification time of
+        a file of the current process that has just been touched.
+        """
+        with open(self._clock, 'a'):
+            pass
+        os.utime(self._clock, None)
+        return os.stat(self._clock).st_mtime
+
+    def enqueue(self, scenes):
+        """
+        Append scenes to the queue.
+
+        The queue should be appended to by a single process, as the
+        item names are given by the number of items already queued.
+
+        :param scenes:
+            An iterable of JSON serialisable scenes, eg the
+            level1 pathnames.
+
+        :return:
+            The number of scenes queued.
+        """
+        start = sum(self.counts().values())
+        count = 0
+        for i, scene in enumerate(scenes):
+            item = {'scene': scene, 'attempts': 0, 'errors': []}
+            fname = self._fname(PENDING, ITEM_FMT.format(start + i))
+            _write_json(item, fname)
+            count += 1
+
+        return count
+
+    def claim(self, worker=None):
+        """
+        Claim the next pending item.
+
+        :param worker:
+            An identifier of the claiming worker, recorded with the
+            item. Default is None; the hostname and pid.
+
+        :return:
+            A `Lease`, or None if there are no pending items.
+            Items that have exhausted their attempts are moved to
+            failed/ rather than being claimed.
+        """
+        for name in self.items(PENDING):
+            pending = self._fname(PENDING, name)
+            leased = self._fname(LEASED, name)
+            try:
+                # start the lease before it is visible as leased
+                os.utime(pending, None)
+                os.rename(pending, leased)
+            except OSError:
+                # claimed by another worker
+                continue
+
+            item = _read_json(leased)
+            item['attempts'] += 1
+            item['token'] = uuid.uuid4().hex
+            item['worker'] = worker or worker_id()
+
+            if item['attempts'] > self.max_attempts:
+                _write_json(item, leased)
+                os.rename(leased, self._fname(FAILED, name))
+                continue
+
+            _write_json(item, leased)
+            return Lease(name, item)
+
+        return None
+
+    def _held(self, lease):
+        """
+        Whether the item is still held by the lease.
+        """
+        try:
+            return _read_json(self._fname(LEASED, lease.name)).get(
+                'token') == lease.token
+        except (OSError, ValueError):
+            return False
+
+    def renew(self, lease):
+        """
+        Renew a lease.
+
+        :return:
+            A `bool`; False if the lease has expired and the item has
+            been returned to the queue (or claimed by another worker).
+        """
+        if not self._held(lease):
+            return False
+
+        try:
+            os.utime(self._fname(LEASED, lease.name), None)
+        except OSError:
+            return False
+
+        return True
+
+    def _release(self, lease, state, error=None):
+        """
+        Move a leased item to the given state.
+
+        The item is first moved to a name private to this release, so
+        that it can't be reaped and reclaimed by another worker between
+        checking the token and moving it to `state`. An item left at its
+        private name by a worker that died is reaped once its lease
+        expires.
+        """
+        leased = self._fname(LEASED, lease.name)
+        private = '{}.{}.release'.format(leased, uuid.uuid4().hex)
+        try:
+            os.rename(leased, private)
+        except OSError:
+            # reaped, and possibly since completed by another worker
+            return False
+
+        try:
+            # not to be reaped while being released
+            os.utime(private, None)
+            held = _read_json(private).get('token') == lease.token
+        except (OSError, ValueError):
+            held = False
+
+        if not held:
+            # claimed by another worker since the lease expired; its
+            # release will find it at its leased name
+            try:
+                os.rename(private, leased)
+            except OSError:
+                pass
+            return False
+
+        item = dict(lease.item)
+        if error is not None:
+            item['errors'] = item['errors'] + [error]
+
+        try:
+            _write_json(item, private)
+            os.rename(private, self._fname(state, lease.name))
+        except OSError:
+            return False
+
+        return True
+
+    def complete(self, lease):
+        """
+        Mark a leased item as done.
+
+        :return:
+            A `bool`; False if the lease had expired.
+        """
+        return self._release(lease, DONE)
+
+    def fail(self, lease, error=''):
+        """
+        Record the failure of an attempt at a leased item. The item is
+        returned to the queue if it has attempts remaining, otherwise
+        it is moved to failed/.
+
+        :param error:
+            A `str` describing the failure.
+
+        :return:
+            A `bool`; False if the lease had expired.
+        """
+        state = PENDING if lease.attempts < self.max_attempts else FAILED
+        return self._release(lease, state, error)
+
+    def reap(self):
+        """
+        Return the items whose lease has expired to the queue.
+
+        :return:
+            The number of items returned to the queue.
+        """
+        now = self.now()
+        count = 0
+        for fname in os.listdir(pjoin(self.path, LEASED)):
+            # includes the items of workers that died mid release
+            if fname.endswith('.json'):
+                name = fname
+            elif fname.endswith('.release'):
+                name = fname.rsplit('.', 2)[0]
+            else:
+                continue
+
+            leased = self._fname(LEASED, fname)
+            try:
+                expired = now - os.stat(leased).st_mtime > self.lease
+                if expired:
+                    os.rename(leased, self._fname(PENDING, name))
+                    count += 1
+            except OSError:
+                # completed, failed or reaped by another worker
+                continue
+
+        return count
+
+
+class _Heartbeat(object):
+
+    """
+    Renews a lease at regular intervals within a thread.
+    """
+
+    def __init__(self, queue, lease, interval):
+        self.queue = queue
+        self.lease = lease
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.queue.renew(self.lease):
+                STATUS_LOGGER.warning('Queue-Lease-Lost',
+                                      scene=self.lease.scene)
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+def _run_slot(queue, func, worker, heartbeat, poll, wait, results):
+    """
+    Claim and process items until the queue is exhausted.
+    """
+    while True:
+        lease = queue.claim(worker)
+        if lease is None:
+            queue.reap()
+            counts = queue.counts()
+            if counts[PENDING]:
+                continue
+            if counts[LEASED] and wait:
+                time.sleep(poll)
+                continue
+            return
+
+        STATUS_LOGGER.info('Queue-Claim', scene=lease.scene, worker=worker,
+                           attempt=lease.attempts)
+        try:
+            with _Heartbeat(queue, lease, heartbeat):
+                func(lease.scene)
+        except Exception as exc:
+            tb = traceback.format_exc().splitlines()
+            ERROR_LOGGER.error('Queue-Scene', scene=lease.scene,
+                               worker=worker, attempt=lease.attempts,
+                               exception=exc.__str__(), traceback=tb)
+            queue.fail(lease, exc.__str__())
+            results.append((lease.scene, exc))
+        else:
+            queue.complete(lease)
+            results.append((lease.scene, None))
+
+
+def run_worker(queue, func, slots=1, worker=None, heartbeat=None, poll=None,
+               wait=True):
+    """
+    Process the items of a queue until it is exhausted.
+
+    :param queue:
+        A `WorkQueue`.
+
+    :param func:
+        A callable taking a scene. An item is considered to have
+        failed if `func` raises an exception.
+
+    :param slots:
+        The number of items processed concurrently (each within its
+        own thread). Default is 1.
+
+    :param worker:
+        An identifier of the worker. Default is None; the hostname
+        and pid.
+
+    :param heartbeat:
+        The number of seconds between the renewals of a lease.
+        Default is None; a quarter of the queue's lease.
+
+    :param poll:
+        The number of seconds between polling the queue, while
+        waiting on the items leased by other workers.
+        Default is None; the heartbeat.
+
+    :param wait:
+        A `bool`; if True (default), the worker waits for the items
+        leased by other workers to complete, so as to retry any that
+        fail or whose lease expires.
+
+    :return:
+        A `list` of (scene, exception) tuples for each attempt made by
+        this worker; the exception is None for a successful attempt.
+    """
+    worker = worker or worker_id()
+    heartbeat = heartbeat or queue.lease / 4.0
+    poll = poll or heartbeat
+    results = []
+
+    threads = [threading.Thread(target=_run_slot,
+                                args=(queue, func, worker, heartbeat, poll,
+                                      wait, results))
+               for _ in range(slots)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results